@@ -124,3 +124,164 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tax-parsing-api',
+    }
+}
+
+# Seconds a serialized tax form detail response stays cached, None keeps it until invalidated
+TAX_FORM_CACHE_TIMEOUT = None
+
+
+# Tax form processing
+
+# Number of worker processes tax forms are preprocessed on, None uses every core
+TAX_FORM_WORKERS = None
+
+# Directory of the advisory lock files of the documents, held while their artifacts are written. It must be
+# on a local file system, None uses the temporary directory of the host
+TAX_FORM_LOCK_DIRECTORY = None
+
+# Number of threads the async views run uploads on under ASGI, None uses twice TAX_FORM_WORKERS. Reads
+# do not take these threads, so they are served while every one of them is busy
+TAX_FORM_REQUEST_THREADS = None
+
+# Save every rasterized page as a PNG, and an annotated copy of it, for debugging. When False the pages
+# are OCR-ed in memory and only the annotation file of each tax form is written
+TAX_FORM_PERSIST_PAGE_IMAGES = DEBUG
+
+# Classify the pages of every tax form from its PDF text layer and only OCR the pages that can hold
+# the requested tax fields. Scanned pages without a text layer are always OCR-ed
+TAX_FORM_CLASSIFY_PAGES = True
+
+# Pages OCR-ed by concurrent requests are batched into one worker call, a batch is flushed once it
+# holds MAX_BATCH_SIZE pages or MAX_DELAY seconds after its first page was queued. At most MAX_IN_FLIGHT
+# batches are handed to the workers at a time, the other pages wait in the priority queues so interactive
+# uploads overtake bulk ones, None allows a batch per worker
+OCR_DISPATCHER = {
+    'MAX_BATCH_SIZE': 8,
+    'MAX_DELAY': 0.005,
+    'MAX_IN_FLIGHT': None,
+}
+
+# Page OCR tasks queued in the database for `manage.py run_ocr_worker` processes on any node sharing the database
+# and MEDIA_ROOT. When ENABLED, uploads OCR their pages through the queue instead of the local worker pool. A worker
+# leases a task for LEASE_SECONDS and renews the lease while it works, a task whose lease expires is queued again,
+# up to MAX_ATTEMPTS leases. An upload waits up to TIMEOUT seconds for its pages, None waits forever. The workers
+# purge the tasks done or failed RETENTION_SECONDS ago, and the ones queued RETENTION_SECONDS before their upload
+# stopped waiting, which an upload that died left behind
+OCR_TASK_QUEUE = {
+    'ENABLED': False,
+    'DIRECTORY': MEDIA_ROOT / 'tax_forms' / 'ocr_tasks',
+    'LEASE_SECONDS': 60,
+    'MAX_ATTEMPTS': 3,
+    'POLL_INTERVAL': 0.2,
+    'TIMEOUT': 600,
+    'RETENTION_SECONDS': 60 * 60,
+}
+
+# Checks run on every uploaded tax form before it is rasterized. Files over MAX_BYTES, that are not PDFs,
+# with more than MAX_PAGES pages or a page rasterizing to more than MAX_PAGE_PIXELS pixels are rejected,
+# and uploads with more than BULK_PAGES pages are OCR-ed in the bulk priority class. None disables a limit
+TAX_FORM_PREFLIGHT = {
+    'MAX_BYTES': 200 * 1024 * 1024,
+    'MAX_PAGES': 200,
+    'BULK_PAGES': 20,
+    'MAX_PAGE_PIXELS': 40_000_000,
+    'TIMEOUT': 10,
+}
+
+# Uploads are refused with a 503 while their pages would take the pages waiting for OCR over MAX_QUEUED_PAGES,
+# and with a 429 while they would take the waiting pages of their tenant over MAX_TENANT_QUEUED_PAGES. The
+# Retry-After is the p99 wait of the queue, at least RETRY_AFTER seconds. None disables a limit
+OCR_ADMISSION = {
+    'MAX_QUEUED_PAGES': 2000,
+    'MAX_TENANT_QUEUED_PAGES': 500,
+    'RETRY_AFTER': 5,
+}
+
+# OCR engines of every process. SIZE caps the pages, or strips, OCR-ed concurrently, None caps them at
+# one per worker, and WARM_UP runs a first recognition in every worker process of the worker pool when
+# it starts, which loads the OCR framework before the first page. The ASGI and WSGI applications start
+# the worker pool with the serving process
+OCR_ENGINES = {
+    'SIZE': None,
+    'RECOGNITION_LEVEL': 'accurate',
+    'WARM_UP': True,
+}
+
+# Height in pixels of the horizontal strips a page is split into and OCR-ed concurrently, None OCRs
+# every page whole. Each strip overlaps its neighbours by OCR_STRIP_OVERLAP pixels, which must be
+# taller than a line of text
+OCR_STRIP_HEIGHT = None
+OCR_STRIP_OVERLAP = 100
+
+# Preprocessing of every rasterized page before OCR, by form template. Each template sets the
+# PagePreprocessor options: grayscale, binarize (block_size, offset), deskew (max_skew_angle,
+# skew_step) and crop_margins (margin). The OCR cache and the saved annotations are keyed by the
+# options, so the pages are OCR-ed again when they change
+PAGE_PREPROCESSING = {
+    'default': {'grayscale': True},
+    'scanned': {'grayscale': True, 'binarize': True, 'deskew': True, 'crop_margins': True},
+}
+
+# Form template of PAGE_PREPROCESSING the pages of a PageClassifier label are preprocessed with, the
+# other pages use 'default'. Pages without a text layer, such as scans, are labelled 'unknown'
+PAGE_PREPROCESSING_BY_LABEL = {
+    'unknown': 'scanned',
+}
+
+# Process wide cache of the OCR annotations of documents, keyed by document hash. The memory
+# tier is an LRU bounded in bytes, the disk tier is bounded in bytes and by entry age in seconds
+OCR_CACHE = {
+    'MEMORY_BYTES': 64 * 1024 * 1024,
+    'DISK_DIRECTORY': MEDIA_ROOT / 'tax_forms' / 'ocr_cache',
+    'DISK_BYTES': 1024 * 1024 * 1024,
+    'DISK_MAX_AGE': 30 * 24 * 60 * 60,
+}
+
+# Process wide cache of the OCR annotations of single pages, keyed by a hash of the downscaled page,
+# so boilerplate pages repeated across documents, such as instructions, are OCR-ed once
+OCR_PAGE_CACHE = {
+    'MEMORY_BYTES': 32 * 1024 * 1024,
+    'DISK_DIRECTORY': MEDIA_ROOT / 'tax_forms' / 'ocr_cache' / 'pages',
+    'DISK_BYTES': 512 * 1024 * 1024,
+    'DISK_MAX_AGE': 30 * 24 * 60 * 60,
+}
+
+# Disk budget of the regenerable preprocessing artifacts (page images, overlays, text), None disables
+# eviction. Annotations are never evicted. Artifacts used in the last TAX_FORM_ARTIFACTS_MIN_AGE seconds
+# are left alone, and TAX_FORM_ARTIFACTS_SWEEP_INTERVAL seconds, if set, runs a background sweep
+TAX_FORM_ARTIFACTS_MAX_BYTES = 10 * 1024 * 1024 * 1024
+TAX_FORM_ARTIFACTS_MIN_AGE = 60 * 60
+TAX_FORM_ARTIFACTS_SWEEP_INTERVAL = None
+
+# Number of pages OCR-ed between two saves of the partial annotation file, so a tax form interrupted
+# while OCR-ing resumes from its last saved page. None saves the annotations once every page is OCR-ed
+TAX_FORM_CHECKPOINT_PAGES = 8
+
+# Resumable uploads of POST /api/tax-form-uploads/, sent in ranges of at most MAX_RANGE_BYTES bytes. The part
+# files are kept in DIRECTORY, None keeps them in tax_forms/upload_sessions of MEDIA_ROOT, and a session not
+# finalized EXPIRY_SECONDS after its last range is deleted. The largest file accepted is TAX_FORM_PREFLIGHT['MAX_BYTES']
+TAX_FORM_UPLOAD_SESSIONS = {
+    'DIRECTORY': None,
+    'MAX_RANGE_BYTES': 16 * 1024 * 1024,
+    'EXPIRY_SECONDS': 24 * 60 * 60,
+}
+
+# Most tax forms POST /api/tax-forms/reprocess/ re-parses per request, and its default limit. The
+# reprocess_tax_forms command re-parses every stale tax form regardless
+TAX_FORM_REPROCESS_MAX_BATCH = 100
+
+# Maximum number of tax forms accepted by POST /api/tax-forms/batch/, and the most bytes they take together,
+# uncompressed. Both are checked from the zip directories before any tax form is read
+TAX_FORM_BATCH_MAX_FILES = 500
+TAX_FORM_BATCH_MAX_BYTES = 1024 * 1024 * 1024
+DATA_UPLOAD_MAX_NUMBER_FILES = TAX_FORM_BATCH_MAX_FILES
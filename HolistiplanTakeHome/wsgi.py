@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'HolistiplanTakeHome.settings')
 
 application = get_wsgi_application()
+
+# start the worker pool, and warm up its OCR engines, before the first upload is served
+from TaxParsingAPI.helpers.executor import start_worker_pool  # noqa: E402
+
+start_worker_pool()
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class TaxparsingapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'TaxParsingAPI'
+
+    def ready(self):
+        # register signal receivers
+        from TaxParsingAPI import signals  # noqa: F401
+
+        from django.conf import settings
+
+        sweep_interval = getattr(settings, "TAX_FORM_ARTIFACTS_SWEEP_INTERVAL", None)
+        if sweep_interval:
+            from TaxParsingAPI.helpers.artifact_helper import start_artifact_sweeper
+
+            start_artifact_sweeper(sweep_interval)
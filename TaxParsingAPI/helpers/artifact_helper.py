@@ -0,0 +1,362 @@
+"""
+provides the lifecycle management of the artifacts written while preprocessing tax forms
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import ClassVar, Dict, List, Optional, Set, Tuple
+import logging
+import os
+import shutil
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from TaxParsingAPI.models import TaxForm, UPLOAD_TO
+from TaxParsingAPI.helpers.utils.annotation_store import AnnotationStore
+from TaxParsingAPI.helpers.utils.atomic_files import document_lock
+
+logger = logging.getLogger(__name__)
+
+_sweeper: Optional[threading.Thread] = None
+_sweeper_lock = threading.Lock()
+
+
+@dataclass
+class Artifact:
+    """
+    Data class for representing an artifact of a tax form on disk.
+
+    Attributes:
+        document (str): The stem of the tax form file the artifact was generated from.
+        kind (str): The base directory of the artifact, such as "images" or "annotations".
+        path (Path): The file or directory of the artifact.
+        size (int): The size of the artifact in bytes.
+        last_used (float): The latest modification time of the artifact.
+        regenerable (bool): True if the artifact can be regenerated from the tax form file alone.
+    """
+
+    document: str
+    kind: str
+    path: Path
+    size: int
+    last_used: float
+    regenerable: bool
+
+
+@dataclass
+class ArtifactManager:
+    """
+    Data class for tracking and garbage collecting the artifacts of tax forms.
+
+    PreprocessTaxForm writes the artifacts of a tax form named <stem>.pdf to <stem> entries of
+    the images, text_from_pdf, annotations and annotations_over_images directories. The manager
+    deletes every artifact of a document no TaxForm references anymore, and keeps the artifacts
+    under a disk budget by evicting the least recently used regenerable ones. The annotations are
+    never evicted, since regenerating them means OCR-ing the tax form again.
+
+    Attributes:
+        base_dir (Path): The directory holding the tax forms and their artifact directories.
+        max_bytes (Optional[int]): The disk budget of the artifacts, None disables eviction.
+        min_age (float): Seconds an artifact is left alone after its last use, so tax forms still
+                         being preprocessed, and not saved yet, are not collected.
+
+    Methods:
+        list_artifacts() -> List[Artifact]:
+            List every artifact under base_dir.
+
+        get_referenced_documents() -> Set[str]:
+            Get the stems of the tax form files referenced by a TaxForm.
+
+        is_referenced(document) -> bool:
+            Check if a TaxForm references a document.
+
+        release(document) -> int:
+            Delete every artifact of a document.
+
+        get_artifact_paths(document) -> List[Tuple[str, Path]]:
+            Get the paths the artifacts of a document are written to.
+
+        release_if_unreferenced(document) -> int:
+            Delete every artifact of a document no TaxForm references.
+
+        collect_garbage(dry_run) -> Dict[str, int]:
+            Delete unreferenced artifacts, then evict regenerable ones over the disk budget.
+    """
+
+    base_dir: Path = None
+    max_bytes: Optional[int] = None
+    min_age: float = 0
+
+    REGENERABLE_KINDS: ClassVar[List[str]] = ["images", "annotations_over_images", "text_from_pdf"]
+    KEPT_KINDS: ClassVar[List[str]] = ["annotations"]
+
+    def __post_init__(self):
+        if self.base_dir is None:
+            self.base_dir = Path(settings.MEDIA_ROOT) / UPLOAD_TO
+
+    @classmethod
+    def from_settings(cls) -> "ArtifactManager":
+        """
+        Create a manager configured by the TAX_FORM_ARTIFACTS_* settings.
+
+        Returns:
+            ArtifactManager: The configured manager.
+        """
+        return cls(
+            max_bytes=getattr(settings, "TAX_FORM_ARTIFACTS_MAX_BYTES", None),
+            min_age=getattr(settings, "TAX_FORM_ARTIFACTS_MIN_AGE", 0),
+        )
+
+    def list_artifacts(self) -> List[Artifact]:
+        """
+        List every artifact under base_dir.
+
+        Returns:
+            List[Artifact]: The artifacts of every document.
+        """
+        artifacts = []
+        for kind in self.REGENERABLE_KINDS + self.KEPT_KINDS:
+            kind_directory = self.base_dir / kind
+            if not kind_directory.is_dir():
+                continue
+            for path in kind_directory.iterdir():
+                document = self._get_document(path)
+                # an artifact still being written under its temporary name
+                if document is None or path.name.startswith("."):
+                    continue
+                size, last_used = self._get_usage(path)
+                artifacts.append(
+                    Artifact(
+                        document=document,
+                        kind=kind,
+                        path=path,
+                        size=size,
+                        last_used=last_used,
+                        regenerable=kind in self.REGENERABLE_KINDS,
+                    )
+                )
+        return artifacts
+
+    def get_referenced_documents(self) -> Set[str]:
+        """
+        Get the stems of the tax form files referenced by a TaxForm.
+
+        Returns:
+            Set[str]: The referenced document stems.
+        """
+        return {Path(name).stem for name in TaxForm.objects.values_list("tax_form", flat=True)}
+
+    def is_referenced(self, document: str) -> bool:
+        """
+        Check if a TaxForm references a document.
+
+        Args:
+            document (str): The stem of the tax form file.
+
+        Returns:
+            bool: True if a TaxForm file has the stem.
+        """
+        return TaxForm.objects.filter(
+            Q(tax_form__iexact=f"{document}.pdf") | Q(tax_form__iendswith=f"/{document}.pdf")
+        ).exists()
+
+    def release(self, document: str) -> int:
+        """
+        Delete every artifact of a document, looking only at the paths its artifacts are written to.
+
+        Args:
+            document (str): The stem of the tax form file.
+
+        Returns:
+            int: The number of bytes freed.
+        """
+        freed = 0
+        for kind, path in self.get_artifact_paths(document):
+            try:
+                size, last_used = self._get_usage(path)
+            except FileNotFoundError:
+                continue
+            freed += self._delete(
+                Artifact(
+                    document=document,
+                    kind=kind,
+                    path=path,
+                    size=size,
+                    last_used=last_used,
+                    regenerable=kind in self.REGENERABLE_KINDS,
+                )
+            )
+        return freed
+
+    def get_artifact_paths(self, document: str) -> List[Tuple[str, Path]]:
+        """
+        Get the paths the artifacts of a document are written to, whether they exist or not.
+
+        Args:
+            document (str): The stem of the tax form file.
+
+        Returns:
+            List[Tuple[str, Path]]: The kind and the path of every artifact: the <document> directory of every
+                                    kind, and the annotation file of the document and its partial file.
+        """
+        paths = [(kind, self.base_dir / kind / document) for kind in self.REGENERABLE_KINDS + self.KEPT_KINDS]
+        annotations_file_path = self.base_dir / "annotations" / f"{document}{AnnotationStore.SUFFIX}"
+        paths.append(("annotations", annotations_file_path))
+        paths.append(
+            ("annotations", annotations_file_path.with_name(annotations_file_path.name + AnnotationStore.PARTIAL_SUFFIX))
+        )
+        return paths
+
+    def release_if_unreferenced(self, document: str) -> int:
+        """
+        Delete every artifact of a document no TaxForm references.
+
+        Args:
+            document (str): The stem of the tax form file.
+
+        Returns:
+            int: The number of bytes freed.
+        """
+        if self.is_referenced(document):
+            return 0
+        return self.release(document)
+
+    def collect_garbage(self, dry_run: bool = False) -> Dict[str, int]:
+        """
+        Delete the artifacts of the documents no TaxForm references, then evict the least recently
+        used regenerable artifacts until the artifacts fit in max_bytes.
+
+        Args:
+            dry_run (bool): If True, report what would be deleted without deleting anything.
+
+        Returns:
+            Dict[str, int]: The number of "released" documents, of "evicted" artifacts, the "freed_bytes"
+                            and the "remaining_bytes".
+        """
+        now = time.time()
+        artifacts = self.list_artifacts()
+        referenced = self.get_referenced_documents()
+
+        released: Set[str] = set()
+        freed = 0
+        kept: List[Artifact] = []
+        for artifact in artifacts:
+            if artifact.document not in referenced and now - artifact.last_used >= self.min_age:
+                released.add(artifact.document)
+                freed += artifact.size if dry_run else self._delete(artifact)
+            else:
+                kept.append(artifact)
+
+        remaining = sum(artifact.size for artifact in kept)
+        evicted = 0
+        if self.max_bytes is not None and remaining > self.max_bytes:
+            evictable = sorted(
+                (
+                    artifact
+                    for artifact in kept
+                    if artifact.regenerable and now - artifact.last_used >= self.min_age
+                ),
+                key=lambda artifact: artifact.last_used,
+            )
+            for artifact in evictable:
+                if remaining <= self.max_bytes:
+                    break
+                size = artifact.size if dry_run else self._delete(artifact)
+                remaining -= size
+                freed += size
+                evicted += 1
+
+        return {
+            "released": len(released),
+            "evicted": evicted,
+            "freed_bytes": freed,
+            "remaining_bytes": remaining,
+        }
+
+    @classmethod
+    def _get_document(cls, path: Path) -> Optional[str]:
+        """
+        Get the document of an artifact, the name of its directory or the stem of its annotation file,
+        partial or not, or None for a file that is not an artifact.
+        """
+        if not path.is_file():
+            return path.name
+        for suffix in (AnnotationStore.SUFFIX + AnnotationStore.PARTIAL_SUFFIX, AnnotationStore.SUFFIX):
+            if path.name.endswith(suffix):
+                return path.name[: -len(suffix)]
+        return None
+
+    @classmethod
+    def _get_usage(cls, path: Path):
+        """
+        Get the size and the latest modification time of a file or directory tree.
+        """
+        stat = path.stat()
+        if path.is_file():
+            return stat.st_size, stat.st_mtime
+
+        # the directory's own mtime only moves when files are added or removed
+        size = 0
+        last_used = None
+        for root, _, file_names in os.walk(path):
+            for file_name in file_names:
+                try:
+                    file_stat = os.stat(os.path.join(root, file_name))
+                except FileNotFoundError:
+                    continue
+                size += file_stat.st_size
+                last_used = max(last_used or 0, file_stat.st_mtime)
+        return size, last_used if last_used is not None else stat.st_mtime
+
+    def _delete(self, artifact: Artifact) -> int:
+        """
+        Delete an artifact under the lock of its document, so it is not deleted while being written,
+        returning the number of bytes freed.
+        """
+        try:
+            with document_lock(self.base_dir, artifact.document):
+                if artifact.path.is_dir():
+                    shutil.rmtree(artifact.path)
+                else:
+                    artifact.path.unlink()
+        except FileNotFoundError:
+            return 0
+        logger.info("Deleted %s artifact %s", artifact.kind, artifact.path)
+        return artifact.size
+
+
+def start_artifact_sweeper(interval: float) -> threading.Thread:
+    """
+    Start a daemon thread collecting the garbage artifacts every interval seconds, once per process.
+
+    Args:
+        interval (float): The seconds between two sweeps.
+
+    Returns:
+        threading.Thread: The sweeper thread.
+    """
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(
+                target=_sweep, args=(interval,), name="tax-form-artifact-sweeper", daemon=True
+            )
+            _sweeper.start()
+        return _sweeper
+
+
+def _sweep(interval: float) -> None:
+    """
+    Collect the garbage artifacts forever, every interval seconds.
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            summary = ArtifactManager.from_settings().collect_garbage()
+            logger.info("Artifact sweep: %s", summary)
+        except Exception:
+            logger.exception("Artifact sweep failed")
+        finally:
+            close_old_connections()
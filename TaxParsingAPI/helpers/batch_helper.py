@@ -0,0 +1,228 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import zipfile
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from TaxParsingAPI.models import TaxForm
+from TaxParsingAPI.parse.tax_parser import parse_tax_form
+from TaxParsingAPI.helpers.checkpoint_helper import TaxFormCheckpoint, persist_parsed_tax_forms
+from TaxParsingAPI.helpers.executor import get_worker_count
+from TaxParsingAPI.helpers.ocr_dispatcher import get_ocr_dispatcher
+from TaxParsingAPI.helpers.ocr_task_queue import get_ocr_task_queue
+from TaxParsingAPI.helpers.ocr_scheduler import BULK
+from TaxParsingAPI.helpers.preflight import PreflightError, TaxFormPreflight
+from TaxParsingAPI.helpers.upload_helper import StoredUpload, store_upload
+
+
+class TaxFormBatchError(ValueError):
+    """
+    Raised when a batch is refused before any of its files is read.
+    """
+
+
+@dataclass
+class TaxFormBatch:
+    """
+    Data class for processing many uploaded tax forms at once.
+
+    Every tax form is preprocessed and parsed on a thread, and its pages are OCR-ed on the shared
+    worker pool through the OCR dispatcher, so the wall-clock time of a batch is bounded by the
+    number of cores rather than by the number of files. The pages are queued in the bulk priority
+    class, so interactive uploads are OCR-ed first, and are interleaved with the pages of the other
+    tax forms of the tenant. Every tax form is streamed to the tax form storage, inspected and received as
+    a TaxForm from its stored file, and its stages are checkpointed, and the tax forms that were parsed
+    successfully are then persisted with bulk writes in a single transaction.
+
+    Attributes:
+        files (List[Tuple[str, StoredUpload]]): The name, the path in its zip archive for a zip member, and the stored
+                                                file of every tax form in the batch.
+        tax_fields (List[Dict]): The tax fields to extract, each a dictionary with a "tax_field" key.
+        tenant (str): The user or firm the batch is processed for. Defaults to "".
+        rejections (List[Optional[str]]): Why every file was rejected by the preflight, None if it was not, set by preflight().
+        page_count (Optional[int]): The pages of the files the preflight accepted, set by preflight().
+        results (List[Dict]): One result per file, in upload order, set by process().
+
+    Methods:
+        from_uploads(cls, uploads, tax_fields, tenant, max_files, max_bytes) -> 'TaxFormBatch':
+            Stream uploaded PDF and zip files to the storage, refusing the batch before reading them if it is too large.
+
+        preflight() -> int:
+            Inspect every stored tax form before anything is rasterized, setting aside the rejected ones.
+
+        process() -> List[Dict]:
+            Parse every tax form, OCR-ing its pages on the worker pool, and persist the successful ones.
+
+        discard():
+            Delete the stored files of a batch that is not processed.
+    """
+
+    files: List[Tuple[str, StoredUpload]]
+    tax_fields: List[Dict]
+    tenant: str = ""
+    rejections: List[Optional[str]] = field(init=False, default_factory=list)
+    page_count: Optional[int] = field(init=False, default=None)
+    results: List[Dict] = field(init=False, default_factory=list)
+
+    @classmethod
+    def from_uploads(
+        cls,
+        uploads: List[UploadedFile],
+        tax_fields: List[Dict],
+        tenant: str = "",
+        max_files: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> "TaxFormBatch":
+        """
+        Create a batch from uploaded files, streaming every tax form to the tax form storage.
+
+        PDF files are stored as is, the PDF members of zip files one by one, a chunk at a time, so the batch is
+        never held in memory. The tax forms are counted and their sizes summed from the zip directories before any
+        of them is read, so a batch over the limits is refused without being expanded.
+
+        Args:
+            uploads (List[UploadedFile]): The uploaded PDF and zip files.
+            tax_fields (List[Dict]): The tax fields to extract, each a dictionary with a "tax_field" key.
+            tenant (str): The user or firm the batch is processed for. Defaults to "".
+            max_files (Optional[int]): The most tax forms the batch holds, None for no limit. Defaults to None.
+            max_bytes (Optional[int]): The most bytes its tax forms take together, uncompressed, None for no limit.
+                                       Defaults to None.
+
+        Raises:
+            TaxFormBatchError: If the batch holds more than max_files tax forms or more than max_bytes bytes, or a
+                               zip member does not match its zip directory, in which case nothing is left stored.
+
+        Returns:
+            TaxFormBatch: The batch of tax forms.
+        """
+        # every PDF upload, and every PDF member of a zip upload with its archive
+        entries: List[Tuple[UploadedFile, Optional[zipfile.ZipFile], Optional[zipfile.ZipInfo]]] = []
+        archives: List[zipfile.ZipFile] = []
+        files: List[Tuple[str, StoredUpload]] = []
+        try:
+            for upload in uploads:
+                if zipfile.is_zipfile(upload):
+                    upload.seek(0)
+                    archive = zipfile.ZipFile(upload)
+                    archives.append(archive)
+                    entries.extend(
+                        (upload, archive, member) for member in archive.infolist() if cls._is_tax_form(member)
+                    )
+                else:
+                    entries.append((upload, None, None))
+
+            if max_files is not None and len(entries) > max_files:
+                raise TaxFormBatchError(f"A batch holds at most {max_files} tax forms.")
+            total_bytes = sum(upload.size if member is None else member.file_size for upload, _, member in entries)
+            if max_bytes is not None and total_bytes > max_bytes:
+                raise TaxFormBatchError(f"A batch holds at most {max_bytes} bytes of tax forms.")
+
+            for upload, archive, member in entries:
+                if member is None:
+                    files.append((Path(upload.name).name, store_upload(upload)))
+                    continue
+                # zipfile stops at the size of the zip directory, and fails the CRC of a member that is larger
+                try:
+                    with archive.open(member) as member_file:
+                        member_upload = File(member_file, name=Path(member.filename).name)
+                        member_upload.size = member.file_size
+                        files.append((member.filename, store_upload(member_upload)))
+                except zipfile.BadZipFile as error:
+                    raise TaxFormBatchError(f"{member.filename} could not be read: {error}")
+        except BaseException:
+            for _, stored_upload in files:
+                stored_upload.delete()
+            raise
+        finally:
+            for archive in archives:
+                archive.close()
+        return cls(files=files, tax_fields=tax_fields, tenant=tenant)
+
+    @staticmethod
+    def _is_tax_form(member: zipfile.ZipInfo) -> bool:
+        member_path = Path(member.filename)
+        return not member.is_dir() and member_path.suffix.lower() == ".pdf" and "__MACOSX" not in member_path.parts
+
+    def preflight(self) -> int:
+        """
+        Inspect every stored tax form with TaxFormPreflight before anything is rasterized, setting aside and deleting
+        the rejected ones.
+
+        Returns:
+            int: The pages of the accepted tax forms, a tax form whose pages could not be counted counting as one.
+        """
+        preflight = TaxFormPreflight.from_settings()
+        self.rejections = []
+        self.page_count = 0
+        for _, stored_upload in self.files:
+            try:
+                report = preflight.inspect(file_path=stored_upload.path, priority=BULK)
+            except PreflightError as error:
+                self.rejections.append(str(error))
+                stored_upload.delete()
+                continue
+            self.rejections.append(None)
+            self.page_count += report.page_count or 1
+        return self.page_count
+
+    def process(self) -> List[Dict]:
+        """
+        Parse every tax form, OCR-ing its pages on the worker pool, and persist the successful ones.
+
+        Every tax form is saved as a received TaxForm first, and its stages are recorded as they complete,
+        so a tax form that fails keeps its id and can be resumed. A file that fails to parse does not fail
+        the batch, its result holds the error instead. Files rejected by preflight(), run first unless it
+        already was, get the error without a TaxForm.
+
+        Returns:
+            List[Dict]: One result per file, in order, with the "file" name, the "id" of its TaxForm, and an
+                        "error" if it was not persisted.
+        """
+        if self.page_count is None:
+            self.preflight()
+        ocr_dispatcher = get_ocr_dispatcher()
+        ocr_task_queue = get_ocr_task_queue()
+
+        futures: List[Tuple[Dict, TaxForm, Future]] = []
+        self.results = []
+        parsed: List[Tuple[TaxForm, Dict]] = []
+        # the threads only rasterize, preprocess and parse, the OCR runs on the worker pool
+        with ThreadPoolExecutor(max_workers=get_worker_count(), thread_name_prefix="tax-form-batch") as executor:
+            for (name, stored_upload), rejection in zip(self.files, self.rejections):
+                if rejection is not None:
+                    self.results.append({"file": name, "error": rejection})
+                    continue
+
+                # the stored name is unique, so tax forms of the same name do not share their artifacts
+                tax_form = TaxFormCheckpoint.receive(stored_upload.name, self.tax_fields, source=name)
+                future = executor.submit(
+                    parse_tax_form,
+                    Path(tax_form.tax_form.path),
+                    None,
+                    self.tax_fields,
+                    ocr_dispatcher=ocr_dispatcher,
+                    ocr_task_queue=ocr_task_queue,
+                    ocr_priority=BULK,
+                    tenant=self.tenant,
+                )
+                result = {"file": name, "id": tax_form.id}
+                self.results.append(result)
+                futures.append((result, tax_form, future))
+
+            for result, tax_form, future in futures:
+                try:
+                    parsed.append((tax_form, future.result()))
+                except Exception as error:
+                    TaxFormCheckpoint(tax_form.id).record_error(error)
+                    result["error"] = str(error) or error.__class__.__name__
+
+        persist_parsed_tax_forms(parsed)
+        return self.results
+
+    def discard(self) -> None:
+        """
+        Delete the stored files of a batch that is not processed, such as one refused by the admission control.
+        """
+        for _, stored_upload in self.files:
+            stored_upload.delete()
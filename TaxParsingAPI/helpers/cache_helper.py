@@ -0,0 +1,153 @@
+from typing import Dict, Iterable, Optional
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import parse_etags
+
+TAX_FORM_CACHE_PREFIX = "tax_form_representation"
+
+
+def get_tax_form_cache_key(tax_form_id) -> str:
+    """
+    Get the cache key of a tax form's serialized representation.
+
+    Args:
+        tax_form_id (Union[UUID, str]): The id of the tax form.
+
+    Returns:
+        str: The cache key.
+    """
+    return f"{TAX_FORM_CACHE_PREFIX}:{tax_form_id}"
+
+
+def get_cached_representation(tax_form_id, base_uri: str) -> Optional[Dict]:
+    """
+    Get the cached representation of a tax form.
+
+    The representation holds absolute urls, so an entry cached for another host is
+    treated as a miss.
+
+    Args:
+        tax_form_id (Union[UUID, str]): The id of the tax form.
+        base_uri (str): The absolute uri of the site root the representation was built for.
+
+    Returns:
+        Optional[Dict]: A dictionary with the "etag" and the "data" of the representation, or None on a miss.
+    """
+    return _match_base_uri(cache.get(get_tax_form_cache_key(tax_form_id)), base_uri)
+
+
+async def aget_cached_representations(tax_form_ids: Iterable, base_uri: str) -> Dict:
+    """
+    Get the cached representations of many tax forms in one cache call, for the async views.
+
+    Args:
+        tax_form_ids (Iterable[Union[UUID, str]]): The ids of the tax forms.
+        base_uri (str): The absolute uri of the site root the representations were built for.
+
+    Returns:
+        Dict: The cached entries of the hits by tax form id, each a dictionary with the "etag" and the "data".
+    """
+    keys = {get_tax_form_cache_key(tax_form_id): tax_form_id for tax_form_id in tax_form_ids}
+    found = await cache.aget_many(keys)
+    hits = {keys[key]: _match_base_uri(cached, base_uri) for key, cached in found.items()}
+    return {tax_form_id: cached for tax_form_id, cached in hits.items() if cached is not None}
+
+
+def set_cached_representation(tax_form_id, base_uri: str, data: Dict) -> Dict:
+    """
+    Cache the representation of a tax form along with its strong ETag.
+
+    Args:
+        tax_form_id (Union[UUID, str]): The id of the tax form.
+        base_uri (str): The absolute uri of the site root the representation was built for.
+        data (Dict): The serialized representation of the tax form.
+
+    Returns:
+        Dict: The cached entry, a dictionary with the "etag" and the "data" of the representation.
+    """
+    cached = {"base_uri": base_uri, "etag": get_etag(data), "data": data}
+    cache.set(
+        get_tax_form_cache_key(tax_form_id),
+        cached,
+        timeout=getattr(settings, "TAX_FORM_CACHE_TIMEOUT", None),
+    )
+    return cached
+
+
+async def aset_cached_representations(representations: Dict, base_uri: str) -> Dict:
+    """
+    Cache the representations of many tax forms in one cache call, for the async views.
+
+    Args:
+        representations (Dict): The serialized representations by tax form id.
+        base_uri (str): The absolute uri of the site root the representations were built for.
+
+    Returns:
+        Dict: The cached entries by tax form id, each a dictionary with the "etag" and the "data".
+    """
+    entries = {
+        tax_form_id: {"base_uri": base_uri, "etag": get_etag(data), "data": data}
+        for tax_form_id, data in representations.items()
+    }
+    await cache.aset_many(
+        {get_tax_form_cache_key(tax_form_id): cached for tax_form_id, cached in entries.items()},
+        timeout=getattr(settings, "TAX_FORM_CACHE_TIMEOUT", None),
+    )
+    return entries
+
+
+def invalidate_tax_form(tax_form_id) -> None:
+    """
+    Remove the cached representation of a tax form.
+
+    Args:
+        tax_form_id (Union[UUID, str]): The id of the tax form.
+    """
+    cache.delete(get_tax_form_cache_key(tax_form_id))
+
+
+def _match_base_uri(cached: Optional[Dict], base_uri: str) -> Optional[Dict]:
+    """
+    Treat an entry cached for another host as a miss.
+    """
+    if cached is None or cached["base_uri"] != base_uri:
+        return None
+    return cached
+
+
+def get_etag(data: Dict) -> str:
+    """
+    Calculate the strong ETag of a serialized representation.
+
+    Args:
+        data (Dict): The serialized representation.
+
+    Returns:
+        str: The quoted ETag.
+    """
+    content = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+    return f'"{hashlib.sha256(content.encode()).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check whether an If-None-Match header matches an ETag.
+
+    Args:
+        if_none_match (Optional[str]): The value of the If-None-Match request header.
+        etag (str): The quoted ETag of the current representation.
+
+    Returns:
+        bool: True if the client already holds the current representation.
+    """
+    if not if_none_match:
+        return False
+    # If-None-Match uses the weak comparison function
+    etags = [
+        client_etag[2:] if client_etag.startswith("W/") else client_etag
+        for client_etag in parse_etags(if_none_match)
+    ]
+    return "*" in etags or etag in etags
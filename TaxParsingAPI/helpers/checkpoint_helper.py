@@ -0,0 +1,229 @@
+"""
+provides the pipeline stage checkpoints recorded on tax forms, so an interrupted tax form resumes after its last completed stage
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+from django.core.files import File
+from django.db import transaction
+from TaxParsingAPI.models import TaxForm, TaxField
+from TaxParsingAPI.parse.tax_parser import TaxParser, parse_tax_form
+from TaxParsingAPI.helpers.cache_helper import invalidate_tax_form
+
+
+@dataclass
+class TaxFormCheckpoint:
+    """
+    Data class for recording the pipeline stages of a tax form on its TaxForm.
+
+    A tax form goes through the received, rasterized, ocr_done, parsed and persisted stages. Each
+    completed stage is recorded in TaxForm.checkpoints with its state and the artifacts it produced,
+    and TaxForm.stage is advanced to it. The artifacts hold the work itself: the page images, the
+    annotation file, or the partial annotation file saved as the pages are OCR-ed, which PreprocessTaxForm
+    reuses, and the extracted tax fields are kept in the parsed checkpoint. A retry of the tax form
+    therefore only runs the stages after the last completed one.
+
+    The stages are recorded by the process that owns the tax form, the preprocessing on worker processes
+    reports them back in the "stages" of the parse_tax_form result, so the workers need no database.
+
+    Attributes:
+        tax_form_id (Any): The id of the tax form.
+
+    Methods:
+        receive(cls, file, tax_fields, source) -> TaxForm:
+            Save a tax form file as a received TaxForm.
+
+        record(stage, **state) -> TaxForm:
+            Record a stage and its state.
+
+        record_stages(stages) -> TaxForm:
+            Record the stages completed by the preprocessing of the tax form.
+
+        record_error(error) -> TaxForm:
+            Record the error that interrupted the tax form.
+
+        get(stage) -> Optional[Dict]:
+            Get the state recorded for a stage.
+    """
+
+    tax_form_id: Any
+
+    @classmethod
+    def receive(cls, file: Union[File, str], tax_fields: List[Dict], source: str = "") -> TaxForm:
+        """
+        Save a tax form file as a received TaxForm, recording the tax fields to extract from it.
+
+        Args:
+            file (Union[File, str]): The tax form file, saved to the storage under a name of its own, or the storage
+                                     name of a file already streamed there.
+            tax_fields (List[Dict]): The tax fields to extract, each a dictionary with a "tax_field" key.
+            source (str): Where the file came from, such as its path in an ingested directory. Defaults to "".
+
+        Returns:
+            TaxForm: The received tax form.
+        """
+        tax_form = TaxForm(tax_form=file, stage=TaxForm.RECEIVED)
+        tax_form.checkpoints = {
+            TaxForm.RECEIVED: {"source": source, "tax_fields": tax_fields, "artifacts": []}
+        }
+        tax_form.save()
+        tax_form.checkpoints[TaxForm.RECEIVED]["artifacts"] = [tax_form.tax_form.name]
+        TaxForm.objects.filter(id=tax_form.id).update(checkpoints=tax_form.checkpoints)
+        return tax_form
+
+    def record(self, stage: str, **state) -> TaxForm:
+        """
+        Record a stage and its state, advancing the stage of the tax form unless it is further already.
+
+        The state is merged into the state recorded for the stage. An ocr_done state with "complete" False
+        records the pages OCR-ed so far without advancing the stage.
+
+        Args:
+            stage (str): The stage, one of TaxForm.STAGES.
+            **state: The state of the stage, such as its "artifacts".
+
+        Returns:
+            TaxForm: The updated tax form.
+        """
+        with transaction.atomic():
+            tax_form = TaxForm.objects.select_for_update().get(id=self.tax_form_id)
+            tax_form.checkpoints[stage] = {**tax_form.checkpoints.get(stage, {}), **state}
+            tax_form.checkpoints.pop("error", None)
+            if state.get("complete", True) and not tax_form.has_reached(stage):
+                tax_form.stage = stage
+            tax_form.save(update_fields=["stage", "checkpoints"])
+        return tax_form
+
+    def record_stages(self, stages: Dict[str, Dict]) -> TaxForm:
+        """
+        Record the stages completed by the preprocessing of the tax form, in pipeline order.
+
+        Args:
+            stages (Dict[str, Dict]): The state of every completed stage, by stage, such as the stage_state of
+                                      PreprocessTaxForm.
+
+        Returns:
+            TaxForm: The updated tax form.
+        """
+        tax_form = None
+        for stage in TaxForm.STAGES:
+            if stage in stages:
+                tax_form = self.record(stage, **stages[stage])
+        return tax_form if tax_form is not None else TaxForm.objects.get(id=self.tax_form_id)
+
+    def record_error(self, error: BaseException) -> TaxForm:
+        """
+        Record the error that interrupted the tax form, leaving its stage as is.
+
+        Args:
+            error (BaseException): The error.
+
+        Returns:
+            TaxForm: The updated tax form.
+        """
+        with transaction.atomic():
+            tax_form = TaxForm.objects.select_for_update().get(id=self.tax_form_id)
+            tax_form.checkpoints["error"] = str(error) or error.__class__.__name__
+            tax_form.save(update_fields=["checkpoints"])
+        return tax_form
+
+    def get(self, stage: str) -> Optional[Dict]:
+        """
+        Get the state recorded for a stage.
+
+        Args:
+            stage (str): The stage, one of TaxForm.STAGES.
+
+        Returns:
+            Optional[Dict]: The state of the stage, or None if it was not recorded.
+        """
+        return TaxForm.objects.values_list("checkpoints", flat=True).get(id=self.tax_form_id).get(stage)
+
+
+def get_requested_tax_fields(tax_form: TaxForm) -> List[Dict]:
+    """
+    Get the tax fields to extract from a tax form, as recorded when it was received.
+
+    Args:
+        tax_form (TaxForm): The tax form.
+
+    Returns:
+        List[Dict]: The tax fields, each a dictionary with a "tax_field" key, every tax field if none was recorded.
+    """
+    received = tax_form.checkpoints.get(TaxForm.RECEIVED, {})
+    return received.get("tax_fields") or [{"tax_field": tax_field} for tax_field, _ in TaxField.FIELD_CHOICES]
+
+
+def persist_parsed_tax_forms(parsed: List[Tuple[TaxForm, Dict]]) -> None:
+    """
+    Record the stages of parsed tax forms, then save their tax fields with bulk writes in a single transaction.
+
+    A tax form already parsed, whose parsed checkpoint is passed again, only has its tax fields saved.
+
+    Args:
+        parsed (List[Tuple[TaxForm, Dict]]): Every tax form and its parse_tax_form result, or its parsed checkpoint.
+    """
+    for tax_form, result in parsed:
+        checkpoint = TaxFormCheckpoint(tax_form.id)
+        checkpoint.record_stages(result.get("stages", {}))
+        checkpoint.record(
+            TaxForm.PARSED,
+            tax_fields=result["tax_fields"],
+            page_count=result.get("page_count", 0),
+            artifacts=[],
+        )
+
+    parser_version = TaxParser.get_version()
+    tax_form_ids = [tax_form.id for tax_form, _ in parsed]
+    with transaction.atomic():
+        # a retry after a crash between the writes below replaces the tax fields already saved
+        TaxField.objects.filter(tax_form_id__in=tax_form_ids).delete()
+        TaxField.objects.bulk_create(
+            [
+                TaxField(tax_form_id=tax_form.id, **tax_field)
+                for tax_form, result in parsed
+                for tax_field in result["tax_fields"]
+            ]
+        )
+        TaxForm.objects.filter(id__in=tax_form_ids).update(parser_version=parser_version)
+        for tax_form, _ in parsed:
+            TaxFormCheckpoint(tax_form.id).record(TaxForm.PERSISTED, artifacts=[])
+
+    for tax_form, _ in parsed:
+        tax_form.refresh_from_db()
+        invalidate_tax_form(tax_form.id)
+
+
+def resume_tax_form(tax_form: TaxForm, **parse_options) -> TaxForm:
+    """
+    Run the stages of a tax form left after its last completed one.
+
+    A parsed tax form is only persisted, from its parsed checkpoint. Otherwise it is parsed from its saved
+    file, and PreprocessTaxForm reuses the page images and the, possibly partial, annotations saved before.
+
+    Args:
+        tax_form (TaxForm): The tax form.
+        **parse_options: The OCR options passed to parse_tax_form, such as ocr_dispatcher.
+
+    Returns:
+        TaxForm: The persisted tax form.
+
+    Raises:
+        Exception: The error that interrupted the tax form again, after it is recorded on it.
+    """
+    if tax_form.has_reached(TaxForm.PERSISTED):
+        return tax_form
+
+    result = tax_form.checkpoints.get(TaxForm.PARSED) if tax_form.has_reached(TaxForm.PARSED) else None
+    if result is None:
+        try:
+            result = parse_tax_form(
+                Path(tax_form.tax_form.path), None, get_requested_tax_fields(tax_form), **parse_options
+            )
+        except Exception as error:
+            TaxFormCheckpoint(tax_form.id).record_error(error)
+            raise
+
+    persist_parsed_tax_forms([(tax_form, result)])
+    return tax_form
@@ -0,0 +1,170 @@
+"""
+provides the process wide worker pool that tax form preprocessing is fanned out to, the
+thread pool the strips of a page are OCR-ed on, and the thread pool the async views run
+the synchronous upload pipeline on
+"""
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Optional
+import logging
+import os
+import threading
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_thread_executor: Optional[ThreadPoolExecutor] = None
+_thread_executor_lock = threading.Lock()
+_request_executor: Optional[ThreadPoolExecutor] = None
+_request_executor_lock = threading.Lock()
+
+
+def get_worker_count() -> int:
+    """
+    Get the number of worker processes of the pool.
+
+    Returns:
+        int: settings.TAX_FORM_WORKERS, or the number of cores when it is not set.
+    """
+    return getattr(settings, "TAX_FORM_WORKERS", None) or os.cpu_count() or 1
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Get the process wide worker pool, creating it on first use, or again once a worker crash broke it.
+
+    A pool whose worker died fails every later submission, so it is replaced instead of being kept for the
+    life of the process. Callers should get the pool on every use rather than hold on to it.
+
+    Returns:
+        ProcessPoolExecutor: The shared worker pool.
+    """
+    global _executor
+    with _executor_lock:
+        # set by ProcessPoolExecutor once a worker died abruptly
+        if _executor is not None and getattr(_executor, "_broken", False):
+            logger.warning("Replacing the broken worker pool: %s", _executor._broken)
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=get_worker_count(), initializer=_initialize_worker
+            )
+        return _executor
+
+
+def start_worker_pool() -> List[Future]:
+    """
+    Create the process wide worker pool and start its worker processes, which set up Django and warm up
+    their OCR engines when settings.OCR_ENGINES['WARM_UP'] is set, so the first uploads served do not wait
+    for them.
+
+    The pool only starts a worker when a call finds none idle, so a call per worker is submitted before
+    any of them started. The ASGI and WSGI applications call this when a serving process starts.
+
+    Returns:
+        List[Future]: The futures of the calls, each resolving to the process id of the worker it ran on.
+    """
+    executor = get_executor()
+    return [executor.submit(os.getpid) for _ in range(get_worker_count())]
+
+
+def submit_to_executor(function: Callable, *args, **kwargs) -> Future:
+    """
+    Submit a call to the process wide worker pool, replacing the pool once if it turns out broken.
+
+    The calls already running on a pool when it broke fail with BrokenProcessPool, the later ones run
+    on the new pool.
+
+    Args:
+        function (Callable): The picklable function to call on a worker.
+        *args: The arguments of the call.
+        **kwargs: The keyword arguments of the call.
+
+    Returns:
+        Future: The future of the call.
+    """
+    executor = get_executor()
+    try:
+        return executor.submit(function, *args, **kwargs)
+    except BrokenProcessPool:
+        global _executor
+        with _executor_lock:
+            if _executor is executor:
+                logger.warning("Replacing the broken worker pool")
+                executor.shutdown(wait=False, cancel_futures=True)
+                _executor = None
+        return get_executor().submit(function, *args, **kwargs)
+
+
+def get_thread_executor() -> ThreadPoolExecutor:
+    """
+    Get the thread pool of this process, creating it on first use.
+
+    OCR releases the GIL while recognizing, so the strips of a page are OCR-ed on threads, which
+    also works inside the worker processes of the worker pool.
+
+    Returns:
+        ThreadPoolExecutor: The thread pool of this process.
+    """
+    global _thread_executor
+    with _thread_executor_lock:
+        if _thread_executor is None:
+            _thread_executor = ThreadPoolExecutor(
+                max_workers=get_worker_count(), thread_name_prefix="ocr-strip"
+            )
+        return _thread_executor
+
+
+def get_request_executor() -> ThreadPoolExecutor:
+    """
+    Get the thread pool the async views run uploads on, creating it on first use.
+
+    An upload holds its thread while it is stored, rasterized and parsed, and mostly waits for the
+    worker pool to OCR its pages, so the pool has settings.TAX_FORM_REQUEST_THREADS threads, twice the
+    worker processes when it is not set. It is kept apart from the strip pool, which the uploads wait on.
+
+    Returns:
+        ThreadPoolExecutor: The thread pool of the async views.
+    """
+    global _request_executor
+    with _request_executor_lock:
+        if _request_executor is None:
+            _request_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "TAX_FORM_REQUEST_THREADS", None) or 2 * get_worker_count(),
+                thread_name_prefix="tax-form-request",
+            )
+        return _request_executor
+
+
+def shutdown_executor() -> None:
+    """
+    Shut down the process wide worker pool, waiting for running work to finish.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+def _initialize_worker() -> None:
+    """
+    Set up Django in a freshly started worker process, and warm up its OCR engines when
+    settings.OCR_ENGINES['WARM_UP'] is set.
+
+    The pages are OCR-ed in the worker processes, which only the processes serving uploads and the
+    OCR commands start, so the other processes, management commands and tests, do not load OCR.
+    """
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "HolistiplanTakeHome.settings")
+    django.setup()
+
+    if getattr(settings, "OCR_ENGINES", {}).get("WARM_UP"):
+        from TaxParsingAPI.helpers.ocr_engine import start_ocr_engine_warm_up
+
+        start_ocr_engine_warm_up()
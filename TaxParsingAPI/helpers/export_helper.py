@@ -0,0 +1,156 @@
+from dataclasses import dataclass
+from typing import ClassVar, Dict, Iterator, List, Optional
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from TaxParsingAPI.models import TaxForm, TaxField
+
+
+class _Echo:
+    """
+    Pseudo-buffer for csv.writer that returns the written row instead of storing it.
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+@dataclass
+class TaxFormExporter:
+    """
+    Data class for streaming every tax form, and its tax fields, out of the database.
+
+    Tax forms are read with a chunked server side iterator and, for each chunk, the tax fields
+    of all the forms in the chunk are fetched with a single query and joined in memory. Rows are
+    plain dictionaries built from .values() so no model instances or DRF serializers are involved,
+    which keeps memory flat and throughput bounded by the database.
+
+    Attributes:
+        queryset (QuerySet): The tax forms to export. Defaults to every persisted tax form, the others are still
+                             being processed or failed, and have no tax fields yet.
+        chunk_size (int): The number of tax forms fetched, and joined with their tax fields, per query.
+
+        FORM_COLUMNS (ClassVar[List[str]]): The TaxForm columns that are exported.
+        FIELD_COLUMNS (ClassVar[List[str]]): The TaxField columns that are exported.
+
+    Methods:
+        iter_records() -> Iterator[Dict]:
+            Yield one dictionary per tax form with its tax fields nested under "tax_fields".
+
+        iter_ndjson() -> Iterator[str]:
+            Yield one JSON document per tax form, newline delimited.
+
+        iter_csv() -> Iterator[str]:
+            Yield a header line and then one CSV line per tax field.
+    """
+
+    queryset: Optional[QuerySet] = None
+    chunk_size: int = 2000
+
+    FORM_COLUMNS: ClassVar[List[str]] = ["id", "tax_form", "uploaded_at"]
+    FIELD_COLUMNS: ClassVar[List[str]] = [
+        "tax_field",
+        "instruction_text",
+        "instruction_matched_pattern",
+        "value_text",
+        "value_normalized_text",
+        "value_in_numeric",
+        "value_matched_pattern",
+        "page_number",
+    ]
+
+    def __post_init__(self):
+        if self.queryset is None:
+            self.queryset = TaxForm.objects.filter(stage=TaxForm.PERSISTED)
+
+    def iter_records(self) -> Iterator[Dict]:
+        """
+        Yield one dictionary per tax form with its tax fields nested under "tax_fields".
+
+        Each record also carries "pay_this_amount", calculated from the joined tax fields
+        instead of issuing extra queries per tax form.
+
+        Returns:
+            Iterator[Dict]: The tax form records, ordered by upload time.
+        """
+        tax_forms = (
+            self.queryset.order_by("uploaded_at", "id")
+            .values(*self.FORM_COLUMNS)
+            .iterator(chunk_size=self.chunk_size)
+        )
+
+        chunk: List[Dict] = []
+        for tax_form in tax_forms:
+            chunk.append(tax_form)
+            if len(chunk) == self.chunk_size:
+                yield from self._join_tax_fields(chunk)
+                chunk = []
+        if chunk:
+            yield from self._join_tax_fields(chunk)
+
+    def iter_ndjson(self) -> Iterator[str]:
+        """
+        Yield one JSON document per tax form, newline delimited.
+
+        Returns:
+            Iterator[str]: The NDJSON lines.
+        """
+        for record in self.iter_records():
+            yield json.dumps(record, cls=DjangoJSONEncoder) + "\n"
+
+    def iter_csv(self) -> Iterator[str]:
+        """
+        Yield a header line and then one CSV line per tax field.
+
+        The tax form columns are repeated on every line of that tax form. A tax form without
+        tax fields is exported as a single line with empty tax field columns.
+
+        Returns:
+            Iterator[str]: The CSV lines.
+        """
+        writer = csv.writer(_Echo())
+        yield writer.writerow(self.FORM_COLUMNS + ["pay_this_amount"] + self.FIELD_COLUMNS)
+
+        for record in self.iter_records():
+            form_row = [record[column] for column in self.FORM_COLUMNS]
+            form_row.append(record["pay_this_amount"])
+
+            tax_fields = record["tax_fields"] or [{}]
+            for tax_field in tax_fields:
+                yield writer.writerow(
+                    form_row + [tax_field.get(column, "") for column in self.FIELD_COLUMNS]
+                )
+
+    def _join_tax_fields(self, tax_forms: List[Dict]) -> Iterator[Dict]:
+        """
+        Fetch the tax fields of a chunk of tax forms in one query and attach them to each record.
+
+        Args:
+            tax_forms (List[Dict]): The chunk of tax form records.
+
+        Returns:
+            Iterator[Dict]: The tax form records with "tax_fields" and "pay_this_amount" set.
+        """
+        field_order = {tax_field: index for index, (tax_field, _) in enumerate(TaxField.FIELD_CHOICES)}
+
+        tax_fields_by_form: Dict = {}
+        tax_fields = TaxField.objects.filter(
+            tax_form_id__in=[tax_form["id"] for tax_form in tax_forms]
+        ).values("tax_form_id", *self.FIELD_COLUMNS)
+        for tax_field in tax_fields:
+            tax_fields_by_form.setdefault(tax_field.pop("tax_form_id"), []).append(tax_field)
+
+        for tax_form in tax_forms:
+            form_tax_fields = sorted(
+                tax_fields_by_form.get(tax_form["id"], []),
+                key=lambda tax_field: field_order.get(tax_field["tax_field"], len(field_order)),
+            )
+            values = {tax_field["tax_field"]: tax_field["value_in_numeric"] for tax_field in form_tax_fields}
+
+            tax_form["tax_fields"] = form_tax_fields
+            tax_form["pay_this_amount"] = TaxForm.calculate_pay_this_amount(
+                amount_owed=values.get(TaxField.AMOUNT_OWED),
+                overpaid=values.get(TaxField.OVERPAID),
+            )
+            yield tax_form
@@ -0,0 +1,341 @@
+"""
+provides the process wide, two tier caches of the OCR annotations of documents, keyed by document hash,
+and of single pages, keyed by page hash
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional
+import hashlib
+import os
+import sys
+import threading
+import time
+import numpy as np
+from django.conf import settings
+from PIL import Image as PILImage
+from PIL.Image import Image
+from TaxParsingAPI.helpers.utils.annotation_store import AnnotationStore
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+
+_ocr_cache: Optional["OcrCache"] = None
+_ocr_cache_lock = threading.Lock()
+_page_cache: Optional["OcrCache"] = None
+_page_cache_lock = threading.Lock()
+
+# the width the page is downscaled to before hashing, and the gray levels kept per pixel
+PAGE_HASH_WIDTH = 512
+PAGE_HASH_LEVELS = 16
+# the size of the chunks a document file is hashed in, so it is never read whole into memory
+DOCUMENT_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_document_hash(file_bytes: bytes) -> str:
+    """
+    Get the cache key of a document.
+
+    Args:
+        file_bytes (bytes): The bytes of the document.
+
+    Returns:
+        str: The hex sha256 digest of the document.
+    """
+    return get_document_hasher(file_bytes).hexdigest()
+
+
+def get_document_hasher(file_bytes: bytes = b""):
+    """
+    Get a hash object to compute the cache key of a document incrementally, such as while it is uploaded.
+
+    Args:
+        file_bytes (bytes): The first bytes of the document. Defaults to b"".
+
+    Returns:
+        The sha256 hash object, whose hexdigest() is the document hash once every byte was given to update().
+    """
+    return hashlib.sha256(file_bytes)
+
+
+def get_file_document_hash(file_path: Path) -> str:
+    """
+    Get the cache key of a document file, reading it in chunks.
+
+    Args:
+        file_path (Path): The path to the document.
+
+    Returns:
+        str: The hex sha256 digest of the document, the same as get_document_hash of its bytes.
+    """
+    hasher = get_document_hasher()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(DOCUMENT_HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def get_page_hash(image: Image) -> str:
+    """
+    Get the cache key of a rasterized page.
+
+    The page is downscaled to PAGE_HASH_WIDTH pixels wide, in grayscale, and every pixel is quantized
+    to PAGE_HASH_LEVELS gray levels before hashing, so faint noise, such as near-white speckles, maps
+    to the same key. The thumbnail is kept large enough for a single
+    changed digit to change the key, since a hit on a page with different values would return wrong
+    annotations, while a miss only costs an OCR. The size of the page is part of the key, since the
+    cached bounding boxes are in its pixels.
+
+    Args:
+        image (Image): The rasterized page, as handed to OCR.
+
+    Returns:
+        str: The hex sha256 digest of the quantized thumbnail.
+    """
+    width, height = image.size
+    thumbnail_size = (PAGE_HASH_WIDTH, max(1, round(height * PAGE_HASH_WIDTH / max(width, 1))))
+    thumbnail = image.convert("L").resize(thumbnail_size, resample=PILImage.BOX)
+    quantized = np.asarray(thumbnail, dtype=np.uint8) // (256 // PAGE_HASH_LEVELS)
+
+    page_hash = hashlib.sha256(f"{width}x{height}:".encode())
+    page_hash.update(quantized.astype(np.uint8).tobytes())
+    return page_hash.hexdigest()
+
+
+@dataclass
+class OcrCache:
+    """
+    Data class for caching the OCR annotations of every page of a document.
+
+    The memory tier is an LRU of annotation tables bounded by an estimate of their size in bytes,
+    so hot documents are served without touching the disk. The disk tier holds one annotation
+    file per document hash, bounded by the total size of its files and by their age. Disk entries
+    are promoted to the memory tier when read, and their modification time is bumped so the
+    least recently used files are evicted first.
+
+    Attributes:
+        memory_bytes (int): The byte budget of the memory tier, 0 disables it.
+        disk_directory (Optional[Path]): The directory of the disk tier, None disables it.
+        disk_bytes (int): The byte budget of the disk tier.
+        disk_max_age (Optional[float]): Seconds after which an unused disk entry is evicted, None keeps them.
+        stats (Dict[str, int]): The hit, miss and eviction counters.
+
+    Methods:
+        get(document_hash) -> Optional[Dict[int, AnnotationTable]]:
+            Get the annotations of every page of a document.
+
+        put(document_hash, pages):
+            Cache the annotations of every page of a document in both tiers.
+
+        clear():
+            Empty the memory tier and reset the counters.
+    """
+
+    memory_bytes: int = 64 * 1024 * 1024
+    disk_directory: Optional[Path] = None
+    disk_bytes: int = 1024 * 1024 * 1024
+    disk_max_age: Optional[float] = None
+    stats: Dict[str, int] = field(
+        default_factory=lambda: {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+    )
+
+    def __post_init__(self):
+        self._entries: "OrderedDict[str, Dict[int, AnnotationTable]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._memory_used = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, setting: str = "OCR_CACHE") -> "OcrCache":
+        """
+        Create a cache configured by a settings dictionary.
+
+        Args:
+            setting (str): The name of the setting, "OCR_CACHE" or "OCR_PAGE_CACHE".
+
+        Returns:
+            OcrCache: The configured cache.
+        """
+        config = getattr(settings, setting, {})
+        disk_directory = config.get("DISK_DIRECTORY")
+        return cls(
+            memory_bytes=config.get("MEMORY_BYTES", cls.memory_bytes),
+            disk_directory=Path(disk_directory) if disk_directory else None,
+            disk_bytes=config.get("DISK_BYTES", cls.disk_bytes),
+            disk_max_age=config.get("DISK_MAX_AGE"),
+        )
+
+    def get(self, document_hash: str) -> Optional[Dict[int, AnnotationTable]]:
+        """
+        Get the annotations of every page of a document.
+
+        Args:
+            document_hash (str): The hash of the document.
+
+        Returns:
+            Optional[Dict[int, AnnotationTable]]: The annotations of every page by page number, or None on a miss.
+        """
+        with self._lock:
+            pages = self._entries.get(document_hash)
+            if pages is not None:
+                self._entries.move_to_end(document_hash)
+                self.stats["memory_hits"] += 1
+                return pages
+
+        pages = self._read_disk(document_hash)
+        with self._lock:
+            if pages is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self._put_memory(document_hash, pages)
+        return pages
+
+    def put(self, document_hash: str, pages: Dict[int, AnnotationTable]) -> None:
+        """
+        Cache the annotations of every page of a document in both tiers.
+
+        Args:
+            document_hash (str): The hash of the document.
+            pages (Dict[int, AnnotationTable]): The annotations of every page by page number.
+        """
+        with self._lock:
+            self._put_memory(document_hash, pages)
+        self._write_disk(document_hash, pages)
+
+    def clear(self) -> None:
+        """
+        Empty the memory tier and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._memory_used = 0
+            for counter in self.stats:
+                self.stats[counter] = 0
+
+    def _put_memory(self, document_hash: str, pages: Dict[int, AnnotationTable]) -> None:
+        """
+        Add a document to the memory tier and evict the least recently used ones over budget.
+        Must be called with the lock held.
+        """
+        size = self._get_size(pages)
+        if size > self.memory_bytes:
+            return
+        if document_hash in self._entries:
+            self._memory_used -= self._sizes.pop(document_hash)
+            del self._entries[document_hash]
+
+        self._entries[document_hash] = pages
+        self._sizes[document_hash] = size
+        self._memory_used += size
+
+        while self._memory_used > self.memory_bytes:
+            evicted_hash, _ = self._entries.popitem(last=False)
+            self._memory_used -= self._sizes.pop(evicted_hash)
+            self.stats["memory_evictions"] += 1
+
+    def _get_disk_path(self, document_hash: str) -> Path:
+        return self.disk_directory / f"{document_hash}{AnnotationStore.SUFFIX}"
+
+    def _read_disk(self, document_hash: str) -> Optional[Dict[int, AnnotationTable]]:
+        """
+        Read a document from the disk tier, bumping its modification time.
+        """
+        if self.disk_directory is None:
+            return None
+        disk_path = self._get_disk_path(document_hash)
+        try:
+            with AnnotationStore(path=disk_path) as store:
+                pages = {page_num: store.read_page(page_num) for page_num in store.page_numbers()}
+            os.utime(disk_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return pages
+
+    def _write_disk(self, document_hash: str, pages: Dict[int, AnnotationTable]) -> None:
+        """
+        Write a document to the disk tier, then evict the expired and least recently used files over budget.
+        """
+        if self.disk_directory is None:
+            return
+        self.disk_directory.mkdir(parents=True, exist_ok=True)
+        AnnotationStore.write(path=self._get_disk_path(document_hash), pages=pages).close()
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """
+        Delete the disk tier files that are older than disk_max_age, then the least recently used
+        ones until the tier fits in disk_bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.disk_directory):
+            if entry.name.endswith(AnnotationStore.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for mtime, size, path in entries:
+            expired = self.disk_max_age is not None and now - mtime > self.disk_max_age
+            if not expired and total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+
+        if evicted:
+            with self._lock:
+                self.stats["disk_evictions"] += evicted
+
+    @classmethod
+    def _get_size(cls, pages: Dict[int, AnnotationTable]) -> int:
+        """
+        Estimate the memory used by the annotations of a document.
+        """
+        size = 0
+        for table in pages.values():
+            size += sum(sys.getsizeof(text) for text in table.texts)
+            size += table.bboxes.itemsize * len(table.bboxes)
+            size += table.centers.itemsize * len(table.centers)
+        return size
+
+
+def get_ocr_cache() -> OcrCache:
+    """
+    Get the process wide OCR cache, creating it on first use.
+
+    Returns:
+        OcrCache: The shared OCR cache.
+    """
+    global _ocr_cache
+    with _ocr_cache_lock:
+        if _ocr_cache is None:
+            _ocr_cache = OcrCache.from_settings()
+        return _ocr_cache
+
+
+def get_page_cache() -> OcrCache:
+    """
+    Get the process wide cache of single pages, keyed by page hash, creating it on first use.
+
+    Every entry holds the annotations of one page, as page 0.
+
+    Returns:
+        OcrCache: The shared page cache.
+    """
+    global _page_cache
+    with _page_cache_lock:
+        if _page_cache is None:
+            _page_cache = OcrCache.from_settings("OCR_PAGE_CACHE")
+        return _page_cache
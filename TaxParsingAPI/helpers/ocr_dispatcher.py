@@ -0,0 +1,260 @@
+"""
+provides the process wide dispatcher batching the pages of concurrent requests into OCR worker calls
+"""
+
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+import time
+from django.conf import settings
+from PIL.Image import Image
+from TaxParsingAPI.helpers.executor import get_worker_count, submit_to_executor
+from TaxParsingAPI.helpers.ocr_scheduler import INTERACTIVE, OcrScheduler
+from TaxParsingAPI.helpers.shared_pages import SharedPage, ocr_shared_pages, release_segments
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+
+_ocr_dispatcher: Optional["OcrDispatcher"] = None
+_ocr_dispatcher_lock = threading.Lock()
+
+
+@dataclass
+class OcrDispatcher:
+    """
+    Data class for batching the pages OCR-ed by concurrent requests into worker calls.
+
+    Every page submitted, by any thread of the process, is queued with a future in the scheduler,
+    which orders the pages by priority class and shares the workers fairly between tenants and
+    documents. A dispatching thread takes the pages in that order in batches, flushing a batch when
+    it holds max_batch_size pages or when max_delay seconds passed since its first page, copies the
+    batch into shared memory and submits it to the executor as one call, so the hand-off to a worker
+    is paid once per batch instead of once per page. At most max_in_flight batches are submitted at
+    a time, so the waiting pages stay in the scheduler, where an interactive page can overtake them,
+    instead of in the first in, first out queue of the executor. The results are routed back to the
+    future of every page, and the shared memory of a batch is released once its call is done.
+
+    Attributes:
+        executor (Optional[Executor]): The pool the batches are OCR-ed on. None, the default, uses the process wide
+                                       worker pool, fetched on every batch so a pool broken by a worker crash
+                                       is replaced.
+        max_batch_size (int): The most pages in a batch. Defaults to 8.
+        max_delay (float): The most seconds a page waits for its batch to fill. Defaults to 0.005.
+        max_in_flight (Optional[int]): The most batches submitted to the executor at a time, None does not limit them.
+                                       Defaults to None.
+        scheduler (OcrScheduler): The queue of the pages waiting for a batch.
+        batch_function (Callable): OCRs a batch of shared pages on a worker, returning the annotations, or the
+                                   exception, of every page. Defaults to ocr_shared_pages.
+        stats (Dict[str, int]): The "batches" submitted and the "pages" they held.
+
+    Methods:
+        from_settings(cls) -> 'OcrDispatcher':
+            Create a dispatcher on the process wide worker pool, configured by settings.OCR_DISPATCHER.
+
+        submit(image, priority, tenant, document) -> Future:
+            Queue a page for OCR.
+
+        ocr_pages(images, priority, tenant, document) -> List[AnnotationTable]:
+            Queue pages for OCR and wait for their annotations.
+
+        close():
+            Flush the queued pages and stop the dispatching thread.
+
+        metrics() -> Dict:
+            Get the scheduler metrics and the batch counters.
+    """
+
+    executor: Optional[Executor] = None
+    max_batch_size: int = 8
+    max_delay: float = 0.005
+    max_in_flight: Optional[int] = None
+    batch_function: Callable = ocr_shared_pages
+    scheduler: OcrScheduler = field(default_factory=OcrScheduler)
+    stats: Dict[str, int] = field(default_factory=lambda: {"batches": 0, "pages": 0})
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._slots = threading.Semaphore(self.max_in_flight) if self.max_in_flight else None
+
+    @classmethod
+    def from_settings(cls) -> "OcrDispatcher":
+        """
+        Create a dispatcher on the process wide worker pool, configured by settings.OCR_DISPATCHER.
+
+        Returns:
+            OcrDispatcher: The configured dispatcher.
+        """
+        config = getattr(settings, "OCR_DISPATCHER", {})
+        return cls(
+            max_batch_size=config.get("MAX_BATCH_SIZE", cls.max_batch_size),
+            max_delay=config.get("MAX_DELAY", cls.max_delay),
+            max_in_flight=config.get("MAX_IN_FLIGHT") or get_worker_count(),
+        )
+
+    def submit(
+        self, image: Image, priority: str = INTERACTIVE, tenant: str = "", document: str = ""
+    ) -> Future:
+        """
+        Queue a page for OCR.
+
+        Args:
+            image (Image): The page image.
+            priority (str): The priority class of the page, one of OcrScheduler.PRIORITIES. Defaults to "interactive".
+            tenant (str): The user or firm the page is OCR-ed for. Defaults to "".
+            document (str): The document the page belongs to. Defaults to "".
+
+        Returns:
+            Future: The future of the annotations of the page, an AnnotationTable.
+        """
+        future: Future = Future()
+        with self._thread_lock:
+            self.scheduler.put((image, future), priority=priority, tenant=tenant, document=document)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name="ocr-dispatcher", daemon=True)
+                self._thread.start()
+        return future
+
+    def ocr_pages(
+        self, images: List[Image], priority: str = INTERACTIVE, tenant: str = "", document: str = ""
+    ) -> List[AnnotationTable]:
+        """
+        Queue the pages of a document for OCR and wait for their annotations.
+
+        Args:
+            images (List[Image]): The page images.
+            priority (str): The priority class of the pages, one of OcrScheduler.PRIORITIES. Defaults to "interactive".
+            tenant (str): The user or firm the pages are OCR-ed for. Defaults to "".
+            document (str): The document the pages belong to. Defaults to "".
+
+        Returns:
+            List[AnnotationTable]: The annotations of every page, in order.
+        """
+        futures = [
+            self.submit(image, priority=priority, tenant=tenant, document=document) for image in images
+        ]
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        """
+        Flush the queued pages and stop the dispatching thread, without waiting for the last submitted batches.
+        """
+        with self._thread_lock:
+            if self._thread is None:
+                return
+            self.scheduler.close()
+            self._thread.join()
+            self._thread = None
+            self.scheduler.reopen()
+
+    def metrics(self) -> Dict[str, Dict]:
+        """
+        Get the scheduler metrics of every priority class and the batch counters.
+
+        Returns:
+            Dict[str, Dict]: The OcrScheduler.metrics() by class under "queues", and the stats under "batches".
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        return {"queues": self.scheduler.metrics(), "batches": stats}
+
+    def _dispatch(self) -> None:
+        """
+        Take the queued pages in batches and submit them, until the scheduler is closed and empty.
+        """
+        while True:
+            if self._slots is not None:
+                self._slots.acquire()
+            item = self.scheduler.get()
+            if item is None:
+                self._release_slot()
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                item = self.scheduler.get(timeout=remaining)
+                if item is None:
+                    break
+                batch.append(item)
+            self._submit_batch(batch)
+
+    def _submit_batch(self, batch: List[Tuple[Image, Future]]) -> None:
+        """
+        Copy a batch into shared memory and submit it as one call, resolving the futures of its pages when done.
+        """
+        images: List[Image] = []
+        futures: List[Future] = []
+        for image, future in batch:
+            # a page cancelled while queued is left out
+            if future.set_running_or_notify_cancel():
+                images.append(image)
+                futures.append(future)
+        if not futures:
+            self._release_slot()
+            return
+
+        segments: List[shared_memory.SharedMemory] = []
+        try:
+            shared_pages = []
+            for image in images:
+                segment, shared_page = SharedPage.create(image)
+                segments.append(segment)
+                shared_pages.append(shared_page)
+            if self.executor is not None:
+                batch_future = self.executor.submit(self.batch_function, shared_pages)
+            else:
+                batch_future = submit_to_executor(self.batch_function, shared_pages)
+        except Exception as error:
+            release_segments(segments)
+            self._release_slot()
+            for future in futures:
+                future.set_exception(error)
+            return
+
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["pages"] += len(futures)
+        batch_future.add_done_callback(
+            lambda done: self._complete_batch(done, futures, segments)
+        )
+
+    def _complete_batch(self, batch_future: Future, futures: List[Future], segments: List[shared_memory.SharedMemory]) -> None:
+        """
+        Release the shared memory and the slot of a finished batch and route its results to the futures of its pages.
+        """
+        release_segments(segments)
+        self._release_slot()
+        try:
+            results = batch_future.result()
+        except BaseException as error:
+            for future in futures:
+                future.set_exception(error)
+            return
+
+        for future, result in zip(futures, results):
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _release_slot(self) -> None:
+        if self._slots is not None:
+            self._slots.release()
+
+
+def get_ocr_dispatcher() -> OcrDispatcher:
+    """
+    Get the process wide OCR dispatcher, creating it on first use.
+
+    Returns:
+        OcrDispatcher: The shared OCR dispatcher.
+    """
+    global _ocr_dispatcher
+    with _ocr_dispatcher_lock:
+        if _ocr_dispatcher is None:
+            _ocr_dispatcher = OcrDispatcher.from_settings()
+        return _ocr_dispatcher
@@ -0,0 +1,206 @@
+"""
+provides the process wide pool of OCR engines, which caps the pages OCR-ed concurrently in a process
+"""
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+import queue
+import threading
+from django.conf import settings
+from PIL import Image as PILImage, ImageDraw
+from PIL.Image import Image
+from TaxParsingAPI.helpers.executor import get_worker_count
+
+logger = logging.getLogger(__name__)
+
+_engine_pool: Optional["OcrEnginePool"] = None
+_engine_pool_lock = threading.Lock()
+
+
+def create_ocrmac_engine(recognition_level: str = "accurate") -> Any:
+    """
+    Create an ocrmac OCR engine, importing ocrmac, and the Vision framework with it, on first use.
+
+    Args:
+        recognition_level (str): "accurate" or "fast".
+
+    Returns:
+        OCR: The engine, holding a blank placeholder image until a page is handed to it.
+    """
+    from ocrmac.ocrmac import OCR
+
+    return OCR(image=PILImage.new("L", (1, 1), 255), recognition_level=recognition_level)
+
+
+@dataclass
+class OcrEnginePool:
+    """
+    Data class for a pool of OCR engines shared by every page OCR-ed in a process, which caps the
+    pages, or strips, OCR-ed concurrently.
+
+    An engine is created the first time no idle one is left, up to size engines, and is then checked
+    out and back in for every page. An engine handles one page at a time, so size is a concurrency
+    cap: an ocrmac engine only holds the image and the recognition level, and builds a new Vision
+    request for every recognition, so no recognition state is reused between pages. What is paid once
+    per process is loading the Vision framework and its models, on the first recognition, which
+    warm_up moves ahead of the first page.
+
+    Attributes:
+        size (int): The most engines the pool creates. Defaults to 1.
+        recognition_level (str): The recognition level of the engines, "accurate" or "fast". Defaults to "accurate".
+        engine_factory (Optional[Callable[[], Any]]): Creates an engine with image and res attributes and a
+                                                      recognize(px) method. Defaults to an ocrmac engine.
+        stats (Dict[str, int]): The "created" engines, the "recognitions" and the "waits" for an idle engine.
+
+    Methods:
+        from_settings(cls) -> 'OcrEnginePool':
+            Create a pool configured by settings.OCR_ENGINES.
+
+        engine() -> Iterator[Any]:
+            Check an engine out of the pool for the duration of the context.
+
+        recognize(image) -> List[Tuple[str, float, Tuple[float, float, float, float]]]:
+            Recognize the text of an image on an engine of the pool.
+
+        warm_up():
+            Run a first recognition, so the first page does not pay for loading the OCR framework.
+    """
+
+    size: int = 1
+    recognition_level: str = "accurate"
+    engine_factory: Optional[Callable[[], Any]] = None
+    stats: Dict[str, int] = field(
+        default_factory=lambda: {"created": 0, "recognitions": 0, "waits": 0}
+    )
+
+    def __post_init__(self):
+        if self.engine_factory is None:
+            self.engine_factory = lambda: create_ocrmac_engine(self.recognition_level)
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "OcrEnginePool":
+        """
+        Create a pool configured by settings.OCR_ENGINES, with an engine per worker by default.
+
+        Returns:
+            OcrEnginePool: The configured pool.
+        """
+        config = getattr(settings, "OCR_ENGINES", {})
+        return cls(
+            size=config.get("SIZE") or get_worker_count(),
+            recognition_level=config.get("RECOGNITION_LEVEL", cls.recognition_level),
+        )
+
+    @contextmanager
+    def engine(self) -> Iterator[Any]:
+        """
+        Check an engine out of the pool for the duration of the context, creating it if none is idle
+        and fewer than size exist, or waiting for one otherwise.
+
+        Yields:
+            Any: The engine.
+        """
+        engine = self._check_out()
+        try:
+            yield engine
+        finally:
+            self._idle.put(engine)
+
+    def recognize(self, image: Image) -> List[Tuple[str, float, Tuple[float, float, float, float]]]:
+        """
+        Recognize the text of an image on an engine of the pool.
+
+        Args:
+            image (Image): The image.
+
+        Returns:
+            List[Tuple[str, float, Tuple[float, float, float, float]]]: The (text, confidence, bbox) of every
+                                                                         recognized text, bbox in pixels.
+        """
+        with self.engine() as engine:
+            engine.image = image
+            try:
+                return engine.recognize(px=True)
+            finally:
+                # do not keep the page, nor its results, alive while the engine is idle
+                engine.image = None
+                engine.res = None
+                with self._lock:
+                    self.stats["recognitions"] += 1
+
+    def warm_up(self) -> None:
+        """
+        Run a first recognition on a small drawn page, which loads the OCR framework and its models
+        in this process, so the first page does not pay for it.
+        """
+        page = PILImage.new("L", (240, 60), 255)
+        ImageDraw.Draw(page).text((10, 20), "Form 1040 220,640.", fill=0)
+        self.recognize(page.convert("RGB"))
+
+    def _check_out(self) -> Any:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self.stats["created"] < self.size
+            if create:
+                self.stats["created"] += 1
+            else:
+                self.stats["waits"] += 1
+        if not create:
+            return self._idle.get()
+
+        try:
+            return self.engine_factory()
+        except BaseException:
+            with self._lock:
+                self.stats["created"] -= 1
+            raise
+
+
+def get_ocr_engine_pool() -> OcrEnginePool:
+    """
+    Get the process wide OCR engine pool, creating it on first use.
+
+    Returns:
+        OcrEnginePool: The shared OCR engine pool.
+    """
+    global _engine_pool
+    with _engine_pool_lock:
+        if _engine_pool is None:
+            _engine_pool = OcrEnginePool.from_settings()
+        return _engine_pool
+
+
+def warm_up_ocr_engines() -> bool:
+    """
+    Warm up the process wide OCR engine pool.
+
+    Returns:
+        bool: True if the warm-up recognition ran, False if OCR is not available in this process.
+    """
+    try:
+        get_ocr_engine_pool().warm_up()
+    except Exception:
+        logger.warning("Could not warm up the OCR engines", exc_info=True)
+        return False
+    logger.info("Warmed up the OCR engines")
+    return True
+
+
+def start_ocr_engine_warm_up() -> threading.Thread:
+    """
+    Warm up the process wide OCR engine pool on a daemon thread, so the startup of the process is not held up.
+
+    Returns:
+        threading.Thread: The warm-up thread.
+    """
+    thread = threading.Thread(target=warm_up_ocr_engines, name="ocr-engine-warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,210 @@
+"""
+provides the priority aware, fair queue of the pages waiting for an OCR worker
+"""
+
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, ClassVar, Deque, Dict, List, Optional, Tuple
+import threading
+import time
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+REPROCESS = "reprocess"
+
+
+def get_tenant(user: Any) -> str:
+    """
+    Get the tenant the pages of a user are shared fairly as.
+
+    Args:
+        user (Any): The user of the request, if any.
+
+    Returns:
+        str: The primary key of an authenticated user, or "" for everyone else.
+    """
+    if user is None or not getattr(user, "is_authenticated", False):
+        return ""
+    return str(user.pk)
+
+
+@dataclass
+class OcrScheduler:
+    """
+    Data class for ordering the pages waiting for an OCR worker.
+
+    Pages are queued by priority class, then by tenant, then by document. The next page is taken
+    from the most urgent class holding pages, so interactive uploads never wait behind bulk ingest
+    or reprocessing. Within a class the tenants take turns, and within a tenant the documents take
+    turns, one page each, so an 80 page document is interleaved page by page with the single page
+    documents queued after it instead of running to completion first.
+
+    Attributes:
+        wait_samples (int): The most recent waits per class kept to compute the wait time metrics. Defaults to 1000.
+
+    Methods:
+        put(item, priority, tenant, document):
+            Queue a page.
+
+        get(timeout) -> Optional[Any]:
+            Take the next page, waiting up to timeout seconds for one.
+
+        close():
+            Make get return None once the queued pages are taken.
+
+        reopen():
+            Make get wait for pages again after close.
+
+        depth(tenant) -> int:
+            Count the queued pages, of every tenant or of one.
+
+        metrics() -> Dict:
+            Get the queue depth and the wait time metrics of every class.
+    """
+
+    wait_samples: int = 1000
+
+    # from the most to the least urgent
+    PRIORITIES: ClassVar[List[str]] = [INTERACTIVE, BULK, REPROCESS]
+
+    def __post_init__(self):
+        # class -> tenant -> document -> pages, each level in turn order
+        self._queues: Dict[str, "OrderedDict[str, OrderedDict[str, Deque[Tuple[Any, float]]]]"] = {
+            priority: OrderedDict() for priority in self.PRIORITIES
+        }
+        self._depths: Dict[str, int] = {priority: 0 for priority in self.PRIORITIES}
+        self._waits: Dict[str, Deque[float]] = {
+            priority: deque(maxlen=self.wait_samples) for priority in self.PRIORITIES
+        }
+        self._dispatched: Dict[str, int] = {priority: 0 for priority in self.PRIORITIES}
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, item: Any, priority: str = INTERACTIVE, tenant: str = "", document: str = "") -> None:
+        """
+        Queue a page.
+
+        Args:
+            item (Any): The page.
+            priority (str): The priority class, one of PRIORITIES. Defaults to "interactive".
+            tenant (str): The user or firm the page is OCR-ed for. Defaults to "".
+            document (str): The document the page belongs to. Defaults to "".
+
+        Raises:
+            ValueError: If priority is not one of PRIORITIES.
+        """
+        if priority not in self._queues:
+            raise ValueError(f"Unknown OCR priority {priority!r}, expected one of {self.PRIORITIES}")
+        with self._condition:
+            tenants = self._queues[priority]
+            documents = tenants.setdefault(tenant, OrderedDict())
+            documents.setdefault(document, deque()).append((item, time.monotonic()))
+            self._depths[priority] += 1
+            self._condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        """
+        Take the next page, waiting up to timeout seconds for one.
+
+        Args:
+            timeout (Optional[float]): The most seconds to wait, None waits until a page is queued or close is called.
+
+        Returns:
+            Optional[Any]: The page, or None if the timeout expired or the scheduler was closed with no page left.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                for priority in self.PRIORITIES:
+                    if self._depths[priority]:
+                        return self._take(priority)
+                if self._closed:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def close(self) -> None:
+        """
+        Make get return None once the queued pages are taken, instead of waiting for more.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def reopen(self) -> None:
+        """
+        Make get wait for pages again after close.
+        """
+        with self._condition:
+            self._closed = False
+
+    def depth(self, tenant: Optional[str] = None) -> int:
+        """
+        Count the queued pages of every class, of every tenant or of one.
+
+        Args:
+            tenant (Optional[str]): The tenant to count the pages of, None counts every tenant. Defaults to None.
+
+        Returns:
+            int: The number of queued pages.
+        """
+        with self._condition:
+            if tenant is None:
+                return sum(self._depths.values())
+            return sum(
+                len(pages)
+                for tenants in self._queues.values()
+                for pages in tenants.get(tenant, {}).values()
+            )
+
+    def metrics(self) -> Dict[str, Dict]:
+        """
+        Get the queue depth and the wait time metrics of every class.
+
+        Returns:
+            Dict[str, Dict]: By class, the queued "depth", the "tenants" and "documents" with queued pages, the
+                             "dispatched" pages, and the "wait_seconds" of the recent pages as "mean", "p99" and "max".
+        """
+        with self._condition:
+            metrics = {}
+            for priority in self.PRIORITIES:
+                waits = sorted(self._waits[priority])
+                tenants = self._queues[priority]
+                metrics[priority] = {
+                    "depth": self._depths[priority],
+                    "tenants": len(tenants),
+                    "documents": sum(len(documents) for documents in tenants.values()),
+                    "dispatched": self._dispatched[priority],
+                    "wait_seconds": {
+                        "mean": sum(waits) / len(waits) if waits else 0.0,
+                        "p99": waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0,
+                        "max": waits[-1] if waits else 0.0,
+                    },
+                }
+            return metrics
+
+    def _take(self, priority: str) -> Any:
+        """
+        Take the first page of the next document of the next tenant of a class, and move both to
+        the back of their turn order. Must be called with the condition held.
+        """
+        tenants = self._queues[priority]
+        tenant, documents = next(iter(tenants.items()))
+        document, pages = next(iter(documents.items()))
+        item, queued_at = pages.popleft()
+
+        if pages:
+            documents.move_to_end(document)
+        else:
+            del documents[document]
+        if documents:
+            tenants.move_to_end(tenant)
+        else:
+            del tenants[tenant]
+
+        self._depths[priority] -= 1
+        self._dispatched[priority] += 1
+        self._waits[priority].append(time.monotonic() - queued_at)
+        return item
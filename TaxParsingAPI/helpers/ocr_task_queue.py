@@ -0,0 +1,416 @@
+"""
+provides the database backed queue of page OCR tasks, claimed with leases by workers on any node
+"""
+
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import List, Optional, Union
+import logging
+import shutil
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL.Image import Image
+from TaxParsingAPI.models import OcrTask, UPLOAD_TO
+from TaxParsingAPI.helpers.ocr_scheduler import INTERACTIVE, OcrScheduler
+from TaxParsingAPI.helpers.utils.annotation_store import AnnotationStore
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+from TaxParsingAPI.helpers.utils.ocr_wrapper import OcrWrapper
+
+logger = logging.getLogger(__name__)
+
+_ocr_task_queue: Optional["OcrTaskQueue"] = None
+_ocr_task_queue_lock = threading.Lock()
+
+
+def ocr_task_image(image_path: Path) -> AnnotationTable:
+    """
+    Perform OCR on the page image of a task, on a pool worker.
+
+    Args:
+        image_path (Path): The path to the page image.
+
+    Returns:
+        AnnotationTable: The annotations of the page.
+    """
+    return AnnotationTable.from_annotations(OcrWrapper.from_settings(image=str(image_path)).annotations)
+
+
+@dataclass
+class OcrTaskQueue:
+    """
+    Data class for distributing the OCR of pages to `run_ocr_worker` processes on any number of nodes.
+
+    The queue is the OcrTask table and the task directory of the shared artifact store, so adding
+    a node only takes starting workers on it, with no message broker. The producer writes every
+    page image to the task directory and queues a task for it. A worker claims tasks by leasing
+    them, with a conditional update that only one worker can win, renews its leases while it OCRs
+    the pages, writes the annotations of every page to the task directory, and marks the task done
+    if it still holds the lease. A lease that is not renewed expires and its task is queued again,
+    until it was attempted max_attempts times. The producer polls its tasks until they are done,
+    reads the annotations and deletes the tasks and their files. The tasks of a producer that died
+    before deleting them are purged by the workers once they are retention_seconds stale.
+
+    Attributes:
+        directory (Path): The task directory, shared by every node. Defaults to MEDIA_ROOT/tax_forms/ocr_tasks.
+        lease_seconds (float): Seconds a lease lasts unless it is renewed. Defaults to 60.
+        max_attempts (int): The most times a task is leased before it fails. Defaults to 3.
+        poll_interval (float): Seconds between the polls of the producer and of idle workers. Defaults to 0.2.
+        timeout (Optional[float]): The most seconds the producer waits for its tasks, None waits forever.
+                                   Defaults to 600.
+        retention_seconds (float): Seconds a done or failed task is kept for its producer to read, and a task is
+                                   kept after its producer stopped waiting for it, before it is purged. Defaults to 3600.
+
+    Methods:
+        from_settings(cls) -> 'OcrTaskQueue':
+            Create a queue configured by settings.OCR_TASK_QUEUE.
+
+        enqueue(images, priority, tenant, document) -> List[OcrTask]:
+            Queue the OCR of pages.
+
+        claim(worker, limit) -> List[OcrTask]:
+            Lease the next tasks for a worker.
+
+        heartbeat(tasks) -> int:
+            Renew the leases of tasks.
+
+        complete(task, annotations) -> bool:
+            Write the annotations of a leased task and mark it done.
+
+        fail(task, error) -> bool:
+            Give up a leased task after an error.
+
+        requeue_expired() -> int:
+            Queue again the tasks whose lease expired.
+
+        depth(tenant) -> int:
+            Count the tasks pending or leased, of every tenant or of one.
+
+        purge() -> int:
+            Delete the stale tasks no producer will read, and their files.
+
+        wait(tasks) -> List[AnnotationTable]:
+            Wait for tasks to be done and read their annotations.
+
+        ocr_pages(images, priority, tenant, document) -> List[AnnotationTable]:
+            Queue pages for OCR and wait for their annotations.
+    """
+
+    directory: Path = None
+    lease_seconds: float = 60.0
+    max_attempts: int = 3
+    poll_interval: float = 0.2
+    timeout: Optional[float] = 600.0
+    retention_seconds: float = 3600.0
+
+    def __post_init__(self):
+        if self.directory is None:
+            self.directory = Path(settings.MEDIA_ROOT) / UPLOAD_TO / "ocr_tasks"
+        self.directory = Path(self.directory)
+
+    @classmethod
+    def from_settings(cls) -> "OcrTaskQueue":
+        """
+        Create a queue configured by settings.OCR_TASK_QUEUE.
+
+        Returns:
+            OcrTaskQueue: The configured queue.
+        """
+        config = getattr(settings, "OCR_TASK_QUEUE", {})
+        return cls(
+            directory=config.get("DIRECTORY"),
+            lease_seconds=config.get("LEASE_SECONDS", cls.lease_seconds),
+            max_attempts=config.get("MAX_ATTEMPTS", cls.max_attempts),
+            poll_interval=config.get("POLL_INTERVAL", cls.poll_interval),
+            timeout=config.get("TIMEOUT", cls.timeout),
+            retention_seconds=config.get("RETENTION_SECONDS", cls.retention_seconds),
+        )
+
+    def enqueue(
+        self, images: List[Union[Image, Path]], priority: str = INTERACTIVE, tenant: str = "", document: str = ""
+    ) -> List[OcrTask]:
+        """
+        Write page images to the task directory and queue a task for each.
+
+        Args:
+            images (List[Union[Image, Path]]): The in-memory images, or the paths to the image files, of the pages.
+            priority (str): The priority class of the pages, one of OcrScheduler.PRIORITIES. Defaults to "interactive".
+            tenant (str): The user or firm the pages are OCR-ed for. Defaults to "".
+            document (str): The file name of the tax form the pages belong to. Defaults to "".
+
+        Returns:
+            List[OcrTask]: The queued tasks, in page order.
+
+        Raises:
+            ValueError: If priority is not one of OcrScheduler.PRIORITIES.
+        """
+        if priority not in OcrScheduler.PRIORITIES:
+            raise ValueError(f"Unknown OCR priority {priority!r}, expected one of {OcrScheduler.PRIORITIES}")
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        tasks = []
+        for page_number, image in enumerate(images):
+            task = OcrTask(
+                document=document,
+                page_number=page_number,
+                priority=OcrScheduler.PRIORITIES.index(priority),
+                tenant=tenant,
+            )
+            task.image = f"{task.id}.png"
+            if isinstance(image, Path):
+                shutil.copyfile(image, self.directory / task.image)
+            else:
+                image.save(self.directory / task.image, format="PNG")
+            tasks.append(task)
+        return OcrTask.objects.bulk_create(tasks)
+
+    def claim(self, worker: str, limit: int = 1) -> List[OcrTask]:
+        """
+        Lease the next tasks for a worker, the most urgent and then the oldest first.
+
+        Every task is leased with a conditional update that only succeeds if the task is still claimable,
+        so workers racing for a task, on any node, cannot both win it.
+
+        Args:
+            worker (str): The name of the worker, such as "<host>:<pid>".
+            limit (int): The most tasks to lease. Defaults to 1.
+
+        Returns:
+            List[OcrTask]: The leased tasks.
+        """
+        now = timezone.now()
+        claimable = Q(status=OcrTask.PENDING) | Q(
+            status=OcrTask.LEASED, lease_expires_at__lt=now, attempts__lt=self.max_attempts
+        )
+        candidates = list(
+            OcrTask.objects.filter(claimable)
+            .order_by("priority", "created_at", "page_number")
+            .values_list("id", flat=True)[: limit * 4]
+        )
+
+        claimed = []
+        for task_id in candidates:
+            leased = OcrTask.objects.filter(claimable, id=task_id).update(
+                status=OcrTask.LEASED,
+                leased_by=worker,
+                lease_token=uuid.uuid4(),
+                lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                attempts=F("attempts") + 1,
+                updated_at=now,
+            )
+            if leased:
+                claimed.append(task_id)
+                if len(claimed) == limit:
+                    break
+        return list(OcrTask.objects.filter(id__in=claimed).order_by("priority", "created_at", "page_number"))
+
+    def heartbeat(self, tasks: List[OcrTask]) -> int:
+        """
+        Renew the leases of tasks still held by the worker that leased them.
+
+        Args:
+            tasks (List[OcrTask]): The leased tasks.
+
+        Returns:
+            int: The number of leases renewed, fewer than the tasks if some expired and were claimed again.
+        """
+        if not tasks:
+            return 0
+        held = Q()
+        for task in tasks:
+            held |= Q(id=task.id, lease_token=task.lease_token)
+        now = timezone.now()
+        return OcrTask.objects.filter(held, status=OcrTask.LEASED).update(
+            lease_expires_at=now + timedelta(seconds=self.lease_seconds), updated_at=now
+        )
+
+    def complete(self, task: OcrTask, annotations: AnnotationTable) -> bool:
+        """
+        Write the annotations of a leased task to the task directory and mark it done.
+
+        The annotation file is named after the lease, so a worker whose lease expired never overwrites
+        the annotations of the worker that claimed the task after it.
+
+        Args:
+            task (OcrTask): The leased task.
+            annotations (AnnotationTable): The annotations of the page.
+
+        Returns:
+            bool: True if the task was done, False if the lease was lost and the annotations were discarded.
+        """
+        result = f"{task.id}.{task.lease_token.hex}{AnnotationStore.SUFFIX}"
+        AnnotationStore.write(self.directory / result, {0: annotations}).close()
+        done = OcrTask.objects.filter(id=task.id, lease_token=task.lease_token, status=OcrTask.LEASED).update(
+            status=OcrTask.DONE, result=result, error="", updated_at=timezone.now()
+        )
+        if not done:
+            (self.directory / result).unlink(missing_ok=True)
+            logger.warning("Lost the lease of OCR task %s before completing it", task.id)
+        return bool(done)
+
+    def fail(self, task: OcrTask, error: BaseException) -> bool:
+        """
+        Give up a leased task after an error, queueing it again unless it was attempted max_attempts times.
+
+        Args:
+            task (OcrTask): The leased task.
+            error (BaseException): The error.
+
+        Returns:
+            bool: True if the task was given up, False if the lease was already lost.
+        """
+        status = OcrTask.FAILED if task.attempts >= self.max_attempts else OcrTask.PENDING
+        return bool(
+            OcrTask.objects.filter(id=task.id, lease_token=task.lease_token, status=OcrTask.LEASED).update(
+                status=status,
+                error=str(error) or error.__class__.__name__,
+                leased_by="",
+                lease_token=None,
+                lease_expires_at=None,
+                updated_at=timezone.now(),
+            )
+        )
+
+    def requeue_expired(self) -> int:
+        """
+        Queue again the tasks whose lease expired, and fail the ones attempted max_attempts times.
+
+        Returns:
+            int: The number of tasks queued again.
+        """
+        now = timezone.now()
+        expired = OcrTask.objects.filter(status=OcrTask.LEASED, lease_expires_at__lt=now)
+        expired.filter(attempts__gte=self.max_attempts).update(
+            status=OcrTask.FAILED, error="The lease expired on every attempt.", updated_at=now
+        )
+        requeued = expired.filter(attempts__lt=self.max_attempts).update(
+            status=OcrTask.PENDING, leased_by="", lease_token=None, lease_expires_at=None, updated_at=now
+        )
+        if requeued:
+            logger.info("Queued %d OCR tasks with an expired lease again", requeued)
+        return requeued
+
+    def depth(self, tenant: Optional[str] = None) -> int:
+        """
+        Count the tasks pending or leased, of every tenant or of one.
+
+        Args:
+            tenant (Optional[str]): The tenant to count the tasks of, None counts every tenant. Defaults to None.
+
+        Returns:
+            int: The number of tasks waiting for a worker or being OCR-ed.
+        """
+        tasks = OcrTask.objects.filter(status__in=[OcrTask.PENDING, OcrTask.LEASED])
+        if tenant is not None:
+            tasks = tasks.filter(tenant=tenant)
+        return tasks.count()
+
+    def purge(self) -> int:
+        """
+        Delete the tasks no producer will read, and their files: the tasks done or failed retention_seconds ago,
+        whose producer died before deleting them, and the tasks queued retention_seconds before their producer
+        stopped waiting for them.
+
+        Returns:
+            int: The number of tasks deleted.
+        """
+        now = timezone.now()
+        retention = timedelta(seconds=self.retention_seconds)
+        stale = Q(status__in=[OcrTask.DONE, OcrTask.FAILED], updated_at__lt=now - retention)
+        if self.timeout is not None:
+            stale |= Q(created_at__lt=now - retention - timedelta(seconds=self.timeout))
+        task_ids = list(OcrTask.objects.filter(stale).values_list("id", flat=True))
+        if task_ids:
+            self._delete(task_ids)
+            logger.info("Purged %d stale OCR tasks", len(task_ids))
+        return len(task_ids)
+
+    def wait(self, tasks: List[OcrTask]) -> List[AnnotationTable]:
+        """
+        Wait for tasks to be done, read their annotations and delete the tasks and their files.
+
+        Args:
+            tasks (List[OcrTask]): The queued tasks.
+
+        Returns:
+            List[AnnotationTable]: The annotations of every task, in order.
+
+        Raises:
+            RuntimeError: If a task failed.
+            TimeoutError: If the tasks were not done within timeout seconds.
+        """
+        task_ids = [task.id for task in tasks]
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        try:
+            while True:
+                statuses = {
+                    values["id"]: values
+                    for values in OcrTask.objects.filter(id__in=task_ids).values("id", "status", "result", "error")
+                }
+                failed = [
+                    task for task in tasks
+                    if task.id not in statuses or statuses[task.id]["status"] == OcrTask.FAILED
+                ]
+                if failed:
+                    error = statuses.get(failed[0].id, {}).get("error") or "The task was deleted."
+                    raise RuntimeError(f"OCR of page {failed[0].page_number} of {failed[0].document} failed: {error}")
+                if all(values["status"] == OcrTask.DONE for values in statuses.values()):
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"OCR of {len(tasks)} pages was not done within {self.timeout} seconds")
+                time.sleep(self.poll_interval)
+
+            annotations = []
+            for task in tasks:
+                with AnnotationStore(path=self.directory / statuses[task.id]["result"]) as store:
+                    annotations.append(store.read_page(0))
+            return annotations
+        finally:
+            self._delete(task_ids)
+
+    def ocr_pages(
+        self, images: List[Union[Image, Path]], priority: str = INTERACTIVE, tenant: str = "", document: str = ""
+    ) -> List[AnnotationTable]:
+        """
+        Queue pages for OCR by the workers and wait for their annotations.
+
+        Args:
+            images (List[Union[Image, Path]]): The in-memory images, or the paths to the image files, of the pages.
+            priority (str): The priority class of the pages, one of OcrScheduler.PRIORITIES. Defaults to "interactive".
+            tenant (str): The user or firm the pages are OCR-ed for. Defaults to "".
+            document (str): The file name of the tax form the pages belong to. Defaults to "".
+
+        Returns:
+            List[AnnotationTable]: The annotations of every page, in order.
+        """
+        return self.wait(self.enqueue(images=images, priority=priority, tenant=tenant, document=document))
+
+    def _delete(self, task_ids: List[uuid.UUID]) -> None:
+        """
+        Delete tasks and their files. A worker still holding one of them loses its lease.
+        """
+        for image, result in OcrTask.objects.filter(id__in=task_ids).values_list("image", "result"):
+            for name in (image, result):
+                if name:
+                    (self.directory / name).unlink(missing_ok=True)
+        OcrTask.objects.filter(id__in=task_ids).delete()
+
+
+def get_ocr_task_queue() -> Optional[OcrTaskQueue]:
+    """
+    Get the process wide OCR task queue, creating it on first use.
+
+    Returns:
+        Optional[OcrTaskQueue]: The shared OCR task queue, or None if settings.OCR_TASK_QUEUE does not enable it.
+    """
+    global _ocr_task_queue
+    if not getattr(settings, "OCR_TASK_QUEUE", {}).get("ENABLED"):
+        return None
+    with _ocr_task_queue_lock:
+        if _ocr_task_queue is None:
+            _ocr_task_queue = OcrTaskQueue.from_settings()
+        return _ocr_task_queue
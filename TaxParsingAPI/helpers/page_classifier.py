@@ -0,0 +1,132 @@
+"""
+provides the classification of the pages of a tax form from the PDF text layer, before OCR
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import ClassVar, Iterable, List, Optional, Tuple
+import logging
+import subprocess
+import regex as re
+
+logger = logging.getLogger(__name__)
+
+FORM_1040_PAGE_1 = "1040_p1"
+FORM_1040_PAGE_2 = "1040_p2"
+SCHEDULE = "schedule"
+OTHER = "other"
+# a page without a text layer, such as a scan, which only OCR can classify
+UNKNOWN = "unknown"
+
+
+@dataclass
+class PageClassifier:
+    """
+    Data class for labelling the pages of a tax form before they are OCR-ed.
+
+    The text layer of the PDF is read with pdftotext, which ships with the poppler utilities
+    pdf2image already rasterizes with, and every page is labelled as the first page of Form 1040,
+    its second page, a schedule or supporting form, or another page. A page with too little text
+    to go by, such as a scanned page, is labelled unknown, since telling it apart would take the
+    OCR the classification is meant to save.
+
+    Attributes:
+        min_text_chars (int): The fewest non blank characters a page needs to be classified. Defaults to 20.
+        timeout (float): Seconds pdftotext is given to read the text layer. Defaults to 30.
+
+    Methods:
+        classify(file_path, file_bytes) -> List[str]:
+            Label every page of a PDF.
+
+        classify_text(text) -> str:
+            Label a page from its text.
+
+        select_pages(cls, page_labels, wanted_labels) -> List[int]:
+            Get the pages to process for the wanted labels.
+    """
+
+    min_text_chars: int = 20
+    timeout: float = 30.0
+
+    # checked in order, the first label with a matching pattern wins. The 1040 headers come first so a
+    # 1040 page quoting a schedule is not taken for one, and the schedules come before the line hints
+    # since schedules refer to the 1040 lines by their statements
+    LABEL_PATTERNS: ClassVar[List[Tuple[str, List[str]]]] = [
+        (FORM_1040_PAGE_2, [r"Form\s+1040(?:-SR)?\s*\(\d{4}\)\s*Page\s*2\b"]),
+        (FORM_1040_PAGE_1, [r"Form\s*1040(?:-SR)?\b.{0,200}?U\.?\s?S\.?\s+Individual\s+Income\s+Tax\s+Return"]),
+        (SCHEDULE, [r"^\s*SCHEDULE\s+[0-9A-Z]{1,3}\b", r"^\s*Form\s+(?:8949|8812|8863|8995|2441|W-2|1099)"]),
+        (FORM_1040_PAGE_1, [r"total\s+income", r"adjusted\s+gross\s+income", r"taxable\s+income"]),
+        (FORM_1040_PAGE_2, [r"total\s+tax", r"total\s+payments", r"amount\s+you\s+(?:owe|overpaid)"]),
+    ]
+
+    def classify(self, file_path: Optional[Path] = None, file_bytes: Optional[bytes] = None) -> List[str]:
+        """
+        Label every page of a PDF from its text layer.
+
+        Args:
+            file_path (Optional[Path]): The path to the PDF file, read if it exists.
+            file_bytes (Optional[bytes]): The bytes of the PDF, used when file_path does not exist.
+
+        Returns:
+            List[str]: The label of every page, in page order, empty if the text layer could not be read.
+        """
+        if file_path is not None and file_path.exists():
+            command, stdin = ["pdftotext", "-layout", str(file_path), "-"], None
+        elif file_bytes is not None:
+            command, stdin = ["pdftotext", "-layout", "-", "-"], file_bytes
+        else:
+            return []
+
+        try:
+            result = subprocess.run(command, input=stdin, capture_output=True, timeout=self.timeout, check=True)
+        except (OSError, subprocess.SubprocessError) as error:
+            logger.warning("Could not read the text layer, every page will be processed: %s", error)
+            return []
+
+        # pdftotext ends every page with a form feed
+        page_texts = result.stdout.decode("utf-8", errors="replace").split("\f")
+        if page_texts and not page_texts[-1].strip():
+            page_texts.pop()
+        return [self.classify_text(text) for text in page_texts]
+
+    def classify_text(self, text: str) -> str:
+        """
+        Label a page from its text.
+
+        Args:
+            text (str): The text layer of the page.
+
+        Returns:
+            str: The label of the page.
+        """
+        if sum(not character.isspace() for character in text) < self.min_text_chars:
+            return UNKNOWN
+        for label, patterns in self.LABEL_PATTERNS:
+            for pattern in patterns:
+                if re.search(pattern, text, re.IGNORECASE | re.MULTILINE | re.DOTALL):
+                    return label
+        return OTHER
+
+    @classmethod
+    def select_pages(cls, page_labels: List[str], wanted_labels: Iterable[str]) -> List[int]:
+        """
+        Get the pages to process for the wanted labels.
+
+        The pages with a wanted label are selected, along with the unknown ones. If no page has a wanted
+        label, the classification is not trusted and every page is selected.
+
+        Args:
+            page_labels (List[str]): The label of every page, in page order.
+            wanted_labels (Iterable[str]): The labels of the pages that can hold the requested fields.
+
+        Returns:
+            List[int]: The selected page numbers, in order.
+        """
+        wanted_labels = set(wanted_labels)
+        if not wanted_labels.intersection(page_labels):
+            return list(range(len(page_labels)))
+        return [
+            page_num
+            for page_num, label in enumerate(page_labels)
+            if label in wanted_labels or label == UNKNOWN
+        ]
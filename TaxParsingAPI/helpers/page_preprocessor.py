@@ -0,0 +1,303 @@
+"""
+provides the vectorized image preprocessing of rasterized pages before OCR
+"""
+
+from dataclasses import dataclass, field, fields
+from typing import Any, ClassVar, Dict, Optional, Tuple
+import hashlib
+import json
+import logging
+import time
+import numpy as np
+from django.conf import settings
+from PIL import Image as PILImage
+from PIL.Image import Image
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PagePreprocessor:
+    """
+    Data class for preparing a rasterized page for OCR.
+
+    The page is converted to grayscale, then optionally binarized with a local mean threshold,
+    deskewed, and cropped to its content. Every step is vectorized with NumPy, and the time spent
+    in each step is accumulated in timings, so it can be weighed against the OCR time it saves.
+    The steps after grayscale work on grayscale pixels, so they cannot be set without it.
+
+    Attributes:
+        grayscale (bool): Convert the page to 8 bit grayscale. Defaults to True.
+        binarize (bool): Turn every pixel black or white by comparing it to the mean of its neighbourhood. Defaults to False.
+        block_size (int): The side in pixels of the neighbourhood binarization compares a pixel to. Defaults to 31.
+        offset (int): How much darker than its neighbourhood mean a pixel must be to turn black. Defaults to 10.
+        deskew (bool): Rotate the page so its text lines are horizontal. Defaults to False.
+        max_skew_angle (float): The largest skew, in degrees, deskew corrects. Defaults to 5.
+        skew_step (float): The resolution, in degrees, of the skew search. Defaults to 0.5.
+        crop_margins (bool): Crop the blank margins around the content of the page. Defaults to False.
+        margin (int): The pixels of blank margin kept around the content. Defaults to 10.
+        timings (Dict[str, float]): The seconds spent in each step, accumulated over every processed page.
+        pages (int): The number of processed pages.
+
+    Methods:
+        from_template(cls, template) -> 'PagePreprocessor':
+            Create a preprocessor configured by a form template of settings.PAGE_PREPROCESSING.
+
+        get_template(cls, page_label) -> str:
+            Get the form template the pages of a PageClassifier label are preprocessed with.
+
+        get_templates_key(cls) -> str:
+            Get the key of the preprocessing configured by settings.
+
+        get_options() -> Dict[str, Any]:
+            Get the options of the preprocessor.
+
+        get_key() -> str:
+            Get the key of the options of the preprocessor.
+
+        process(image) -> Image:
+            Prepare a page for OCR.
+
+        log_timings():
+            Log the seconds spent in each step over every processed page.
+
+    Raises:
+        ValueError: If binarize, deskew or crop_margins is set without grayscale.
+    """
+
+    grayscale: bool = True
+    binarize: bool = False
+    block_size: int = 31
+    offset: int = 10
+    deskew: bool = False
+    max_skew_angle: float = 5.0
+    skew_step: float = 0.5
+    crop_margins: bool = False
+    margin: int = 10
+    timings: Dict[str, float] = field(init=False, default_factory=dict)
+    pages: int = field(init=False, default=0)
+
+    # pixels darker than this count as content when deskewing and cropping
+    INK_THRESHOLD: ClassVar[int] = 128
+    # the longest side of the thumbnail the skew is searched on
+    SKEW_SEARCH_SIZE: ClassVar[int] = 800
+
+    def __post_init__(self):
+        if not self.grayscale and (self.binarize or self.deskew or self.crop_margins):
+            raise ValueError("binarize, deskew and crop_margins work on grayscale pages and need grayscale to be set")
+
+    @classmethod
+    def from_template(cls, template: str = "default") -> "PagePreprocessor":
+        """
+        Create a preprocessor configured by a form template of settings.PAGE_PREPROCESSING.
+
+        Args:
+            template (str): The name of the form template, unknown templates use "default".
+
+        Returns:
+            PagePreprocessor: The configured preprocessor.
+        """
+        templates = getattr(settings, "PAGE_PREPROCESSING", {})
+        return cls(**templates.get(template, templates.get("default", {})))
+
+    @classmethod
+    def get_template(cls, page_label: str) -> str:
+        """
+        Get the form template the pages of a PageClassifier label are preprocessed with.
+
+        Args:
+            page_label (str): The label of the page.
+
+        Returns:
+            str: The template settings.PAGE_PREPROCESSING_BY_LABEL maps the label to, "default" for the other labels.
+        """
+        return getattr(settings, "PAGE_PREPROCESSING_BY_LABEL", {}).get(page_label, "default")
+
+    @classmethod
+    def get_templates_key(cls) -> str:
+        """
+        Get the key of the preprocessing configured by settings, from the options of every form template
+        and the template of every page label, so it changes with any of them.
+
+        Returns:
+            str: The key of the configured preprocessing.
+        """
+        templates = set(getattr(settings, "PAGE_PREPROCESSING", {})) | {"default"}
+        return cls._get_key(
+            {
+                "templates": {template: cls.from_template(template).get_options() for template in templates},
+                "by_label": getattr(settings, "PAGE_PREPROCESSING_BY_LABEL", {}),
+            }
+        )
+
+    def get_options(self) -> Dict[str, Any]:
+        """
+        Get the options of the preprocessor, the defaults included.
+
+        Returns:
+            Dict[str, Any]: The value of every option, by name.
+        """
+        return {option.name: getattr(self, option.name) for option in fields(self) if option.init}
+
+    def get_key(self) -> str:
+        """
+        Get the key of the options of the preprocessor, which the annotations OCR-ed after it are cached by.
+
+        Returns:
+            str: The key of the options.
+        """
+        return self._get_key(self.get_options())
+
+    @classmethod
+    def _get_key(cls, options: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def process(self, image: Image) -> Image:
+        """
+        Prepare a page for OCR.
+
+        Args:
+            image (Image): The rasterized page.
+
+        Returns:
+            Image: The preprocessed page, 8 bit grayscale unless grayscale is False, in which case it is returned as is.
+        """
+        if not self.grayscale:
+            return image
+
+        with self._timed("grayscale"):
+            pixels = self._to_grayscale(image)
+        if self.binarize:
+            with self._timed("binarize"):
+                pixels = self._binarize(pixels)
+        if self.deskew:
+            with self._timed("deskew"):
+                pixels = self._deskew(pixels)
+        if self.crop_margins:
+            with self._timed("crop_margins"):
+                pixels = self._crop_margins(pixels)
+
+        self.pages += 1
+        return PILImage.fromarray(pixels)
+
+    def log_timings(self, name: str = "") -> None:
+        """
+        Log the seconds spent in each step over every processed page.
+
+        Args:
+            name (str): What the pages were preprocessed for, such as the document and the form template.
+        """
+        logger.info(
+            "Preprocessed %d pages%s: %s",
+            self.pages,
+            f" of {name}" if name else "",
+            ", ".join(f"{step} {seconds:.3f}s" for step, seconds in self.timings.items()),
+        )
+
+    def _timed(self, step: str) -> "_StepTimer":
+        return _StepTimer(self.timings, step)
+
+    @classmethod
+    def _to_grayscale(cls, image: Image) -> np.ndarray:
+        """
+        Convert a page to an array of 8 bit luma values, weighting the channels as ITU-R 601.
+        """
+        if image.mode == "L":
+            return np.asarray(image, dtype=np.uint8)
+        rgb = np.asarray(image.convert("RGB"), dtype=np.float32)
+        luma = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        return np.clip(luma + 0.5, 0, 255).astype(np.uint8)
+
+    def _binarize(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Turn pixels darker than the mean of their block_size neighbourhood, minus offset, black and
+        every other pixel white. The neighbourhood means are read from a summed-area table.
+        """
+        height, width = pixels.shape
+        radius = self.block_size // 2
+        integral = np.zeros((height + 1, width + 1), dtype=np.int64)
+        integral[1:, 1:] = pixels.cumsum(axis=0, dtype=np.int64).cumsum(axis=1)
+
+        rows = np.arange(height)
+        cols = np.arange(width)
+        top = np.clip(rows - radius, 0, height)[:, None]
+        bottom = np.clip(rows + radius + 1, 0, height)[:, None]
+        left = np.clip(cols - radius, 0, width)[None, :]
+        right = np.clip(cols + radius + 1, 0, width)[None, :]
+
+        sums = integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+        areas = (bottom - top) * (right - left)
+        threshold = sums / areas - self.offset
+        return np.where(pixels < threshold, 0, 255).astype(np.uint8)
+
+    def _deskew(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Rotate the page by the angle whose horizontal projection of ink is the most peaked, which is
+        the angle that lines the text rows up horizontally. The angle is searched on a thumbnail.
+        """
+        page = PILImage.fromarray(pixels)
+        thumbnail = page.copy()
+        thumbnail.thumbnail((self.SKEW_SEARCH_SIZE, self.SKEW_SEARCH_SIZE))
+        ink = PILImage.fromarray(
+            np.where(np.asarray(thumbnail) < self.INK_THRESHOLD, 255, 0).astype(np.uint8)
+        )
+
+        # smaller angles first, so a straight page is never rotated on a tie
+        angles = sorted(
+            np.arange(-self.max_skew_angle, self.max_skew_angle + 1e-9, self.skew_step), key=abs
+        )
+        best_angle, best_score = 0.0, -1.0
+        for angle in angles:
+            profile = np.asarray(ink.rotate(float(angle), resample=PILImage.NEAREST), dtype=np.float32).sum(axis=1)
+            score = float(np.square(np.diff(profile)).sum())
+            if score > best_score:
+                best_angle, best_score = float(angle), score
+
+        if abs(best_angle) < 1e-9:
+            return pixels
+        rotated = page.rotate(best_angle, resample=PILImage.BILINEAR, fillcolor=255)
+        return np.asarray(rotated, dtype=np.uint8)
+
+    def _crop_margins(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Crop the rows and columns without ink around the content, keeping margin pixels of them.
+        """
+        bounds = self._get_content_bounds(pixels)
+        if bounds is None:
+            return pixels
+        top, bottom, left, right = bounds
+        height, width = pixels.shape
+        return pixels[
+            max(top - self.margin, 0) : min(bottom + self.margin + 1, height),
+            max(left - self.margin, 0) : min(right + self.margin + 1, width),
+        ]
+
+    @classmethod
+    def _get_content_bounds(cls, pixels: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Get the first and last rows and columns holding ink, or None for a blank page.
+        """
+        ink = pixels < cls.INK_THRESHOLD
+        rows = np.flatnonzero(ink.any(axis=1))
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(ink.any(axis=0))
+        return int(rows[0]), int(rows[-1]), int(cols[0]), int(cols[-1])
+
+
+class _StepTimer:
+    """
+    Context manager adding the seconds spent in its block to a step of a timings dictionary.
+    """
+
+    __slots__ = ("timings", "step", "started_at")
+
+    def __init__(self, timings: Dict[str, float], step: str):
+        self.timings = timings
+        self.step = step
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timings[self.step] = self.timings.get(self.step, 0.0) + time.perf_counter() - self.started_at
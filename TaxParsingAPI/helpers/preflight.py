@@ -0,0 +1,293 @@
+"""
+provides the cheap inspection of an uploaded tax form and the admission control run before it is rasterized or OCR-ed
+"""
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple
+import logging
+import math
+import regex as re
+from django.conf import settings
+from pdf2image.exceptions import PDFInfoNotInstalledError, PDFPageCountError, PDFPopplerTimeoutError
+from pdf2image.pdf2image import pdfinfo_from_bytes, pdfinfo_from_path
+from TaxParsingAPI.helpers.ocr_dispatcher import OcrDispatcher
+from TaxParsingAPI.helpers.ocr_scheduler import BULK, INTERACTIVE
+from TaxParsingAPI.helpers.ocr_task_queue import OcrTaskQueue
+
+logger = logging.getLogger(__name__)
+
+PDF_MAGIC = b"%PDF-"
+# readers accept the header anywhere in the first kilobyte, after junk such as a mail header
+PDF_MAGIC_OFFSET = 1024
+# the resolution pdf2image rasterizes pages at
+RENDER_DPI = 200
+POINTS_PER_INCH = 72
+
+
+class PreflightError(ValueError):
+    """
+    Raised when a tax form is rejected before it is rasterized.
+    """
+
+
+class AdmissionError(Exception):
+    """
+    Raised when the OCR queues are too full to admit the pages of a tax form.
+
+    Attributes:
+        status_code (int): 429 when the tenant has too many pages queued, 503 when every tenant together has.
+        retry_after (int): The seconds to wait before retrying.
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@dataclass
+class PreflightReport:
+    """
+    Data class for what the inspection of a tax form found.
+
+    Attributes:
+        file_size (int): The size of the file in bytes.
+        page_count (Optional[int]): The number of pages, None if pdfinfo is not available.
+        page_sizes (List[Tuple[float, float]]): The width and height in points of the inspected pages.
+        priority (str): The priority class the pages of the tax form are to be OCR-ed in.
+    """
+
+    file_size: int
+    page_count: Optional[int] = None
+    page_sizes: List[Tuple[float, float]] = field(default_factory=list)
+    priority: str = INTERACTIVE
+
+
+@dataclass
+class TaxFormPreflight:
+    """
+    Data class for inspecting an uploaded tax form before the expensive pipeline runs.
+
+    The file size and the PDF magic bytes are checked first, then pdfinfo, from the poppler utilities pdf2image
+    already rasterizes with, reads the page count and the size of every page from the PDF structure without
+    rendering anything. A tax form with too many pages, or a page that would rasterize to too many pixels, is
+    rejected, and a long one is routed to the bulk priority class so it does not hold back interactive uploads.
+    Without pdfinfo only the file size and the magic bytes are checked.
+
+    Attributes:
+        max_bytes (Optional[int]): The largest file accepted, None does not limit it. Defaults to 200 MiB.
+        max_pages (Optional[int]): The most pages accepted, None does not limit them. Defaults to 200.
+        bulk_pages (Optional[int]): Tax forms with more pages are OCR-ed in the bulk class, None never routes them.
+                                    Defaults to 20.
+        max_page_pixels (Optional[int]): The most pixels a page may rasterize to, None does not limit them.
+                                         Defaults to 40 million, about ten times a letter page.
+        timeout (int): Seconds pdfinfo is given to read the PDF. Defaults to 10.
+
+    Methods:
+        from_settings(cls) -> 'TaxFormPreflight':
+            Create a preflight configured by settings.TAX_FORM_PREFLIGHT.
+
+        inspect(file_path, file_bytes, priority) -> PreflightReport:
+            Inspect a tax form, raising PreflightError if it is rejected.
+    """
+
+    max_bytes: Optional[int] = 200 * 1024 * 1024
+    max_pages: Optional[int] = 200
+    bulk_pages: Optional[int] = 20
+    max_page_pixels: Optional[int] = 40_000_000
+    timeout: int = 10
+
+    PAGE_SIZE_PATTERN = re.compile(r"([\d.]+)\s*x\s*([\d.]+)\s*pts")
+
+    @classmethod
+    def from_settings(cls) -> "TaxFormPreflight":
+        """
+        Create a preflight configured by settings.TAX_FORM_PREFLIGHT.
+
+        Returns:
+            TaxFormPreflight: The configured preflight.
+        """
+        config = getattr(settings, "TAX_FORM_PREFLIGHT", {})
+        return cls(
+            max_bytes=config.get("MAX_BYTES", cls.max_bytes),
+            max_pages=config.get("MAX_PAGES", cls.max_pages),
+            bulk_pages=config.get("BULK_PAGES", cls.bulk_pages),
+            max_page_pixels=config.get("MAX_PAGE_PIXELS", cls.max_page_pixels),
+            timeout=config.get("TIMEOUT", cls.timeout),
+        )
+
+    def inspect(
+        self, file_path: Optional[Path] = None, file_bytes: Optional[bytes] = None, priority: str = INTERACTIVE
+    ) -> PreflightReport:
+        """
+        Inspect a tax form, without rendering any page or reading the whole file into memory.
+
+        Args:
+            file_path (Optional[Path]): The path to the tax form, such as a streamed upload. Takes precedence over file_bytes.
+            file_bytes (Optional[bytes]): The bytes of the tax form.
+            priority (str): The priority class the tax form is to be OCR-ed in. Defaults to "interactive".
+
+        Returns:
+            PreflightReport: The report, with priority lowered to "bulk" for a long tax form.
+
+        Raises:
+            PreflightError: If the file is too large, is not a PDF, cannot be read, has too many pages or too large a page.
+        """
+        if file_path is not None:
+            report = PreflightReport(file_size=file_path.stat().st_size, priority=priority)
+            with open(file_path, "rb") as file:
+                head = file.read(PDF_MAGIC_OFFSET)
+        else:
+            report = PreflightReport(file_size=len(file_bytes), priority=priority)
+            head = file_bytes[:PDF_MAGIC_OFFSET]
+        if self.max_bytes is not None and report.file_size > self.max_bytes:
+            raise PreflightError(f"The file is {report.file_size} bytes, at most {self.max_bytes} are accepted.")
+        if PDF_MAGIC not in head:
+            raise PreflightError("The file is not a PDF.")
+
+        try:
+            if file_path is not None:
+                info = pdfinfo_from_path(str(file_path), timeout=self.timeout, first_page=1, last_page=self.max_pages)
+            else:
+                info = pdfinfo_from_bytes(file_bytes, timeout=self.timeout, first_page=1, last_page=self.max_pages)
+        except PDFInfoNotInstalledError:
+            logger.warning("pdfinfo is not installed, tax forms are admitted without counting their pages")
+            return report
+        except (PDFPageCountError, PDFPopplerTimeoutError) as error:
+            raise PreflightError(f"The PDF could not be read: {str(error).strip()}") from error
+
+        report.page_count = info["Pages"]
+        report.page_sizes = self._get_page_sizes(info)
+        if self.max_pages is not None and report.page_count > self.max_pages:
+            raise PreflightError(f"The PDF has {report.page_count} pages, at most {self.max_pages} are accepted.")
+        for page_num, (width, height) in enumerate(report.page_sizes):
+            pixels = (width / POINTS_PER_INCH * RENDER_DPI) * (height / POINTS_PER_INCH * RENDER_DPI)
+            if self.max_page_pixels is not None and pixels > self.max_page_pixels:
+                raise PreflightError(
+                    f"Page {page_num + 1} is {width:g} x {height:g} pts, too large to rasterize."
+                )
+
+        if priority == INTERACTIVE and self.bulk_pages is not None and report.page_count > self.bulk_pages:
+            report.priority = BULK
+        return report
+
+    @classmethod
+    def _get_page_sizes(cls, info: dict) -> List[Tuple[float, float]]:
+        """
+        Get the size of every page listed by pdfinfo, in page order.
+
+        Args:
+            info (dict): The pdfinfo output, by key.
+
+        Returns:
+            List[Tuple[float, float]]: The width and height in points of every page listed.
+        """
+        page_sizes = []
+        for key, value in info.items():
+            if key.startswith("Page") and key.endswith("size"):
+                match = cls.PAGE_SIZE_PATTERN.search(value)
+                if match:
+                    page_sizes.append((float(match.group(1)), float(match.group(2))))
+        return page_sizes
+
+
+@dataclass
+class AdmissionController:
+    """
+    Data class for admitting the pages of a tax form only while the OCR queues can take them.
+
+    The pages waiting for OCR are counted in the OcrTask table when the task queue is enabled, otherwise
+    in the scheduler of the OCR dispatcher of the process. A tax form whose pages would take the pages queued
+    by every tenant over max_queued_pages is refused with a 503, and one that would take the pages of its
+    tenant over max_tenant_queued_pages with a 429, so one tenant flooding the queues is throttled without
+    refusing the others. The Retry-After is the p99 wait of the priority class of the pages, at least retry_after.
+
+    Attributes:
+        max_queued_pages (Optional[int]): The most pages queued for every tenant, None does not limit them.
+                                          Defaults to 2000.
+        max_tenant_queued_pages (Optional[int]): The most pages queued for a tenant, None does not limit them.
+                                                 Defaults to 500.
+        retry_after (int): The fewest seconds a refused client is asked to wait. Defaults to 5.
+
+    Methods:
+        from_settings(cls) -> 'AdmissionController':
+            Create an admission controller configured by settings.OCR_ADMISSION.
+
+        admit(pages, priority, tenant, ocr_dispatcher, ocr_task_queue):
+            Admit the pages of a tax form, raising AdmissionError if the queues are saturated.
+    """
+
+    max_queued_pages: Optional[int] = 2000
+    max_tenant_queued_pages: Optional[int] = 500
+    retry_after: int = 5
+
+    @classmethod
+    def from_settings(cls) -> "AdmissionController":
+        """
+        Create an admission controller configured by settings.OCR_ADMISSION.
+
+        Returns:
+            AdmissionController: The configured admission controller.
+        """
+        config = getattr(settings, "OCR_ADMISSION", {})
+        return cls(
+            max_queued_pages=config.get("MAX_QUEUED_PAGES", cls.max_queued_pages),
+            max_tenant_queued_pages=config.get("MAX_TENANT_QUEUED_PAGES", cls.max_tenant_queued_pages),
+            retry_after=config.get("RETRY_AFTER", cls.retry_after),
+        )
+
+    def admit(
+        self,
+        pages: int,
+        priority: str = INTERACTIVE,
+        tenant: str = "",
+        ocr_dispatcher: Optional[OcrDispatcher] = None,
+        ocr_task_queue: Optional[OcrTaskQueue] = None,
+    ) -> None:
+        """
+        Admit the pages of a tax form, or refuse them if the OCR queues are saturated.
+
+        Args:
+            pages (int): The number of pages to OCR.
+            priority (str): The priority class the pages are to be OCR-ed in. Defaults to "interactive".
+            tenant (str): The user or firm the pages are OCR-ed for. Defaults to "".
+            ocr_dispatcher (Optional[OcrDispatcher]): The dispatcher the pages are queued in without a task queue.
+            ocr_task_queue (Optional[OcrTaskQueue]): The database task queue the pages are queued in, if enabled.
+
+        Raises:
+            AdmissionError: If the pages would take the queued pages of the tenant, or of every tenant, over its limit.
+        """
+        if ocr_task_queue is not None:
+            queued, tenant_queued = ocr_task_queue.depth(), ocr_task_queue.depth(tenant=tenant)
+        elif ocr_dispatcher is not None:
+            queued, tenant_queued = ocr_dispatcher.scheduler.depth(), ocr_dispatcher.scheduler.depth(tenant=tenant)
+        else:
+            return
+
+        if self.max_queued_pages is not None and queued + pages > self.max_queued_pages:
+            raise AdmissionError(
+                f"The OCR queue holds {queued} pages, try again later.",
+                status_code=503,
+                retry_after=self._get_retry_after(priority, ocr_dispatcher, ocr_task_queue),
+            )
+        if self.max_tenant_queued_pages is not None and tenant_queued + pages > self.max_tenant_queued_pages:
+            raise AdmissionError(
+                f"{tenant_queued} of your pages are waiting for OCR, try again later.",
+                status_code=429,
+                retry_after=self._get_retry_after(priority, ocr_dispatcher, ocr_task_queue),
+            )
+
+    def _get_retry_after(
+        self, priority: str, ocr_dispatcher: Optional[OcrDispatcher], ocr_task_queue: Optional[OcrTaskQueue]
+    ) -> int:
+        """
+        Estimate the seconds a refused client should wait from the recent waits of the priority class.
+
+        Returns:
+            int: The p99 wait of the class in the scheduler, rounded up, at least retry_after.
+        """
+        if ocr_task_queue is not None or ocr_dispatcher is None:
+            return self.retry_after
+        wait_seconds = ocr_dispatcher.scheduler.metrics()[priority]["wait_seconds"]["p99"]
+        return max(self.retry_after, math.ceil(wait_seconds))
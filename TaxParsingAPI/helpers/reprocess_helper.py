@@ -0,0 +1,190 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from TaxParsingAPI.models import TaxForm, TaxField
+from TaxParsingAPI.parse.tax_parser import TaxParser
+from TaxParsingAPI.helpers.tax_form_helper import PreprocessTaxForm
+from TaxParsingAPI.helpers.cache_helper import invalidate_tax_form
+
+
+@dataclass
+class TaxFormReprocessor:
+    """
+    Data class for re-parsing stored tax forms whose parser version is stale.
+
+    The tax fields are re-extracted from the annotations saved when the tax form was first
+    preprocessed, so no page is rasterized or OCR-ed again. The tax fields of each chunk of
+    tax forms are then updated with bulk writes.
+
+    A run given a limit considers at most that many stale tax forms, in upload order, and sets
+    next_cursor to the id of the last one when others remain. A run given that cursor resumes after it,
+    so a tax form that keeps failing does not hold back the ones behind it.
+
+    Attributes:
+        queryset (QuerySet): The tax forms to consider. Defaults to every persisted tax form, the others are
+                             resumed rather than re-parsed.
+        chunk_size (int): The number of tax forms re-parsed per transaction.
+        include_current (bool): If True, tax forms already parsed by the current parser version are re-parsed too.
+        limit (Optional[int]): The most tax forms run() considers, None considers every stale tax form.
+        cursor (Optional[str]): The next_cursor of a previous run, which this run resumes after.
+        parser_version (str): The current parser version, set in __post_init__.
+        reprocessed (int): The number of tax forms re-parsed by run().
+        errors (Dict[str, str]): The error of every tax form that could not be re-parsed, by tax form id.
+        next_cursor (Optional[str]): The id of the last tax form considered by run() if stale tax forms remain
+                                     after it, None otherwise.
+
+    Methods:
+        get_stale_tax_forms() -> QuerySet:
+            Get the tax forms that need to be re-parsed.
+
+        run() -> int:
+            Re-parse the stale tax forms after the cursor, up to the limit, and return how many were re-parsed.
+
+        _after_cursor(queryset) -> QuerySet:
+            Get the tax forms of a queryset uploaded after the tax form of the cursor.
+    """
+
+    queryset: Optional[QuerySet] = None
+    chunk_size: int = 100
+    include_current: bool = False
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    parser_version: str = field(init=False, default="")
+    reprocessed: int = field(init=False, default=0)
+    errors: Dict[str, str] = field(init=False, default_factory=dict)
+    next_cursor: Optional[str] = field(init=False, default=None)
+
+    def __post_init__(self):
+        if self.queryset is None:
+            self.queryset = TaxForm.objects.filter(stage=TaxForm.PERSISTED)
+        self.parser_version = TaxParser.get_version()
+
+    def get_stale_tax_forms(self) -> QuerySet:
+        """
+        Get the tax forms that need to be re-parsed.
+
+        Returns:
+            QuerySet: The tax forms whose parser version differs from the current one.
+        """
+        if self.include_current:
+            return self.queryset
+        return self.queryset.exclude(parser_version=self.parser_version)
+
+    def run(self) -> int:
+        """
+        Re-parse the stale tax forms after the cursor, up to the limit.
+
+        Returns:
+            int: The number of tax forms re-parsed.
+
+        Raises:
+            ValueError: If the cursor is not the id of a tax form.
+        """
+        # collect the ids up front, since re-parsing writes to the rows being selected
+        stale_tax_forms = self._after_cursor(self.get_stale_tax_forms()).order_by("uploaded_at", "id")
+        if self.limit is None:
+            tax_form_ids = list(stale_tax_forms.values_list("id", flat=True))
+        else:
+            # one more than the limit tells whether stale tax forms remain after this run
+            tax_form_ids = list(stale_tax_forms.values_list("id", flat=True)[: self.limit + 1])
+            if len(tax_form_ids) > self.limit:
+                tax_form_ids = tax_form_ids[: self.limit]
+                self.next_cursor = str(tax_form_ids[-1])
+        for start in range(0, len(tax_form_ids), self.chunk_size):
+            chunk_ids = tax_form_ids[start : start + self.chunk_size]
+            self._reprocess_chunk(list(TaxForm.objects.filter(id__in=chunk_ids)))
+        return self.reprocessed
+
+    def _after_cursor(self, queryset: QuerySet) -> QuerySet:
+        """
+        Get the tax forms of a queryset uploaded after the tax form of the cursor, in ("uploaded_at", "id") order.
+
+        Args:
+            queryset (QuerySet): The tax forms.
+
+        Returns:
+            QuerySet: The tax forms after the cursor, all of them if there is no cursor.
+
+        Raises:
+            ValueError: If the cursor is not the id of a tax form.
+        """
+        if self.cursor is None:
+            return queryset
+        try:
+            uploaded_at = TaxForm.objects.filter(id=self.cursor).values_list("uploaded_at", flat=True).first()
+        except ValidationError:
+            uploaded_at = None
+        if uploaded_at is None:
+            raise ValueError(f"Unknown cursor {self.cursor}.")
+        return queryset.filter(Q(uploaded_at__gt=uploaded_at) | Q(uploaded_at=uploaded_at, id__gt=self.cursor))
+
+    def _reprocess_chunk(self, tax_forms: List[TaxForm]) -> None:
+        """
+        Re-parse a chunk of tax forms and update their tax fields with bulk writes.
+
+        Args:
+            tax_forms (List[TaxForm]): The chunk of tax forms.
+        """
+        existing: Dict = {}
+        for tax_field in TaxField.objects.filter(tax_form__in=tax_forms):
+            existing.setdefault(tax_field.tax_form_id, {})[tax_field.tax_field] = tax_field
+
+        to_update: List[TaxField] = []
+        to_create: List[TaxField] = []
+        reprocessed_ids = []
+        for tax_form in tax_forms:
+            form_tax_fields = existing.get(tax_form.id, {})
+            requested = [{"tax_field": tax_field} for tax_field in form_tax_fields] or [
+                {"tax_field": tax_field} for tax_field, _ in TaxField.FIELD_CHOICES
+            ]
+            try:
+                preprocessed_tax_form = PreprocessTaxForm(
+                    file_path=Path(tax_form.tax_form.path), annotations_only=True
+                )
+                extracted = TaxParser.extract_tax_fields(
+                    preprocessed_tax_form=preprocessed_tax_form, tax_fields=requested
+                )
+            except Exception as error:
+                self.errors[str(tax_form.id)] = str(error) or error.__class__.__name__
+                continue
+
+            for tax_field_dict in extracted:
+                tax_field_obj = form_tax_fields.get(tax_field_dict["tax_field"])
+                if tax_field_obj is None:
+                    to_create.append(TaxField(tax_form=tax_form, **tax_field_dict))
+                    continue
+                for attr, value in tax_field_dict.items():
+                    setattr(tax_field_obj, attr, value)
+                to_update.append(tax_field_obj)
+            reprocessed_ids.append(tax_form.id)
+
+        with transaction.atomic():
+            TaxField.objects.bulk_update(to_update, fields=self.get_updated_fields())
+            TaxField.objects.bulk_create(to_create)
+            TaxForm.objects.filter(id__in=reprocessed_ids).update(parser_version=self.parser_version)
+
+        # bulk writes send no signals, so drop the cached representations here
+        for tax_form_id in reprocessed_ids:
+            invalidate_tax_form(tax_form_id)
+        self.reprocessed += len(reprocessed_ids)
+
+    @classmethod
+    def get_updated_fields(cls) -> List[str]:
+        """
+        Get the TaxField model fields that re-parsing updates.
+
+        Returns:
+            List[str]: The names of the updated model fields.
+        """
+        return [
+            "instruction_text",
+            "instruction_matched_pattern",
+            "value_text",
+            "value_normalized_text",
+            "value_in_numeric",
+            "value_matched_pattern",
+            "page_number",
+        ]
@@ -0,0 +1,197 @@
+"""
+provides the shared memory hand-off of rasterized pages to OCR worker processes
+"""
+
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Iterator, List, Tuple, Union
+from PIL import Image as PILImage
+from PIL.Image import Image
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+from TaxParsingAPI.helpers.utils.ocr_wrapper import OcrWrapper
+
+
+@dataclass(frozen=True)
+class SharedPage:
+    """
+    Data class for the metadata of a page image held in a shared memory segment.
+
+    Only this metadata is pickled to the OCR worker, which maps the segment and reads the
+    raw grayscale pixels in place.
+
+    Attributes:
+        name (str): The name of the shared memory segment.
+        shape (Tuple[int, int]): The (height, width) of the page image.
+        dtype (str): The type of a pixel, "uint8" for 8 bit grayscale.
+
+    Methods:
+        create(cls, image) -> Tuple[SharedMemory, 'SharedPage']:
+            Copy a page image into a new shared memory segment.
+
+        open() -> Iterator[Image]:
+            Map the segment and yield the page image backed by it.
+    """
+
+    name: str
+    shape: Tuple[int, int]
+    dtype: str = "uint8"
+
+    @classmethod
+    def create(cls, image: Image) -> Tuple[shared_memory.SharedMemory, "SharedPage"]:
+        """
+        Copy a page image, as 8 bit grayscale, into a new shared memory segment.
+
+        The caller owns the segment and must close and unlink it, see share_pages.
+
+        Args:
+            image (Image): The page image.
+
+        Returns:
+            Tuple[SharedMemory, SharedPage]: The segment and its metadata.
+        """
+        grayscale = image if image.mode == "L" else image.convert("L")
+        width, height = grayscale.size
+        segment = shared_memory.SharedMemory(create=True, size=max(width * height, 1))
+        segment.buf[: width * height] = grayscale.tobytes()
+        return segment, cls(name=segment.name, shape=(height, width))
+
+    @contextmanager
+    def open(self) -> Iterator[Image]:
+        """
+        Map the segment and yield the page image backed by it, without copying the pixels.
+
+        The segment is only attached, never unlinked, and is detached when the context exits.
+
+        Yields:
+            Image: The grayscale page image.
+        """
+        segment = _attach(self.name)
+        try:
+            height, width = self.shape
+            image = PILImage.frombuffer("L", (width, height), segment.buf, "raw", "L", 0, 1)
+            try:
+                yield image
+            finally:
+                image.close()
+                del image
+        finally:
+            segment.close()
+
+
+@contextmanager
+def share_pages(images: List[Image]) -> Iterator[List[SharedPage]]:
+    """
+    Copy page images into shared memory segments owned by the calling process.
+
+    Every segment is closed and unlinked when the context exits, whether the work on the pages
+    succeeded, raised, or a worker process died, so no segment outlives the call.
+
+    Args:
+        images (List[Image]): The page images.
+
+    Yields:
+        List[SharedPage]: The metadata of every page, in order.
+    """
+    segments: List[shared_memory.SharedMemory] = []
+    try:
+        shared_pages = []
+        for image in images:
+            segment, shared_page = SharedPage.create(image)
+            segments.append(segment)
+            shared_pages.append(shared_page)
+        yield shared_pages
+    finally:
+        release_segments(segments)
+
+
+def release_segments(segments: List[shared_memory.SharedMemory]) -> None:
+    """
+    Close and unlink shared memory segments owned by the calling process.
+
+    Args:
+        segments (List[SharedMemory]): The segments.
+    """
+    for segment in segments:
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def ocr_shared_page(shared_page: SharedPage) -> AnnotationTable:
+    """
+    Perform OCR on a page held in shared memory, on a pool worker.
+
+    Args:
+        shared_page (SharedPage): The metadata of the page.
+
+    Returns:
+        AnnotationTable: The annotations of the page.
+    """
+    with shared_page.open() as image:
+        annotations = OcrWrapper.from_settings(image=image).annotations
+    return AnnotationTable.from_annotations(annotations)
+
+
+def ocr_shared_pages(shared_pages: List[SharedPage]) -> List[Union[AnnotationTable, Exception]]:
+    """
+    Perform OCR on a batch of pages held in shared memory, in one call on a pool worker.
+
+    A page that fails does not fail the batch, its exception is returned in its place, so the
+    pages of other documents in the batch are unaffected.
+
+    Args:
+        shared_pages (List[SharedPage]): The metadata of the pages.
+
+    Returns:
+        List[Union[AnnotationTable, Exception]]: The annotations, or the exception, of every page, in order.
+    """
+    results: List[Union[AnnotationTable, Exception]] = []
+    for shared_page in shared_pages:
+        try:
+            results.append(ocr_shared_page(shared_page))
+        except Exception as error:
+            results.append(error)
+    return results
+
+
+def ocr_pages_in_workers(images: List[Image], executor: Executor) -> List[AnnotationTable]:
+    """
+    Perform OCR on every page on the worker pool, handing the pages over through shared memory.
+
+    Args:
+        images (List[Image]): The page images.
+        executor (Executor): The process pool the pages are OCR-ed on.
+
+    Returns:
+        List[AnnotationTable]: The annotations of every page, in order.
+    """
+    with share_pages(images) as shared_pages:
+        futures = [executor.submit(ocr_shared_page, shared_page) for shared_page in shared_pages]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            # wait for every submitted page, a segment unlinked before its worker attached could not be opened
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                if not future.cancelled():
+                    try:
+                        future.exception()
+                    except Exception:
+                        pass
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing segment without making this process responsible for unlinking it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 attaching registers the segment again, which is harmless here since
+        # pool workers share the resource tracker of the process that created the segment
+        return shared_memory.SharedMemory(name=name)
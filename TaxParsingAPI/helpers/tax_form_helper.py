@@ -1,12 +1,35 @@
-from dataclasses import dataclass, field, asdict
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
 from pathlib import Path
-from TaxParsingAPI.helpers.utils.annotation import Annotation
+from TaxParsingAPI.helpers.utils.annotation_store import AnnotationStore
+from TaxParsingAPI.helpers.utils.atomic_files import atomic_write, document_lock
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+from TaxParsingAPI.helpers.ocr_cache import (
+    get_document_hash,
+    get_file_document_hash,
+    get_ocr_cache,
+    get_page_cache,
+    get_page_hash,
+)
+from TaxParsingAPI.helpers.shared_pages import ocr_pages_in_workers
+from TaxParsingAPI.helpers.ocr_dispatcher import OcrDispatcher
+from TaxParsingAPI.helpers.ocr_task_queue import OcrTaskQueue
+from TaxParsingAPI.helpers.ocr_scheduler import INTERACTIVE
+from TaxParsingAPI.helpers.page_preprocessor import PagePreprocessor
+from TaxParsingAPI.helpers.page_classifier import PageClassifier
 from TaxParsingAPI.helpers.utils.ocr_wrapper import OcrWrapper
-from typing import List, Dict
+from typing import Callable, ClassVar, List, Dict, Optional, Tuple, Union
 import json
-from pdf2image import convert_from_path, convert_from_bytes
+import logging
+import shutil
+import time
+from PIL import Image as PILImage, ImageDraw
+from PIL.Image import Image
+from django.conf import settings
+from pdf2image import convert_from_path, convert_from_bytes, pdfinfo_from_bytes, pdfinfo_from_path
 from HolistiplanTakeHome.settings import MEDIA_ROOT
 
+logger = logging.getLogger(__name__)
 
 @dataclass
 class PreprocessTaxForm:
@@ -23,8 +46,53 @@ class PreprocessTaxForm:
         image_directory (Path): The directory where images extracted from the PDF are stored.
         text_from_pdf_directory (Path): The directory where text extracted from the PDF is stored.
         image_file_paths (List[Path]): A list of paths to the image files extracted from the PDF.
-        annotations_directory (Path): The directory where annotations related to the PDF are stored.
+        annotations_directory (Path): The directory where legacy per page JSON annotations of the PDF are stored.
+        annotations_file_path (Path): The annotation file holding the annotations of every page of the PDF.
         ocr_pages (Dict[int, 'OCRPage']): A dictionary mapping page numbers to OCRPage objects containing OCR data.
+        annotations_only (bool): If True, the OCR pages are only loaded from previously saved annotations, the PDF
+                                 is neither rasterized nor OCR-ed. Defaults to False.
+        use_ocr_cache (bool): If True, the OCR pages are looked up in, and added to, the process wide OCR cache
+                              by document hash. On a hit nothing is read from disk and image_file_paths is empty.
+                              On a miss, every page to OCR is first looked up in the page cache by page hash.
+                              Defaults to True.
+        document_hash (str): The hash of the PDF the OCR cache is keyed by, such as the one store_upload computed while
+                             the upload was streamed to file_path. Computed if not given, empty if the cache is not used.
+        persist_page_images (bool): If True, the pages are saved as PNG images that are OCR-ed from disk, and
+                                    annotated copies are saved for debugging. If False, the rasterized pages go
+                                    straight to OCR in memory and only the annotation file is written.
+                                    Defaults to settings.TAX_FORM_PERSIST_PAGE_IMAGES.
+        ocr_executor (Optional[Executor]): A process pool the in-memory pages are OCR-ed on in parallel, handed
+                                           over through shared memory. If None, the pages are OCR-ed in this process.
+        ocr_dispatcher (Optional[OcrDispatcher]): A dispatcher batching the in-memory pages with the pages of concurrent
+                                                  requests into worker calls. Takes precedence over ocr_executor.
+        ocr_task_queue (Optional[OcrTaskQueue]): A database backed queue the pages are OCR-ed through by the
+                                                 `run_ocr_worker` processes of every node. Takes precedence over
+                                                 ocr_dispatcher and ocr_executor.
+        ocr_priority (str): The OcrScheduler priority class the pages are queued in by ocr_dispatcher or ocr_task_queue,
+                            "interactive", "bulk" or "reprocess". Defaults to "interactive".
+        tenant (str): The user or firm the pages are OCR-ed for, which ocr_dispatcher shares the workers between.
+                      Defaults to "".
+        page_preprocessor (Optional[PagePreprocessor]): The preprocessing applied to every rasterized page before OCR.
+                                                        If None, every page is preprocessed with the form template of
+                                                        settings.PAGE_PREPROCESSING its PageClassifier label maps to in
+                                                        settings.PAGE_PREPROCESSING_BY_LABEL. Defaults to None.
+        page_preprocessors (Dict[str, PagePreprocessor]): The preprocessor of every form template used, by template.
+        preprocessing_key (str): The key of the page preprocessing, which the OCR cache, the page cache, the annotation
+                                 file and the page images are keyed by, so the pages are OCR-ed again when it changes.
+        ocr_page_labels (Optional[List[str]]): The PageClassifier labels of the pages that can hold the requested
+                                               fields. If set, the pages are classified from the PDF text layer and
+                                               only those pages, and unclassifiable ones, are OCR-ed, so ocr_pages
+                                               may skip page numbers. If None, every page is OCR-ed. Defaults to None.
+        checkpoint_pages (Optional[int]): The OCR-ed pages are saved to the partial annotation file every checkpoint_pages
+                                          pages, so preprocessing interrupted midway resumes after the last saved page.
+                                          Defaults to settings.TAX_FORM_CHECKPOINT_PAGES, None saves them once all are OCR-ed.
+        partial_annotations_file_path (Path): The annotation file of the pages OCR-ed so far, replaced by the annotation file
+                                              once every page is OCR-ed.
+        page_labels (List[str]): The label of every page, empty if the pages were not classified.
+        stage_state (Dict[str, Dict]): The pipeline stages completed, "rasterized" with the "page_count", and "ocr_done" with
+                                       the OCR-ed "pages" and whether OCR is "complete", each with its "artifacts" relative
+                                       to base_dir, for TaxFormCheckpoint to record.
+        stage_timings (Dict[str, float]): The seconds spent classifying, rasterizing, preprocessing and OCR-ing the pages.
 
         base_dir (Path): The base directory for storing tax form related files.
         base_image_directory (Path): The base directory for storing extracted images.
@@ -40,11 +108,80 @@ class PreprocessTaxForm:
         _convert_to_pdf_to_image(self) -> None:
             Convert the PDF file to images and save them in the image directory.
         
+        _set_cached_ocr_pages(self) -> bool:
+            Set the OCR pages of the tax form from the OCR cache, if it holds the document.
+
+        _put_cached_ocr_pages(self) -> None:
+            Add the OCR pages of the tax form to the OCR cache, unless pages were skipped.
+
+        _get_cached_ocr_pages(self) -> Optional[Dict[int, 'OCRPage']]:
+            Get the OCR pages of the tax form from the OCR cache.
+
+        _get_ocr_cache_key(self) -> str:
+            Get the key of the tax form in the OCR cache.
+
+        _get_image_preprocessing(self) -> str:
+            Get the key of the preprocessing the saved page images were made with.
+
         _set_ocr_pages(self) -> List[Dict[int, 'OCRPage']]:
             Set the OCR pages for the tax form.
+
+        _set_ocr_pages_in_memory(self) -> Dict[int, 'OCRPage']:
+            Set the OCR pages for the tax form without writing any page image.
+
+        _get_page_nums_to_ocr(self) -> Optional[List[int]]:
+            Classify the pages of the PDF from its text layer and get the ones to OCR.
+
+        _classify_pages(self) -> List[str]:
+            Classify the pages of the PDF from its text layer, once.
+
+        _ocr_missing_pages(self, page_annotations, page_nums, get_images) -> None:
+            OCR the pages missing from page_annotations, saving the progress every checkpoint_pages pages.
+
+        _save_ocr_pages(self, pages) -> None:
+            Save the annotations of every page to the annotation file, replacing the partial annotation file.
+
+        _artifact_lock(self):
+            Get the lock of the document, held only while its artifacts are written.
+
+        _compute_lock(self):
+            Get the lock of the computation of the document, held while it is rasterized and OCR-ed.
+
+        _set_stage_state(self, stage, artifacts, **state) -> None:
+            Set the state of a completed pipeline stage in stage_state.
+
+        _get_page_count(self) -> int:
+            Get the number of pages of the PDF without rasterizing it.
+
+        _rasterize(self, page_nums) -> List[Image]:
+            Convert pages of the PDF file to in-memory page images, preprocessed for OCR.
+
+        _get_page_runs(cls, page_nums: List[int]) -> List[Tuple[int, int]]:
+            Group page numbers into runs of consecutive pages.
+
+        _preprocess_images(self, images: List[Image], page_nums: List[int]) -> List[Image]:
+            Prepare the page images for OCR with the preprocessor of every page.
+
+        _get_page_preprocessor(self, page_num: int) -> PagePreprocessor:
+            Get the preprocessor of a page.
+
+        _log_preprocessing_timings(self) -> None:
+            Log the seconds every preprocessor spent in each step.
+
+        _load_ocr_pages(self, any_preprocessing) -> Dict[int, 'OCRPage']:
+            Load the OCR pages from previously saved annotations only.
+
+        _load_saved_annotations(self, any_preprocessing) -> Dict[int, AnnotationTable]:
+            Load the annotations of every page saved in the annotation file, or in the partial one.
+
+        _load_annotations(cls, annotation_file_path: Path) -> AnnotationTable:
+            Load the annotations saved in a legacy JSON file.
         
-        _ocr_and_save(self, annotation_file_path: Path, image_file_path: Path) -> List[Annotation]:
-            Perform OCR on the provided image file and save the annotations to a JSON file.
+        _ocr_pages(self, images: List[Union[Image, Path]]) -> List[AnnotationTable]:
+            Get the annotations of pages from the page cache, performing OCR only on the pages missing from it.
+
+        _ocr(cls, image: Union[Image, Path]) -> AnnotationTable:
+            Perform OCR on the provided image file.
         
         _save_annotations_over_images(self) -> None:
             Save annotated images to visualize OCR results.
@@ -62,7 +199,26 @@ class PreprocessTaxForm:
     text_from_pdf_directory: Path = None
     image_file_paths: List[Path] = field(default_factory=lambda: {})
     annotations_directory: Path = None
+    annotations_file_path: Path = None
     ocr_pages: Dict[int, "OCRPage"] = field(default_factory=lambda: {})
+    annotations_only: bool = False
+    use_ocr_cache: bool = True
+    persist_page_images: bool = None
+    ocr_executor: Optional[Executor] = None
+    ocr_dispatcher: Optional[OcrDispatcher] = None
+    ocr_task_queue: Optional[OcrTaskQueue] = None
+    ocr_priority: str = INTERACTIVE
+    tenant: str = ""
+    page_preprocessor: Optional[PagePreprocessor] = None
+    ocr_page_labels: Optional[List[str]] = None
+    checkpoint_pages: Optional[int] = None
+    partial_annotations_file_path: Path = None
+    page_labels: List[str] = field(init=False, default_factory=list)
+    stage_state: Dict[str, Dict] = field(init=False, default_factory=dict)
+    stage_timings: Dict[str, float] = field(init=False, default_factory=dict)
+    document_hash: str = ""
+    page_preprocessors: Dict[str, PagePreprocessor] = field(init=False, default_factory=dict)
+    preprocessing_key: str = field(init=False, default="")
 
     base_dir: Path = MEDIA_ROOT / "tax_forms"
     base_image_directory: Path = field(init=False, default=base_dir / "images")
@@ -74,23 +230,149 @@ class PreprocessTaxForm:
         init=False, default=base_dir / "annotations_over_images"
     )
 
+    # the file of the image directory holding the preprocessing_key its page images were made with
+    PREPROCESSING_FILE_NAME: ClassVar[str] = "preprocessing"
+
     def __post_init__(self):
+        # without a file or its bytes nothing would be OCR-ed, and the tax form would be saved with empty fields
+        if not self.annotations_only and self.file_bytes is None and not Path(self.file_path).exists():
+            raise FileNotFoundError(f"The tax form {self.file_path} does not exist and no file_bytes were given.")
 
         self._set_base_directories()
-        self._ensure_base_directories_exist()
+        if self.persist_page_images is None:
+            self.persist_page_images = getattr(settings, "TAX_FORM_PERSIST_PAGE_IMAGES", True)
+        self.preprocessing_key = (
+            self.page_preprocessor.get_key() if self.page_preprocessor is not None else PagePreprocessor.get_templates_key()
+        )
+        self._pages_classified = False
+        if self.checkpoint_pages is None:
+            self.checkpoint_pages = getattr(settings, "TAX_FORM_CHECKPOINT_PAGES", None)
 
         self.image_directory = self.base_image_directory / self.file_path.stem
         self.text_from_pdf_directory = (
             self.base_text_from_pdf_directory / self.file_path.stem
         )
         self.annotations_directory = self.base_annotations_directory / self.file_path.stem
+        self.annotations_file_path = (
+            self.base_annotations_directory / f"{self.file_path.stem}{AnnotationStore.SUFFIX}"
+        )
+        self.partial_annotations_file_path = self.annotations_file_path.with_name(
+            f"{self.annotations_file_path.name}{AnnotationStore.PARTIAL_SUFFIX}"
+        )
 
-        self._convert_to_pdf_to_image()
+        if self._set_cached_ocr_pages():
+            return
 
-        self.image_file_paths = self._get_image_file_paths()
+        self._ensure_base_directories_exist()
+
+        if self.annotations_only:
+            self.image_file_paths = []
+            try:
+                self.ocr_pages = self._load_ocr_pages()
+            except FileNotFoundError:
+                # annotations OCR-ed after another preprocessing are still re-parsed, but not cached as this one's
+                self.ocr_pages = self._load_ocr_pages(any_preprocessing=True)
+                return
+            self._put_cached_ocr_pages()
+            return
+
+        # processes preprocessing the same document wait for the first one and reuse its annotations
+        with self._compute_lock():
+            # the process waited on put the document in the OCR cache, and left its annotation file for the paths below
+            if self._set_cached_ocr_pages():
+                return
+
+            if not self.persist_page_images:
+                self.image_file_paths = []
+                self.ocr_pages = self._set_ocr_pages_in_memory()
+            else:
+                self._convert_to_pdf_to_image()
+
+                self.image_file_paths = self._get_image_file_paths()
+                self._set_stage_state(
+                    "rasterized", page_count=len(self.image_file_paths), artifacts=[self.image_directory]
+                )
 
-        self.ocr_pages = self._set_ocr_pages()
-        self._save_annotations_over_images()
+                self.ocr_pages = self._set_ocr_pages()
+                self._save_annotations_over_images()
+
+            self._set_ocr_stage_state(complete=True)
+
+            if self.stage_timings:
+                logger.info(
+                    "Preprocessed %s: %s",
+                    self.file_path.name,
+                    ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in self.stage_timings.items()),
+                )
+            self._log_preprocessing_timings()
+
+            # before the lock is released, so a process waiting on it with the same content under another name finds it
+            self._put_cached_ocr_pages()
+
+    def _put_cached_ocr_pages(self) -> None:
+        """
+        Add the OCR pages of the tax form to the OCR cache, unless pages were skipped.
+        """
+        # the OCR cache holds whole documents, a document with skipped pages would be served incomplete
+        if self.document_hash and not (self.page_labels and len(self.ocr_pages) < len(self.page_labels)):
+            get_ocr_cache().put(
+                self._get_ocr_cache_key(),
+                {page_num: page.annotations for page_num, page in self.ocr_pages.items()},
+            )
+
+    def _set_cached_ocr_pages(self) -> bool:
+        """
+        Set the OCR pages of the tax form from the OCR cache, if it holds the document.
+
+        Returns:
+            bool: True if the OCR pages were set from the OCR cache.
+        """
+        cached_ocr_pages = self._get_cached_ocr_pages()
+        if cached_ocr_pages is None:
+            return False
+        self.image_file_paths = []
+        self.ocr_pages = cached_ocr_pages
+        self._set_ocr_stage_state(complete=True)
+        return True
+
+    def _get_cached_ocr_pages(self) -> Optional[Dict[int, "OCRPage"]]:
+        """
+        Get the OCR pages of the tax form from the OCR cache.
+
+        This method hashes the PDF, unless document_hash was given, preferring file_bytes so an uploaded
+        form is hashed without touching the disk, and otherwise reading file_path in chunks, and looks the
+        hash up in the process wide OCR cache, along with preprocessing_key.
+
+        Returns:
+            Optional[Dict[int, 'OCRPage']]: A dictionary mapping page numbers to OCRPage objects, or None on a miss.
+        """
+        if not self.use_ocr_cache:
+            self.document_hash = ""
+            return None
+        if not self.document_hash:
+            if self.file_bytes is not None:
+                self.document_hash = get_document_hash(self.file_bytes)
+            elif self.file_path.exists():
+                self.document_hash = get_file_document_hash(self.file_path)
+            else:
+                return None
+
+        cached_pages = get_ocr_cache().get(self._get_ocr_cache_key())
+        if cached_pages is None:
+            return None
+        return {
+            page_num: OCRPage(tax_file=self, page_number=page_num, annotations=annotations)
+            for page_num, annotations in cached_pages.items()
+        }
+
+    def _get_ocr_cache_key(self) -> str:
+        """
+        Get the key of the tax form in the OCR cache, the document hash and the key of its page preprocessing.
+
+        Returns:
+            str: The key of the tax form.
+        """
+        return f"{self.document_hash}-{self.preprocessing_key}"
 
     def _get_image_file_paths(self) -> List[Path]:
         """
@@ -113,157 +395,557 @@ class PreprocessTaxForm:
         """
         Convert the PDF file to images and save them in the image directory.
 
-        This method converts each page of the PDF file into a separate image and saves
-        them in the image directory. It handles both file paths and file bytes. If the
-        image directory does not exist, it is created. Each image is saved with a filename
-        indicating the page number.
+        This method converts each page of the PDF file into a separate image, preprocessed for
+        OCR by the preprocessor of every page, and saves them in the image directory. It handles both file paths and file
+        bytes. If the image directory does not exist, the images are saved in a temporary directory that is then renamed
+        to it, so the image directory never holds only some of the pages. Each image is saved with a filename
+        indicating the page number, along with the preprocessing_key file. An image directory made with another
+        preprocessing is replaced, and the annotations drawn over its images are deleted.
 
         Returns:
             None
         """
-        # Path to the PDF file
-        if self.file_path.exists():
-            # Save each page as an image
-            if not self.image_directory.exists():
-                # Convert PDF to images
-                images = convert_from_path(self.file_path)
-                self.image_directory.mkdir()
-
-                for i, image in enumerate(images):
-
-                    image_file_path = self.image_directory / f"page_{i + 1}.png"
-                    if not image_file_path.exists():
-                        image.save(image_file_path, "PNG")
-
-                        print("PDF pages have been converted to images successfully.")
+        if not self.file_path.exists() and self.file_bytes is None:
+            return
+        if self.image_directory.exists():
+            if self._get_image_preprocessing() in ("", self.preprocessing_key):
+                return
+            with self._artifact_lock():
+                shutil.rmtree(self.image_directory, ignore_errors=True)
+                shutil.rmtree(self.base_annotations_over_images_dir / self.file_path.stem, ignore_errors=True)
 
-        elif self.file_bytes is not None:
+        # Convert PDF to images
+        images = self._rasterize()
+        with self._artifact_lock(), atomic_write(self.image_directory) as temporary_directory:
+            temporary_directory.mkdir()
             # Save each page as an image
-            if not self.image_directory.exists():
-                # Convert PDF to images
-                images = convert_from_bytes(self.file_bytes)
-                self.image_directory.mkdir()
+            for i, image in enumerate(images):
+                image.save(temporary_directory / f"page_{i + 1}.png", "PNG")
+            (temporary_directory / self.PREPROCESSING_FILE_NAME).write_text(self.preprocessing_key)
 
-                for i, image in enumerate(images):
+        logger.info("Converted the %d pages of %s to images", len(images), self.file_path.name)
 
-                    image_file_path = self.image_directory / f"page_{i + 1}.png"
-                    if not image_file_path.exists():
-                        image.save(image_file_path, "PNG")
+    def _get_image_preprocessing(self) -> str:
+        """
+        Get the key of the preprocessing the saved page images were made with.
 
-                        print("PDF pages have been converted to images successfully.")
+        Returns:
+            str: The preprocessing_key the image directory was made with, empty if it was not recorded.
+        """
+        try:
+            return (self.image_directory / self.PREPROCESSING_FILE_NAME).read_text()
+        except FileNotFoundError:
+            return ""
 
     def _set_ocr_pages(self) -> List[Dict[int, "OCRPage"]]:
         """
         Set the OCR pages for the tax form.
 
-        This method processes each image file path to generate or load OCR annotations. It checks if the
-        annotations directory exists and if not, it creates it. For each image file, it either reads the
-        existing annotations from a JSON file or performs OCR, using _ocr_and_save method, to generate and save new annotations.
-        The annotations are then added to the OCRPage instances and stored in a dictionary.
+        This method processes each image file path to generate or load OCR annotations. For each image file,
+        it either reads the page's annotations from the annotation file, or from a legacy JSON file, or gets
+        them, using _ocr_missing_pages method, from the page cache or OCR. With ocr_page_labels, the pages
+        _get_page_nums_to_ocr method leaves out are skipped. If any page was not saved, the annotations of every
+        page are saved to the annotation file in one write. The annotations are then stored in a dictionary of OCRPage instances.
 
         Returns:
             List[Dict[int, 'OCRPage']]: A dictionary mapping page numbers to OCRPage objects containing OCR data and annotations.
         """
-        pages: Dict[int, "OCRPage"] = {}
+        saved_annotations = self._load_saved_annotations()
+        page_nums_to_ocr = self._get_page_nums_to_ocr() if self.ocr_page_labels is not None else None
+
+        page_annotations: Dict[int, AnnotationTable] = {}
+        unannotated_page_nums: List[int] = []
         for page_num, image_file_path in enumerate(self.image_file_paths):
             annotation_file_path = (
                 self.annotations_directory / f"{image_file_path.stem}.json"
             )
 
-            if not self.annotations_directory.exists():
-                self.annotations_directory.mkdir()
-                annotations = self._ocr_and_save(
-                    annotation_file_path=annotation_file_path,
-                    image_file_path=image_file_path,
-                )
-                if pages.get(page_num):
-                    pages[page_num].annotations += annotations
-                else:
-                    pages[page_num] = OCRPage(
-                        tax_file=self, page_number=page_num, annotations=annotations
-                    )
-            elif not annotation_file_path.exists():
-                annotations = self._ocr_and_save(
-                    annotation_file_path=annotation_file_path,
-                    image_file_path=image_file_path,
-                )
-                if pages.get(page_num):
-                    pages[page_num].annotations += annotations
-                else:
-                    pages[page_num] = OCRPage(
-                        tax_file=self, page_number=page_num, annotations=annotations
-                    )
+            if page_num in saved_annotations:
+                page_annotations[page_num] = saved_annotations[page_num]
+            elif annotation_file_path.exists():
+                page_annotations[page_num] = self._load_annotations(annotation_file_path)
+            elif page_nums_to_ocr is None or page_num in page_nums_to_ocr:
+                unannotated_page_nums.append(page_num)
 
-            else:
-                with open(annotation_file_path, "r") as j:
-
-                    json_annotation = json.load(j)
-                    for item in json_annotation:
-                        if pages.get(page_num):
-                            pages[page_num].annotations.append(
-                                Annotation(
-                                    text=item["text"],
-                                    bbox=item["bbox"],
-                                    center=item["center"],
-                                )
-                            )
-                        else:
-                            pages[page_num] = OCRPage(
-                                tax_file=self,
-                                page_number=page_num,
-                                annotations=[
-                                    Annotation(
-                                        text=item["text"],
-                                        bbox=item["bbox"],
-                                        center=item["center"],
-                                    )
-                                ],
-                            )
+        if unannotated_page_nums:
+            self._ocr_missing_pages(
+                page_annotations=page_annotations,
+                page_nums=unannotated_page_nums,
+                get_images=lambda page_nums: [self.image_file_paths[page_num] for page_num in page_nums],
+            )
+
+        pages: Dict[int, "OCRPage"] = {
+            page_num: OCRPage(tax_file=self, page_number=page_num, annotations=page_annotations[page_num])
+            for page_num in sorted(page_annotations)
+        }
+
+        if unannotated_page_nums or self.partial_annotations_file_path.exists():
+            self._save_ocr_pages(pages)
+
+        return pages
+
+    def _set_ocr_pages_in_memory(self) -> Dict[int, "OCRPage"]:
+        """
+        Set the OCR pages for the tax form without writing any page image.
+
+        This method loads the saved annotations of the tax form if they hold every page to OCR. Otherwise only the
+        pages to OCR missing from the saved annotations are rasterized in memory, checkpoint_pages at a time, and every
+        page image missing from the page cache is handed to OCR as is, without a PNG encode, write, read and decode.
+        The images of a chunk are dropped once it is OCR-ed, so at most a chunk of pages is held in memory, and only
+        the annotations of every page are saved to the annotation file. When the pages cannot be counted without rasterizing, any saved
+        annotations are trusted to hold every page, unless they are the partial annotations of an interrupted run.
+        With an ocr_dispatcher or an ocr_executor, the pages are OCR-ed on worker processes, which read the raw pixels
+        from shared memory instead of unpickling a copy of every page.
+
+        Returns:
+            Dict[int, 'OCRPage']: A dictionary mapping page numbers to OCRPage objects containing OCR data and annotations.
+        """
+        try:
+            saved_pages = self._load_ocr_pages()
+        except FileNotFoundError:
+            saved_pages = {}
+
+        resuming = self.partial_annotations_file_path.exists()
+        page_nums_to_ocr = None
+        if saved_pages or self.ocr_page_labels is not None:
+            page_nums_to_ocr = self._get_page_nums_to_ocr()
+        if saved_pages and not resuming and (
+            page_nums_to_ocr is None or saved_pages.keys() >= set(page_nums_to_ocr)
+        ):
+            return saved_pages
+
+        page_count = self._get_page_count()
+        self._set_stage_state("rasterized", page_count=page_count, artifacts=[])
+        if page_nums_to_ocr is None:
+            page_nums_to_ocr = range(page_count)
+        unannotated_page_nums = [
+            page_num for page_num in page_nums_to_ocr if page_num not in saved_pages and page_num < page_count
+        ]
 
+        page_annotations = {page_num: page.annotations for page_num, page in saved_pages.items()}
+        self._ocr_missing_pages(
+            page_annotations=page_annotations, page_nums=unannotated_page_nums, get_images=self._rasterize
+        )
+
+        pages: Dict[int, "OCRPage"] = {
+            page_num: OCRPage(tax_file=self, page_number=page_num, annotations=page_annotations[page_num])
+            for page_num in sorted(page_annotations)
+        }
+        self._save_ocr_pages(pages)
         return pages
 
-    def _ocr_and_save(
-        self, annotation_file_path: Path, image_file_path: Path
-    ) -> List[Annotation]:
+    def _ocr_missing_pages(
+        self,
+        page_annotations: Dict[int, AnnotationTable],
+        page_nums: List[int],
+        get_images: Callable[[List[int]], List[Union[Image, Path]]],
+    ) -> None:
         """
-        Perform OCR on the provided image file and save the annotations to a JSON file.
+        OCR the pages missing from page_annotations, adding their annotations to it.
 
-        This method uses the OcrWrapper to perform OCR on the specified image file. It then
-        processes the annotations, converts them to a JSON-serializable format, and saves
-        them to the specified annotation file path. Finally, it returns the list of annotations.
+        The pages are OCR-ed checkpoint_pages at a time, and after each chunk every page annotated so far is saved
+        to the partial annotation file, so an interrupted run only loses the chunk in progress. The images of a
+        chunk are only got when it is OCR-ed, and dropped right after.
 
         Args:
-            annotation_file_path (Path): The path to the JSON file where annotations will be saved.
-            image_file_path (Path): The path to the image file on which OCR will be performed.
+            page_annotations (Dict[int, AnnotationTable]): The annotations of the pages already annotated, by page number.
+            page_nums (List[int]): The page numbers to OCR, in order.
+            get_images (Callable[[List[int]], List[Union[Image, Path]]]): Gets the image, or the path to the image file,
+                                                                         of every page of a chunk, in order.
+        """
+        chunk_size = self.checkpoint_pages or len(page_nums) or 1
+        for start in range(0, len(page_nums), chunk_size):
+            chunk = page_nums[start : start + chunk_size]
+            images = get_images(chunk)
+            started_at = time.perf_counter()
+            page_annotations.update(zip(chunk, self._ocr_pages(images=images)))
+            self._add_stage_timing("ocr", started_at)
+            # before the next chunk is rasterized, so the pages of two chunks are never held at once
+            del images
+
+            if self.checkpoint_pages and start + chunk_size < len(page_nums):
+                with self._artifact_lock():
+                    AnnotationStore.write(
+                        path=self.partial_annotations_file_path,
+                        pages=dict(sorted(page_annotations.items())),
+                        preprocessing=self.preprocessing_key,
+                    ).close()
+                self.ocr_pages = {
+                    page_num: OCRPage(tax_file=self, page_number=page_num, annotations=annotations)
+                    for page_num, annotations in sorted(page_annotations.items())
+                }
+                self._set_ocr_stage_state(complete=False)
+
+    def _save_ocr_pages(self, pages: Dict[int, "OCRPage"]) -> None:
+        """
+        Save the annotations of every page to the annotation file, replacing the partial annotation file.
+
+        Args:
+            pages (Dict[int, 'OCRPage']): The OCR pages, by page number.
+        """
+        with self._artifact_lock():
+            AnnotationStore.write(
+                path=self.annotations_file_path,
+                pages={page_num: page.annotations for page_num, page in pages.items()},
+                preprocessing=self.preprocessing_key,
+            ).close()
+            self.partial_annotations_file_path.unlink(missing_ok=True)
+
+    def _artifact_lock(self):
+        """
+        Get the lock of the document, held only while its artifacts are written, so the artifact garbage
+        collector does not delete them midway. Rasterizing and OCR run without it.
+        """
+        return document_lock(self.base_dir, self.file_path.stem)
+
+    def _compute_lock(self):
+        """
+        Get the lock of the computation of the document, held while it is rasterized and OCR-ed, so processes
+        preprocessing the same document at once OCR it once, the others waiting and reusing its annotations. It
+        is keyed by the document hash, so the same content stored under two names is OCR-ed once too, and by
+        the file name without the OCR cache. The artifact garbage collector does not take it.
+        """
+        return document_lock(self.base_dir, f"compute-{self.document_hash or self.file_path.stem}")
+
+    def _set_stage_state(self, stage: str, artifacts: List[Path], **state) -> None:
+        """
+        Set the state of a completed pipeline stage in stage_state.
+
+        Args:
+            stage (str): The stage, a TaxForm stage.
+            artifacts (List[Path]): The artifacts the stage produced.
+            **state: The other state of the stage.
+        """
+        self.stage_state[stage] = {
+            **state,
+            "artifacts": [str(artifact.relative_to(self.base_dir)) for artifact in artifacts],
+        }
+
+    def _set_ocr_stage_state(self, complete: bool) -> None:
+        """
+        Set the OCR-ed pages of ocr_pages in stage_state, and whether every page to OCR was OCR-ed.
+
+        Args:
+            complete (bool): True if every page to OCR was OCR-ed and saved to the annotation file.
+        """
+        self._set_stage_state(
+            "ocr_done",
+            pages=sorted(self.ocr_pages),
+            complete=complete,
+            artifacts=[self.annotations_file_path if complete else self.partial_annotations_file_path],
+        )
+
+    def _get_page_nums_to_ocr(self) -> Optional[List[int]]:
+        """
+        Classify the pages of the PDF from its text layer and get the ones to OCR.
+
+        Every page is to OCR if ocr_page_labels is None, otherwise only the pages PageClassifier selects for them.
+
+        Returns:
+            Optional[List[int]]: The page numbers to OCR, in order, or None if the text layer could not be read.
+        """
+        self._classify_pages()
+        if not self.page_labels:
+            return None
+        if self.ocr_page_labels is None:
+            return list(range(len(self.page_labels)))
+        page_nums = PageClassifier.select_pages(self.page_labels, self.ocr_page_labels)
+        logger.info(
+            "OCR-ing %d of %d pages of %s", len(page_nums), len(self.page_labels), self.file_path.name
+        )
+        return page_nums
+
+    def _classify_pages(self) -> List[str]:
+        """
+        Classify the pages of the PDF from its text layer, once, for the pages to OCR and the preprocessing of every page.
+
+        Returns:
+            List[str]: The label of every page, page_labels, empty if the text layer could not be read.
+        """
+        if not self._pages_classified:
+            started_at = time.perf_counter()
+            self.page_labels = PageClassifier().classify(file_path=self.file_path, file_bytes=self.file_bytes)
+            self._add_stage_timing("classify", started_at)
+            self._pages_classified = True
+        return self.page_labels
+
+    def _get_page_count(self) -> int:
+        """
+        Get the number of pages of the PDF from pdfinfo, without rasterizing it.
+
+        Returns:
+            int: The number of pages.
+        """
+        if self.file_path.exists():
+            return int(pdfinfo_from_path(self.file_path)["Pages"])
+        if self.file_bytes is not None:
+            return int(pdfinfo_from_bytes(self.file_bytes)["Pages"])
+        raise FileNotFoundError(f"{self.file_path} does not exist and no file bytes were given")
+
+    def _rasterize(self, page_nums: Optional[List[int]] = None) -> List[Image]:
+        """
+        Convert pages of the PDF file to in-memory page images, preprocessed for OCR by the preprocessor of every page.
+
+        The pages are rasterized a run of consecutive pages at a time, so the pages left out are never rendered.
+
+        Args:
+            page_nums (Optional[List[int]]): The page numbers to rasterize, in order. If None, every page is rasterized.
+
+        Returns:
+            List[Image]: The image of every page, in the order of page_nums.
+        """
+        if self.file_path.exists():
+            convert, pdf = convert_from_path, self.file_path
+        elif self.file_bytes is not None:
+            convert, pdf = convert_from_bytes, self.file_bytes
+        else:
+            raise FileNotFoundError(f"{self.file_path} does not exist and no file bytes were given")
+
+        started_at = time.perf_counter()
+        if page_nums is None:
+            images = convert(pdf)
+            page_nums = list(range(len(images)))
+        else:
+            images = []
+            for first_page, last_page in self._get_page_runs(page_nums):
+                # pdf2image numbers the pages from 1
+                images.extend(convert(pdf, first_page=first_page + 1, last_page=last_page + 1))
+        self._add_stage_timing("rasterize", started_at)
+
+        return self._preprocess_images(images, page_nums)
+
+    @classmethod
+    def _get_page_runs(cls, page_nums: List[int]) -> List[Tuple[int, int]]:
+        """
+        Group page numbers into runs of consecutive pages, as (first page, last page) pairs.
+        """
+        runs: List[Tuple[int, int]] = []
+        for page_num in page_nums:
+            if runs and page_num == runs[-1][1] + 1:
+                runs[-1] = (runs[-1][0], page_num)
+            else:
+                runs.append((page_num, page_num))
+        return runs
+
+    def _preprocess_images(self, images: List[Image], page_nums: List[int]) -> List[Image]:
+        """
+        Prepare the page images for OCR with the preprocessor of every page.
+
+        Args:
+            images (List[Image]): The rasterized page images.
+            page_nums (List[int]): The page number of every image.
+
+        Returns:
+            List[Image]: The preprocessed page images, in the same order.
+        """
+        started_at = time.perf_counter()
+        images = [self._get_page_preprocessor(page_num).process(image) for page_num, image in zip(page_nums, images)]
+        self._add_stage_timing("preprocess", started_at)
+        return images
+
+    def _get_page_preprocessor(self, page_num: int) -> PagePreprocessor:
+        """
+        Get the preprocessor of a page, page_preprocessor if set, otherwise the one of the form template its
+        PageClassifier label maps to. The pages are classified only if a label maps to a template, and the
+        pages that could not be classified use the "default" template.
+
+        Args:
+            page_num (int): The page number.
+
+        Returns:
+            PagePreprocessor: The preprocessor of the page.
+        """
+        if self.page_preprocessor is not None:
+            return self.page_preprocessor
+
+        template = "default"
+        if getattr(settings, "PAGE_PREPROCESSING_BY_LABEL", {}):
+            page_labels = self._classify_pages()
+            if page_num < len(page_labels):
+                template = PagePreprocessor.get_template(page_labels[page_num])
+        if template not in self.page_preprocessors:
+            self.page_preprocessors[template] = PagePreprocessor.from_template(template)
+        return self.page_preprocessors[template]
+
+    def _log_preprocessing_timings(self) -> None:
+        """
+        Log the seconds every preprocessor spent in each step, by form template.
+        """
+        preprocessors = (
+            {"custom": self.page_preprocessor} if self.page_preprocessor is not None else self.page_preprocessors
+        )
+        for template, preprocessor in preprocessors.items():
+            if preprocessor.pages:
+                preprocessor.log_timings(name=f"{self.file_path.name} ({template})")
+
+    def _add_stage_timing(self, stage: str, started_at: float) -> None:
+        """
+        Add the seconds elapsed since started_at to a stage of stage_timings.
+
+        Args:
+            stage (str): The name of the stage.
+            started_at (float): The time.perf_counter() value the stage started at.
+        """
+        self.stage_timings[stage] = self.stage_timings.get(stage, 0.0) + time.perf_counter() - started_at
+
+    def _load_ocr_pages(self, any_preprocessing: bool = False) -> Dict[int, "OCRPage"]:
+        """
+        Load the OCR pages from previously saved annotations only.
+
+        This method reads every page's annotations from the annotation file, or from the legacy JSON files of
+        the annotations directory, without rasterizing or OCR-ing the PDF, so the tax fields can be re-parsed cheaply.
+
+        Args:
+            any_preprocessing (bool): If True, an annotation file OCR-ed after another preprocessing is loaded too.
+
+        Returns:
+            Dict[int, 'OCRPage']: A dictionary mapping page numbers to OCRPage objects containing annotations.
+
+        Raises:
+            FileNotFoundError: If no annotations were saved for the tax form.
+        """
+        saved_annotations = self._load_saved_annotations(any_preprocessing=any_preprocessing)
+        if not saved_annotations:
+            for annotation_file_path in self.annotations_directory.glob("page_*.json"):
+                page_num = int(annotation_file_path.stem.split("_")[-1]) - 1
+                saved_annotations[page_num] = self._load_annotations(annotation_file_path)
+
+        if not saved_annotations:
+            raise FileNotFoundError(
+                f"No saved annotations for {self.file_path.name} in {self.base_annotations_directory}"
+            )
+
+        return {
+            page_num: OCRPage(
+                tax_file=self, page_number=page_num, annotations=saved_annotations[page_num]
+            )
+            for page_num in sorted(saved_annotations)
+        }
+
+    def _load_saved_annotations(self, any_preprocessing: bool = False) -> Dict[int, AnnotationTable]:
+        """
+        Load the annotations of every page saved in the annotation file, or in the partial annotation file
+        of an interrupted run. A file OCR-ed after another preprocessing than preprocessing_key is skipped,
+        while a file that did not record its preprocessing, written before it was, is loaded.
+
+        Args:
+            any_preprocessing (bool): If True, a file OCR-ed after another preprocessing is loaded too.
 
         Returns:
-            List[Annotation]: A list of Annotation objects obtained from the OCR process.
+            Dict[int, AnnotationTable]: The annotations of every page by page number, empty if there is no annotation file.
         """
-        ocr_wrapper = OcrWrapper(image=str(image_file_path))
+        saved_annotations: Dict[int, AnnotationTable] = {}
+        for annotations_file_path in (self.partial_annotations_file_path, self.annotations_file_path):
+            if not annotations_file_path.exists():
+                continue
+            with AnnotationStore(path=annotations_file_path) as store:
+                if not any_preprocessing and store.preprocessing not in ("", self.preprocessing_key):
+                    continue
+                saved_annotations.update(
+                    (page_num, store.read_page(page_num)) for page_num in store.page_numbers()
+                )
+        return saved_annotations
+
+    @classmethod
+    def _load_annotations(cls, annotation_file_path: Path) -> AnnotationTable:
+        """
+        Load the annotations saved in a legacy JSON file.
 
-        to_save = []
-        for annotation in ocr_wrapper.annotations:
-            temp = {}
-            temp["text"] = annotation.text
-            temp["bbox"] = annotation.bbox
-            temp["center"] = annotation.center
+        Args:
+            annotation_file_path (Path): The path to the JSON file of a page's annotations.
+
+        Returns:
+            AnnotationTable: The annotations of the page.
+        """
+        with open(annotation_file_path, "r") as j:
+            return AnnotationTable.from_json(json.load(j))
 
-            to_save.append(temp)
+    def _ocr_pages(self, images: List[Union[Image, Path]]) -> List[AnnotationTable]:
+        """
+        Get the annotations of pages from the page cache, performing OCR only on the pages missing from it.
 
-        json_data = json.dumps(to_save, indent=4)
+        The pages are looked up by the hash of their downscaled image and preprocessing_key, so boilerplate pages repeated across
+        documents, such as instructions, are OCR-ed once. The OCR-ed pages are added to the page cache. With
+        an ocr_task_queue, they are queued for the OCR workers of every node, with
+        an ocr_dispatcher, they are batched with the pages of concurrent requests into calls to its worker processes,
+        with an ocr_executor, they are OCR-ed on its worker processes, otherwise in this process. The page cache
+        is skipped if use_ocr_cache is False.
 
-        with open(annotation_file_path, "w") as file:
-            file.write(json_data)
+        Args:
+            images (List[Union[Image, Path]]): The in-memory images, or the paths to the image files, of the pages.
 
-        return ocr_wrapper.annotations
+        Returns:
+            List[AnnotationTable]: The annotations of every page, in order.
+        """
+        page_cache = get_page_cache() if self.use_ocr_cache else None
+        page_hashes: List[Optional[str]] = [None] * len(images)
+        page_annotations: List[Optional[AnnotationTable]] = [None] * len(images)
+        if page_cache is not None:
+            for index, image in enumerate(images):
+                if isinstance(image, Path):
+                    with PILImage.open(image) as opened_image:
+                        page_hashes[index] = get_page_hash(opened_image)
+                else:
+                    page_hashes[index] = get_page_hash(image)
+                cached_pages = page_cache.get(f"{page_hashes[index]}-{self.preprocessing_key}")
+                if cached_pages is not None:
+                    page_annotations[index] = cached_pages[0]
+
+        missing = [index for index, annotations in enumerate(page_annotations) if annotations is None]
+        if missing:
+            in_memory = not any(isinstance(images[index], Path) for index in missing)
+            if self.ocr_task_queue is not None:
+                ocr_annotations = self.ocr_task_queue.ocr_pages(
+                    images=[images[index] for index in missing],
+                    priority=self.ocr_priority,
+                    tenant=self.tenant,
+                    document=self.file_path.name,
+                )
+            elif self.ocr_dispatcher is not None and in_memory:
+                ocr_annotations = self.ocr_dispatcher.ocr_pages(
+                    images=[images[index] for index in missing],
+                    priority=self.ocr_priority,
+                    tenant=self.tenant,
+                    document=self.file_path.name,
+                )
+            elif self.ocr_executor is not None and in_memory:
+                ocr_annotations = ocr_pages_in_workers(
+                    images=[images[index] for index in missing], executor=self.ocr_executor
+                )
+            else:
+                ocr_annotations = [self._ocr(image=images[index]) for index in missing]
+            for index, annotations in zip(missing, ocr_annotations):
+                page_annotations[index] = annotations
+                if page_cache is not None:
+                    page_cache.put(f"{page_hashes[index]}-{self.preprocessing_key}", {0: annotations})
+
+        logger.debug("%d of %d pages served by the page cache", len(images) - len(missing), len(images))
+        return page_annotations
+
+    @classmethod
+    def _ocr(cls, image: Union[Image, Path]) -> AnnotationTable:
+        """
+        Perform OCR on the provided image.
+
+        Args:
+            image (Union[Image, Path]): The in-memory image, or the path to the image file, on which OCR will be performed.
+
+        Returns:
+            AnnotationTable: The annotations obtained from the OCR process.
+        """
+        if isinstance(image, Path):
+            image = str(image)
+        return AnnotationTable.from_annotations(OcrWrapper.from_settings(image=image).annotations)
 
     def _save_annotations_over_images(self) -> None:
         """
         Save annotated images to visualize OCR results.
 
         This method generates images with OCR annotations overlayed on top of the original images.
+        The annotations are drawn from ocr_pages, so no page is OCR-ed again, and the pages that were not OCR-ed are skipped.
         It saves these annotated images in a specified directory, annotations_over_images_dir, allowing for easy examination of the OCR results.
-        If the directory for saving the annotated images does not exist, it is created.
+        If the directory for saving the annotated images does not exist, it is created. Every image is written under a
+        temporary name and renamed into place, so a partially written image is never left behind.
 
         Returns:
             None
@@ -272,17 +954,22 @@ class PreprocessTaxForm:
             self.base_annotations_over_images_dir / self.file_path.stem
         )
 
-        if not annotations_over_images_dir.exists():
-            annotations_over_images_dir.mkdir()
+        annotations_over_images_dir.mkdir(parents=True, exist_ok=True)
 
         for page_num, image_file_path in enumerate(self.image_file_paths):
             annotations_over_images_file_path = (
                 annotations_over_images_dir / f"{image_file_path.stem}.png"
             )
-            if not annotations_over_images_file_path.exists():
-                ocr_wrapper = OcrWrapper(image=str(image_file_path))
-                image = ocr_wrapper.ocr_mac.annotate_PIL()
-                image.save(annotations_over_images_file_path)
+            if page_num in self.ocr_pages and not annotations_over_images_file_path.exists():
+                with PILImage.open(image_file_path) as image:
+                    annotated_image = image.convert("RGB")
+                draw = ImageDraw.Draw(annotated_image)
+                for annotation in self.ocr_pages[page_num].annotations:
+                    x1, y1, x2, y2 = annotation.bbox
+                    draw.rectangle((x1, y1, x2, y2), outline="red")
+                    draw.text((x1, y2), annotation.text, fill="red")
+                with self._artifact_lock(), atomic_write(annotations_over_images_file_path) as temporary_path:
+                    annotated_image.save(temporary_path, "PNG")
 
     def _set_base_directories(self)->None:
         """
@@ -322,9 +1009,9 @@ class PreprocessTaxForm:
         """
         Ensure all base directories for extracted data from the PDF exist.
 
-        This method checks if the base directories for storing various types of extracted 
-        data from the PDF (images, text, annotations, and annotated images) exist. If any 
-        of these directories do not exist, it creates them.
+        This method creates the base directories for storing various types of extracted 
+        data from the PDF (images, text, annotations, and annotated images) if they do not
+        exist, without failing if another process creates them at the same time.
 
         Directories:
             - base_image_directory: Directory for storing images.
@@ -335,16 +1022,14 @@ class PreprocessTaxForm:
         Returns:
             None
         """
-        if not self.base_dir.exists():
-            self.base_dir.mkdir()
-        if not self.base_image_directory.exists():
-            self.base_image_directory.mkdir()
-        if not self.base_text_from_pdf_directory.exists():
-            self.base_text_from_pdf_directory.mkdir()
-        if not self.base_annotations_directory.exists():
-            self.base_annotations_directory.mkdir()
-        if not self.base_annotations_over_images_dir.exists():
-            self.base_annotations_over_images_dir.mkdir()
+        for directory in (
+            self.base_dir,
+            self.base_image_directory,
+            self.base_text_from_pdf_directory,
+            self.base_annotations_directory,
+            self.base_annotations_over_images_dir,
+        ):
+            directory.mkdir(parents=True, exist_ok=True)
 
 
 @dataclass
@@ -353,12 +1038,13 @@ class OCRPage:
     Data class for representing an OCR page of a tax form.
 
     This class encapsulates the OCR data for a single page of a tax form, including 
-    the tax form instance, page number, and a list of annotations.
+    the tax form instance, page number, and a table of annotations.
 
     Attributes:
         tax_file (PreprocessTaxForm): The instance of the preprocessed tax form.
         page_number (int): The page number of the tax form.
-        annotations (List[Annotation]): A list of Annotation objects containing OCR data.
+        annotations (AnnotationTable): The table of annotations containing OCR data. A list of
+                                       Annotation objects is converted to a table.
 
     Methods:
         to_json() -> str:
@@ -366,10 +1052,10 @@ class OCRPage:
     """
     tax_file: PreprocessTaxForm
     page_number: int
-    annotations: List[Annotation]
+    annotations: AnnotationTable
+
+    def __post_init__(self):
+        self.annotations = AnnotationTable.from_annotations(self.annotations)
 
     def to_json(self) -> str:
-        temp_annotations = []
-        for annotation in self.annotations:
-            temp_annotations.append(asdict(annotation))
-        return json.dumps(temp_annotations, indent=4)
+        return json.dumps(self.annotations.to_json(), indent=4)
@@ -0,0 +1,129 @@
+"""
+provides the streaming of uploaded tax forms to the tax form storage, hashing them as they are written
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple
+import os
+from django.core.files import File
+from django.core.files.storage import default_storage
+from TaxParsingAPI.models import UPLOAD_TO
+from TaxParsingAPI.helpers.ocr_cache import get_document_hasher
+
+# the size of the chunks an upload is copied in, bounding the memory a request holds whatever the file size
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """
+    Raised when an upload turns out larger than the limit while it is streamed.
+    """
+
+
+@dataclass
+class StoredUpload:
+    """
+    Data class for an upload streamed to the tax form storage.
+
+    Attributes:
+        name (str): The storage name of the file, the value of TaxForm.tax_form, unique among the stored tax forms.
+        path (Path): The path to the file.
+        size (int): The size of the file in bytes.
+        document_hash (str): The document hash of the file, the key of the OCR cache.
+
+    Methods:
+        delete():
+            Delete the file, for an upload that was rejected.
+    """
+
+    name: str
+    path: Path
+    size: int
+    document_hash: str
+
+    def delete(self) -> None:
+        """
+        Delete the file, for an upload that was rejected.
+        """
+        self.path.unlink(missing_ok=True)
+
+
+def store_upload(upload: File, max_bytes: Optional[int] = None, upload_to: str = UPLOAD_TO) -> StoredUpload:
+    """
+    Stream an upload to the tax form storage in chunks, hashing it as it is written.
+
+    The file is saved under a name no stored tax form has, created exclusively so concurrent uploads of the
+    same name do not overwrite each other, and no more than a chunk of it is held in memory at a time.
+
+    Args:
+        upload (File): The uploaded file, which Django spools to a temporary file once it is large.
+        max_bytes (Optional[int]): The largest upload accepted, None does not limit it. Defaults to None.
+        upload_to (str): The storage directory of the tax forms. Defaults to UPLOAD_TO.
+
+    Returns:
+        StoredUpload: The stored file, with its size and document hash.
+
+    Raises:
+        UploadTooLarge: If the upload is larger than max_bytes, in which case nothing is left stored.
+    """
+    if max_bytes is not None and upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(f"The file is {upload.size} bytes, at most {max_bytes} are accepted.")
+
+    name, path, stored_file = _create_stored_file(Path(upload.name).name, upload_to)
+
+    hasher = get_document_hasher()
+    size = 0
+    try:
+        with stored_file:
+            upload.seek(0)
+            for chunk in upload.chunks(chunk_size=UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLarge(f"The file is over {max_bytes} bytes, at most {max_bytes} are accepted.")
+                hasher.update(chunk)
+                stored_file.write(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+    return StoredUpload(name=name, path=path, size=size, document_hash=hasher.hexdigest())
+
+
+def move_to_storage(source_path: Path, file_name: str, document_hash: str, upload_to: str = UPLOAD_TO) -> StoredUpload:
+    """
+    Move a file received outside of a request, such as the part file of a resumable upload, to the tax form storage.
+
+    Args:
+        source_path (Path): The complete file, on the file system of the storage.
+        file_name (str): The name of the uploaded file.
+        document_hash (str): The document hash of the file, already verified.
+        upload_to (str): The storage directory of the tax forms. Defaults to UPLOAD_TO.
+
+    Returns:
+        StoredUpload: The stored file.
+    """
+    name, path, stored_file = _create_stored_file(Path(file_name).name, upload_to)
+    stored_file.close()
+    os.replace(source_path, path)
+    return StoredUpload(name=name, path=path, size=path.stat().st_size, document_hash=document_hash)
+
+
+def _create_stored_file(file_name: str, upload_to: str) -> Tuple[str, Path, BinaryIO]:
+    """
+    Create an empty file in the tax form storage under a name no stored tax form has.
+
+    The file is created exclusively, so concurrent uploads of the same name do not take the same one.
+
+    Returns:
+        Tuple[str, Path, BinaryIO]: The storage name, the path and the file opened for writing.
+    """
+    while True:
+        name = default_storage.get_available_name(f"{upload_to}/{file_name}")
+        path = Path(default_storage.path(name))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            return name, path, open(path, "xb")
+        except FileExistsError:
+            # another upload took the name since it was found available
+            continue
@@ -0,0 +1,369 @@
+"""
+provides the resumable uploads of tax forms, received in byte ranges and verified by hash before they are processed
+"""
+
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+import logging
+import regex as re
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from TaxParsingAPI.models import TaxForm, UploadSession, UPLOAD_TO
+from TaxParsingAPI.helpers.ocr_cache import get_file_document_hash
+from TaxParsingAPI.helpers.upload_helper import UPLOAD_CHUNK_SIZE, StoredUpload, move_to_storage
+from TaxParsingAPI.helpers.utils.atomic_files import document_lock
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE_PATTERN = re.compile(r"^bytes\s+(\d+)-(\d+)/(\d+)$")
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+PART_SUFFIX = ".part"
+
+
+class UploadSessionError(Exception):
+    """
+    Raised when a request of a resumable upload cannot be applied to its session.
+
+    Attributes:
+        status_code (int): The HTTP status of the error, 400 for a malformed request, 409 for a range that does not
+                           start within the received bytes or a session in the wrong status, 413 for too large a file
+                           or range, and 422 for a file that does not match its hash.
+    """
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_content_range(content_range: Optional[str]) -> Tuple[int, int, int]:
+    """
+    Parse a Content-Range header of the form "bytes <first>-<last>/<size>".
+
+    Args:
+        content_range (Optional[str]): The header.
+
+    Returns:
+        Tuple[int, int, int]: The first and last byte of the range, both included, and the size of the file.
+
+    Raises:
+        UploadSessionError: If the header is missing or malformed.
+    """
+    match = CONTENT_RANGE_PATTERN.match((content_range or "").strip())
+    if not match:
+        raise UploadSessionError('A "Content-Range: bytes <first>-<last>/<size>" header is required.')
+    first, last, size = (int(group) for group in match.groups())
+    if last < first:
+        raise UploadSessionError("The last byte of the range is before its first byte.")
+    return first, last, size
+
+
+@dataclass
+class UploadSessionStore:
+    """
+    Data class for receiving tax forms in byte ranges, so a lost connection only resends the bytes not received.
+
+    A session is created with the name, size and sha256 of the file, then the client PUTs byte ranges in order,
+    each with a Content-Range header. A range is written at its offset in the part file of the session, under
+    the lock of the session so concurrent retries of a range do not interleave, whose file is deleted on release, and a range starting within the
+    received bytes is accepted, so a range resent after a lost response does no harm. Once every byte is received,
+    finalize verifies the file against its sha256, reading it in chunks, and moves it to the tax form storage, where
+    it is processed like a single upload. finalize also claims the processing of the stored file under the lock, so
+    a client retrying a slow finalize is told the file is being processed instead of processing it a second time.
+    Sessions not finalized within expiry_seconds of their last range are deleted with their part file.
+
+    Attributes:
+        directory (Path): The directory of the part files. Defaults to MEDIA_ROOT/tax_forms/upload_sessions.
+        max_bytes (Optional[int]): The largest file accepted, None does not limit it. Defaults to 200 MiB, from_settings
+                                   uses settings.TAX_FORM_PREFLIGHT, so a file is not received only to be rejected.
+        max_range_bytes (int): The largest range accepted in one request. Defaults to 16 MiB.
+        expiry_seconds (float): Seconds an unfinished session is kept after its last range. Defaults to one day.
+
+    Methods:
+        from_settings(cls) -> 'UploadSessionStore':
+            Create a store configured by settings.TAX_FORM_UPLOAD_SESSIONS.
+
+        create(file_name, size, sha256, tax_fields, tenant) -> UploadSession:
+            Create a session and its empty part file.
+
+        get_part_path(session) -> Path:
+            Get the path of the part file of a session.
+
+        write(session, content_range, stream) -> UploadSession:
+            Write a byte range of the file.
+
+        finalize(session) -> StoredUpload:
+            Verify the complete file, move it to the tax form storage and claim its processing.
+
+        complete(session, tax_form) -> UploadSession:
+            Record the tax form created by the processing of a session.
+
+        release(session) -> UploadSession:
+            Give back a session whose processing failed, so it can be finalized again.
+
+        delete(session):
+            Delete a session and its part file.
+
+        purge_expired() -> int:
+            Delete the expired sessions and their part files.
+    """
+
+    directory: Path = None
+    max_bytes: Optional[int] = 200 * 1024 * 1024
+    max_range_bytes: int = 16 * 1024 * 1024
+    expiry_seconds: float = 24 * 60 * 60
+
+    def __post_init__(self):
+        if self.directory is None:
+            self.directory = Path(settings.MEDIA_ROOT) / UPLOAD_TO / "upload_sessions"
+
+    @classmethod
+    def from_settings(cls) -> "UploadSessionStore":
+        """
+        Create a store configured by settings.TAX_FORM_UPLOAD_SESSIONS, accepting the files TaxFormPreflight accepts.
+
+        Returns:
+            UploadSessionStore: The configured store.
+        """
+        config = getattr(settings, "TAX_FORM_UPLOAD_SESSIONS", {})
+        return cls(
+            directory=config.get("DIRECTORY"),
+            max_bytes=getattr(settings, "TAX_FORM_PREFLIGHT", {}).get("MAX_BYTES", cls.max_bytes),
+            max_range_bytes=config.get("MAX_RANGE_BYTES", cls.max_range_bytes),
+            expiry_seconds=config.get("EXPIRY_SECONDS", cls.expiry_seconds),
+        )
+
+    def create(
+        self, file_name: str, size: int, sha256: str, tax_fields: Optional[List[Dict]] = None, tenant: str = ""
+    ) -> UploadSession:
+        """
+        Create a session and its empty part file, deleting the expired sessions first.
+
+        Args:
+            file_name (str): The name of the file.
+            size (int): The size of the file in bytes.
+            sha256 (str): The hex sha256 digest of the file.
+            tax_fields (Optional[List[Dict]]): The tax fields to extract, each a dictionary with a "tax_field" key,
+                                               every one if None or empty. Defaults to None.
+            tenant (str): The user or firm the session belongs to. Defaults to "".
+
+        Returns:
+            UploadSession: The session.
+
+        Raises:
+            UploadSessionError: If the name, size or digest is invalid, or the file is too large.
+        """
+        sha256 = (sha256 or "").strip().lower()
+        if not Path(file_name or "").name:
+            raise UploadSessionError("A file_name is required.")
+        if size <= 0:
+            raise UploadSessionError("The size must be a positive number of bytes.")
+        if self.max_bytes is not None and size > self.max_bytes:
+            raise UploadSessionError(f"The file is {size} bytes, at most {self.max_bytes} are accepted.", 413)
+        if not SHA256_PATTERN.match(sha256):
+            raise UploadSessionError("The sha256 must be the hex sha256 digest of the file.")
+
+        self.purge_expired()
+        session = UploadSession.objects.create(
+            file_name=Path(file_name).name,
+            size=size,
+            sha256=sha256,
+            tax_fields=tax_fields or [],
+            tenant=tenant,
+            expires_at=timezone.now() + timedelta(seconds=self.expiry_seconds),
+        )
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.get_part_path(session).touch()
+        return session
+
+    def get_part_path(self, session: UploadSession) -> Path:
+        """
+        Get the path of the part file of a session.
+
+        Args:
+            session (UploadSession): The session.
+
+        Returns:
+            Path: The part file, "<session id>.part" in directory.
+        """
+        return self.directory / f"{session.id}{PART_SUFFIX}"
+
+    def write(self, session: UploadSession, content_range: Optional[str], stream: BinaryIO) -> UploadSession:
+        """
+        Write a byte range of the file, read from stream in chunks, at its offset in the part file.
+
+        Args:
+            session (UploadSession): The session.
+            content_range (Optional[str]): The Content-Range header of the range.
+            stream (BinaryIO): The body of the request, holding the bytes of the range.
+
+        Returns:
+            UploadSession: The session, with its offset moved past the range.
+
+        Raises:
+            UploadSessionError: If the header is malformed or does not match the session, the range starts after the
+                                received bytes, the body is shorter than the range, or the session is not open.
+        """
+        first, last, size = parse_content_range(content_range)
+        length = last - first + 1
+        if size != session.size:
+            raise UploadSessionError(f"The session is for a file of {session.size} bytes, not {size}.")
+        if last >= session.size:
+            raise UploadSessionError(f"The range ends after the last byte of the file, {session.size - 1}.")
+        if length > self.max_range_bytes:
+            raise UploadSessionError(f"A range holds at most {self.max_range_bytes} bytes.", 413)
+
+        with document_lock(self.directory, str(session.id)):
+            session.refresh_from_db()
+            if session.status != UploadSession.OPEN:
+                raise UploadSessionError(f"The session is {session.status}, it takes no more bytes.", 409)
+            if first > session.offset:
+                raise UploadSessionError(f"The range starts at byte {first}, the next byte expected is {session.offset}.", 409)
+
+            written = 0
+            with open(self.get_part_path(session), "r+b") as part_file:
+                part_file.seek(first)
+                while written < length:
+                    chunk = stream.read(min(UPLOAD_CHUNK_SIZE, length - written))
+                    if not chunk:
+                        break
+                    part_file.write(chunk)
+                    written += len(chunk)
+
+            # the bytes written before a body cut short are kept, the client resumes after them
+            session.offset = max(session.offset, first + written)
+            session.expires_at = timezone.now() + timedelta(seconds=self.expiry_seconds)
+            session.save(update_fields=["offset", "expires_at", "updated_at"])
+
+        if written < length:
+            raise UploadSessionError(f"The body holds {written} of the {length} bytes of the range.")
+        return session
+
+    def finalize(self, session: UploadSession) -> StoredUpload:
+        """
+        Verify the complete file against its sha256, move it to the tax form storage and claim its processing.
+
+        The session moves to processing under its lock, so of concurrent finalize calls only one gets the stored file,
+        the others are refused until it is completed or released. A session already stored, whose processing failed
+        and was released, returns its stored file again, so finalize can be retried. A file that does not match its
+        hash is discarded, and the session restarts from its first byte.
+
+        Args:
+            session (UploadSession): The session.
+
+        Returns:
+            StoredUpload: The stored file, with its verified document hash, to be processed by the caller.
+
+        Raises:
+            UploadSessionError: If bytes are missing, the file does not match its hash, or the session is being processed
+                                or was finalized.
+        """
+        with document_lock(self.directory, str(session.id)):
+            session.refresh_from_db()
+            if session.status == UploadSession.FINALIZED:
+                raise UploadSessionError("The session is finalized.", 409)
+            if session.status == UploadSession.PROCESSING:
+                raise UploadSessionError("The file of the session is being processed.", 409)
+            if session.status == UploadSession.STORED:
+                path = Path(default_storage.path(session.stored_name))
+                stored_upload = StoredUpload(
+                    name=session.stored_name, path=path, size=path.stat().st_size, document_hash=session.sha256
+                )
+                self._set_status(session, UploadSession.PROCESSING)
+                return stored_upload
+            if not session.is_complete():
+                raise UploadSessionError(
+                    f"{session.size - session.offset} bytes are missing, the next byte expected is {session.offset}.",
+                    409,
+                )
+
+            part_path = self.get_part_path(session)
+            if get_file_document_hash(part_path) != session.sha256:
+                part_path.write_bytes(b"")
+                session.offset = 0
+                session.save(update_fields=["offset", "updated_at"])
+                raise UploadSessionError("The file does not match its sha256, upload it again from the first byte.", 422)
+
+            stored_upload = move_to_storage(part_path, session.file_name, session.sha256)
+            session.stored_name = stored_upload.name
+            self._set_status(session, UploadSession.PROCESSING)
+        return stored_upload
+
+    def complete(self, session: UploadSession, tax_form: TaxForm) -> UploadSession:
+        """
+        Record the tax form created by the processing of a session, finalizing it.
+
+        Args:
+            session (UploadSession): The session, being processed.
+            tax_form (TaxForm): The tax form created from its stored file.
+
+        Returns:
+            UploadSession: The finalized session.
+        """
+        with document_lock(self.directory, str(session.id)):
+            session.tax_form = tax_form
+            self._set_status(session, UploadSession.FINALIZED)
+        return session
+
+    def release(self, session: UploadSession) -> UploadSession:
+        """
+        Give back a session whose processing failed or was refused, keeping its stored file, so it can be finalized again.
+
+        Args:
+            session (UploadSession): The session, being processed.
+
+        Returns:
+            UploadSession: The stored session.
+        """
+        with document_lock(self.directory, str(session.id)):
+            self._set_status(session, UploadSession.STORED)
+        return session
+
+    def delete(self, session: UploadSession) -> None:
+        """
+        Delete a session and its part file, or its stored file if it was not processed yet.
+
+        Args:
+            session (UploadSession): The session.
+
+        Raises:
+            UploadSessionError: If the file of the session is being processed.
+        """
+        with document_lock(self.directory, str(session.id)):
+            try:
+                session.refresh_from_db()
+            except UploadSession.DoesNotExist:
+                return
+            # the processing of a session only outlives its expiry if the process processing it died
+            if session.status == UploadSession.PROCESSING and session.expires_at > timezone.now():
+                raise UploadSessionError("The file of the session is being processed.", 409)
+            self.get_part_path(session).unlink(missing_ok=True)
+            if session.status in (UploadSession.STORED, UploadSession.PROCESSING):
+                Path(default_storage.path(session.stored_name)).unlink(missing_ok=True)
+            session.delete()
+
+    def _set_status(self, session: UploadSession, status: str) -> None:
+        """
+        Set the status of a session, pushing its expiry back, so a session being processed is not purged meanwhile.
+        """
+        session.status = status
+        session.expires_at = timezone.now() + timedelta(seconds=self.expiry_seconds)
+        session.save(update_fields=["status", "stored_name", "tax_form", "expires_at", "updated_at"])
+
+    def purge_expired(self) -> int:
+        """
+        Delete the sessions not finalized before they expired, and their files.
+
+        Returns:
+            int: The number of sessions deleted.
+        """
+        expired = list(
+            UploadSession.objects.exclude(status=UploadSession.FINALIZED).filter(expires_at__lt=timezone.now())
+        )
+        for session in expired:
+            self.delete(session)
+        if expired:
+            logger.info("Deleted %d expired upload sessions", len(expired))
+        return len(expired)
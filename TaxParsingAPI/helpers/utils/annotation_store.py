@@ -0,0 +1,310 @@
+"""
+provides a compact, memory-mappable, single file store for the annotations of every page of a document
+"""
+
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import ClassVar, Dict, List, Optional, Tuple, Union
+from array import array
+import json
+import mmap
+import struct
+import sys
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+from TaxParsingAPI.helpers.utils.atomic_files import atomic_write
+
+# the arrays of the annotation file are little-endian, which the memory map is only read as in place on such hosts
+LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+class StoredTexts(Sequence):
+    """
+    Read-only sequence of the texts of a page of an annotation file, each decoded from the memory map the
+    first time it is read, so a page whose texts are not all read does not decode them all.
+
+    Attributes:
+        blob (memoryview): The text blob of the page, a view of the text blob of the annotation file.
+        offsets (Sequence[int]): The byte offsets of the texts of the page into the text blob of the file, one
+            more than the texts, so the first is the offset of the blob of the page.
+        decoded (Optional[List[Optional[str]]]): The texts decoded so far, None until one is.
+    """
+
+    __slots__ = ("blob", "offsets", "decoded")
+
+    def __init__(self, blob: memoryview, offsets: Sequence):
+        self.blob = blob
+        self.offsets = offsets
+        self.decoded: Optional[List[Optional[str]]] = None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(key, slice):
+            return [self[index] for index in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("StoredTexts index out of range")
+        if self.decoded is None:
+            self.decoded = [None] * len(self)
+        text = self.decoded[key]
+        if text is None:
+            base = self.offsets[0]
+            text = self.decoded[key] = str(self.blob[self.offsets[key] - base : self.offsets[key + 1] - base], "utf-8")
+        return text
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def __repr__(self) -> str:
+        return f"StoredTexts({len(self)} texts)"
+
+
+@dataclass
+class AnnotationStore:
+    """
+    Data class for reading and writing the annotation file of a document.
+
+    All the annotations of a document are kept in one columnar file: a text blob with an offset
+    array, and float32 bounding box and center arrays. The file is memory-mapped when read, so
+    worker processes reading the same document share its pages through the OS page cache. A page is
+    read without copying: its arrays are views of the memory map and its texts are decoded on access.
+    The views keep the memory map alive once the store is closed, until the last of them is dropped.
+
+    File layout (little-endian byte order on every host, every section 4 byte aligned):
+        header: magic b"TXAN", version (uint16), reserved (uint16), page count (uint32)
+        preprocessing key: size (uint32), then the UTF-8 encoded key, padded to 4 bytes (from version 2)
+        page table: page count x (page number (int32), first annotation (uint32), annotation count (uint32))
+        annotation count (uint32), text blob size (uint32)
+        text offsets: (annotation count + 1) x uint32, byte offsets into the text blob
+        bounding boxes: annotation count x 4 x float32, (x_min, y_min, x_max, y_max)
+        centers: annotation count x 2 x float32, (x, y)
+        text blob: the UTF-8 encoded texts of every annotation
+
+    Attributes:
+        path (Path): The path to the annotation file.
+        pages (Dict[int, Tuple[int, int]]): The first annotation index and the annotation count of every page, by page number.
+        preprocessing (str): The key of the page preprocessing the pages were OCR-ed after, empty if it was not recorded,
+                             as in version 1 files.
+
+    Methods:
+        write(cls, path, pages, preprocessing) -> 'AnnotationStore':
+            Write the annotations of every page of a document to an annotation file.
+
+        from_json_directory(cls, annotations_directory, path) -> 'AnnotationStore':
+            Convert the per page JSON annotation files of a document to an annotation file.
+
+        page_numbers() -> List[int]:
+            Get the page numbers stored in the annotation file.
+
+        read_page(page_number) -> AnnotationTable:
+            Read the annotations of a page, without copying them out of the memory map.
+
+        close():
+            Release the memory map.
+    """
+
+    path: Path
+    pages: Dict[int, Tuple[int, int]] = field(init=False, default_factory=dict)
+    preprocessing: str = field(init=False, default="")
+
+    MAGIC: ClassVar[bytes] = b"TXAN"
+    VERSION: ClassVar[int] = 2
+    # the versions that can still be read, version 1 files have no preprocessing key
+    READABLE_VERSIONS: ClassVar[Tuple[int, ...]] = (1, 2)
+    SUFFIX: ClassVar[str] = ".ann"
+    # the annotation file of the pages OCR-ed so far by an interrupted run is "<stem>.ann.partial"
+    PARTIAL_SUFFIX: ClassVar[str] = ".partial"
+
+    _HEADER: ClassVar[struct.Struct] = struct.Struct("<4sHHI")
+    _KEY_SIZE: ClassVar[struct.Struct] = struct.Struct("<I")
+    _PAGE: ClassVar[struct.Struct] = struct.Struct("<iII")
+    _COUNTS: ClassVar[struct.Struct] = struct.Struct("<II")
+
+    def __post_init__(self):
+        self._file = open(self.path, "rb")
+        self._mmap: Optional[mmap.mmap] = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = self._buffer = memoryview(self._mmap)
+
+        magic, version, _, page_count = self._HEADER.unpack_from(buffer, 0)
+        if magic != self.MAGIC or version not in self.READABLE_VERSIONS:
+            self.close()
+            raise ValueError(f"{self.path} is not a version {self.VERSION} annotation file")
+        offset = self._HEADER.size
+
+        if version >= 2:
+            (key_size,) = self._KEY_SIZE.unpack_from(buffer, offset)
+            offset += self._KEY_SIZE.size
+            self.preprocessing = str(buffer[offset : offset + key_size], "utf-8")
+            offset += self._get_padded_size(key_size)
+
+        for _ in range(page_count):
+            page_number, start, count = self._PAGE.unpack_from(buffer, offset)
+            self.pages[page_number] = (start, count)
+            offset += self._PAGE.size
+
+        annotation_count, text_size = self._COUNTS.unpack_from(buffer, offset)
+        offset += self._COUNTS.size
+
+        self._text_offsets = self._read_array(buffer[offset : offset + 4 * (annotation_count + 1)], "I")
+        offset += 4 * (annotation_count + 1)
+        self._bboxes = self._read_array(buffer[offset : offset + 16 * annotation_count], "f")
+        offset += 16 * annotation_count
+        self._centers = self._read_array(buffer[offset : offset + 8 * annotation_count], "f")
+        offset += 8 * annotation_count
+        self._text = buffer[offset : offset + text_size]
+
+    @classmethod
+    def _read_array(cls, section: memoryview, typecode: str) -> Union[memoryview, array]:
+        """
+        Read a little-endian array section of the file, as a view of the memory map on a little-endian host,
+        and as a byte swapped copy otherwise.
+        """
+        if LITTLE_ENDIAN:
+            return section.cast(typecode)
+        values = array(typecode)
+        values.frombytes(section)
+        values.byteswap()
+        return values
+
+    @classmethod
+    def _to_bytes(cls, values: array) -> bytes:
+        """
+        Get the little-endian bytes of an array, whatever the byte order of the host.
+        """
+        if not LITTLE_ENDIAN:
+            values = array(values.typecode, values)
+            values.byteswap()
+        return values.tobytes()
+
+    @classmethod
+    def write(cls, path: Path, pages: Dict[int, AnnotationTable], preprocessing: str = "") -> "AnnotationStore":
+        """
+        Write the annotations of every page of a document to an annotation file.
+
+        The file is written under a temporary name and renamed into place, so a process reading it, or
+        a store already opened on it, never sees a partially written file.
+
+        Args:
+            path (Path): The path to the annotation file.
+            pages (Dict[int, AnnotationTable]): The annotations of every page, by page number.
+            preprocessing (str): The key of the page preprocessing the pages were OCR-ed after. Defaults to "".
+
+        Returns:
+            AnnotationStore: The store opened on the written file.
+        """
+        page_table = []
+        text_offsets = [0]
+        bboxes = array("f")
+        centers = array("f")
+        texts: List[bytes] = []
+        for page_number in sorted(pages):
+            table = AnnotationTable.from_annotations(pages[page_number])
+            page_table.append((page_number, len(texts), len(table)))
+            for text in table.texts:
+                text = text.encode("utf-8")
+                texts.append(text)
+                text_offsets.append(text_offsets[-1] + len(text))
+            bboxes.fromlist(table.bboxes.tolist())
+            centers.fromlist(table.centers.tolist())
+
+        with atomic_write(path) as temporary_path, open(temporary_path, "wb") as file:
+            file.write(cls._HEADER.pack(cls.MAGIC, cls.VERSION, 0, len(page_table)))
+            key = preprocessing.encode("utf-8")
+            file.write(cls._KEY_SIZE.pack(len(key)))
+            file.write(key.ljust(cls._get_padded_size(len(key)), b"\0"))
+            for page in page_table:
+                file.write(cls._PAGE.pack(*page))
+            file.write(cls._COUNTS.pack(len(texts), text_offsets[-1]))
+            file.write(cls._to_bytes(array("I", text_offsets)))
+            file.write(cls._to_bytes(bboxes))
+            file.write(cls._to_bytes(centers))
+            file.write(b"".join(texts))
+
+        return cls(path=path)
+
+    @classmethod
+    def from_json_directory(cls, annotations_directory: Path, path: Path) -> "AnnotationStore":
+        """
+        Convert the per page JSON annotation files of a document to an annotation file.
+
+        Args:
+            annotations_directory (Path): The directory holding the page_<n>.json annotation files of the document.
+            path (Path): The path to the annotation file to write.
+
+        Returns:
+            AnnotationStore: The store opened on the written file.
+        """
+        pages: Dict[int, AnnotationTable] = {}
+        for annotation_file_path in annotations_directory.glob("page_*.json"):
+            page_number = int(annotation_file_path.stem.split("_")[-1]) - 1
+            with open(annotation_file_path, "r") as j:
+                pages[page_number] = AnnotationTable.from_json(json.load(j))
+        return cls.write(path=path, pages=pages)
+
+    def page_numbers(self) -> List[int]:
+        """
+        Get the page numbers stored in the annotation file.
+
+        Returns:
+            List[int]: The sorted page numbers.
+        """
+        return sorted(self.pages)
+
+    def read_page(self, page_number: int) -> AnnotationTable:
+        """
+        Read the annotations of a page, without copying them out of the memory map.
+
+        The bounding boxes and centers of the table are float32 views of the memory map, and its texts
+        a StoredTexts decoding each text the first time it is read.
+
+        Args:
+            page_number (int): The page number.
+
+        Returns:
+            AnnotationTable: The annotations of the page, in reading order.
+        """
+        start, count = self.pages[page_number]
+        text_offsets = self._text_offsets[start : start + count + 1]
+        return AnnotationTable(
+            texts=StoredTexts(blob=self._text[text_offsets[0] : text_offsets[-1]], offsets=text_offsets),
+            bboxes=self._bboxes[4 * start : 4 * (start + count)],
+            centers=self._centers[2 * start : 2 * (start + count)],
+        )
+
+    @classmethod
+    def _get_padded_size(cls, size: int) -> int:
+        """
+        Get a section size rounded up to 4 bytes, so the sections after it stay aligned.
+        """
+        return (size + 3) // 4 * 4
+
+    def close(self) -> None:
+        """
+        Release the memory map and the underlying file. The memory map of pages still referenced by the
+        tables read from it is unmapped once the last of them is dropped.
+        """
+        for view in ("_text_offsets", "_bboxes", "_centers", "_text", "_buffer"):
+            if isinstance(getattr(self, view, None), memoryview):
+                getattr(self, view).release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # views of the pages read are still alive, they hold the memory map until they are dropped
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self) -> "AnnotationStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
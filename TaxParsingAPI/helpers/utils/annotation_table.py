@@ -0,0 +1,222 @@
+"""
+provides a compact, array backed table of the annotations of a page
+"""
+
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+
+class AnnotationView:
+    """
+    Slotted, read-only view of one row of an AnnotationTable.
+
+    It exposes the same text, bbox and center attributes as Annotation, without copying the row
+    out of the table.
+
+    Attributes:
+        table (AnnotationTable): The table holding the annotation.
+        index (int): The row of the annotation in the table.
+    """
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table: "AnnotationTable", index: int):
+        self.table = table
+        self.index = index
+
+    @property
+    def text(self) -> str:
+        return self.table.texts[self.index]
+
+    @property
+    def bbox(self) -> Tuple[float, float, float, float]:
+        return tuple(self.table.bboxes[4 * self.index : 4 * self.index + 4])
+
+    @property
+    def center(self) -> Tuple[float, float]:
+        return tuple(self.table.centers[2 * self.index : 2 * self.index + 2])
+
+    def __eq__(self, other) -> bool:
+        try:
+            return (
+                self.text == other.text
+                and self.bbox == tuple(other.bbox)
+                and self.center == tuple(other.center)
+            )
+        except AttributeError:
+            return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"AnnotationView(text={self.text!r}, bbox={self.bbox!r}, center={self.center!r})"
+
+
+class AnnotationTable:
+    """
+    Columnar table of the annotations of a page.
+
+    The texts are kept in a list and the bounding boxes and centers in flat arrays of floats, so a
+    page costs a handful of objects instead of one object, and two lists, per annotation. Rows are
+    read through AnnotationView instances created on access. A table read from an annotation file
+    holds float views of its memory map and a sequence decoding its texts on access instead, and is
+    pickled as a copy.
+
+    Attributes:
+        texts (Sequence[str]): The recognized text of every annotation.
+        bboxes (Union[array, memoryview]): The bounding boxes, 4 floats per annotation, (x_min, y_min, x_max, y_max).
+        centers (Union[array, memoryview]): The centers of the bounding boxes, 2 floats per annotation, (x, y).
+
+    Methods:
+        from_annotations(cls, annotations) -> 'AnnotationTable':
+            Build a table from annotation objects.
+
+        from_json(cls, json_annotations) -> 'AnnotationTable':
+            Build a table from the JSON representation of annotations.
+
+        to_json() -> List[Dict]:
+            Get the JSON representation of the annotations.
+
+        bbox(index) -> Tuple[float, float, float, float]:
+            Get the bounding box of an annotation.
+
+        center_y(index) -> float:
+            Get the vertical center of an annotation.
+    """
+
+    __slots__ = ("texts", "bboxes", "centers")
+
+    def __init__(
+        self,
+        texts: Optional[List[str]] = None,
+        bboxes: Optional[array] = None,
+        centers: Optional[array] = None,
+    ):
+        self.texts: List[str] = texts if texts is not None else []
+        self.bboxes: array = bboxes if bboxes is not None else array("d")
+        self.centers: array = centers if centers is not None else array("d")
+
+    @classmethod
+    def from_annotations(cls, annotations: Iterable) -> "AnnotationTable":
+        """
+        Build a table from annotation objects.
+
+        Args:
+            annotations (Iterable): Objects with text, bbox and center attributes, such as Annotation instances.
+
+        Returns:
+            AnnotationTable: The table holding the annotations.
+        """
+        if isinstance(annotations, AnnotationTable):
+            return annotations
+        table = cls()
+        for annotation in annotations:
+            table.texts.append(annotation.text)
+            table.bboxes.extend(annotation.bbox)
+            table.centers.extend(annotation.center)
+        return table
+
+    @classmethod
+    def from_json(cls, json_annotations: List[Dict]) -> "AnnotationTable":
+        """
+        Build a table from the JSON representation of annotations.
+
+        Args:
+            json_annotations (List[Dict]): Dictionaries with "text", "bbox" and "center" keys.
+
+        Returns:
+            AnnotationTable: The table holding the annotations.
+        """
+        table = cls()
+        for item in json_annotations:
+            table.texts.append(item["text"])
+            table.bboxes.extend(item["bbox"])
+            table.centers.extend(item["center"])
+        return table
+
+    def to_json(self) -> List[Dict]:
+        """
+        Get the JSON representation of the annotations.
+
+        Returns:
+            List[Dict]: Dictionaries with "text", "bbox" and "center" keys.
+        """
+        return [
+            {"text": annotation.text, "bbox": list(annotation.bbox), "center": list(annotation.center)}
+            for annotation in self
+        ]
+
+    def bbox(self, index: int) -> Tuple[float, float, float, float]:
+        """
+        Get the bounding box of an annotation.
+
+        Args:
+            index (int): The row of the annotation.
+
+        Returns:
+            Tuple[float, float, float, float]: The bounding box, (x_min, y_min, x_max, y_max).
+        """
+        return tuple(self.bboxes[4 * index : 4 * index + 4])
+
+    def center_y(self, index: int) -> float:
+        """
+        Get the vertical center of an annotation.
+
+        Args:
+            index (int): The row of the annotation.
+
+        Returns:
+            float: The y coordinate of the center of the annotation.
+        """
+        return self.centers[2 * index + 1]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __reduce__(self):
+        # the views of a memory map cannot be pickled, the arrays are copied out of them
+        return (
+            AnnotationTable,
+            (
+                list(self.texts),
+                array(self._get_typecode(self.bboxes), self.bboxes),
+                array(self._get_typecode(self.centers), self.centers),
+            ),
+        )
+
+    @classmethod
+    def _get_typecode(cls, values: Union[array, memoryview]) -> str:
+        return values.typecode if isinstance(values, array) else values.format
+
+    def __iter__(self) -> Iterator[AnnotationView]:
+        for index in range(len(self.texts)):
+            yield AnnotationView(self, index)
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[AnnotationView, "AnnotationTable"]:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self.texts))
+            if step != 1:
+                raise ValueError("AnnotationTable slices must be contiguous")
+            return AnnotationTable(
+                texts=self.texts[start:stop],
+                bboxes=self.bboxes[4 * start : 4 * stop],
+                centers=self.centers[2 * start : 2 * stop],
+            )
+        if key < 0:
+            key += len(self.texts)
+        if not 0 <= key < len(self.texts):
+            raise IndexError("AnnotationTable index out of range")
+        return AnnotationView(self, key)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, AnnotationTable):
+            return (
+                self.texts == other.texts
+                and list(self.bboxes) == list(other.bboxes)
+                and list(self.centers) == list(other.centers)
+            )
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"AnnotationTable({len(self)} annotations)"
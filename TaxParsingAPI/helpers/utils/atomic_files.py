@@ -0,0 +1,132 @@
+"""
+provides atomic file writes and per document advisory locks for the artifacts shared by worker processes
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover, not available on Windows
+    fcntl = None
+
+LOCK_DIRECTORY = "tax-parsing-api-locks"
+TEMPORARY_SUFFIX = ".tmp"
+
+
+def get_lock_path(base_dir: Path, document: str) -> Path:
+    """
+    Get the lock file of a document, in settings.TAX_FORM_LOCK_DIRECTORY or the temporary directory of the host.
+
+    The name holds a digest of base_dir, so the documents of different artifact directories do not share locks.
+
+    Args:
+        base_dir (Path): The directory holding the tax forms and their artifact directories.
+        document (str): The stem of the tax form file.
+
+    Returns:
+        Path: The lock file, "<base_dir digest>-<document>.lock".
+    """
+    lock_directory = Path(
+        getattr(settings, "TAX_FORM_LOCK_DIRECTORY", None) or Path(tempfile.gettempdir()) / LOCK_DIRECTORY
+    )
+    base_dir_digest = hashlib.sha256(str(Path(base_dir).resolve()).encode()).hexdigest()[:16]
+    return lock_directory / f"{base_dir_digest}-{document}.lock"
+
+
+def get_temporary_path(path: Path) -> Path:
+    """
+    Get a hidden, unique path next to a path, to write it under before renaming it into place.
+
+    The temporary path is in the same directory, so the rename stays on one file system and is atomic.
+
+    Args:
+        path (Path): The final path.
+
+    Returns:
+        Path: The temporary path, ".<name>.<unique>.tmp".
+    """
+    return path.parent / f".{path.name}.{uuid.uuid4().hex}{TEMPORARY_SUFFIX}"
+
+
+@contextmanager
+def atomic_write(path: Path) -> Iterator[Path]:
+    """
+    Write a file, or a directory, under a temporary path and rename it to path once written, so readers
+    see either the previous version or the complete new one, never a partial one.
+
+    If the context raises, the temporary path is removed and path is left untouched.
+
+    Args:
+        path (Path): The final path.
+
+    Yields:
+        Path: The temporary path to write to.
+    """
+    temporary_path = get_temporary_path(path)
+    try:
+        yield temporary_path
+        if temporary_path.is_dir():
+            # a directory cannot replace another one, the first writer wins
+            try:
+                temporary_path.rename(path)
+            except OSError:
+                if not path.is_dir():
+                    raise
+        else:
+            os.replace(temporary_path, path)
+    finally:
+        if temporary_path.is_dir():
+            shutil.rmtree(temporary_path, ignore_errors=True)
+        else:
+            temporary_path.unlink(missing_ok=True)
+
+
+@contextmanager
+def document_lock(base_dir: Path, document: str) -> Iterator[None]:
+    """
+    Hold the exclusive advisory lock of a document for the duration of the context.
+
+    The lock is a file of the lock directory, locked with flock, so it is shared by every process and
+    thread of the host, and released by the OS if the holder dies. The holder deletes the file when it
+    releases the lock, so lock files do not pile up, and a process that locked a file deleted meanwhile
+    locks the new one instead. Hold it only while writing or deleting the artifacts of the document.
+    Without fcntl, the context does not lock.
+
+    Args:
+        base_dir (Path): The directory holding the tax forms and their artifact directories.
+        document (str): The stem of the tax form file.
+
+    Yields:
+        None
+    """
+    if fcntl is None:
+        yield
+        return
+
+    lock_path = get_lock_path(base_dir, document)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        lock_file = open(lock_path, "a")
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path)):
+                break
+        except FileNotFoundError:
+            pass
+        # the previous holder deleted the file this process waited on
+        lock_file.close()
+
+    try:
+        yield
+    finally:
+        lock_path.unlink(missing_ok=True)
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        lock_file.close()
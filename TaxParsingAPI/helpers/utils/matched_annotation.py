@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from functools import cached_property
 from typing import Pattern, Match, Optional
 from TaxParsingAPI.helpers.tax_form_helper import OCRPage
 from TaxParsingAPI.helpers.utils.annotation import Annotation
@@ -19,19 +20,19 @@ class MatchedAnnotation(Annotation):
         page_index (int): The index of the page where the annotation was found. Defaults to -1.
         match (Optional[Match]): The match object containing details of the pattern match. Defaults to None.
         pattern (Pattern): The pattern that matched the text. Defaults to an empty string.
-        normalized_text (str): The normalized text with spaces removed. Defaults to an empty string.
+        normalized_text (str): The normalized text with spaces removed, computed on first access.
     """
     page: Optional[OCRPage] = None
     page_index: int = -1
     match: Optional[Match] = None
     pattern: Pattern = "" # pattern that matched
-    normalized_text:str = "" 
-    
-    def __post_init__(self):
+
+    @cached_property
+    def normalized_text(self) -> str:
         """
-        Post-initialization method to normalize the text.
+        The text normalized by _normalize_text, computed only for annotations whose value is read.
         """
-        self.normalized_text = self._normalize_text()
+        return self._normalize_text()
     
     def _normalize_text(self)->str:
         """
@@ -60,7 +61,7 @@ class MatchedAnnotation(Annotation):
             page_index (int): The index of the page where the annotation was found.
             match (Match): The match object containing details of the pattern match.
             pattern (str): The pattern that matched the text.
-            annotation (Annotation): The original Annotation instance.
+            annotation (Annotation): The original Annotation instance, or a row view of an AnnotationTable.
 
         Returns:
             MatchedAnnotation: A new MatchedAnnotation instance with the combined details.
@@ -1,8 +1,12 @@
+from concurrent.futures import Executor
 from dataclasses import dataclass, field
-from ocrmac.ocrmac import OCR
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
+from django.conf import settings
+from PIL import Image as PILImage
 from PIL.Image import Image
 from typing import  List
+from TaxParsingAPI.helpers.executor import get_thread_executor
+from TaxParsingAPI.helpers.ocr_engine import OcrEnginePool, get_ocr_engine_pool
 from TaxParsingAPI.helpers.utils.annotation import Annotation
 
 @dataclass()
@@ -10,18 +14,31 @@ class OcrWrapper:
     """
     Wrapper class for handling OCR processing on images.
 
-    This class uses the OCR class to perform OCR on the provided image and stores the 
-    resulting annotations. It initializes the OCR object and processes the annotations 
-    to set their bounding boxes and centers.
+    This class uses an OCR engine of the process wide OcrEnginePool to perform OCR on the provided
+    image and stores the resulting annotations. It processes the annotations to set their
+    bounding boxes and centers.
+
+    With a strip_height, a taller page is split into horizontal strips of that height, each
+    extended by strip_overlap pixels above and below, which are OCR-ed concurrently on a thread
+    pool. An annotation is kept from the strip whose own rows, without the overlaps, hold its
+    center, so a line recognized in two strips is kept once, and a line cut by the edge of a
+    strip is kept from the strip holding it whole, as long as lines are no taller than strip_overlap.
 
     Attributes:
         image (Union[Image, str]): The image or the path to the image on which OCR is performed.
-        ocr_mac (OCR): The OCR object that performs the recognition. Defaults to None.
         annotations (List[Annotation]): A list of Annotation objects containing OCR data.
+        strip_height (Optional[int]): The height in pixels of the strips the page is split into, None OCRs
+                                      the page whole. Defaults to None.
+        strip_overlap (int): The pixels each strip extends into its neighbours. Defaults to 100.
+        executor (Optional[Executor]): The pool the strips are OCR-ed on. Defaults to the process wide thread pool.
+        engine_pool (Optional[OcrEnginePool]): The engines performing the recognition. Defaults to the process wide pool.
 
     Methods:
         __post_init__():
-            Initializes the OCR object and sets the annotations.
+            Performs OCR on the image and sets the annotations.
+
+        from_settings(cls, image) -> 'OcrWrapper':
+            Perform OCR on an image, in strips as configured by settings.OCR_STRIP_HEIGHT.
         
         _set_annotation(cls, annotations):
             Converts raw OCR output into a list of Annotation objects.
@@ -30,23 +47,124 @@ class OcrWrapper:
             Calculates the center coordinates of a bounding box.
     """
     image: Union[Image, str]
-    ocr_mac: OCR = None
     annotations: List[Annotation] = field(
         default_factory=list
     )
+    strip_height: Optional[int] = None
+    strip_overlap: int = 100
+    executor: Optional[Executor] = None
+    engine_pool: Optional[OcrEnginePool] = None
 
     def __post_init__(self):
         """
-        Initialize the OCR object and set the annotations.
+        Perform OCR on the image and set the annotations.
 
-        This method initializes the OCR object with the provided image and sets the annotations
-        by processing the output from the OCR recognition.
+        This method hands the image to an engine of engine_pool and sets the annotations by
+        processing the output from the OCR recognition. A page taller than a strip and its
+        overlap is OCR-ed in strips instead.
         """
-        self.ocr_mac = OCR(image=self.image)
-        self.annotations = self._set_annotation(
-            annotations=self.ocr_mac.recognize(px=True)
-        )        
-     
+        if self.engine_pool is None:
+            self.engine_pool = get_ocr_engine_pool()
+
+        image = self.image if isinstance(self.image, Image) else PILImage.open(self.image)
+        try:
+            if self.strip_height and image.height > self.strip_height + self.strip_overlap:
+                raw_annotations = self._recognize_strips(image)
+            else:
+                raw_annotations = self.engine_pool.recognize(image)
+        finally:
+            if image is not self.image:
+                image.close()
+        self.annotations = self._set_annotation(annotations=raw_annotations)
+
+    @classmethod
+    def from_settings(cls, image: Union[Image, str]) -> "OcrWrapper":
+        """
+        Perform OCR on an image, in strips as configured by settings.OCR_STRIP_HEIGHT and settings.OCR_STRIP_OVERLAP.
+
+        Args:
+            image (Union[Image, str]): The image or the path to the image on which OCR is performed.
+
+        Returns:
+            OcrWrapper: The wrapper holding the annotations of the image.
+        """
+        return cls(
+            image=image,
+            strip_height=getattr(settings, "OCR_STRIP_HEIGHT", None),
+            strip_overlap=getattr(settings, "OCR_STRIP_OVERLAP", cls.strip_overlap),
+        )
+
+    def _get_strips(self, height: int) -> List[Tuple[int, int, int, int]]:
+        """
+        Split the rows of a page into strips.
+
+        Returns:
+            List[Tuple[int, int, int, int]]: The (top, bottom) rows OCR-ed and the (own_top, own_bottom) rows
+                                             owned by every strip, bottoms excluded.
+        """
+        strips = []
+        for own_top in range(0, height, self.strip_height):
+            own_bottom = min(own_top + self.strip_height, height)
+            strips.append(
+                (
+                    max(own_top - self.strip_overlap, 0),
+                    min(own_bottom + self.strip_overlap, height),
+                    own_top,
+                    own_bottom,
+                )
+            )
+        return strips
+
+    def _recognize_strips(self, image: Image) -> List[Tuple[str, float, Tuple[float, float, float, float]]]:
+        """
+        OCR the strips of a page concurrently and merge their annotations back into page coordinates.
+
+        Returns:
+            List[Tuple[str, float, Tuple[float, float, float, float]]]: The raw (text, confidence, bbox)
+                                                                         annotations of the page, in strip order.
+        """
+        strips = self._get_strips(image.height)
+        executor = self.executor or get_thread_executor()
+        futures = [
+            executor.submit(self._recognize_strip, image.crop((0, top, image.width, bottom)), top)
+            for top, bottom, _, _ in strips
+        ]
+
+        merged: List[Tuple[str, float, Tuple[float, float, float, float]]] = []
+        for future, (_, _, own_top, own_bottom) in zip(futures, strips):
+            for text, confidence, bbox in future.result():
+                if not own_top <= (bbox[1] + bbox[3]) / 2 < own_bottom:
+                    continue
+                if any(text == kept_text and self._get_overlap(bbox, kept_bbox) > 0.5 for kept_text, _, kept_bbox in merged):
+                    continue
+                merged.append((text, confidence, bbox))
+        return merged
+
+    def _recognize_strip(self, strip: Image, top: int) -> List[Tuple[str, float, Tuple[float, float, float, float]]]:
+        """
+        OCR a strip and shift its bounding boxes down by top, into page coordinates.
+        """
+        return [
+            (text, confidence, (x1, y1 + top, x2, y2 + top))
+            for text, confidence, (x1, y1, x2, y2) in self.engine_pool.recognize(strip)
+        ]
+
+    @classmethod
+    def _get_overlap(cls, box, other_box) -> float:
+        """
+        Get the intersection over union of two bounding boxes.
+        """
+        width = min(box[2], other_box[2]) - max(box[0], other_box[0])
+        height = min(box[3], other_box[3]) - max(box[1], other_box[1])
+        if width <= 0 or height <= 0:
+            return 0.0
+        intersection = width * height
+        union = (
+            (box[2] - box[0]) * (box[3] - box[1])
+            + (other_box[2] - other_box[0]) * (other_box[3] - other_box[1])
+            - intersection
+        )
+        return intersection / union if union > 0 else 0.0
 
     @classmethod
     def _set_annotation(cls, annotations)->List[Annotation]:
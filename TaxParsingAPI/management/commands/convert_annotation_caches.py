@@ -0,0 +1,62 @@
+from pathlib import Path
+import shutil
+from django.core.management.base import BaseCommand, CommandError
+from TaxParsingAPI.models import UPLOAD_TO
+from TaxParsingAPI.helpers.utils.annotation_store import AnnotationStore
+from HolistiplanTakeHome.settings import MEDIA_ROOT
+
+
+class Command(BaseCommand):
+    """
+    Convert the legacy per page JSON annotation caches to one annotation file per document.
+
+    Documents that already have an annotation file are skipped, so the command can be re-run safely.
+
+    Example:
+        python manage.py convert_annotation_caches --delete-json
+    """
+
+    help = "Convert the per page JSON annotation caches of every tax form to compact annotation files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--base-dir",
+            type=Path,
+            default=MEDIA_ROOT / UPLOAD_TO,
+            help="Directory holding the tax forms and their annotations directory.",
+        )
+        parser.add_argument(
+            "--delete-json", action="store_true", help="Delete the JSON annotations once converted."
+        )
+
+    def handle(self, *args, **options):
+        annotations_base_directory: Path = options["base_dir"] / "annotations"
+        if not annotations_base_directory.is_dir():
+            raise CommandError(f"{annotations_base_directory} is not a directory.")
+
+        converted = 0
+        json_size = 0
+        store_size = 0
+        for annotations_directory in sorted(annotations_base_directory.iterdir()):
+            json_file_paths = list(annotations_directory.glob("page_*.json"))
+            if not annotations_directory.is_dir() or not json_file_paths:
+                continue
+
+            store_path = annotations_base_directory / f"{annotations_directory.name}{AnnotationStore.SUFFIX}"
+            if not store_path.exists():
+                AnnotationStore.from_json_directory(
+                    annotations_directory=annotations_directory, path=store_path
+                ).close()
+                converted += 1
+                json_size += sum(path.stat().st_size for path in json_file_paths)
+                store_size += store_path.stat().st_size
+
+            if options["delete_json"]:
+                shutil.rmtree(annotations_directory)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Converted {converted} annotation caches, {json_size / 1024:.1f} KiB of JSON "
+                f"to {store_size / 1024:.1f} KiB."
+            )
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from TaxParsingAPI.helpers.export_helper import TaxFormExporter
+
+
+class Command(BaseCommand):
+    """
+    Stream every tax form and its tax fields as NDJSON or CSV.
+
+    Example:
+        python manage.py export_tax_forms --format csv --output tax_forms.csv
+    """
+
+    help = "Stream every parsed tax form and its tax fields as NDJSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+        parser.add_argument("--output", help="File to write to. Defaults to stdout.")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        exporter = TaxFormExporter(chunk_size=options["chunk_size"])
+        lines = exporter.iter_csv() if options["format"] == "csv" else exporter.iter_ndjson()
+
+        if options["output"]:
+            with open(options["output"], "w", newline="") as file:
+                file.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from TaxParsingAPI.helpers.artifact_helper import ArtifactManager
+
+
+class Command(BaseCommand):
+    """
+    Delete the preprocessing artifacts of deleted tax forms, and evict the least recently used
+    regenerable artifacts over the disk budget.
+
+    Example:
+        python manage.py gc_tax_form_artifacts --max-bytes 5000000000 --dry-run
+    """
+
+    help = "Garbage collect the images, annotations and overlays written while preprocessing tax forms."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-bytes", type=int, help="Disk budget. Defaults to settings.TAX_FORM_ARTIFACTS_MAX_BYTES.")
+        parser.add_argument("--min-age", type=float, help="Seconds a recently used artifact is left alone.")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted without deleting it.")
+
+    def handle(self, *args, **options):
+        manager = ArtifactManager.from_settings()
+        if options["max_bytes"] is not None:
+            manager.max_bytes = options["max_bytes"]
+        if options["min_age"] is not None:
+            manager.min_age = options["min_age"]
+
+        summary = manager.collect_garbage(dry_run=options["dry_run"])
+
+        prefix = "Would free" if options["dry_run"] else "Freed"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefix} {summary['freed_bytes'] / 1024 ** 2:.1f} MiB: {summary['released']} deleted tax forms, "
+                f"{summary['evicted']} evicted artifacts. {summary['remaining_bytes'] / 1024 ** 2:.1f} MiB remaining."
+            )
+        )
@@ -0,0 +1,194 @@
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+import time
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from TaxParsingAPI.models import TaxForm
+from TaxParsingAPI.parse.tax_parser import parse_tax_form
+from TaxParsingAPI.serializers import get_default_tax_fields
+from TaxParsingAPI.helpers.checkpoint_helper import (
+    TaxFormCheckpoint,
+    get_requested_tax_fields,
+    persist_parsed_tax_forms,
+)
+from TaxParsingAPI.helpers.executor import get_worker_count, submit_to_executor
+
+
+class Command(BaseCommand):
+    """
+    Ingest every PDF tax form found under a directory.
+
+    Tax forms are preprocessed and parsed on the shared worker pool and written in batched
+    transactions. After each transaction commits, the ingested files are appended to a
+    checkpoint file, so an interrupted run resumes with the files it had not written yet.
+    Every file is received as a TaxForm before it is parsed and its stages are checkpointed,
+    so a file interrupted mid-way resumes after its last completed stage instead of restarting.
+
+    Example:
+        python manage.py ingest_tax_forms /archives/2023 --batch-size 50
+    """
+
+    help = "Ingest every PDF tax form found under a directory, resuming from the last checkpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", type=Path)
+        parser.add_argument("--batch-size", type=int, default=20, help="Tax forms written per transaction.")
+        parser.add_argument(
+            "--checkpoint",
+            type=Path,
+            help="File recording the ingested files. Defaults to <directory>/.ingest_checkpoint.",
+        )
+        parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and ingest every file.")
+
+    def handle(self, *args, **options):
+        directory: Path = options["directory"].resolve()
+        if not directory.is_dir():
+            raise CommandError(f"{directory} is not a directory.")
+
+        checkpoint_path: Path = options["checkpoint"] or directory / ".ingest_checkpoint"
+        if options["restart"] and checkpoint_path.exists():
+            checkpoint_path.unlink()
+        ingested = self._read_checkpoint(checkpoint_path)
+
+        source_paths = sorted(
+            path for path in directory.rglob("*") if path.is_file() and path.suffix.lower() == ".pdf"
+        )
+        pending = [path for path in source_paths if str(path.relative_to(directory)) not in ingested]
+        self.stdout.write(
+            f"Found {len(source_paths)} tax forms, {len(source_paths) - len(pending)} already ingested."
+        )
+
+        self.directory = directory
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = options["batch_size"]
+        self.total = len(pending)
+        self.forms_done = 0
+        self.pages_done = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+
+        self._ingest(pending)
+
+        self.stdout.write(self.style.SUCCESS(f"Done. {self._progress()}"))
+
+    def _ingest(self, pending: List[Path]) -> None:
+        """
+        Keep the worker pool busy with a bounded window of files and write the results in batches.
+
+        Args:
+            pending (List[Path]): The files that still need to be ingested.
+        """
+        tax_fields = get_default_tax_fields()
+        max_in_flight = get_worker_count() * 2
+
+        queue = list(reversed(pending))
+        in_flight: Dict[Future, TaxForm] = {}
+        parsed: List[Tuple[TaxForm, Dict]] = []
+
+        while queue or in_flight:
+            while queue and len(in_flight) < max_in_flight:
+                tax_form = self._receive(queue.pop(), tax_fields)
+                parsed_checkpoint = tax_form.checkpoints.get(TaxForm.PARSED)
+                if tax_form.has_reached(TaxForm.PARSED) and parsed_checkpoint is not None:
+                    parsed.append((tax_form, parsed_checkpoint))
+                    continue
+                future = submit_to_executor(
+                    parse_tax_form, Path(tax_form.tax_form.path), None, get_requested_tax_fields(tax_form)
+                )
+                in_flight[future] = tax_form
+
+            if in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tax_form = in_flight.pop(future)
+                    try:
+                        parsed.append((tax_form, future.result()))
+                    except Exception as error:
+                        TaxFormCheckpoint(tax_form.id).record_error(error)
+                        self.failed += 1
+                        self.stderr.write(f"Failed to ingest {self._get_source(tax_form)}: {error}")
+
+            if len(parsed) >= self.batch_size or (parsed and not queue and not in_flight):
+                self._write_batch(parsed)
+                parsed = []
+
+    def _receive(self, source_path: Path, tax_fields: List[Dict]) -> TaxForm:
+        """
+        Get the TaxForm of a file received by an interrupted run, or receive the file as a new one.
+
+        Args:
+            source_path (Path): The path of the tax form PDF to ingest.
+            tax_fields (List[Dict]): The tax fields to extract, each a dictionary with a "tax_field" key.
+
+        Returns:
+            TaxForm: The tax form, with the stages it already completed.
+        """
+        tax_form = (
+            TaxForm.objects.exclude(stage=TaxForm.PERSISTED)
+            .filter(checkpoints__received__source=str(source_path))
+            .order_by("-uploaded_at")
+            .first()
+        )
+        if tax_form is not None:
+            return tax_form
+        with open(source_path, "rb") as file:
+            return TaxFormCheckpoint.receive(File(file, name=source_path.name), tax_fields, source=str(source_path))
+
+    def _write_batch(self, parsed: List[Tuple[TaxForm, Dict]]) -> None:
+        """
+        Write a batch of parsed tax forms in one transaction, then checkpoint them.
+
+        Args:
+            parsed (List[Tuple[TaxForm, Dict]]): Every tax form and its parse result, or its parsed checkpoint.
+        """
+        persist_parsed_tax_forms(parsed)
+
+        with open(self.checkpoint_path, "a") as checkpoint:
+            for tax_form, _ in parsed:
+                checkpoint.write(f"{Path(self._get_source(tax_form)).relative_to(self.directory)}\n")
+
+        self.forms_done += len(parsed)
+        self.pages_done += sum(result.get("page_count", 0) for _, result in parsed)
+        self.stdout.write(self._progress())
+
+    @classmethod
+    def _get_source(cls, tax_form: TaxForm) -> str:
+        """
+        Get the path of the file a tax form was ingested from.
+
+        Args:
+            tax_form (TaxForm): The tax form.
+
+        Returns:
+            str: The path of the ingested file.
+        """
+        return tax_form.checkpoints[TaxForm.RECEIVED]["source"]
+
+    def _progress(self) -> str:
+        """
+        Describe the progress and throughput of the run.
+
+        Returns:
+            str: The progress line.
+        """
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return (
+            f"Ingested {self.forms_done}/{self.total} tax forms ({self.failed} failed) | "
+            f"{self.forms_done / elapsed:.2f} forms/sec | {self.pages_done / elapsed:.2f} pages/sec"
+        )
+
+    @classmethod
+    def _read_checkpoint(cls, checkpoint_path: Path) -> Set[str]:
+        """
+        Read the files recorded as ingested by previous runs.
+
+        Args:
+            checkpoint_path (Path): The checkpoint file.
+
+        Returns:
+            Set[str]: The ingested files, relative to the ingested directory.
+        """
+        if not checkpoint_path.exists():
+            return set()
+        return {line.strip() for line in checkpoint_path.read_text().splitlines() if line.strip()}
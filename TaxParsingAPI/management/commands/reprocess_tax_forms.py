@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from TaxParsingAPI.helpers.reprocess_helper import TaxFormReprocessor
+
+
+class Command(BaseCommand):
+    """
+    Re-parse the tax forms extracted by a previous parser version from their saved annotations.
+
+    Example:
+        python manage.py reprocess_tax_forms --chunk-size 200
+    """
+
+    help = "Re-parse stale tax forms from their saved annotations, without OCR-ing them again."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=100, help="Tax forms updated per transaction.")
+        parser.add_argument("--all", action="store_true", help="Re-parse tax forms that are already current too.")
+
+    def handle(self, *args, **options):
+        reprocessor = TaxFormReprocessor(chunk_size=options["chunk_size"], include_current=options["all"])
+        self.stdout.write(f"Re-parsing with parser version {reprocessor.parser_version}.")
+
+        reprocessed = reprocessor.run()
+
+        for tax_form_id, error in reprocessor.errors.items():
+            self.stderr.write(f"Failed to re-parse {tax_form_id}: {error}")
+        self.stdout.write(
+            self.style.SUCCESS(f"Re-parsed {reprocessed} tax forms, {len(reprocessor.errors)} failed.")
+        )
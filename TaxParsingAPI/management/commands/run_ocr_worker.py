@@ -0,0 +1,118 @@
+from typing import List
+import os
+import socket
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from TaxParsingAPI.models import OcrTask
+from TaxParsingAPI.helpers.executor import get_worker_count, submit_to_executor
+from TaxParsingAPI.helpers.ocr_task_queue import OcrTaskQueue, ocr_task_image
+
+
+class Command(BaseCommand):
+    """
+    Claim page OCR tasks from the OcrTask queue and OCR them, until stopped.
+
+    Any number of workers can run on any number of nodes sharing the database and MEDIA_ROOT. A
+    worker leases up to --batch-size tasks at a time, OCRs them on the worker pool of its node,
+    renews the leases while it works and writes the annotations back to the task directory. The
+    tasks of a worker that dies are queued again once their leases expire, and the stale tasks
+    left by a producer that died are purged with their files.
+
+    Example:
+        python manage.py run_ocr_worker --batch-size 8
+    """
+
+    help = "Claim page OCR tasks queued in the database and OCR them on this node."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--worker-id", help="Name of the worker holding the leases. Defaults to <host>:<pid>."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, help="Tasks leased at a time. Defaults to the number of workers of the pool."
+        )
+        parser.add_argument(
+            "--in-process", action="store_true", help="OCR the tasks in this process instead of on the worker pool."
+        )
+        parser.add_argument("--once", action="store_true", help="Exit once no task is left to claim.")
+
+    def handle(self, *args, **options):
+        self.queue = OcrTaskQueue.from_settings()
+        self.worker = options["worker_id"] or f"{socket.gethostname()}:{os.getpid()}"
+        self.in_process = options["in_process"]
+        batch_size = options["batch_size"] or get_worker_count()
+        self.done = 0
+        self.failed = 0
+
+        self.stdout.write(f"OCR worker {self.worker} claiming up to {batch_size} tasks at a time.")
+        next_purge = 0.0
+        while True:
+            close_old_connections()
+            self.queue.requeue_expired()
+            if time.monotonic() >= next_purge:
+                self.queue.purge()
+                next_purge = time.monotonic() + self.queue.lease_seconds
+            tasks = self.queue.claim(self.worker, limit=batch_size)
+            if not tasks:
+                if options["once"]:
+                    break
+                time.sleep(self.queue.poll_interval)
+                continue
+            self._run(tasks)
+
+        self.stdout.write(self.style.SUCCESS(f"Done. OCR-ed {self.done} pages ({self.failed} failed)."))
+
+    def _run(self, tasks: List[OcrTask]) -> None:
+        """
+        OCR leased tasks and write their annotations back, renewing the leases until every task is done.
+
+        Args:
+            tasks (List[OcrTask]): The leased tasks.
+        """
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(tasks, stop), name="ocr-lease-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            image_paths = [self.queue.directory / task.image for task in tasks]
+            if self.in_process:
+                results = [self._call(ocr_task_image, image_path) for image_path in image_paths]
+            else:
+                futures = [submit_to_executor(ocr_task_image, image_path) for image_path in image_paths]
+                results = [self._call(future.result) for future in futures]
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        for task, (annotations, error) in zip(tasks, results):
+            if error is None and self.queue.complete(task, annotations):
+                self.done += 1
+            elif error is not None:
+                self.failed += 1
+                self.stderr.write(f"Failed to OCR page {task.page_number} of {task.document}: {error}")
+                self.queue.fail(task, error)
+
+    def _heartbeat(self, tasks: List[OcrTask], stop: threading.Event) -> None:
+        """
+        Renew the leases of tasks every third of the lease, until stop is set.
+
+        Args:
+            tasks (List[OcrTask]): The leased tasks.
+            stop (threading.Event): Set once the tasks are OCR-ed.
+        """
+        try:
+            while not stop.wait(self.queue.lease_seconds / 3):
+                self.queue.heartbeat(tasks)
+        finally:
+            connection.close()
+
+    @classmethod
+    def _call(cls, function, *args):
+        """
+        Call a function, returning its result and None, or None and the exception it raised.
+        """
+        try:
+            return function(*args), None
+        except Exception as error:
+            return None, error
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-19 05:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TaxParsingAPI', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taxform',
+            name='parser_version',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.13 on 2026-10-19 05:38
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TaxParsingAPI', '0002_taxform_parser_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcrTask',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('document', models.CharField(blank=True, default='', max_length=255)),
+                ('page_number', models.IntegerField(default=0)),
+                ('image', models.CharField(max_length=255)),
+                ('result', models.CharField(blank=True, default='', max_length=255)),
+                ('priority', models.PositiveSmallIntegerField(default=0)),
+                ('tenant', models.CharField(blank=True, default='', max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('leased', 'Leased'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('leased_by', models.CharField(blank=True, default='', max_length=255)),
+                ('lease_token', models.UUIDField(blank=True, null=True)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'priority', 'created_at'], name='TaxParsingA_status_c94e68_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.13 on 2026-10-19 05:45
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TaxParsingAPI', '0003_ocrtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taxform',
+            name='checkpoints',
+            field=models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.AddField(
+            model_name='taxform',
+            name='stage',
+            field=models.CharField(choices=[('received', 'Received'), ('rasterized', 'Rasterized'), ('ocr_done', 'OCR Done'), ('parsed', 'Parsed'), ('persisted', 'Persisted')], default='persisted', max_length=16),
+        ),
+    ]
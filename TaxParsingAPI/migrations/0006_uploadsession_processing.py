@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-19 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('TaxParsingAPI', '0005_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='status',
+            field=models.CharField(choices=[('open', 'Open'), ('stored', 'Stored'), ('processing', 'Processing'), ('finalized', 'Finalized')], default='open', max_length=16),
+        ),
+    ]
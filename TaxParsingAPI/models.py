@@ -1,3 +1,4 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from typing import Optional
 import uuid
@@ -11,13 +12,30 @@ class TaxForm(models.Model):
     to retrieve associated tax fields and calculate the amount to be paid or overpaid.
 
     Attributes:
+        RECEIVED (str): Constant for a tax form whose file was saved.
+        RASTERIZED (str): Constant for a tax form whose pages were rasterized.
+        OCR_DONE (str): Constant for a tax form whose pages were all OCR-ed.
+        PARSED (str): Constant for a tax form whose tax fields were extracted.
+        PERSISTED (str): Constant for a tax form whose tax fields were saved.
+
+        STAGES (list): The pipeline stages, in order.
+        STAGE_CHOICES (list): List of tuples containing stage choices and their descriptions.
+
         id (UUIDField): The unique identifier for each tax form, generated automatically.
         tax_form (FileField): The file field for uploading the tax form.
         uploaded_at (DateTimeField): The timestamp when the tax form was uploaded, set automatically.
+        parser_version (CharField): The version of the TaxParser that extracted the tax fields, blank if unknown.
+        stage (CharField): The last pipeline stage completed, with choices from STAGE_CHOICES.
+        checkpoints (JSONField): The state of every completed stage, by stage, with the "artifacts" it produced,
+                                 so a retry resumes after the last completed stage. The "ocr_done" stage lists
+                                 the OCR-ed "pages" as they are saved, and the "parsed" stage the extracted "tax_fields".
 
     Methods:
         __str__():
             Returns a string representation of the tax form file name.
+
+        has_reached(stage) -> bool:
+            Checks if a pipeline stage was completed.
         
         get_all_tax_fields():
             Retrieves all associated tax fields for the tax form.
@@ -30,12 +48,33 @@ class TaxForm(models.Model):
             Calculates the amount to be paid or overpaid based on the tax fields.
             Returns a negative amount if there is an amount owed, or a positive amount if there is an overpayment.
     """
+    RECEIVED = "received"
+    RASTERIZED = "rasterized"
+    OCR_DONE = "ocr_done"
+    PARSED = "parsed"
+    PERSISTED = "persisted"
+
+    STAGES = [RECEIVED, RASTERIZED, OCR_DONE, PARSED, PERSISTED]
+    STAGE_CHOICES = [
+        (RECEIVED, "Received"),
+        (RASTERIZED, "Rasterized"),
+        (OCR_DONE, "OCR Done"),
+        (PARSED, "Parsed"),
+        (PERSISTED, "Persisted"),
+    ]
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     tax_form = models.FileField(upload_to=UPLOAD_TO)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    parser_version = models.CharField(max_length=64, blank=True, default="")
+    # tax forms created in one go, by the API, are persisted as soon as they exist
+    stage = models.CharField(max_length=16, choices=STAGE_CHOICES, default=PERSISTED)
+    checkpoints = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
     
     def __str__(self):
         return f"{self.tax_form}"
+
+    def has_reached(self, stage: str) -> bool:
+        return self.STAGES.index(self.stage) >= self.STAGES.index(stage)
     
     def get_all_tax_fields(self):
         return self.tax_fields.all()
@@ -47,20 +86,38 @@ class TaxForm(models.Model):
             return None
     @property
     def pay_this_amount(self) -> int:
-        
+
         amount_owed_field = self.get_tax_field(TaxField.AMOUNT_OWED)
-        if amount_owed_field is not None:
-            amount_owed:int = int(amount_owed_field.value_in_numeric)
+        overpaid_field = self.get_tax_field(TaxField.OVERPAID)
+
+        return self.calculate_pay_this_amount(
+            amount_owed=amount_owed_field.value_in_numeric if amount_owed_field is not None else None,
+            overpaid=overpaid_field.value_in_numeric if overpaid_field is not None else None,
+        )
+
+    @classmethod
+    def calculate_pay_this_amount(cls, amount_owed=None, overpaid=None) -> int:
+        """
+        Calculate the amount to be paid or overpaid from already loaded field values.
+
+        Args:
+            amount_owed (Optional[Decimal]): The numeric value of the amount owed field, if any.
+            overpaid (Optional[Decimal]): The numeric value of the overpaid field, if any.
+
+        Returns:
+            int: A negative amount if there is an amount owed, a positive amount if there is an overpayment, else 0.
+        """
+        if amount_owed is not None:
+            amount_owed:int = int(amount_owed)
             if amount_owed>0:
                 return -amount_owed
-        
-        overpaid_field = self.get_tax_field(TaxField.OVERPAID)
-        if overpaid_field is not None:
-            overpaid:int = int(overpaid_field.value_in_numeric)
+
+        if overpaid is not None:
+            overpaid:int = int(overpaid)
             if overpaid>0:
                 return overpaid
-                
-        
+
+
         return 0  # or None, depending on your requirement
 
 class TaxField(models.Model):
@@ -140,3 +197,142 @@ class TaxField(models.Model):
     page_number = models.IntegerField(default=-1)
     
 
+
+
+class OcrTask(models.Model):
+    """
+    Model representing the OCR of a page, queued for any `run_ocr_worker` process to claim.
+
+    The page image and the annotations are files of the shared artifact store, the task only
+    names them. A worker claims a task by leasing it for a while, renews the lease while it
+    works, and writes the annotations back before marking the task done. A task whose lease
+    expires, because its worker died or lost its node, is queued again for another worker.
+
+    Attributes:
+        PENDING (str): Constant for a task waiting for a worker.
+        LEASED (str): Constant for a task held by a worker.
+        DONE (str): Constant for a task whose annotations were written.
+        FAILED (str): Constant for a task that failed max attempts times.
+
+        STATUS_CHOICES (list): List of tuples containing status choices and their descriptions.
+
+        id (UUIDField): The unique identifier for each task, generated automatically.
+        document (CharField): The file name of the tax form the page belongs to.
+        page_number (IntegerField): The page number of the page in the tax form.
+        image (CharField): The file name of the page image in the task directory.
+        result (CharField): The file name of the annotation file in the task directory, blank until done.
+        priority (PositiveSmallIntegerField): The rank of the priority class of the page, lower is claimed first.
+        tenant (CharField): The user or firm the page is OCR-ed for.
+        status (CharField): The status of the task, with choices from STATUS_CHOICES.
+        leased_by (CharField): The worker holding the lease, blank if not leased.
+        lease_token (UUIDField): Identifies the current lease, so a worker whose lease expired cannot complete the task.
+        lease_expires_at (DateTimeField): When the lease expires if it is not renewed.
+        attempts (PositiveIntegerField): The number of times the task was leased.
+        error (TextField): The error of the last failed attempt.
+        created_at (DateTimeField): The timestamp when the task was queued, set automatically.
+        updated_at (DateTimeField): The timestamp of the last change of the task, set automatically.
+    """
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (LEASED, "Leased"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    document = models.CharField(max_length=255, blank=True, default="")
+    page_number = models.IntegerField(default=0)
+    image = models.CharField(max_length=255)
+    result = models.CharField(max_length=255, blank=True, default="")
+    priority = models.PositiveSmallIntegerField(default=0)
+    tenant = models.CharField(max_length=64, blank=True, default="")
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    leased_by = models.CharField(max_length=255, blank=True, default="")
+    lease_token = models.UUIDField(null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "priority", "created_at"])]
+
+    def __str__(self):
+        return f"{self.document} page {self.page_number} ({self.status})"
+
+
+class UploadSession(models.Model):
+    """
+    Model representing a resumable upload of a tax form, sent in byte ranges over several requests.
+
+    The received bytes are written to the part file of the session, named after its id, and offset
+    counts the bytes received from the start of the file without a gap, so a client that lost its
+    connection asks for the offset and sends the rest. Once every byte is received, the file is
+    verified against the sha256 the client declared, moved to the tax form storage and processed
+    like a single upload, by one request at a time.
+
+    Attributes:
+        OPEN (str): Constant for a session receiving bytes.
+        STORED (str): Constant for a session whose file was verified and moved to the tax form storage.
+        PROCESSING (str): Constant for a session whose stored file is being processed by a finalize request.
+        FINALIZED (str): Constant for a session whose tax form was created.
+
+        STATUS_CHOICES (list): List of tuples containing status choices and their descriptions.
+
+        id (UUIDField): The unique identifier for each session, generated automatically.
+        file_name (CharField): The name of the uploaded file.
+        size (PositiveBigIntegerField): The size of the file in bytes, declared when the session is created.
+        sha256 (CharField): The hex sha256 digest of the file, declared when the session is created.
+        offset (PositiveBigIntegerField): The bytes received from the start of the file without a gap.
+        tax_fields (JSONField): The tax fields to extract, each a dictionary with a "tax_field" key, every one if empty.
+        tenant (CharField): The user or firm the session belongs to.
+        status (CharField): The status of the session, with choices from STATUS_CHOICES.
+        stored_name (CharField): The storage name of the file once moved to the tax form storage.
+        tax_form (ForeignKey): The tax form created from the file, once finalized.
+        created_at (DateTimeField): The timestamp when the session was created, set automatically.
+        updated_at (DateTimeField): The timestamp of the last change of the session, set automatically.
+        expires_at (DateTimeField): When an unfinished session and its part file are deleted, pushed back by every range.
+
+    Methods:
+        is_complete() -> bool:
+            Checks if every byte of the file was received.
+    """
+    OPEN = "open"
+    STORED = "stored"
+    PROCESSING = "processing"
+    FINALIZED = "finalized"
+
+    STATUS_CHOICES = [
+        (OPEN, "Open"),
+        (STORED, "Stored"),
+        (PROCESSING, "Processing"),
+        (FINALIZED, "Finalized"),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    file_name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    offset = models.PositiveBigIntegerField(default=0)
+    tax_fields = models.JSONField(default=list, blank=True)
+    tenant = models.CharField(max_length=64, blank=True, default="")
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=OPEN)
+    stored_name = models.CharField(max_length=255, blank=True, default="")
+    tax_form = models.ForeignKey(TaxForm, null=True, blank=True, related_name="+", on_delete=models.SET_NULL)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.file_name} {self.offset}/{self.size} ({self.status})"
+
+    def is_complete(self) -> bool:
+        return self.offset >= self.size
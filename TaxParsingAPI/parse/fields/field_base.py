@@ -4,9 +4,10 @@ provides common functionalities among fields
 
 from dataclasses import dataclass, field
 from TaxParsingAPI.helpers.tax_form_helper import PreprocessTaxForm, OCRPage
+from TaxParsingAPI.helpers.page_classifier import FORM_1040_PAGE_1, FORM_1040_PAGE_2
 import regex as re
 from typing import List, Pattern, Dict, Optional, ClassVar
-from TaxParsingAPI.helpers.utils.annotation import Annotation
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
 from TaxParsingAPI.helpers.utils.matched_annotation import MatchedAnnotation
 
 
@@ -25,6 +26,8 @@ class FieldBase:
         value_ocr (MatchedAnnotation): The OCR data for the value text (value of corresponding tax field instruction).
         statement_patterns (ClassVar[List[Pattern]]): The list of regex patterns (in order of descending priority) to match statements.
         value_patterns (ClassVar[List[Pattern]]): The list of regex patterns (in order of descending priority to match values.
+        page_labels (ClassVar[List[str]]): The PageClassifier labels of the pages the field can be found on. Both pages
+                                           of Form 1040, since the lines moved between them across tax years.
     """
 
     preprocessed_tax_form: PreprocessTaxForm
@@ -34,6 +37,7 @@ class FieldBase:
 
     statement_patterns: ClassVar[List[Pattern]] = field(default=[])  # priority queue
     value_patterns: ClassVar[List[Pattern]] = field(default=[])
+    page_labels: ClassVar[List[str]] = [FORM_1040_PAGE_1, FORM_1040_PAGE_2]
 
     def __post_init__(self):
         """
@@ -54,9 +58,10 @@ class FieldBase:
         """
         for _, page in self.preprocessed_tax_form.ocr_pages.items():
             for statement_pattern in self.statement_patterns:
-                for page_index, annotation in enumerate(page.annotations):
+                # scan the text column, a row view is only built for the match
+                for page_index, text in enumerate(page.annotations.texts):
                     statement_match = re.search(
-                        statement_pattern, annotation.text, re.MULTILINE
+                        statement_pattern, text, re.MULTILINE
                     )
                     if statement_match:
                         return MatchedAnnotation.from_annotation(
@@ -64,13 +69,13 @@ class FieldBase:
                             page_index=page_index,
                             match=statement_match,
                             pattern=statement_pattern,
-                            annotation=annotation,
+                            annotation=page.annotations[page_index],
                         )
         return MatchedAnnotation(
             page=OCRPage(
                 tax_file=self.preprocessed_tax_form.file_path,
                 page_number=-1,
-                annotations=[],
+                annotations=AnnotationTable(),
             )
         )
 
@@ -87,27 +92,28 @@ class FieldBase:
         """
 
         def filter_annotations(
-            statement: MatchedAnnotation, annotations: List[Annotation]
-        ) -> Dict[int, Annotation]:
-            filtered_annotations: Dict[int, Annotation] = {}
-            for page_index, annotation in enumerate(annotations):
-                if statement.bbox[1] <= annotation.center[1] <= statement.bbox[3]:
-                    filtered_annotations[page_index] = annotation
+            statement: MatchedAnnotation, annotations: AnnotationTable, start: int
+        ) -> Dict[int, int]:
+            # maps the index relative to start to the row of the annotation in the table
+            filtered_annotations: Dict[int, int] = {}
+            for index in range(start, len(annotations)):
+                if statement.bbox[1] <= annotations.center_y(index) <= statement.bbox[3]:
+                    filtered_annotations[index - start] = index
 
             return filtered_annotations
 
         # the corresponding value should be on the same page as the statement
 
-        annotations = self.statement_ocr.page.annotations[
-            self.statement_ocr.page_index + 1 :
-        ]
+        annotations = self.statement_ocr.page.annotations
         filtered_annotations = filter_annotations(
-            statement=self.statement_ocr, annotations=annotations
+            statement=self.statement_ocr,
+            annotations=annotations,
+            start=self.statement_ocr.page_index + 1,
         )
 
         for value_pattern in self.value_patterns:
-            for page_index, annotation in filtered_annotations.items():
-                value_match = re.search(value_pattern, annotation.text, re.MULTILINE)
+            for page_index, index in filtered_annotations.items():
+                value_match = re.search(value_pattern, annotations.texts[index], re.MULTILINE)
                 if value_match:
 
                     return MatchedAnnotation.from_annotation(
@@ -115,7 +121,7 @@ class FieldBase:
                         page_index=page_index,
                         match=value_match,
                         pattern=value_pattern,
-                        annotation=annotation,
+                        annotation=annotations[index],
                     )
 
         return MatchedAnnotation(page=self.statement_ocr.page)
@@ -1,5 +1,8 @@
 from dataclasses import dataclass, field
 from TaxParsingAPI.helpers.tax_form_helper import PreprocessTaxForm
+from TaxParsingAPI.helpers.ocr_dispatcher import OcrDispatcher
+from TaxParsingAPI.helpers.ocr_task_queue import OcrTaskQueue
+from TaxParsingAPI.helpers.ocr_scheduler import INTERACTIVE
 from TaxParsingAPI.parse.fields.total_income import TotalIncome
 from TaxParsingAPI.parse.fields.adjusted_gross_income import AdjustedGrossIncome
 from TaxParsingAPI.parse.fields.deductions import Deductions
@@ -9,11 +12,17 @@ from TaxParsingAPI.parse.fields.total_payments import TotalPayments
 from TaxParsingAPI.parse.fields.overpaid import Overpaid
 from TaxParsingAPI.parse.fields.amount_owed import AmountOwed
 
-from typing import Optional, get_args, _UnionGenericAlias, Union
+from django.conf import settings
+from pathlib import Path
+from typing import Dict, List, Optional, get_args, _UnionGenericAlias, Union
+import hashlib
 
 """
 TaxParser is an orchestrator of fields
 """
+
+# bump when field extraction logic changes without any pattern changing, to mark every parsed form stale
+PARSER_REVISION = 1
  
 @dataclass
 class TaxParser:
@@ -81,3 +90,143 @@ class TaxParser:
         
         else:
             raise AttributeError(f"{field} is not a valid attribute of {cls.__name__}")
+
+
+    @classmethod
+    def get_version(cls) -> str:
+        """
+        Get the version of the parser.
+
+        The version is a fingerprint of PARSER_REVISION and of the statement and value patterns
+        of every tax field class, so editing a pattern list changes the version and marks the
+        tax forms parsed by the previous version as stale.
+
+        Returns:
+            str: The parser version.
+        """
+        fingerprint = hashlib.sha256(f"revision:{PARSER_REVISION}".encode())
+        for field_name in cls.__annotations__:
+            if field_name == "preprocessed_tax_form":
+                continue
+            field_type = cls.get_field_type(field_name)
+            fingerprint.update(field_type.__name__.encode())
+            for pattern in field_type.statement_patterns + field_type.value_patterns:
+                fingerprint.update(b"\0" + pattern.encode())
+        return fingerprint.hexdigest()[:16]
+
+    @classmethod
+    def get_page_labels(cls, tax_fields: List[Dict]) -> Optional[List[str]]:
+        """
+        Get the labels of the pages that can hold the requested tax fields, so only those pages are OCR-ed.
+
+        Args:
+            tax_fields (List[Dict]): The tax fields to extract, each a dictionary with a "tax_field" key.
+
+        Returns:
+            Optional[List[str]]: The PageClassifier labels of the pages, or None to OCR every page when
+                                 settings.TAX_FORM_CLASSIFY_PAGES is False.
+        """
+        if not getattr(settings, "TAX_FORM_CLASSIFY_PAGES", False):
+            return None
+        page_labels: List[str] = []
+        for tax_field_dict in tax_fields:
+            for page_label in cls.get_field_type(tax_field_dict["tax_field"]).page_labels:
+                if page_label not in page_labels:
+                    page_labels.append(page_label)
+        return page_labels
+
+    @classmethod
+    def extract_tax_fields(cls, preprocessed_tax_form: PreprocessTaxForm, tax_fields: List[Dict]) -> List[Dict]:
+        """
+        Extract the requested tax fields from a preprocessed tax form.
+
+        Args:
+            preprocessed_tax_form (PreprocessTaxForm): The preprocessed tax form data.
+            tax_fields (List[Dict]): The tax fields to extract, each a dictionary with a "tax_field" key.
+
+        Returns:
+            List[Dict]: One dictionary per tax field, holding the values of the TaxField model fields.
+        """
+        extracted_tax_fields = []
+        for tax_field_dict in tax_fields:
+            tax_field = tax_field_dict["tax_field"]
+
+            field_type_class = cls.get_field_type(tax_field)
+
+            field_instance = field_type_class(
+                preprocessed_tax_form=preprocessed_tax_form
+            )
+
+            instruction_text = field_instance.statement_ocr.text
+            instruction_matched_pattern = field_instance.statement_ocr.pattern
+            value_text = field_instance.value_ocr.text
+            value_normalized_text = field_instance.value_ocr.normalized_text
+            value_matched_pattern = field_instance.value_ocr.pattern
+            page_number = field_instance.value_ocr.page.page_number
+
+            if field_type_class is Overpaid or field_type_class is AmountOwed and not value_text:
+
+                value_in_numeric = field_instance.calculated_value
+            else:
+                value_in_numeric = field_instance.to_int(text=value_text)
+
+            extracted_tax_fields.append(
+                {
+                    "tax_field": tax_field,
+                    "instruction_text": instruction_text,
+                    "instruction_matched_pattern": instruction_matched_pattern,
+                    "value_text": value_text,
+                    "value_normalized_text": value_normalized_text,
+                    "value_in_numeric": value_in_numeric,
+                    "value_matched_pattern": value_matched_pattern,
+                    "page_number": page_number,
+                }
+            )
+        return extracted_tax_fields
+
+
+def parse_tax_form(
+    file_path: Path,
+    file_bytes: Optional[bytes],
+    tax_fields: List[Dict],
+    ocr_dispatcher: Optional[OcrDispatcher] = None,
+    ocr_task_queue: Optional[OcrTaskQueue] = None,
+    ocr_priority: str = INTERACTIVE,
+    tenant: str = "",
+) -> Dict:
+    """
+    Preprocess a tax form and extract its tax fields.
+
+    This is the unit of work submitted to the worker pool, so it only takes and returns
+    picklable values, unless it runs on a thread of this process with an ocr_dispatcher.
+
+    Args:
+        file_path (Path): The path of the tax form, it determines where the preprocessing artifacts are stored.
+        file_bytes (Optional[bytes]): The bytes of the tax form, used when file_path does not exist yet.
+        tax_fields (List[Dict]): The tax fields to extract, each a dictionary with a "tax_field" key.
+        ocr_dispatcher (Optional[OcrDispatcher]): The dispatcher the pages are OCR-ed through, None OCRs them in this process.
+        ocr_task_queue (Optional[OcrTaskQueue]): The queue the pages are OCR-ed through by the workers of every node,
+                                                 instead of ocr_dispatcher.
+        ocr_priority (str): The priority class the pages are queued in by ocr_dispatcher or ocr_task_queue. Defaults to "interactive".
+        tenant (str): The user or firm the pages are OCR-ed for. Defaults to "".
+
+    Returns:
+        Dict: A dictionary with the extracted "tax_fields", the "page_count" of the tax form, and the "stages"
+              its preprocessing completed, the PreprocessTaxForm stage_state.
+    """
+    preprocessed_tax_form = PreprocessTaxForm(
+        file_path=file_path,
+        file_bytes=file_bytes,
+        ocr_page_labels=TaxParser.get_page_labels(tax_fields),
+        ocr_dispatcher=ocr_dispatcher,
+        ocr_task_queue=ocr_task_queue,
+        ocr_priority=ocr_priority,
+        tenant=tenant,
+    )
+    return {
+        "tax_fields": TaxParser.extract_tax_fields(
+            preprocessed_tax_form=preprocessed_tax_form, tax_fields=tax_fields
+        ),
+        "page_count": len(preprocessed_tax_form.ocr_pages),
+        "stages": preprocessed_tax_form.stage_state,
+    }
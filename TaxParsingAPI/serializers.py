@@ -1,17 +1,24 @@
 from TaxParsingAPI.models import (
     TaxForm,
     TaxField,
-    UPLOAD_TO
+    UploadSession,
 )
 from TaxParsingAPI.helpers.tax_form_helper import PreprocessTaxForm
 from TaxParsingAPI.parse.tax_parser import TaxParser
+from TaxParsingAPI.helpers.ocr_dispatcher import get_ocr_dispatcher
+from TaxParsingAPI.helpers.ocr_task_queue import get_ocr_task_queue
+from TaxParsingAPI.helpers.ocr_scheduler import INTERACTIVE, get_tenant
+from TaxParsingAPI.helpers.preflight import AdmissionController, AdmissionError, PreflightError, TaxFormPreflight
 from TaxParsingAPI.helpers.tax_form_helper import PreprocessTaxForm
-from typing import List,Dict
+from TaxParsingAPI.helpers.upload_helper import StoredUpload, UploadTooLarge, store_upload
+from TaxParsingAPI.helpers.checkpoint_helper import TaxFormCheckpoint, persist_parsed_tax_forms
+from typing import List,Dict,Optional
+from django.core.files.uploadedfile import UploadedFile
+from rest_framework.exceptions import APIException, Throttled, ValidationError
 from rest_framework.serializers import (
     HyperlinkedModelSerializer,
     ModelSerializer,
 )
-from HolistiplanTakeHome.settings import MEDIA_ROOT
 
 
 def get_default_tax_fields()->List[Dict]:
@@ -34,6 +41,60 @@ def get_default_tax_fields()->List[Dict]:
     return tax_fields
 
 
+class OcrQueueUnavailable(APIException):
+    """
+    Raised with a 503 and a Retry-After header when the OCR queue is too full to admit more pages.
+    """
+    status_code = 503
+    default_detail = "The OCR queue is full, try again later."
+    default_code = "ocr_queue_unavailable"
+
+    def __init__(self, detail=None, wait=None):
+        super().__init__(detail)
+        # the exception handler of DRF sets the Retry-After header from wait
+        self.wait = wait
+
+
+class TaxFormProcessingFailed(APIException):
+    """
+    Raised with a 500 when a received tax form fails to be processed. Its TaxForm keeps the file and the
+    stages completed so far, and the response holds its id, so it is resumed rather than uploaded again.
+    """
+    status_code = 500
+    default_detail = "The tax form could not be processed."
+    default_code = "tax_form_processing_failed"
+
+    def __init__(self, tax_form:TaxForm, error:BaseException):
+        super().__init__(
+            {"id": str(tax_form.id), "stage": tax_form.stage, "error": str(error) or error.__class__.__name__}
+        )
+
+
+def admit_ocr_pages(pages:int, priority:str, tenant:str, ocr_dispatcher=None, ocr_task_queue=None)->None:
+    """
+    Admit the pages of an upload into the OCR queues, or refuse the request while they are saturated.
+
+    Args:
+        pages (int): The number of pages to OCR.
+        priority (str): The priority class the pages are to be OCR-ed in.
+        tenant (str): The user or firm the pages are OCR-ed for.
+        ocr_dispatcher (Optional[OcrDispatcher]): The dispatcher the pages are queued in without a task queue.
+        ocr_task_queue (Optional[OcrTaskQueue]): The database task queue the pages are queued in, if enabled.
+
+    Raises:
+        Throttled: With a 429 if the tenant has too many pages queued.
+        OcrQueueUnavailable: With a 503 if every tenant together has too many pages queued.
+    """
+    try:
+        AdmissionController.from_settings().admit(
+            pages, priority=priority, tenant=tenant, ocr_dispatcher=ocr_dispatcher, ocr_task_queue=ocr_task_queue
+        )
+    except AdmissionError as error:
+        if error.status_code == 429:
+            raise Throttled(wait=error.retry_after, detail=str(error))
+        raise OcrQueueUnavailable(detail=str(error), wait=error.retry_after)
+
+
 class TaxFieldSerializer(ModelSerializer):
     """
     Serializer for the TaxField model.
@@ -43,6 +104,21 @@ class TaxFieldSerializer(ModelSerializer):
         fields = ["tax_field"]
 
 
+class UploadSessionSerializer(HyperlinkedModelSerializer):
+    """
+    Serializer for the UploadSession model.
+
+    The client declares the file when it creates the session, the offset and status are only changed by the
+    byte ranges it sends and by finalizing the session.
+    """
+    class Meta:
+        model = UploadSession
+        fields = [
+            "url", "id", "file_name", "size", "sha256", "offset", "status", "tax_fields", "tax_form", "expires_at"
+        ]
+        read_only_fields = ["offset", "status", "tax_form", "expires_at"]
+
+
 class TaxFormSerializer(HyperlinkedModelSerializer):
     """
     Serializer for the TaxForm model.
@@ -57,6 +133,12 @@ class TaxFormSerializer(HyperlinkedModelSerializer):
     Methods:
         to_internal_value(self, data):
             Custom method to handle pre-validation logic and convert input data into internal objects.
+
+        _preprocess_upload(self, upload, requested_tax_fields, stored_upload) -> PreprocessTaxForm:
+            Stream an upload to the tax form storage and preprocess it from there.
+
+        _discard_stored_upload(self, data):
+            Delete the stored file of a refused upload, unless its caller stored it.
         
         create(self, validated_data):
             Custom method to create a TaxForm instance along with its associated tax fields.
@@ -76,69 +158,135 @@ class TaxFormSerializer(HyperlinkedModelSerializer):
         Convert input data into internal Python objects.
 
         This method preprocesses the input data to create a PreprocessTaxForm instance if needed,
-        and generates a list of tax fields with their respective details.
+        and generates a list of tax fields with their respective details. Before anything is rasterized,
+        the upload is inspected by TaxFormPreflight, which rejects it or routes a long one to the bulk
+        priority class, and its pages are admitted into the OCR queues. The upload is streamed to the tax
+        form storage rather than read into memory, and the stored file is deleted if the upload is refused.
+        A file already stored by a resumable upload is passed as data["stored_upload"], and is kept when
+        it is refused, so its session can be finalized again.
+
+        Once admitted, the upload is saved as a received TaxForm, and the stages of its preprocessing are
+        recorded on it by TaxFormCheckpoint, as for the tax forms of a batch. If it then fails, the error is
+        recorded and the TaxForm kept with its file, so it can be resumed from its last completed stage.
 
         Args:
             data (dict): The input data.
 
         Returns:
             dict: The converted data in internal format.
+
+        Raises:
+            ValidationError: If the upload is rejected by the preflight.
+            Throttled: If the tenant has too many pages waiting for OCR.
+            OcrQueueUnavailable: If the OCR queue is saturated.
+            TaxFormProcessingFailed: If the received tax form fails to be preprocessed or parsed.
         """
-        if not isinstance(data.get('preprocessed_tax_form'),PreprocessTaxForm):
-            self.preprocessed_tax_form = PreprocessTaxForm(
-                file_path=MEDIA_ROOT / UPLOAD_TO /  data["tax_form"].name,
-                file_bytes = data['tax_form'].read()
+        requested_tax_fields = data.get("tax_fields", get_default_tax_fields())
+        self.requested_tax_fields = requested_tax_fields
+        self.stored_upload = None
+        self.tax_form = None
+        try:
+            if not isinstance(data.get('preprocessed_tax_form'),PreprocessTaxForm):
+                self.preprocessed_tax_form = self._preprocess_upload(
+                    data["tax_form"], requested_tax_fields, stored_upload=data.get("stored_upload")
+                )
+            else:
+                self.preprocessed_tax_form = data['preprocessed_tax_form']
+
+
+            tax_fields = TaxParser.extract_tax_fields(
+                preprocessed_tax_form=self.preprocessed_tax_form,
+                tax_fields=requested_tax_fields,
             )
-        else:
-            self.preprocessed_tax_form = data['preprocessed_tax_form']
-            
-            
-        tax_fields = []
-        for tax_field_dict in data.get("tax_fields", get_default_tax_fields()):
-            tax_field = tax_field_dict["tax_field"]
-
-            field_type_class = TaxParser.get_field_type(tax_field)
-            
-            field_instance = field_type_class(
-                preprocessed_tax_form=self.preprocessed_tax_form
+
+            self.page_count = (
+                len(self.preprocessed_tax_form.ocr_pages)
+                if isinstance(self.preprocessed_tax_form, PreprocessTaxForm)
+                else 0
             )
+            self.preprocessed_tax_form=tax_fields
+            return super().to_internal_value(data)
+        except Exception as error:
+            if self.tax_form is None:
+                self._discard_stored_upload(data)
+                raise
+            raise TaxFormProcessingFailed(TaxFormCheckpoint(self.tax_form.id).record_error(error), error) from error
+        except BaseException:
+            if self.tax_form is None:
+                self._discard_stored_upload(data)
+            raise
+
+    def _discard_stored_upload(self, data:Dict)->None:
+        """
+        Delete the stored file of a refused upload, unless its caller stored it.
 
-            instruction_text = field_instance.statement_ocr.text
-            instruction_matched_pattern = field_instance.statement_ocr.pattern
-            value_text = field_instance.value_ocr.text
-            value_normalized_text = field_instance.value_ocr.normalized_text
-            value_matched_pattern = field_instance.value_ocr.pattern
-            page_number = field_instance.value_ocr.page.page_number
-            
-            if tax_field == TaxField.OVERPAID or tax_field == TaxField.AMOUNT_OWED and not value_text:
-    
-                value_in_numeric = field_instance.calculated_value
-            else:
-                value_in_numeric = field_instance.to_int(text=value_text)
-                
-            tax_fields.append(
-                {
-                    "tax_field": tax_field,
-                    "instruction_text": instruction_text,
-                    "instruction_matched_pattern": instruction_matched_pattern,
-                    "value_text": value_text,
-                    "value_normalized_text": value_normalized_text,
-                    "value_in_numeric": value_in_numeric,
-                    "value_matched_pattern": value_matched_pattern,
-                    "page_number": page_number,
-                }
+        Args:
+            data (dict): The input data.
+        """
+        if self.stored_upload is not None and data.get("stored_upload") is None:
+            self.stored_upload.delete()
+
+    def _preprocess_upload(
+        self, upload:UploadedFile, requested_tax_fields:List[Dict], stored_upload:Optional[StoredUpload]=None
+    )->PreprocessTaxForm:
+        """
+        Stream an upload to the tax form storage and preprocess it from there.
+
+        The upload is copied in chunks and hashed as it is written, so the request never holds the whole
+        file in memory, and the pipeline, from the preflight to the OCR cache lookup and the rasterization,
+        works from the stored file. Once its pages are admitted, the upload is saved as a received TaxForm,
+        the one left by an earlier failed attempt on the same stored file if any, so the page images and
+        the partial annotations of that attempt are reused, and the completed stages are recorded on it.
+
+        Args:
+            upload (UploadedFile): The uploaded tax form.
+            requested_tax_fields (List[Dict]): The tax fields to extract, each a dictionary with a "tax_field" key.
+            stored_upload (Optional[StoredUpload]): The upload, if already stored. Defaults to None.
+
+        Returns:
+            PreprocessTaxForm: The preprocessed tax form.
+        """
+        request = self.context.get("request")
+        ocr_dispatcher = get_ocr_dispatcher()
+        ocr_task_queue = get_ocr_task_queue()
+        tenant = get_tenant(getattr(request, "user", None))
+        preflight = TaxFormPreflight.from_settings()
+        try:
+            self.stored_upload = stored_upload or store_upload(upload, max_bytes=preflight.max_bytes)
+            report = preflight.inspect(file_path=self.stored_upload.path, priority=INTERACTIVE)
+        except (UploadTooLarge, PreflightError) as error:
+            raise ValidationError({"tax_form": [str(error)]})
+        admit_ocr_pages(
+            report.page_count or 1, report.priority, tenant, ocr_dispatcher=ocr_dispatcher, ocr_task_queue=ocr_task_queue
+        )
+
+        if stored_upload is not None:
+            self.tax_form = (
+                TaxForm.objects.filter(tax_form=stored_upload.name).exclude(stage=TaxForm.PERSISTED).first()
             )
-            
-        self.preprocessed_tax_form=tax_fields
-        return super().to_internal_value(data)
-    
-    
+        if self.tax_form is None:
+            self.tax_form = TaxFormCheckpoint.receive(self.stored_upload.name, requested_tax_fields)
+
+        preprocessed_tax_form = PreprocessTaxForm(
+            file_path=self.stored_upload.path,
+            document_hash=self.stored_upload.document_hash,
+            ocr_dispatcher=ocr_dispatcher,
+            ocr_task_queue=ocr_task_queue,
+            ocr_priority=report.priority,
+            tenant=tenant,
+            ocr_page_labels=TaxParser.get_page_labels(requested_tax_fields),
+        )
+        TaxFormCheckpoint(self.tax_form.id).record_stages(preprocessed_tax_form.stage_state)
+        return preprocessed_tax_form
+
+
     def create(self, validated_data:Dict)->TaxForm:
         """
         Create a TaxForm instance along with its associated tax fields.
 
-        This method creates a new TaxForm instance and its associated tax fields based on the
-        preprocessed tax form data.
+        This method saves the tax fields extracted from the preprocessed tax form on the TaxForm received
+        for the upload, recording its parsed and persisted stages. The TaxForm points to the file the upload
+        was streamed to. A tax form preprocessed by the caller is received here.
 
         Args:
             validated_data (dict): The validated data.
@@ -146,36 +294,18 @@ class TaxFormSerializer(HyperlinkedModelSerializer):
         Returns:
             TaxForm: The created TaxForm instance.
         """
-        validated_data["tax_form"] = TaxForm.objects.create(tax_form=validated_data["tax_form"])
-
-        tax_form = validated_data["tax_form"]
-
-        for tax_field_dict in self.preprocessed_tax_form:
-            
-            
-            tax_field = tax_field_dict["tax_field"]
-            instruction_text = tax_field_dict["instruction_text"]
-            instruction_matched_pattern = tax_field_dict["instruction_matched_pattern"]
-            value_text = tax_field_dict["value_text"]
-            value_normalized_text = tax_field_dict["value_normalized_text"]
-            value_in_numeric = tax_field_dict["value_in_numeric"]
-            value_matched_pattern = tax_field_dict["value_matched_pattern"]
-            page_number = tax_field_dict["page_number"]
-
-            tax_field_obj = TaxField.objects.create(
-                tax_form=tax_form,
-                tax_field=tax_field,
-                instruction_text=instruction_text,
-                instruction_matched_pattern=instruction_matched_pattern,
-                value_text=value_text,
-                value_normalized_text=value_normalized_text,
-                value_in_numeric=value_in_numeric,
-                value_matched_pattern=value_matched_pattern,
-                page_number=page_number,
+        tax_form = getattr(self, "tax_form", None)
+        if tax_form is None:
+            # a streamed upload is already stored, only its name is saved
+            stored_file = self.stored_upload.name if getattr(self, "stored_upload", None) is not None else validated_data["tax_form"]
+            tax_form = TaxFormCheckpoint.receive(
+                stored_file, getattr(self, "requested_tax_fields", None) or get_default_tax_fields()
             )
- 
-            tax_field_obj.save()
-        validated_data["tax_form"].save()
+
+        persist_parsed_tax_forms(
+            [(tax_form, {"tax_fields": self.preprocessed_tax_form, "page_count": getattr(self, "page_count", 0)})]
+        )
+        validated_data["tax_form"] = tax_form
         return tax_form
 
     def to_representation(self, instance: TaxForm):
@@ -0,0 +1,37 @@
+from pathlib import Path
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from TaxParsingAPI.models import TaxForm, TaxField
+from TaxParsingAPI.helpers.artifact_helper import ArtifactManager
+from TaxParsingAPI.helpers.cache_helper import invalidate_tax_form
+
+
+@receiver(post_save, sender=TaxForm)
+@receiver(post_delete, sender=TaxForm)
+def invalidate_tax_form_on_change(sender, instance: TaxForm, **kwargs) -> None:
+    """
+    Drop the cached representation of a tax form when it is updated or deleted.
+    """
+    invalidate_tax_form(instance.pk)
+
+
+@receiver(post_save, sender=TaxField)
+@receiver(post_delete, sender=TaxField)
+def invalidate_tax_form_on_tax_field_change(sender, instance: TaxField, **kwargs) -> None:
+    """
+    Drop the cached representation of a tax form when one of its tax fields is updated or deleted.
+    """
+    invalidate_tax_form(instance.tax_form_id)
+
+
+@receiver(post_delete, sender=TaxForm)
+def release_artifacts_on_delete(sender, instance: TaxForm, **kwargs) -> None:
+    """
+    Delete the preprocessing artifacts of a deleted tax form, once the deletion is committed,
+    unless another tax form references the same file.
+    """
+    if not instance.tax_form.name:
+        return
+    document = Path(instance.tax_form.name).stem
+    transaction.on_commit(lambda: ArtifactManager().release_if_unreferenced(document))
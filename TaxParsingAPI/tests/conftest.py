@@ -6,6 +6,7 @@ from fpdf import FPDF
 from django.core.files.uploadedfile import SimpleUploadedFile
 from io import BytesIO
 from TaxParsingAPI.models import TaxForm, TaxField
+from TaxParsingAPI.helpers import ocr_cache
 from django.conf import settings
 
 test_file_content = [
@@ -42,6 +43,51 @@ positive_pay_this_amount_test_file_content = [
 ]
 
 
+@pytest.fixture(autouse=True)
+def isolated_ocr_cache(tmp_path, monkeypatch) -> ocr_cache.OcrCache:
+    """
+    Fixture to give every test its own empty OCR cache, with its disk tier in a temporary directory.
+
+    Args:
+        tmp_path (pathlib.Path): A temporary directory path provided by pytest.
+        monkeypatch (pytest.MonkeyPatch): The pytest monkeypatch fixture.
+
+    Returns:
+        OcrCache: The OCR cache used by the test.
+    """
+    isolated_cache = ocr_cache.OcrCache(disk_directory=tmp_path / "ocr_cache")
+    monkeypatch.setattr(ocr_cache, "_ocr_cache", isolated_cache)
+    return isolated_cache
+
+
+@pytest.fixture(autouse=True)
+def isolated_page_cache(tmp_path, monkeypatch) -> ocr_cache.OcrCache:
+    """
+    Fixture to give every test its own empty page cache, with its disk tier in a temporary directory.
+
+    Args:
+        tmp_path (pathlib.Path): A temporary directory path provided by pytest.
+        monkeypatch (pytest.MonkeyPatch): The pytest monkeypatch fixture.
+
+    Returns:
+        OcrCache: The page cache used by the test.
+    """
+    isolated_cache = ocr_cache.OcrCache(disk_directory=tmp_path / "page_cache")
+    monkeypatch.setattr(ocr_cache, "_page_cache", isolated_cache)
+    return isolated_cache
+
+
+@pytest.fixture(autouse=True)
+def no_ocr_engine_warm_up(settings) -> None:
+    """
+    Fixture to keep the worker processes started by a test from warming up OCR engines.
+
+    Args:
+        settings (SettingsWrapper): The pytest-django settings fixture.
+    """
+    settings.OCR_ENGINES = {**settings.OCR_ENGINES, "WARM_UP": False}
+
+
 @pytest.fixture
 def mock_pdf_path(tmp_path) -> Path:
     """
@@ -0,0 +1,124 @@
+from pathlib import Path
+import pickle
+import shutil
+import struct
+import pytest
+from django.core.management import call_command
+from TaxParsingAPI.helpers.tax_form_helper import PreprocessTaxForm
+from TaxParsingAPI.helpers.utils.annotation import Annotation
+from TaxParsingAPI.helpers.utils import annotation_store
+from TaxParsingAPI.helpers.utils.annotation_store import AnnotationStore, StoredTexts
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+from TaxParsingAPI.helpers.utils.matched_annotation import MatchedAnnotation
+from TaxParsingAPI.parse.fields.total_tax import TotalTax
+
+TAX_DIR = Path(__file__).parent / "parse" / "EngHwPDFs"
+
+
+def test_annotation_store_round_trip(tmp_path: Path):
+    """
+    Test that the annotations written to an annotation file are read back page by page.
+    """
+    pages = {
+        0: [
+            Annotation(text="Total tax", bbox=[0.125, 0.5, 0.25, 0.75], center=[0.1875, 0.625]),
+            Annotation(text="26,825.", bbox=[0.5, 0.5, 0.75, 0.75], center=[0.625, 0.625]),
+        ],
+        1: [],
+        2: [Annotation(text="Überzahlung", bbox=[0.0, 0.0, 1.0, 1.0], center=[0.5, 0.5])],
+    }
+
+    with AnnotationStore.write(path=tmp_path / "form.ann", pages=pages, preprocessing="key") as store:
+        assert store.preprocessing == "key"
+        assert store.page_numbers() == [0, 1, 2]
+        for page_number, annotations in pages.items():
+            assert store.read_page(page_number) == annotations
+
+
+def test_annotation_store_reads_pages_in_place(tmp_path: Path, monkeypatch):
+    """
+    Test that a page is read as views of the memory map with lazily decoded texts, which outlive the
+    store and pickle as copies, and that the arrays are little-endian whatever the host byte order.
+    """
+    annotations = [
+        Annotation(text="Total tax", bbox=[0.125, 0.5, 0.25, 0.75], center=[0.1875, 0.625]),
+        Annotation(text="Überzahlung", bbox=[0.0, 0.0, 1.0, 1.0], center=[0.5, 0.5]),
+    ]
+    path = tmp_path / "form.ann"
+    AnnotationStore.write(path=path, pages={0: annotations}).close()
+    assert struct.pack("<4f", 0.125, 0.5, 0.25, 0.75) in path.read_bytes()
+
+    with AnnotationStore(path=path) as store:
+        table = store.read_page(0)
+    assert isinstance(table.bboxes, memoryview) and isinstance(table.centers, memoryview)
+    assert isinstance(table.texts, StoredTexts) and table.texts.decoded is None
+    assert table[1].text == "Überzahlung"
+    assert table.texts.decoded == [None, "Überzahlung"]
+    assert table == annotations
+
+    copy = pickle.loads(pickle.dumps(table))
+    assert isinstance(copy.texts, list) and not isinstance(copy.bboxes, memoryview)
+    assert copy == annotations
+
+    monkeypatch.setattr(annotation_store, "LITTLE_ENDIAN", False)
+    AnnotationStore.write(path=path, pages={0: annotations}).close()
+    assert struct.pack(">4f", 0.125, 0.5, 0.25, 0.75) in path.read_bytes()
+    with AnnotationStore(path=path) as store:
+        assert store.read_page(0) == annotations
+
+
+def test_convert_annotation_caches(tmp_path: Path):
+    """
+    Test that the JSON annotation caches are converted to an annotation file that preprocesses
+    and parses the same as the JSON files it replaces.
+    """
+    shutil.copy(TAX_DIR / "7.pdf", tmp_path / "7.pdf")
+    shutil.copytree(TAX_DIR / "annotations" / "7", tmp_path / "annotations" / "7")
+
+    from_json = PreprocessTaxForm(file_path=tmp_path / "7.pdf", annotations_only=True, use_ocr_cache=False)
+
+    call_command("convert_annotation_caches", "--base-dir", str(tmp_path), "--delete-json")
+    assert (tmp_path / "annotations" / "7.ann").exists()
+    assert not (tmp_path / "annotations" / "7").exists()
+
+    from_store = PreprocessTaxForm(file_path=tmp_path / "7.pdf", annotations_only=True, use_ocr_cache=False)
+
+    assert list(from_store.ocr_pages) == list(from_json.ocr_pages)
+    for page_number, ocr_page in from_store.ocr_pages.items():
+        expected = from_json.ocr_pages[page_number].annotations
+        assert [annotation.text for annotation in ocr_page.annotations] == [
+            annotation.text for annotation in expected
+        ]
+        for annotation, expected_annotation in zip(ocr_page.annotations, expected):
+            assert annotation.bbox == pytest.approx(expected_annotation.bbox, rel=1e-6)
+            assert annotation.center == pytest.approx(expected_annotation.center, rel=1e-6)
+
+    assert TotalTax(from_store).value_ocr.text == TotalTax(from_json).value_ocr.text == "26,825."
+
+
+def test_annotation_table_views():
+    """
+    Test that an AnnotationTable exposes its rows as views equal to the annotations it was built from.
+    """
+    annotations = [
+        Annotation(text="Total tax", bbox=[0.0, 1.0, 2.0, 3.0], center=[1.0, 2.0]),
+        Annotation(text="26, 825.", bbox=[4.0, 1.0, 6.0, 3.0], center=[5.0, 2.0]),
+    ]
+    table = AnnotationTable.from_annotations(annotations)
+
+    assert len(table) == 2
+    assert table == annotations
+    assert table[1].text == "26, 825."
+    assert table[1].bbox == (4.0, 1.0, 6.0, 3.0)
+    assert table.center_y(1) == 2.0
+    assert table[1:] == annotations[1:]
+    assert table.to_json() == [
+        {"text": annotation.text, "bbox": annotation.bbox, "center": annotation.center}
+        for annotation in annotations
+    ]
+
+    matched = MatchedAnnotation.from_annotation(
+        page=None, page_index=1, match=None, pattern="", annotation=table[1]
+    )
+    assert "normalized_text" not in matched.__dict__
+    assert matched.normalized_text == "26,825."
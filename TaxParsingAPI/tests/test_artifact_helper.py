@@ -0,0 +1,82 @@
+import os
+import time
+from pathlib import Path
+from TaxParsingAPI.models import TaxForm
+from TaxParsingAPI.helpers.artifact_helper import ArtifactManager
+
+
+def write_artifacts(base_dir: Path, document: str, age: float = 0) -> None:
+    """
+    Write the artifacts PreprocessTaxForm leaves for a document, last used age seconds ago.
+    """
+    used_at = time.time() - age
+    for kind in ["images", "annotations_over_images", "text_from_pdf"]:
+        file_path = base_dir / kind / document / "page_1.png"
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(b"0" * 1000)
+        os.utime(file_path, (used_at, used_at))
+    annotations_file_path = base_dir / "annotations" / f"{document}.ann"
+    annotations_file_path.parent.mkdir(parents=True, exist_ok=True)
+    annotations_file_path.write_bytes(b"0" * 100)
+    os.utime(annotations_file_path, (used_at, used_at))
+
+
+def test_collect_garbage(db, tmp_path: Path):
+    """
+    Test that the artifacts of unreferenced documents are deleted, that the least recently used
+    regenerable artifacts are evicted over the disk budget, and that annotations are kept.
+    """
+    TaxForm.objects.create(tax_form="tax_forms/old.v2.pdf")
+    TaxForm.objects.create(tax_form="tax_forms/new.pdf")
+    write_artifacts(tmp_path, "old.v2", age=7200)
+    write_artifacts(tmp_path, "new", age=3600)
+    write_artifacts(tmp_path, "deleted", age=7200)
+    write_artifacts(tmp_path, "uploading")
+
+    manager = ArtifactManager(base_dir=tmp_path, max_bytes=7500, min_age=60)
+    summary = manager.collect_garbage()
+
+    assert summary == {"released": 1, "evicted": 2, "freed_bytes": 5100, "remaining_bytes": 7300}
+    remaining = sorted(
+        (artifact.kind, artifact.document) for artifact in manager.list_artifacts()
+    )
+    assert remaining == [
+        ("annotations", "new"),
+        ("annotations", "old.v2"),
+        ("annotations", "uploading"),
+        ("annotations_over_images", "new"),
+        ("annotations_over_images", "uploading"),
+        ("images", "new"),
+        ("images", "uploading"),
+        ("text_from_pdf", "new"),
+        ("text_from_pdf", "old.v2"),
+        ("text_from_pdf", "uploading"),
+    ]
+
+
+def test_artifacts_released_on_delete(db, tmp_path: Path, settings, monkeypatch, django_capture_on_commit_callbacks):
+    """
+    Test that deleting a tax form deletes its artifacts, the partial annotations of an interrupted run
+    included, once no tax form references its file, without listing the artifacts of every document.
+    """
+    settings.MEDIA_ROOT = tmp_path
+    write_artifacts(tmp_path / "tax_forms", "shared")
+    (tmp_path / "tax_forms" / "annotations" / "shared.ann.partial").write_bytes(b"0" * 10)
+    first = TaxForm.objects.create(tax_form="tax_forms/shared.pdf")
+    second = TaxForm.objects.create(tax_form="tax_forms/shared.pdf")
+
+    with django_capture_on_commit_callbacks(execute=True):
+        first.delete()
+    assert len(ArtifactManager().list_artifacts()) == 5
+
+    write_artifacts(tmp_path / "tax_forms", "other")
+    list_artifacts = ArtifactManager.list_artifacts
+
+    def fail(self):
+        raise AssertionError("releasing a document lists every artifact")
+
+    monkeypatch.setattr(ArtifactManager, "list_artifacts", fail)
+    with django_capture_on_commit_callbacks(execute=True):
+        second.delete()
+    monkeypatch.setattr(ArtifactManager, "list_artifacts", list_artifacts)
+    assert {artifact.document for artifact in ArtifactManager().list_artifacts()} == {"other"}
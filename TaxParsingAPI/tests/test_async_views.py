@@ -0,0 +1,95 @@
+import asyncio
+import threading
+from django.contrib.auth.models import User
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from asgiref.sync import async_to_sync
+from TaxParsingAPI.models import TaxForm, TaxField
+from TaxParsingAPI.views import AsyncTaxFormDetailView, AsyncTaxFormListView, TaxFormViewSet
+
+
+def create_tax_form(name, total_tax):
+    tax_form = TaxForm.objects.create(tax_form=f"tax_forms/{name}")
+    TaxField.objects.create(tax_form=tax_form, tax_field=TaxField.TOTAL_TAX, value_in_numeric=total_tax)
+    return tax_form
+
+
+def test_async_reads(transactional_db):
+    """
+    Test that the async views list and retrieve the persisted tax forms as TaxFormViewSet does, with the
+    ETag of the representation cache, and refuse anonymous clients.
+    """
+    first = create_tax_form("first.pdf", 100)
+    second = create_tax_form("second.pdf", 200)
+    received = TaxForm.objects.create(tax_form="tax_forms/received.pdf", stage=TaxForm.RECEIVED)
+    client = APIClient()
+    assert client.get("/api/tax-forms/").status_code == 403
+
+    client.force_authenticate(User.objects.create_user("preparer"))
+    response = client.get(f"/api/tax-forms/{first.id}/")
+    assert response.status_code == 200
+    assert response.data["id"] == str(first.id)
+    assert response.data["url"] == f"http://testserver/api/tax-forms/{first.id}/"
+    etag = response["ETag"]
+    assert client.get(f"/api/tax-forms/{first.id}/", HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    # the list serves the cached representation of the first tax form and caches the second
+    response = client.get("/api/tax-forms/")
+    assert response.status_code == 200
+    assert {tax_form["id"] for tax_form in response.data} == {str(first.id), str(second.id)}
+    assert client.get(f"/api/tax-forms/{second.id}/")["ETag"]
+    # a tax form still being processed is only reached by resume
+    assert client.get(f"/api/tax-forms/{received.id}/").status_code == 404
+    received.delete()
+
+    second.delete()
+    assert client.get(f"/api/tax-forms/{second.id}/").status_code == 404
+    # the methods the async views do not serve are passed on to TaxFormViewSet
+    assert client.delete(f"/api/tax-forms/{first.id}/").status_code == 204
+    assert not TaxForm.objects.exists()
+
+
+def test_reads_are_served_while_an_upload_runs(transactional_db, monkeypatch):
+    """
+    Test that an upload, and the authentication of every request, run on the request executor, and that
+    reads are served while an upload is in flight.
+    """
+    tax_form = create_tax_form("return.pdf", 100)
+    user = User.objects.create_user("preparer")
+    started, release = threading.Event(), threading.Event()
+    upload_threads = []
+
+    def slow_create(self, request, *args, **kwargs):
+        upload_threads.append(threading.current_thread().name)
+        started.set()
+        release.wait(timeout=5)
+        return Response(status=201)
+
+    initial_threads = []
+    initial = TaxFormViewSet.initial
+
+    def record_initial(self, request, *args, **kwargs):
+        initial_threads.append(threading.current_thread().name)
+        return initial(self, request, *args, **kwargs)
+
+    monkeypatch.setattr(TaxFormViewSet, "create", slow_create)
+    monkeypatch.setattr(TaxFormViewSet, "initial", record_initial)
+    factory = APIRequestFactory()
+    upload_request = factory.post("/api/tax-forms/", {}, format="multipart")
+    read_request = factory.get(f"/api/tax-forms/{tax_form.id}/")
+    force_authenticate(upload_request, user)
+    force_authenticate(read_request, user)
+
+    async def upload_and_read():
+        upload = asyncio.ensure_future(AsyncTaxFormListView.as_view()(upload_request))
+        await asyncio.to_thread(started.wait, 5)
+        read = await AsyncTaxFormDetailView.as_view()(read_request, pk=tax_form.id)
+        upload_done = upload.done()
+        release.set()
+        return read, upload_done, await upload
+
+    read, upload_done, upload = async_to_sync(upload_and_read)()
+    assert read.status_code == 200 and not upload_done
+    assert upload.status_code == 201
+    assert upload_threads[0].startswith("tax-form-request")
+    assert len(initial_threads) == 2 and all(name.startswith("tax-form-request") for name in initial_threads)
@@ -0,0 +1,141 @@
+import threading
+import time
+from pathlib import Path
+from PIL import Image
+import pytest
+from TaxParsingAPI.helpers.tax_form_helper import PreprocessTaxForm
+from TaxParsingAPI.helpers.utils.annotation import Annotation
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+from TaxParsingAPI.helpers.utils.atomic_files import atomic_write, document_lock, get_lock_path
+
+
+def test_atomic_write(tmp_path: Path):
+    """
+    Test that a file is replaced only once completely written, that a failed write leaves the previous
+    version and no temporary file, and that the first directory renamed into place wins.
+    """
+    path = tmp_path / "page.ann"
+    path.write_text("previous")
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(path) as temporary_path:
+            temporary_path.write_text("partial")
+            raise RuntimeError("interrupted")
+    assert path.read_text() == "previous"
+
+    with atomic_write(path) as temporary_path:
+        temporary_path.write_text("complete")
+        assert path.read_text() == "previous"
+    assert path.read_text() == "complete"
+
+    directory = tmp_path / "images"
+    for page in ("first", "second"):
+        with atomic_write(directory) as temporary_directory:
+            temporary_directory.mkdir()
+            (temporary_directory / "page_1.png").write_text(page)
+    assert (directory / "page_1.png").read_text() == "first"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["images", "page.ann"]
+
+
+def test_document_lock_serializes_holders(tmp_path: Path):
+    """
+    Test that a second holder of the lock of a document waits for the first, and that other documents do not.
+    """
+    events = []
+
+    def hold(document: str, name: str):
+        with document_lock(tmp_path, document):
+            events.append(f"{name} acquired")
+            time.sleep(0.05)
+            events.append(f"{name} released")
+
+    with document_lock(tmp_path, "return"):
+        waiting = threading.Thread(target=hold, args=("return", "waiting"))
+        other = threading.Thread(target=hold, args=("other", "other"))
+        waiting.start()
+        other.start()
+        other.join()
+        events.append("first released")
+    waiting.join()
+
+    assert events == ["other acquired", "other released", "first released", "waiting acquired", "waiting released"]
+    assert not get_lock_path(tmp_path, "return").exists()
+
+
+def preprocess_concurrently(monkeypatch, file_paths, use_ocr_cache):
+    """
+    Preprocess tax forms of the same content on a thread each, with the rasterizing and the OCR stubbed.
+
+    Returns:
+        Tuple[List[Dict], List[int], List[bool]]: The OCR pages of every tax form, the pages of every OCR call, and
+                                                   whether the artifact lock of a tax form was held during each call.
+    """
+    ocr_calls = []
+    artifact_lock_held = []
+
+    def ocr_pages(self, images):
+        ocr_calls.append(len(images))
+        artifact_lock_held.append(get_lock_path(self.base_dir, self.file_path.stem).exists())
+        time.sleep(0.05)
+        return [
+            AnnotationTable.from_annotations([Annotation(text="220,640.", bbox=[0.0, 0.0, 1.0, 1.0], center=[0.5, 0.5])])
+            for _ in images
+        ]
+
+    monkeypatch.setattr(PreprocessTaxForm, "_get_page_count", lambda self: 2)
+    monkeypatch.setattr(
+        PreprocessTaxForm, "_rasterize", lambda self, page_nums=None: [Image.new("L", (20, 20), 255)] * len(page_nums)
+    )
+    monkeypatch.setattr(PreprocessTaxForm, "_ocr_pages", ocr_pages)
+
+    results = []
+
+    def preprocess(file_path):
+        results.append(
+            PreprocessTaxForm(
+                file_path=file_path,
+                file_bytes=b"%PDF-1.4",
+                use_ocr_cache=use_ocr_cache,
+                persist_page_images=False,
+            ).ocr_pages
+        )
+
+    threads = [threading.Thread(target=preprocess, args=(file_path,)) for file_path in file_paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, ocr_calls, artifact_lock_held
+
+
+def test_concurrent_preprocessing_ocrs_once(tmp_path: Path, monkeypatch):
+    """
+    Test that processes preprocessing the same document at once OCR it once, the others waiting for the
+    annotation file and reusing it, that the artifact lock is not held while OCR-ing, and that no lock file
+    is left behind.
+    """
+    base_dir = tmp_path / "tax_forms"
+    results, ocr_calls, artifact_lock_held = preprocess_concurrently(
+        monkeypatch, [base_dir / "return.pdf"] * 3, use_ocr_cache=False
+    )
+
+    assert ocr_calls == [2]
+    assert artifact_lock_held == [False]
+    assert [sorted(pages) for pages in results] == [[0, 1]] * 3
+    assert (base_dir / "annotations" / "return.ann").exists()
+    assert not get_lock_path(base_dir, "return").exists()
+    assert not get_lock_path(base_dir, "compute-return").exists()
+
+
+def test_concurrent_preprocessing_of_the_same_content_ocrs_once(tmp_path: Path, monkeypatch):
+    """
+    Test that the same content stored under two names and preprocessed at once is OCR-ed once, the second
+    tax form being served from the OCR cache.
+    """
+    base_dir = tmp_path / "tax_forms"
+    results, ocr_calls, _ = preprocess_concurrently(
+        monkeypatch, [base_dir / "return.pdf", base_dir / "return_copy.pdf"], use_ocr_cache=True
+    )
+
+    assert ocr_calls == [2]
+    assert [sorted(pages) for pages in results] == [[0, 1]] * 2
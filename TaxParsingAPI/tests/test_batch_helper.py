@@ -0,0 +1,105 @@
+import zipfile
+from io import BytesIO
+from pathlib import Path
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from TaxParsingAPI.models import TaxForm, TaxField
+from TaxParsingAPI.serializers import get_default_tax_fields
+from TaxParsingAPI.helpers.batch_helper import TaxFormBatch, TaxFormBatchError
+
+
+def test_batch_from_uploads_expands_zip_archives(mock_pdf_path: Path, settings):
+    """
+    Test that PDF uploads and the PDF members of zip uploads are streamed to the storage under names of their
+    own, named by their path in the archive, and that a rejected file is deleted.
+    """
+    settings.MEDIA_ROOT = mock_pdf_path.parent.parent
+    pdf_content = mock_pdf_path.read_bytes()
+
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("smith/2023.pdf", pdf_content)
+        zip_file.writestr("jones/2023.pdf", pdf_content)
+        zip_file.writestr("returns/notes.txt", "not a tax form")
+        zip_file.writestr("__MACOSX/returns/._first.pdf", "resource fork")
+        zip_file.writestr("returns/scan.pdf", "not a PDF")
+
+    batch = TaxFormBatch.from_uploads(
+        uploads=[
+            SimpleUploadedFile(name=mock_pdf_path.name, content=pdf_content),
+            SimpleUploadedFile(name="returns.zip", content=archive.getvalue()),
+        ],
+        tax_fields=get_default_tax_fields(),
+    )
+
+    assert [name for name, _ in batch.files] == [mock_pdf_path.name, "smith/2023.pdf", "jones/2023.pdf", "returns/scan.pdf"]
+    assert len({stored_upload.name for _, stored_upload in batch.files}) == 4
+    assert all(stored_upload.path.read_bytes() == pdf_content for _, stored_upload in batch.files[:3])
+
+    batch.preflight()
+    assert batch.rejections[:3] == [None, None, None] and batch.rejections[3]
+    assert not batch.files[3][1].path.exists()
+    batch.discard()
+    assert not any(stored_upload.path.exists() for _, stored_upload in batch.files)
+
+
+def test_batch_process(db, mock_pdf_path: Path, settings):
+    """
+    Test that a batch persists every parsed tax form, the tax forms of the same name in different folders of an
+    archive included.
+    """
+    settings.MEDIA_ROOT = mock_pdf_path.parent.parent
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("smith/2023.pdf", mock_pdf_path.read_bytes())
+        zip_file.writestr("jones/2023.pdf", mock_pdf_path.read_bytes())
+    batch = TaxFormBatch.from_uploads(
+        [SimpleUploadedFile(name="returns.zip", content=archive.getvalue())], get_default_tax_fields()
+    )
+
+    results = batch.process()
+
+    assert [result["file"] for result in results] == ["smith/2023.pdf", "jones/2023.pdf"]
+    assert not any("error" in result for result in results)
+    for result in results:
+        tax_form = TaxForm.objects.get(id=result["id"])
+        assert tax_form.stage == TaxForm.PERSISTED
+        assert tax_form.tax_fields.count() == len(TaxField.FIELD_CHOICES)
+        assert tax_form.pay_this_amount == 7469
+
+
+def test_batch_from_uploads_refuses_large_batches_before_reading(mock_pdf_path: Path, settings, monkeypatch):
+    """
+    Test that a batch over the file or byte limit is refused from the zip directory, before any member is read,
+    and that a member larger than its zip directory says is not read past it.
+    """
+    settings.MEDIA_ROOT = mock_pdf_path.parent.parent
+    pdf_content = mock_pdf_path.read_bytes()
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for index in range(3):
+            zip_file.writestr(f"returns/{index}.pdf", pdf_content)
+
+    def upload():
+        return [SimpleUploadedFile(name="returns.zip", content=archive.getvalue())]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("a member was read")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(zipfile.ZipFile, "open", fail)
+        with pytest.raises(TaxFormBatchError, match="at most 2 tax forms"):
+            TaxFormBatch.from_uploads(upload(), get_default_tax_fields(), max_files=2)
+        with pytest.raises(TaxFormBatchError, match="bytes"):
+            TaxFormBatch.from_uploads(upload(), get_default_tax_fields(), max_bytes=3 * len(pdf_content) - 1)
+
+    batch = TaxFormBatch.from_uploads(upload(), get_default_tax_fields(), max_files=3, max_bytes=3 * len(pdf_content))
+    assert len(batch.files) == 3
+
+    # a zip directory understating the size of a member
+    understated = archive.getvalue().replace(len(pdf_content).to_bytes(4, "little"), (10).to_bytes(4, "little"))
+    with pytest.raises(TaxFormBatchError, match="could not be read"):
+        TaxFormBatch.from_uploads([SimpleUploadedFile(name="returns.zip", content=understated)], get_default_tax_fields())
+    # the members stored before the one that failed are deleted
+    stored_names = {mock_pdf_path.name} | {stored_upload.path.name for _, stored_upload in batch.files}
+    assert {path.name for path in mock_pdf_path.parent.iterdir() if path.is_file()} == stored_names
@@ -0,0 +1,44 @@
+from TaxParsingAPI.models import TaxForm, TaxField
+from TaxParsingAPI.helpers.cache_helper import (
+    etag_matches,
+    get_cached_representation,
+    set_cached_representation,
+)
+
+BASE_URI = "http://testserver/"
+
+
+def test_cached_representation_is_invalidated_on_change(db):
+    """
+    Test that saving a tax field or deleting a tax form drops the cached representation.
+    """
+    tax_form = TaxForm.objects.create(tax_form="tax_forms/cached.pdf")
+    set_cached_representation(tax_form.id, BASE_URI, {"id": str(tax_form.id)})
+
+    cached = get_cached_representation(tax_form.id, BASE_URI)
+    assert cached["data"] == {"id": str(tax_form.id)}
+    assert get_cached_representation(tax_form.id, "http://otherhost/") is None
+
+    TaxField.objects.create(
+        tax_form=tax_form,
+        tax_field=TaxField.TOTAL_TAX,
+        value_in_numeric=1,
+    )
+    assert get_cached_representation(tax_form.id, BASE_URI) is None
+
+    set_cached_representation(tax_form.id, BASE_URI, {"id": str(tax_form.id)})
+    tax_form.delete()
+    assert get_cached_representation(tax_form.id, BASE_URI) is None
+
+
+def test_etag_matches():
+    """
+    Test If-None-Match handling of strong, weak, wildcard and stale ETags.
+    """
+    etag = set_cached_representation("etag-test", BASE_URI, {"value": 1})["etag"]
+
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"stale", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"stale"', etag)
+    assert not etag_matches(None, etag)
@@ -0,0 +1,193 @@
+from pathlib import Path
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+import pytest
+from TaxParsingAPI import serializers
+from TaxParsingAPI.helpers import checkpoint_helper
+from TaxParsingAPI.helpers.preflight import PreflightReport, TaxFormPreflight
+from TaxParsingAPI.helpers.checkpoint_helper import TaxFormCheckpoint, get_requested_tax_fields, resume_tax_form
+from TaxParsingAPI.helpers.tax_form_helper import PreprocessTaxForm
+from TaxParsingAPI.helpers.utils.annotation import Annotation
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+from TaxParsingAPI.models import TaxForm, TaxField
+from TaxParsingAPI.parse.tax_parser import TaxParser
+from TaxParsingAPI.serializers import TaxFormProcessingFailed, TaxFormSerializer
+
+
+@pytest.fixture
+def received_tax_form(db, settings, tmp_path) -> TaxForm:
+    """
+    Fixture to receive a tax form asking for the total income only, with its file saved in a temporary directory.
+
+    Args:
+        db: The pytest-django database fixture.
+        settings: The pytest-django settings fixture.
+        tmp_path (pathlib.Path): A temporary directory path provided by pytest.
+
+    Returns:
+        TaxForm: The received tax form.
+    """
+    settings.MEDIA_ROOT = tmp_path
+    return TaxFormCheckpoint.receive(
+        ContentFile(b"%PDF-1.4", name="return.pdf"), [{"tax_field": TaxField.TOTAL_INCOME}], source="/archive/return.pdf"
+    )
+
+
+def test_record_advances_stage(received_tax_form):
+    """
+    Test that recording a stage advances the tax form to it, that partial OCR progress and earlier stages do not,
+    and that an error is kept until the next stage is recorded.
+    """
+    checkpoint = TaxFormCheckpoint(received_tax_form.id)
+    assert received_tax_form.stage == TaxForm.RECEIVED
+    assert checkpoint.get(TaxForm.RECEIVED)["artifacts"] == [received_tax_form.tax_form.name]
+    assert get_requested_tax_fields(received_tax_form) == [{"tax_field": TaxField.TOTAL_INCOME}]
+
+    checkpoint.record_stages(
+        {
+            TaxForm.OCR_DONE: {"pages": [0], "complete": False, "artifacts": ["annotations/return.ann.partial"]},
+            TaxForm.RASTERIZED: {"page_count": 2, "artifacts": []},
+        }
+    )
+    assert checkpoint.record_error(RuntimeError("OCR worker died")).stage == TaxForm.RASTERIZED
+    assert checkpoint.get("error") == "OCR worker died"
+
+    tax_form = checkpoint.record(TaxForm.OCR_DONE, pages=[0, 1], complete=True, artifacts=["annotations/return.ann"])
+    assert tax_form.stage == TaxForm.OCR_DONE
+    assert tax_form.checkpoints[TaxForm.OCR_DONE]["pages"] == [0, 1]
+    assert "error" not in tax_form.checkpoints
+    assert checkpoint.record(TaxForm.RASTERIZED, page_count=2, artifacts=[]).stage == TaxForm.OCR_DONE
+
+
+def test_resume_persists_parsed_checkpoint(received_tax_form, monkeypatch):
+    """
+    Test that resuming a parsed tax form persists the tax fields of its parsed checkpoint without parsing it again,
+    and that resuming a persisted tax form does nothing.
+    """
+    tax_fields = [
+        {
+            "tax_field": TaxField.TOTAL_INCOME,
+            "instruction_text": "total income",
+            "instruction_matched_pattern": "total income",
+            "value_text": "220,640.",
+            "value_normalized_text": "220640",
+            "value_in_numeric": "220640.00",
+            "value_matched_pattern": r"\d+",
+            "page_number": 0,
+        }
+    ]
+    TaxFormCheckpoint(received_tax_form.id).record(TaxForm.PARSED, tax_fields=tax_fields, page_count=2, artifacts=[])
+
+    def parse_tax_form(*args, **kwargs):
+        raise AssertionError("a parsed tax form is not parsed again")
+
+    monkeypatch.setattr(checkpoint_helper, "parse_tax_form", parse_tax_form)
+    tax_form = resume_tax_form(TaxForm.objects.get(id=received_tax_form.id))
+
+    assert tax_form.stage == TaxForm.PERSISTED
+    assert tax_form.parser_version
+    assert [tax_field.value_text for tax_field in tax_form.get_all_tax_fields()] == ["220,640."]
+    assert resume_tax_form(tax_form) is tax_form
+
+
+def test_interrupted_ocr_resumes_from_partial_annotations(tmp_path: Path, monkeypatch):
+    """
+    Test that the pages OCR-ed before an interruption are saved to the partial annotation file, and that
+    the retry only OCRs the remaining pages and replaces the partial file with the annotation file.
+    """
+    ocr_calls = []
+
+    def ocr_pages(self, images):
+        ocr_calls.append(len(images))
+        if len(ocr_calls) == 2:
+            raise RuntimeError("OCR worker died")
+        return [
+            AnnotationTable.from_annotations([Annotation(text="220,640.", bbox=[0.0, 0.0, 1.0, 1.0], center=[0.5, 0.5])])
+            for _ in images
+        ]
+
+    monkeypatch.setattr(PreprocessTaxForm, "_get_page_count", lambda self: 3)
+    monkeypatch.setattr(
+        PreprocessTaxForm, "_rasterize", lambda self, page_nums=None: [Image.new("L", (20, 20), 255)] * len(page_nums)
+    )
+    monkeypatch.setattr(PreprocessTaxForm, "_ocr_pages", ocr_pages)
+
+    def preprocess() -> PreprocessTaxForm:
+        return PreprocessTaxForm(
+            file_path=tmp_path / "tax_forms" / "return.pdf",
+            file_bytes=b"%PDF-1.4",
+            use_ocr_cache=False,
+            persist_page_images=False,
+            checkpoint_pages=1,
+        )
+
+    with pytest.raises(RuntimeError):
+        preprocess()
+    annotations_directory = tmp_path / "tax_forms" / "annotations"
+    assert (annotations_directory / "return.ann.partial").exists()
+    assert not (annotations_directory / "return.ann").exists()
+
+    preprocessed = preprocess()
+    assert ocr_calls == [1, 1, 1, 1]
+    assert sorted(preprocessed.ocr_pages) == [0, 1, 2]
+    assert preprocessed.stage_state[TaxForm.OCR_DONE] == {
+        "pages": [0, 1, 2],
+        "complete": True,
+        "artifacts": ["annotations/return.ann"],
+    }
+    assert (annotations_directory / "return.ann").exists()
+    assert not (annotations_directory / "return.ann.partial").exists()
+
+
+def test_single_upload_records_its_stages_and_resumes(db, settings, tmp_path, isolated_ocr_cache, monkeypatch):
+    """
+    Test that a single upload is received as a TaxForm before it is preprocessed, that a failure keeps it
+    with its error and the pages OCR-ed so far, that resuming it only OCRs the remaining pages, and that a
+    successful upload of the same content, served by the OCR cache, records its stages up to persisted.
+    """
+    settings.MEDIA_ROOT = tmp_path
+    settings.TAX_FORM_PERSIST_PAGE_IMAGES = False
+    settings.TAX_FORM_CHECKPOINT_PAGES = 1
+    ocr_calls = []
+
+    def ocr_pages(self, images):
+        ocr_calls.append(len(images))
+        if len(ocr_calls) == 2:
+            raise RuntimeError("OCR worker died")
+        return [AnnotationTable.from_annotations([]) for _ in images]
+
+    monkeypatch.setattr(TaxFormPreflight, "inspect", lambda self, **kwargs: PreflightReport(file_size=8, page_count=2))
+    monkeypatch.setattr(serializers, "admit_ocr_pages", lambda *args, **kwargs: None)
+    monkeypatch.setattr(serializers, "get_ocr_dispatcher", lambda: None)
+    monkeypatch.setattr(serializers, "get_ocr_task_queue", lambda: None)
+    monkeypatch.setattr(PreprocessTaxForm, "_get_page_count", lambda self: 2)
+    monkeypatch.setattr(
+        PreprocessTaxForm, "_rasterize", lambda self, page_nums=None: [Image.new("L", (20, 20), 255)] * len(page_nums)
+    )
+    monkeypatch.setattr(PreprocessTaxForm, "_ocr_pages", ocr_pages)
+    monkeypatch.setattr(TaxParser, "extract_tax_fields", lambda preprocessed_tax_form, tax_fields: [])
+
+    def upload() -> TaxFormSerializer:
+        serializer = TaxFormSerializer(data={"tax_form": SimpleUploadedFile("return.pdf", b"%PDF-1.4")})
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+    with pytest.raises(TaxFormProcessingFailed) as failed:
+        upload()
+    tax_form = TaxForm.objects.get()
+    assert failed.value.detail["id"] == str(tax_form.id)
+    assert tax_form.stage == TaxForm.RECEIVED
+    assert tax_form.checkpoints["error"] == "OCR worker died"
+    assert Path(tax_form.tax_form.path).exists()
+
+    resume_tax_form(tax_form)
+    assert ocr_calls == [1, 1, 1]
+    tax_form.refresh_from_db()
+    assert tax_form.stage == TaxForm.PERSISTED
+
+    tax_form = upload().save()
+    assert ocr_calls == [1, 1, 1]
+    assert tax_form.stage == TaxForm.PERSISTED
+    assert set(tax_form.checkpoints) == {TaxForm.RECEIVED, TaxForm.OCR_DONE, TaxForm.PARSED, TaxForm.PERSISTED}
+    assert TaxForm.objects.count() == 2
@@ -0,0 +1,73 @@
+import csv
+import json
+from io import StringIO
+from django.core.management import call_command
+from TaxParsingAPI.models import TaxForm, TaxField
+from TaxParsingAPI.helpers.export_helper import TaxFormExporter
+
+
+def create_tax_form(name: str, amount_owed: int, overpaid: int) -> TaxForm:
+    """
+    Create a TaxForm with an amount owed and an overpaid tax field.
+    """
+    tax_form = TaxForm.objects.create(tax_form=f"tax_forms/{name}")
+    for tax_field, value in [(TaxField.OVERPAID, overpaid), (TaxField.AMOUNT_OWED, amount_owed)]:
+        TaxField.objects.create(
+            tax_form=tax_form,
+            tax_field=tax_field,
+            instruction_text="instruction",
+            instruction_matched_pattern="pattern",
+            value_text=str(value),
+            value_normalized_text=str(value),
+            value_in_numeric=value,
+            value_matched_pattern="pattern",
+            page_number=1,
+        )
+    return tax_form
+
+
+def test_export_ndjson(db, django_assert_max_num_queries):
+    """
+    Test that every persisted tax form is exported with its tax fields, joined in bulk, leaving out the
+    tax forms still being processed.
+
+    With a chunk size of 2 and three tax forms, only the form query and one tax field
+    query per chunk should be issued.
+    """
+    owed = create_tax_form("owed.pdf", amount_owed=233, overpaid=0)
+    create_tax_form("overpaid.pdf", amount_owed=0, overpaid=3642)
+    TaxForm.objects.create(tax_form="tax_forms/empty.pdf")
+    TaxForm.objects.create(tax_form="tax_forms/received.pdf", stage=TaxForm.RECEIVED)
+
+    with django_assert_max_num_queries(3):
+        lines = list(TaxFormExporter(chunk_size=2).iter_ndjson())
+
+    records = [json.loads(line) for line in lines]
+    assert [record["tax_form"] for record in records] == [
+        "tax_forms/owed.pdf",
+        "tax_forms/overpaid.pdf",
+        "tax_forms/empty.pdf",
+    ]
+    assert records[0]["id"] == str(owed.id)
+    assert [tax_field["tax_field"] for tax_field in records[0]["tax_fields"]] == [
+        TaxField.OVERPAID,
+        TaxField.AMOUNT_OWED,
+    ]
+    assert [record["pay_this_amount"] for record in records] == [-233, 3642, 0]
+    assert records[2]["tax_fields"] == []
+
+
+def test_export_csv_command(db):
+    """
+    Test that the export_tax_forms command writes one CSV row per tax field.
+    """
+    create_tax_form("owed.pdf", amount_owed=233, overpaid=0)
+    TaxForm.objects.create(tax_form="tax_forms/empty.pdf")
+
+    out = StringIO()
+    call_command("export_tax_forms", format="csv", stdout=out)
+
+    rows = list(csv.DictReader(StringIO(out.getvalue())))
+    assert len(rows) == 3
+    assert [row["tax_field"] for row in rows] == [TaxField.OVERPAID, TaxField.AMOUNT_OWED, ""]
+    assert rows[0]["pay_this_amount"] == "-233"
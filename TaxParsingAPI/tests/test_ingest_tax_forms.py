@@ -0,0 +1,28 @@
+import shutil
+from io import StringIO
+from pathlib import Path
+from django.core.management import call_command
+from TaxParsingAPI.models import TaxForm
+
+
+def test_ingest_tax_forms_resumes_from_checkpoint(db, tmp_path: Path, mock_pdf_path: Path):
+    """
+    Test that ingest_tax_forms ingests every PDF once and skips checkpointed files on a later run.
+    """
+    archive_dir = tmp_path / "archive"
+    (archive_dir / "nested").mkdir(parents=True)
+    shutil.copy(mock_pdf_path, archive_dir / "first.pdf")
+    shutil.copy(mock_pdf_path, archive_dir / "nested" / "second.pdf")
+
+    out = StringIO()
+    call_command("ingest_tax_forms", str(archive_dir), batch_size=1, stdout=out)
+
+    assert TaxForm.objects.count() == 2
+    assert "pages/sec" in out.getvalue()
+    assert sorted((archive_dir / ".ingest_checkpoint").read_text().split()) == [
+        "first.pdf",
+        "nested/second.pdf",
+    ]
+
+    call_command("ingest_tax_forms", str(archive_dir), stdout=StringIO())
+    assert TaxForm.objects.count() == 2
@@ -0,0 +1,132 @@
+import os
+import time
+from pathlib import Path
+from PIL import Image, ImageDraw
+from TaxParsingAPI.helpers import ocr_cache as ocr_cache_module
+from TaxParsingAPI.helpers.ocr_cache import OcrCache, get_document_hash, get_file_document_hash, get_page_hash
+from TaxParsingAPI.helpers.tax_form_helper import PreprocessTaxForm
+from TaxParsingAPI.helpers.utils.annotation import Annotation
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+
+
+def get_pages(text: str):
+    return {
+        0: AnnotationTable.from_annotations(
+            [Annotation(text=text, bbox=[0.0, 0.0, 1.0, 1.0], center=[0.5, 0.5])]
+        )
+    }
+
+
+def test_memory_tier_evicts_least_recently_used():
+    """
+    Test that the memory tier evicts the least recently used document once over its byte budget.
+    """
+    entry_size = OcrCache._get_size(get_pages("a"))
+    ocr_cache = OcrCache(memory_bytes=2 * entry_size)
+
+    ocr_cache.put("a", get_pages("a"))
+    ocr_cache.put("b", get_pages("b"))
+    assert ocr_cache.get("a") is not None
+    ocr_cache.put("c", get_pages("c"))
+
+    assert ocr_cache.get("b") is None
+    assert ocr_cache.get("a")[0][0].text == "a"
+    assert ocr_cache.get("c")[0][0].text == "c"
+    assert ocr_cache.stats == {
+        "memory_hits": 3,
+        "disk_hits": 0,
+        "misses": 1,
+        "memory_evictions": 1,
+        "disk_evictions": 0,
+    }
+
+
+def test_disk_tier_promotes_and_evicts(tmp_path: Path):
+    """
+    Test that a document only on the disk tier is promoted to memory, and that the disk tier
+    evicts expired files, then the least recently used ones over its byte budget.
+    """
+    ocr_cache = OcrCache(memory_bytes=0, disk_directory=tmp_path)
+    ocr_cache.put("a", get_pages("a"))
+
+    assert ocr_cache.get("a")[0][0].text == "a"
+    assert ocr_cache.stats["disk_hits"] == 1
+
+    disk_size = (tmp_path / "a.ann").stat().st_size
+    ocr_cache.disk_bytes = 2 * disk_size
+    ocr_cache.put("b", get_pages("b"))
+    os.utime(tmp_path / "a.ann", (time.time() - 60, time.time() - 60))
+    ocr_cache.put("c", get_pages("c"))
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["b.ann", "c.ann"]
+
+    ocr_cache.disk_max_age = 30
+    os.utime(tmp_path / "b.ann", (time.time() - 60, time.time() - 60))
+    ocr_cache.put("d", get_pages("d"))
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["c.ann", "d.ann"]
+    assert ocr_cache.stats["disk_evictions"] == 2
+
+
+def test_get_document_hash():
+    """
+    Test that documents are keyed by the sha256 of their bytes.
+    """
+    assert get_document_hash(b"%PDF-1.4") == get_document_hash(b"%PDF-1.4")
+    assert get_document_hash(b"%PDF-1.4") != get_document_hash(b"%PDF-1.5")
+
+
+def test_get_file_document_hash(tmp_path, monkeypatch):
+    """
+    Test that a document file hashed in chunks gets the key of its bytes.
+    """
+    monkeypatch.setattr(ocr_cache_module, "DOCUMENT_HASH_CHUNK_SIZE", 3)
+    file_path = tmp_path / "return.pdf"
+    file_path.write_bytes(b"%PDF-1.4 several chunks")
+    assert get_file_document_hash(file_path) == get_document_hash(b"%PDF-1.4 several chunks")
+
+
+def get_page_image(text: str, speckles: bool = False) -> Image.Image:
+    image = Image.new("L", (1700, 2200), 255)
+    ImageDraw.Draw(image).text((200, 300), text, fill=0)
+    if speckles:
+        for x in range(100, 1600, 97):
+            image.putpixel((x, 2000), 245)
+    return image
+
+
+def test_get_page_hash():
+    """
+    Test that pages are keyed by their downscaled image, so a page with faint speckles matches,
+    while a changed value or a different page size do not.
+    """
+    page_hash = get_page_hash(get_page_image("Total income 220,640."))
+
+    assert get_page_hash(get_page_image("Total income 220,640.", speckles=True)) == page_hash
+    assert get_page_hash(get_page_image("Total income 220,646.")) != page_hash
+    assert get_page_hash(get_page_image("Total income 220,640.").resize((850, 1100))) != page_hash
+
+
+def test_ocr_pages_skips_cached_pages(isolated_page_cache, monkeypatch):
+    """
+    Test that only the pages missing from the page cache are OCR-ed, and that they are added to it.
+    """
+    ocr_calls = []
+
+    def ocr(image):
+        ocr_calls.append(image)
+        return get_pages(f"page {len(ocr_calls)}")[0]
+
+    monkeypatch.setattr(PreprocessTaxForm, "_ocr", staticmethod(ocr))
+    tax_form = object.__new__(PreprocessTaxForm)
+    tax_form.use_ocr_cache = True
+    tax_form.ocr_executor = None
+
+    boilerplate = get_page_image("Instructions for Form 1040")
+    first = tax_form._ocr_pages(images=[boilerplate, get_page_image("Total income 220,640.")])
+    second = tax_form._ocr_pages(images=[boilerplate.copy(), get_page_image("Total income 179,080.")])
+
+    assert len(ocr_calls) == 3
+    assert second[0] == first[0]
+    assert second[1].texts == ["page 3"]
+    assert isolated_page_cache.stats["memory_hits"] == 1
@@ -0,0 +1,84 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Thread
+import os
+from typing import List
+import pytest
+from PIL import Image
+from TaxParsingAPI.helpers import executor as executor_module
+from TaxParsingAPI.helpers.ocr_dispatcher import OcrDispatcher
+from TaxParsingAPI.helpers.shared_pages import SharedPage
+from TaxParsingAPI.helpers.utils.annotation import Annotation
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+
+
+def name_shared_pages(shared_pages: List[SharedPage]):
+    """
+    Stand-in for OCR on a worker, annotating every page with its width, and failing on pages 13 pixels wide.
+    """
+    results = []
+    for shared_page in shared_pages:
+        with shared_page.open() as image:
+            if image.width == 13:
+                results.append(ValueError("unreadable page"))
+                continue
+            results.append(
+                AnnotationTable.from_annotations(
+                    [Annotation(text=f"w{image.width}", bbox=[0.0, 0.0, 1.0, 1.0], center=[0.5, 0.5])]
+                )
+            )
+    return results
+
+
+def test_pages_of_concurrent_requests_are_batched():
+    """
+    Test that the pages submitted by concurrent threads are OCR-ed in fewer worker calls than pages,
+    that every result is routed back to its page, and that a failing page only fails itself.
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        dispatcher = OcrDispatcher(
+            executor=executor, max_batch_size=4, max_delay=0.05, batch_function=name_shared_pages
+        )
+        results = {}
+
+        def request(first_width: int):
+            images = [Image.new("L", (first_width + page, 10), 255) for page in range(3)]
+            results[first_width] = dispatcher.ocr_pages(images)
+
+        threads = [Thread(target=request, args=(width,)) for width in (20, 40, 60, 80)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        failing = dispatcher.submit(Image.new("L", (13, 10), 255))
+        succeeding = dispatcher.submit(Image.new("L", (14, 10), 255))
+        with pytest.raises(ValueError):
+            failing.result()
+        assert succeeding.result().texts == ["w14"]
+        dispatcher.close()
+
+    for first_width, tables in results.items():
+        assert [table.texts for table in tables] == [[f"w{first_width + page}"] for page in range(3)]
+    assert dispatcher.stats["pages"] == 14
+    assert dispatcher.stats["batches"] < dispatcher.stats["pages"]
+
+
+def test_worker_crash_replaces_the_pool(settings, monkeypatch):
+    """
+    Test that the pages of a batch OCR-ed when a worker crashed fail, and that the dispatcher OCRs the
+    next pages on a new worker pool instead of failing them too.
+    """
+    settings.TAX_FORM_WORKERS = 1
+    monkeypatch.setattr(executor_module, "_executor", None)
+    dispatcher = OcrDispatcher(max_batch_size=1, max_delay=0, batch_function=name_shared_pages)
+    try:
+        with pytest.raises(BrokenProcessPool):
+            executor_module.submit_to_executor(os._exit, 1).result()
+        broken = executor_module._executor
+
+        assert dispatcher.submit(Image.new("L", (21, 10), 255)).result().texts == ["w21"]
+        assert executor_module._executor is not broken
+    finally:
+        dispatcher.close()
+        executor_module.shutdown_executor()
@@ -0,0 +1,102 @@
+import threading
+import time
+import pytest
+from TaxParsingAPI.helpers.ocr_scheduler import BULK, INTERACTIVE, REPROCESS, OcrScheduler, get_tenant
+
+
+def drain(scheduler):
+    items = []
+    while True:
+        item = scheduler.get(timeout=0)
+        if item is None:
+            return items
+        items.append(item)
+
+
+def test_priority_classes():
+    """
+    Test that a more urgent class is always taken first, whenever its pages were queued.
+    """
+    scheduler = OcrScheduler()
+    scheduler.put("reprocess", priority=REPROCESS)
+    scheduler.put("bulk", priority=BULK)
+    scheduler.put("interactive", priority=INTERACTIVE)
+
+    assert drain(scheduler) == ["interactive", "bulk", "reprocess"]
+
+
+def test_fair_sharing():
+    """
+    Test that tenants take turns, and that the documents of a tenant take turns, one page each,
+    so a long document does not hold up the short ones queued after it.
+    """
+    scheduler = OcrScheduler()
+    for page in range(4):
+        scheduler.put(f"a-long-{page}", priority=BULK, tenant="a", document="long")
+    scheduler.put("a-short-0", priority=BULK, tenant="a", document="short")
+    for page in range(2):
+        scheduler.put(f"b-form-{page}", priority=BULK, tenant="b", document="form")
+
+    assert drain(scheduler) == [
+        "a-long-0", "b-form-0",
+        "a-short-0", "b-form-1",
+        "a-long-1", "a-long-2", "a-long-3",
+    ]
+
+
+def test_metrics():
+    """
+    Test that the queue depth, the tenants and documents waiting, and the dispatched pages and their
+    waits are reported by class.
+    """
+    scheduler = OcrScheduler()
+    scheduler.put("a-0", priority=BULK, tenant="a", document="x")
+    scheduler.put("b-0", priority=BULK, tenant="b", document="y")
+    scheduler.put("b-1", priority=BULK, tenant="b", document="z")
+
+    metrics = scheduler.metrics()
+    assert metrics[BULK]["depth"] == 3
+    assert metrics[BULK]["tenants"] == 2
+    assert metrics[BULK]["documents"] == 3
+    assert metrics[INTERACTIVE]["depth"] == 0
+
+    time.sleep(0.01)
+    drain(scheduler)
+    metrics = scheduler.metrics()
+    assert metrics[BULK]["depth"] == 0
+    assert metrics[BULK]["dispatched"] == 3
+    assert metrics[BULK]["wait_seconds"]["mean"] >= 0.01
+    assert metrics[BULK]["wait_seconds"]["max"] >= metrics[BULK]["wait_seconds"]["p99"] >= 0.01
+    assert metrics[INTERACTIVE]["wait_seconds"]["max"] == 0.0
+
+
+def test_get_waits_until_put_or_close():
+    """
+    Test that get times out on an empty queue, wakes up for a page queued while waiting, and
+    returns None once closed, and that an unknown class is rejected.
+    """
+    scheduler = OcrScheduler()
+    assert scheduler.get(timeout=0.01) is None
+
+    threading.Timer(0.01, scheduler.put, args=("page",)).start()
+    assert scheduler.get(timeout=5) == "page"
+
+    threading.Timer(0.01, scheduler.close).start()
+    assert scheduler.get() is None
+
+    with pytest.raises(ValueError):
+        scheduler.put("page", priority="urgent")
+
+
+def test_get_tenant(django_user_model):
+    """
+    Test that authenticated users are their own tenant, and that everyone else shares one.
+    """
+    class AnonymousUser:
+        is_authenticated = False
+
+    assert get_tenant(None) == ""
+    assert get_tenant(AnonymousUser()) == ""
+
+    user = django_user_model(pk=7)
+    assert get_tenant(user) == "7"
@@ -0,0 +1,125 @@
+from array import array
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.utils import timezone
+from PIL import Image as PILImage
+import pytest
+import uuid
+from TaxParsingAPI.helpers import ocr_task_queue as ocr_task_queue_module
+from TaxParsingAPI.helpers.ocr_scheduler import BULK, INTERACTIVE
+from TaxParsingAPI.helpers.ocr_task_queue import OcrTaskQueue
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
+from TaxParsingAPI.models import OcrTask
+
+
+def get_page_annotations(text: str) -> AnnotationTable:
+    return AnnotationTable(texts=[text], bboxes=array("d", [10, 20, 110, 40]), centers=array("d", [60, 30]))
+
+
+@pytest.fixture
+def task_queue(tmp_path) -> OcrTaskQueue:
+    """
+    Fixture to create a task queue with its task directory in a temporary directory.
+
+    Args:
+        tmp_path (pathlib.Path): A temporary directory path provided by pytest.
+
+    Returns:
+        OcrTaskQueue: The task queue.
+    """
+    return OcrTaskQueue(directory=tmp_path / "ocr_tasks", lease_seconds=30, max_attempts=2, poll_interval=0.01, timeout=5)
+
+
+def test_claim_leases_each_task_once(db, task_queue):
+    """
+    Test that tasks are claimed by priority then age, that a leased task is not claimed again, and that
+    only the worker holding the lease can renew or complete it.
+    """
+    bulk = task_queue.enqueue([PILImage.new("L", (20, 20), 255)] * 2, priority=BULK, document="bulk.pdf")
+    interactive = task_queue.enqueue([PILImage.new("L", (20, 20), 255)], priority=INTERACTIVE, document="upload.pdf")
+    assert all((task_queue.directory / task.image).exists() for task in bulk + interactive)
+
+    first = task_queue.claim("node-a:1", limit=2)
+    second = task_queue.claim("node-b:1", limit=2)
+    assert [task.id for task in first] == [interactive[0].id, bulk[0].id]
+    assert [task.id for task in second] == [bulk[1].id]
+    assert task_queue.claim("node-c:1") == []
+
+    assert task_queue.heartbeat(first) == 2
+    stale = OcrTask.objects.get(id=second[0].id)
+    stale.lease_token = uuid.uuid4()
+    assert task_queue.heartbeat([stale]) == 0
+    assert not task_queue.complete(stale, get_page_annotations("lost"))
+    assert task_queue.complete(second[0], get_page_annotations("kept"))
+    assert OcrTask.objects.get(id=second[0].id).status == OcrTask.DONE
+
+
+def test_expired_leases_are_requeued(db, task_queue):
+    """
+    Test that a task whose lease expired is queued again, completed by the worker that claims it next,
+    and fails once it was attempted max_attempts times.
+    """
+    task = task_queue.enqueue([PILImage.new("L", (20, 20), 255)], document="upload.pdf")[0]
+    dead_worker_task = task_queue.claim("node-a:1")[0]
+    OcrTask.objects.filter(id=task.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+    assert task_queue.requeue_expired() == 1
+    retried = task_queue.claim("node-b:1")[0]
+    assert retried.attempts == 2
+    assert not task_queue.complete(dead_worker_task, get_page_annotations("late"))
+
+    OcrTask.objects.filter(id=task.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+    assert task_queue.requeue_expired() == 0
+    assert OcrTask.objects.get(id=task.id).status == OcrTask.FAILED
+    with pytest.raises(RuntimeError):
+        task_queue.wait([task])
+    assert not OcrTask.objects.exists()
+
+
+def test_run_ocr_worker(db, task_queue, monkeypatch, settings):
+    """
+    Test that run_ocr_worker OCRs the queued pages and writes their annotations back, and that the producer
+    reads them and deletes the tasks and their files.
+    """
+    settings.OCR_TASK_QUEUE = {"DIRECTORY": task_queue.directory, "POLL_INTERVAL": 0.01}
+    monkeypatch.setattr(
+        ocr_task_queue_module, "ocr_task_image", lambda image_path: get_page_annotations(image_path.name)
+    )
+    from TaxParsingAPI.management.commands import run_ocr_worker
+
+    monkeypatch.setattr(run_ocr_worker, "ocr_task_image", ocr_task_queue_module.ocr_task_image)
+
+    tasks = task_queue.enqueue([PILImage.new("L", (20, 20), 255)] * 3, document="upload.pdf")
+    out = StringIO()
+    call_command("run_ocr_worker", once=True, in_process=True, batch_size=2, stdout=out)
+    assert "OCR-ed 3 pages (0 failed)" in out.getvalue()
+
+    annotations = task_queue.wait(tasks)
+    assert [table.texts for table in annotations] == [[task.image] for task in tasks]
+    assert not OcrTask.objects.exists()
+    assert list(task_queue.directory.iterdir()) == []
+
+
+def test_purge_stale_tasks(db, task_queue):
+    """
+    Test that the tasks done or failed retention_seconds ago, and the tasks their producer stopped waiting for,
+    are purged with their files, and that the other tasks are kept.
+    """
+    task_queue.retention_seconds = 60
+    done, failed, recent, abandoned, pending = task_queue.enqueue([PILImage.new("L", (20, 20), 255)] * 5)
+    for task in (done, recent):
+        task.lease_token = uuid.uuid4()
+        OcrTask.objects.filter(id=task.id).update(status=OcrTask.LEASED, lease_token=task.lease_token)
+        task_queue.complete(task, get_page_annotations(task.image))
+    OcrTask.objects.filter(id=failed.id).update(status=OcrTask.FAILED)
+    a_while_ago = timezone.now() - timedelta(seconds=61)
+    OcrTask.objects.filter(id__in=[done.id, failed.id]).update(updated_at=a_while_ago)
+    OcrTask.objects.filter(id=abandoned.id).update(created_at=a_while_ago - timedelta(seconds=task_queue.timeout))
+    done_result = OcrTask.objects.get(id=done.id).result
+
+    assert task_queue.purge() == 3
+    assert set(OcrTask.objects.values_list("id", flat=True)) == {recent.id, pending.id}
+    assert not (task_queue.directory / done.image).exists()
+    assert not (task_queue.directory / done_result).exists()
+    assert (task_queue.directory / recent.image).exists()
@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from django.apps import apps
+import numpy as np
+from PIL import Image, ImageDraw
+from TaxParsingAPI.helpers import executor, ocr_engine
+from TaxParsingAPI.helpers.ocr_engine import OcrEnginePool
+from TaxParsingAPI.helpers.utils.ocr_wrapper import OcrWrapper
+
+
+class BandOCR:
+    """
+    Stand-in for an OCR engine that recognizes every band of dark rows as one line, named after its width.
+    """
+
+    def __init__(self, image=None):
+        self.image = image
+        self.res = None
+
+    def recognize(self, px=False):
+        ink = np.asarray(self.image.convert("L")) < 128
+        rows = ink.any(axis=1)
+        lines = []
+        top = None
+        for row, has_ink in enumerate(list(rows) + [False]):
+            if has_ink and top is None:
+                top = row
+            elif not has_ink and top is not None:
+                cols = np.flatnonzero(ink[top:row].any(axis=0))
+                lines.append((f"w{cols[-1] - cols[0] + 1}", 1.0, (float(cols[0]), float(top), float(cols[-1] + 1), float(row))))
+                top = None
+        return lines
+
+
+def get_page() -> Image.Image:
+    page = Image.new("L", (1000, 2200), 255)
+    draw = ImageDraw.Draw(page)
+    for line, row in enumerate(range(140, 2150, 170)):
+        draw.rectangle([50, row, 300 + 10 * line - 1, row + 29], fill=0)
+    return page
+
+
+def test_strips_match_the_whole_page():
+    """
+    Test that a page OCR-ed in overlapping strips yields the annotations of the whole page, in page
+    coordinates, with the lines in the overlaps and the lines cut by a strip edge kept once.
+    """
+    engine_pool = OcrEnginePool(size=4, engine_factory=BandOCR)
+    page = get_page()
+
+    whole = OcrWrapper(image=page, engine_pool=engine_pool)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        strips = OcrWrapper(
+            image=page, strip_height=500, strip_overlap=60, executor=executor, engine_pool=engine_pool
+        )
+
+    assert len(strips.annotations) == len(whole.annotations) == 12
+    assert strips.annotations == whole.annotations
+    assert engine_pool.stats["recognitions"] == 1 + 5
+
+
+def test_short_page_is_not_split():
+    """
+    Test that a page no taller than a strip and its overlap is OCR-ed whole.
+    """
+    engine_pool = OcrEnginePool(engine_factory=BandOCR)
+
+    wrapper = OcrWrapper(
+        image=get_page().crop((0, 0, 1000, 550)), strip_height=500, strip_overlap=60, engine_pool=engine_pool
+    )
+
+    assert len(wrapper.annotations) == 3
+    assert engine_pool.stats["recognitions"] == 1
+
+
+def test_engine_pool_reuses_engines():
+    """
+    Test that the engines are created once, up to the pool size, and reused for every page,
+    and that the warm-up runs a recognition.
+    """
+    engine_pool = OcrEnginePool(size=2, engine_factory=BandOCR)
+    engine_pool.warm_up()
+
+    with engine_pool.engine() as first, engine_pool.engine() as second:
+        assert first is not second
+        assert first.image is None
+    for _ in range(3):
+        OcrWrapper(image=get_page(), engine_pool=engine_pool)
+
+    assert engine_pool.stats["created"] == 2
+    assert engine_pool.stats["recognitions"] == 4
+
+
+def test_warm_up_only_in_worker_processes(settings, monkeypatch):
+    """
+    Test that starting Django does not warm up the OCR engines, and that a worker process of the
+    worker pool only warms them up when OCR_ENGINES['WARM_UP'] is set.
+    """
+    warm_ups = []
+    monkeypatch.setattr(ocr_engine, "start_ocr_engine_warm_up", lambda: warm_ups.append(True))
+
+    apps.get_app_config("TaxParsingAPI").ready()
+    executor._initialize_worker()
+    assert warm_ups == []
+
+    settings.OCR_ENGINES = {**settings.OCR_ENGINES, "WARM_UP": True}
+    apps.get_app_config("TaxParsingAPI").ready()
+    assert warm_ups == []
+    executor._initialize_worker()
+    assert warm_ups == [True]
+
+
+def test_start_worker_pool_starts_the_workers(settings, monkeypatch):
+    """
+    Test that starting the worker pool creates it and runs a call per worker, on the worker processes.
+    """
+    settings.TAX_FORM_WORKERS = 2
+    monkeypatch.setattr(executor, "_executor", None)
+    try:
+        futures = executor.start_worker_pool()
+
+        assert executor._executor is not None
+        assert len(futures) == 2
+        assert all(future.result(timeout=60) != os.getpid() for future in futures)
+    finally:
+        executor.shutdown_executor()
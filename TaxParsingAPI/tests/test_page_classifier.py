@@ -0,0 +1,78 @@
+import subprocess
+from TaxParsingAPI.helpers import page_classifier
+from TaxParsingAPI.helpers.page_classifier import PageClassifier
+from TaxParsingAPI.parse.tax_parser import TaxParser
+
+PAGE_TEXTS = [
+    "Form 1040   Department of the Treasury   U.S. Individual Income Tax Return 2023\n"
+    "Filing Status   Single   Married filing jointly\n"
+    "9   Add lines 1z, 2b, 3b, 4b, 5b, 6b, 7, and 8. This is your total income   220,640.",
+    "Form 1040 (2023)                                                       Page 2\n"
+    "24  Add lines 22 and 23. This is your total tax   26,825.",
+    "SCHEDULE 1\n(Form 1040)   Additional Income and Adjustments to Income\n"
+    "Enter the amount from Form 1040, line 11, your adjusted gross income",
+    "Form 8949   Sales and Other Dispositions of Capital Assets",
+    "Instructions for the state return, keep this page for your records.",
+    "   ",
+]
+
+
+def test_classify_text():
+    """
+    Test that pages are labelled from their text, and that pages without text are unknown.
+    """
+    classifier = PageClassifier()
+
+    assert [classifier.classify_text(text) for text in PAGE_TEXTS] == [
+        "1040_p1",
+        "1040_p2",
+        "schedule",
+        "schedule",
+        "other",
+        "unknown",
+    ]
+
+
+def test_classify_reads_the_text_layer(monkeypatch, tmp_path):
+    """
+    Test that every page of the pdftotext output is labelled, and that no page is labelled without it.
+    """
+    pdf_path = tmp_path / "return.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4")
+
+    def run(command, **kwargs):
+        assert command == ["pdftotext", "-layout", str(pdf_path), "-"]
+        return subprocess.CompletedProcess(command, 0, stdout="\f".join(PAGE_TEXTS[:3] + [""]).encode())
+
+    monkeypatch.setattr(page_classifier.subprocess, "run", run)
+    assert PageClassifier().classify(file_path=pdf_path) == ["1040_p1", "1040_p2", "schedule"]
+
+    def run_without_pdftotext(command, **kwargs):
+        raise FileNotFoundError("pdftotext")
+
+    monkeypatch.setattr(page_classifier.subprocess, "run", run_without_pdftotext)
+    assert PageClassifier().classify(file_bytes=b"%PDF-1.4") == []
+
+
+def test_select_pages():
+    """
+    Test that the pages with a wanted label and the unknown ones are selected, and that every page
+    is selected when none has a wanted label.
+    """
+    wanted = ["1040_p1", "1040_p2"]
+
+    assert PageClassifier.select_pages(["schedule", "1040_p1", "unknown", "1040_p2", "other"], wanted) == [1, 2, 3]
+    assert PageClassifier.select_pages(["other", "schedule", "other"], wanted) == [0, 1, 2]
+
+
+def test_tax_parser_page_labels(settings):
+    """
+    Test that the requested tax fields map to the pages of Form 1040, unless page classification is disabled.
+    """
+    tax_fields = [{"tax_field": "total_income"}, {"tax_field": "amount_owed"}]
+
+    settings.TAX_FORM_CLASSIFY_PAGES = True
+    assert TaxParser.get_page_labels(tax_fields) == ["1040_p1", "1040_p2"]
+
+    settings.TAX_FORM_CLASSIFY_PAGES = False
+    assert TaxParser.get_page_labels(tax_fields) is None
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+from TaxParsingAPI.helpers.page_preprocessor import PagePreprocessor
+
+
+def get_page(angle: float = 0) -> Image.Image:
+    """
+    Draw a faint, light grey page with dark text-like lines, rotated by angle degrees.
+    """
+    page = Image.new("RGB", (600, 800), (235, 235, 225))
+    draw = ImageDraw.Draw(page)
+    for row in range(200, 600, 40):
+        draw.rectangle([100, row, 500, row + 6], fill=(60, 60, 90))
+    return page.rotate(angle, resample=Image.BILINEAR, fillcolor=(235, 235, 225))
+
+
+def test_grayscale_and_binarize():
+    """
+    Test that a page is converted to grayscale, and that binarization turns it black and white.
+    """
+    preprocessor = PagePreprocessor(binarize=True)
+    page = preprocessor.process(get_page())
+
+    assert page.mode == "L"
+    assert page.size == (600, 800)
+    pixels = np.asarray(page)
+    assert set(np.unique(pixels)) == {0, 255}
+    assert pixels[203, 300] == 0
+    assert pixels[100, 300] == 255
+    assert set(preprocessor.timings) == {"grayscale", "binarize"}
+    assert preprocessor.pages == 1
+
+
+def test_deskew_and_crop_margins():
+    """
+    Test that a skewed page is rotated back, and that its blank margins are cropped.
+    """
+    preprocessor = PagePreprocessor(deskew=True, crop_margins=True, margin=5)
+    page = np.asarray(preprocessor.process(get_page(angle=3)))
+
+    # every text line is horizontal again: its ink spans a few rows only
+    ink_rows = np.flatnonzero((page < PagePreprocessor.INK_THRESHOLD).any(axis=1))
+    assert ink_rows.size < 10 * 12
+    assert page.shape[0] < 420 and page.shape[1] < 420
+    assert set(preprocessor.timings) == {"grayscale", "deskew", "crop_margins"}
+
+
+def test_from_template(settings):
+    """
+    Test that a preprocessor is configured by its form template, falling back to the default one, that
+    the options it leaves out keep their defaults, and that the key of the templates changes with them.
+    """
+    settings.PAGE_PREPROCESSING = {"default": {"grayscale": False}, "scanned": {"binarize": True}}
+    settings.PAGE_PREPROCESSING_BY_LABEL = {"unknown": "scanned"}
+    key = PagePreprocessor.get_templates_key()
+
+    assert PagePreprocessor.from_template("scanned").binarize
+    assert PagePreprocessor.from_template("scanned").grayscale
+    assert not PagePreprocessor.from_template("unknown").grayscale
+    assert PagePreprocessor.get_template("unknown") == "scanned"
+    assert PagePreprocessor.get_template("1040_p1") == "default"
+    assert PagePreprocessor(binarize=True).get_key() == PagePreprocessor.from_template("scanned").get_key()
+    assert PagePreprocessor(binarize=True).get_key() != PagePreprocessor().get_key()
+
+    settings.PAGE_PREPROCESSING = {"default": {"grayscale": False}, "scanned": {"binarize": True, "offset": 5}}
+    assert PagePreprocessor.get_templates_key() != key
+
+
+def test_steps_need_grayscale():
+    """
+    Test that the steps working on grayscale pixels cannot be set without grayscale, instead of being ignored.
+    """
+    with pytest.raises(ValueError):
+        PagePreprocessor(grayscale=False, binarize=True)
+
+    page = get_page()
+    assert PagePreprocessor(grayscale=False).process(page) is page
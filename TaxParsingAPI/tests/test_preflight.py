@@ -0,0 +1,102 @@
+from pdf2image.exceptions import PDFInfoNotInstalledError, PDFPageCountError
+from rest_framework.exceptions import Throttled
+import pytest
+from TaxParsingAPI.helpers import preflight as preflight_module
+from TaxParsingAPI.helpers.ocr_dispatcher import OcrDispatcher
+from TaxParsingAPI.helpers.ocr_scheduler import BULK, INTERACTIVE
+from TaxParsingAPI.helpers.preflight import AdmissionController, AdmissionError, PreflightError, TaxFormPreflight
+from TaxParsingAPI.serializers import OcrQueueUnavailable, admit_ocr_pages
+
+
+def get_pdfinfo(page_sizes):
+    """
+    Get a pdfinfo stand-in reporting pages of the given sizes in points.
+    """
+    def pdfinfo_from_bytes(pdf_bytes, timeout=None, first_page=None, last_page=None):
+        info = {"Pages": len(page_sizes), "Encrypted": "no"}
+        for page_num, (width, height) in enumerate(page_sizes[:last_page], start=1):
+            info[f"Page {page_num:4d} size"] = f"{width} x {height} pts (letter)"
+        return info
+
+    return pdfinfo_from_bytes
+
+
+def test_preflight_checks_file_before_pdfinfo(monkeypatch):
+    """
+    Test that oversized files and files without the PDF magic bytes are rejected without running pdfinfo,
+    and that tax forms are admitted unchecked when pdfinfo is not installed.
+    """
+    def pdfinfo_not_installed(*args, **kwargs):
+        raise PDFInfoNotInstalledError("Unable to get page count. Is poppler installed and in PATH?")
+
+    monkeypatch.setattr(preflight_module, "pdfinfo_from_bytes", pdfinfo_not_installed)
+    preflight = TaxFormPreflight(max_bytes=100)
+
+    with pytest.raises(PreflightError, match="at most 100"):
+        preflight.inspect(file_bytes=b"%PDF-1.4" + b" " * 100)
+    with pytest.raises(PreflightError, match="not a PDF"):
+        preflight.inspect(file_bytes=b"PK\x03\x04 a zip archive")
+
+    report = preflight.inspect(file_bytes=b"mail header\n%PDF-1.7")
+    assert report.page_count is None
+    assert report.priority == INTERACTIVE
+
+
+def test_preflight_checks_pages(monkeypatch):
+    """
+    Test that the page count and sizes read by pdfinfo reject dumps and huge pages, route long tax forms
+    to the bulk class, and that an unreadable PDF is rejected.
+    """
+    preflight = TaxFormPreflight(max_pages=5, bulk_pages=2, max_page_pixels=10_000_000)
+    letter = (612, 792)
+
+    monkeypatch.setattr(preflight_module, "pdfinfo_from_bytes", get_pdfinfo([letter] * 2))
+    report = preflight.inspect(file_bytes=b"%PDF-1.4")
+    assert (report.page_count, report.page_sizes, report.priority) == (2, [(612.0, 792.0)] * 2, INTERACTIVE)
+
+    monkeypatch.setattr(preflight_module, "pdfinfo_from_bytes", get_pdfinfo([letter] * 3))
+    assert preflight.inspect(file_bytes=b"%PDF-1.4").priority == BULK
+
+    monkeypatch.setattr(preflight_module, "pdfinfo_from_bytes", get_pdfinfo([letter] * 6))
+    with pytest.raises(PreflightError, match="6 pages"):
+        preflight.inspect(file_bytes=b"%PDF-1.4")
+
+    monkeypatch.setattr(preflight_module, "pdfinfo_from_bytes", get_pdfinfo([letter, (14400, 14400)]))
+    with pytest.raises(PreflightError, match="Page 2"):
+        preflight.inspect(file_bytes=b"%PDF-1.4")
+
+    def pdfinfo_corrupt(*args, **kwargs):
+        raise PDFPageCountError("Unable to get page count.\nSyntax Error: Couldn't find trailer dictionary")
+
+    monkeypatch.setattr(preflight_module, "pdfinfo_from_bytes", pdfinfo_corrupt)
+    with pytest.raises(PreflightError, match="could not be read"):
+        preflight.inspect(file_bytes=b"%PDF-1.4")
+
+
+def test_admission_control():
+    """
+    Test that pages are refused with a 429 once their tenant has too many queued, with a 503 once every
+    tenant together has, and that the refusals reach the client with a Retry-After.
+    """
+    dispatcher = OcrDispatcher(executor=None)
+    for _ in range(3):
+        dispatcher.scheduler.put("page", priority=BULK, tenant="7", document="dump.pdf")
+    dispatcher.scheduler.put("page", priority=INTERACTIVE, tenant="8", document="return.pdf")
+    assert dispatcher.scheduler.depth() == 4
+    assert dispatcher.scheduler.depth(tenant="7") == 3
+
+    controller = AdmissionController(max_queued_pages=6, max_tenant_queued_pages=4, retry_after=3)
+    controller.admit(2, tenant="8", ocr_dispatcher=dispatcher)
+    with pytest.raises(AdmissionError) as tenant_refusal:
+        controller.admit(2, tenant="7", ocr_dispatcher=dispatcher)
+    assert (tenant_refusal.value.status_code, tenant_refusal.value.retry_after) == (429, 3)
+    with pytest.raises(AdmissionError) as refusal:
+        controller.admit(3, tenant="9", ocr_dispatcher=dispatcher)
+    assert refusal.value.status_code == 503
+
+    with pytest.raises(Throttled) as throttled:
+        admit_ocr_pages(500, INTERACTIVE, "7", ocr_dispatcher=dispatcher)
+    assert throttled.value.wait == 5
+    with pytest.raises(OcrQueueUnavailable) as unavailable:
+        admit_ocr_pages(2000, INTERACTIVE, "9", ocr_dispatcher=dispatcher)
+    assert unavailable.value.status_code == 503
@@ -1,4 +1,12 @@
+import shutil
+import numpy as np
+import pytest
+from PIL import Image
+from TaxParsingAPI.helpers import tax_form_helper
+from TaxParsingAPI.helpers.page_classifier import PageClassifier
 from TaxParsingAPI.helpers.tax_form_helper import PreprocessTaxForm, OCRPage
+from TaxParsingAPI.helpers.utils.annotation_store import AnnotationStore
+from TaxParsingAPI.helpers.utils.annotation_table import AnnotationTable
 from pathlib import Path
 from typing import Dict
 def test_preprocess_tax_form_intialization(mock_pdf_path:Path):
@@ -36,3 +44,172 @@ def test_preprocess_tax_form_intialization(mock_pdf_path:Path):
         assert isinstance(ocr_page, OCRPage)
     # Check if the file has the correct suffix
     assert preprocessed_tax_form.file_path.suffix == '.pdf', "The temporary file does not have a .pdf suffix."
+
+
+def test_preprocess_tax_form_annotations_only():
+    """
+    Test that a PreprocessTaxForm created with annotations_only loads the same OCR pages
+    from the saved annotations, without collecting any page image.
+    """
+    file_path = Path(__file__).parent / "parse" / "EngHwPDFs" / "7.pdf"
+
+    preprocessed_tax_form = PreprocessTaxForm(file_path=file_path, annotations_only=True, use_ocr_cache=False)
+    fully_preprocessed_tax_form = PreprocessTaxForm(file_path=file_path, use_ocr_cache=False)
+
+    assert preprocessed_tax_form.image_file_paths == []
+    assert list(preprocessed_tax_form.ocr_pages) == list(fully_preprocessed_tax_form.ocr_pages)
+    for page_number, ocr_page in preprocessed_tax_form.ocr_pages.items():
+        assert ocr_page.annotations == fully_preprocessed_tax_form.ocr_pages[page_number].annotations
+
+
+def test_preprocess_tax_form_ocr_cache(isolated_ocr_cache):
+    """
+    Test that a document preprocessed once is served from the memory tier of the OCR cache,
+    and from the disk tier once the memory tier is emptied.
+    """
+    file_path = Path(__file__).parent / "parse" / "EngHwPDFs" / "7.pdf"
+
+    preprocessed_tax_form = PreprocessTaxForm(file_path=file_path, annotations_only=True)
+    assert isolated_ocr_cache.stats["misses"] == 1
+
+    cached_tax_form = PreprocessTaxForm(file_path=file_path, file_bytes=file_path.read_bytes())
+    assert isolated_ocr_cache.stats["memory_hits"] == 1
+    assert cached_tax_form.document_hash == preprocessed_tax_form.document_hash
+    assert cached_tax_form.image_file_paths == []
+    for page_number, ocr_page in cached_tax_form.ocr_pages.items():
+        assert ocr_page.tax_file is cached_tax_form
+        assert ocr_page.annotations == preprocessed_tax_form.ocr_pages[page_number].annotations
+
+    isolated_ocr_cache.clear()
+    from_disk_tax_form = PreprocessTaxForm(file_path=file_path, annotations_only=True)
+    assert isolated_ocr_cache.stats["disk_hits"] == 1
+    assert list(from_disk_tax_form.ocr_pages) == list(preprocessed_tax_form.ocr_pages)
+
+
+def test_preprocess_tax_form_in_memory(mock_pdf_path:Path):
+    """
+    Test that a PreprocessTaxForm created without page image persistence OCRs the pages in memory,
+    writes the annotation file, and writes no page image nor annotated image.
+    """
+    preprocessed_tax_form = PreprocessTaxForm(file_path=mock_pdf_path, persist_page_images=False)
+
+    assert preprocessed_tax_form.image_file_paths == []
+    assert not preprocessed_tax_form.image_directory.exists()
+    assert not (preprocessed_tax_form.base_annotations_over_images_dir / mock_pdf_path.stem).exists()
+    assert preprocessed_tax_form.annotations_file_path.exists()
+    assert len(preprocessed_tax_form.ocr_pages) > 0
+
+
+def test_preprocess_tax_form_in_memory_uses_saved_annotations(tmp_path:Path):
+    """
+    Test that a PreprocessTaxForm created without page image persistence loads the saved annotations
+    instead of rasterizing the PDF again.
+    """
+    tax_dir = Path(__file__).parent / "parse" / "EngHwPDFs"
+    shutil.copy(tax_dir / "7.pdf", tmp_path / "7.pdf")
+    shutil.copytree(tax_dir / "annotations" / "7", tmp_path / "annotations" / "7")
+
+    preprocessed_tax_form = PreprocessTaxForm(
+        file_path=tmp_path / "7.pdf", persist_page_images=False, use_ocr_cache=False
+    )
+    saved_tax_form = PreprocessTaxForm(
+        file_path=tax_dir / "7.pdf", annotations_only=True, use_ocr_cache=False
+    )
+
+    assert not preprocessed_tax_form.image_directory.exists()
+    assert list(preprocessed_tax_form.ocr_pages) == list(saved_tax_form.ocr_pages)
+    for page_number, ocr_page in preprocessed_tax_form.ocr_pages.items():
+        assert ocr_page.annotations == saved_tax_form.ocr_pages[page_number].annotations
+
+
+def test_preprocess_tax_form_without_file(tmp_path:Path):
+    """
+    Test that a tax form with neither a file nor its bytes is refused instead of being preprocessed into no pages.
+    """
+    with pytest.raises(FileNotFoundError):
+        PreprocessTaxForm(file_path=tmp_path / "tax_forms" / "missing.pdf", use_ocr_cache=False)
+
+
+def test_preprocess_tax_form_by_page_template(tmp_path:Path, settings, monkeypatch):
+    """
+    Test that every page is preprocessed with the form template of its label, the scanned pages binarized,
+    that the annotation file records the preprocessing, and that the pages are OCR-ed again, and only
+    then, when the preprocessing changes.
+    """
+    settings.PAGE_PREPROCESSING = {
+        "default": {"grayscale": True},
+        "scanned": {"grayscale": True, "binarize": True},
+    }
+    settings.PAGE_PREPROCESSING_BY_LABEL = {"unknown": "scanned"}
+    ocr_calls = []
+
+    def ocr_pages(self, images):
+        ocr_calls.append([set(np.unique(np.asarray(image))) <= {0, 255} for image in images])
+        return [AnnotationTable.from_annotations([]) for _ in images]
+
+    monkeypatch.setattr(tax_form_helper, "pdfinfo_from_path", lambda *args, **kwargs: {"Pages": 2})
+    monkeypatch.setattr(
+        tax_form_helper,
+        "convert_from_path",
+        lambda *args, first_page, last_page, **kwargs: [Image.new("RGB", (60, 60), (200, 200, 190))]
+        * (last_page - first_page + 1),
+    )
+    monkeypatch.setattr(PageClassifier, "classify", lambda self, **kwargs: ["1040_p1", "unknown"])
+    monkeypatch.setattr(PreprocessTaxForm, "_ocr_pages", ocr_pages)
+    file_path = tmp_path / "tax_forms" / "return.pdf"
+    file_path.parent.mkdir()
+    file_path.write_bytes(b"%PDF-1.4")
+
+    def preprocess():
+        return PreprocessTaxForm(file_path=file_path, persist_page_images=False, use_ocr_cache=False)
+
+    preprocessed_tax_form = preprocess()
+    assert ocr_calls == [[False, True]]
+    assert sorted(preprocessed_tax_form.page_preprocessors) == ["default", "scanned"]
+    with AnnotationStore(path=preprocessed_tax_form.annotations_file_path) as store:
+        assert store.preprocessing == preprocessed_tax_form.preprocessing_key
+
+    preprocess()
+    assert len(ocr_calls) == 1
+
+    settings.PAGE_PREPROCESSING = {**settings.PAGE_PREPROCESSING, "default": {"grayscale": True, "binarize": True}}
+    preprocess()
+    assert ocr_calls[1:] == [[True, True]]
+
+
+def test_preprocess_tax_form_rasterizes_only_the_pages_to_ocr(tmp_path:Path, monkeypatch):
+    """
+    Test that only the pages to OCR are rasterized, a run of consecutive pages and a checkpoint chunk
+    at a time, and that every chunk is OCR-ed before the next one is rasterized.
+    """
+    calls = []
+
+    def convert_from_path(pdf_path, first_page, last_page, **kwargs):
+        calls.append(("rasterize", first_page, last_page))
+        return [Image.new("L", (20, 20), 255)] * (last_page - first_page + 1)
+
+    def ocr_pages(self, images):
+        calls.append(("ocr", len(images)))
+        return [AnnotationTable.from_annotations([]) for _ in images]
+
+    monkeypatch.setattr(tax_form_helper, "pdfinfo_from_path", lambda *args, **kwargs: {"Pages": 6})
+    monkeypatch.setattr(tax_form_helper, "convert_from_path", convert_from_path)
+    monkeypatch.setattr(
+        PageClassifier, "classify", lambda self, **kwargs: ["other", "1040_p1", "unknown", "other", "1040_p2", "1040_p2"]
+    )
+    monkeypatch.setattr(PreprocessTaxForm, "_ocr_pages", ocr_pages)
+    file_path = tmp_path / "tax_forms" / "return.pdf"
+    file_path.parent.mkdir()
+    file_path.write_bytes(b"%PDF-1.4")
+
+    preprocessed_tax_form = PreprocessTaxForm(
+        file_path=file_path,
+        persist_page_images=False,
+        use_ocr_cache=False,
+        ocr_page_labels=["1040_p1", "1040_p2"],
+        checkpoint_pages=3,
+    )
+
+    assert calls == [("rasterize", 2, 3), ("rasterize", 5, 5), ("ocr", 3), ("rasterize", 6, 6), ("ocr", 1)]
+    assert sorted(preprocessed_tax_form.ocr_pages) == [1, 2, 4, 5]
+    assert preprocessed_tax_form.stage_state["rasterized"]["page_count"] == 6
@@ -0,0 +1,62 @@
+from pathlib import Path
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from TaxParsingAPI.models import TaxForm, TaxField
+from TaxParsingAPI.parse.tax_parser import TaxParser
+from TaxParsingAPI.helpers.reprocess_helper import TaxFormReprocessor
+
+TAX_DIR = Path(__file__).parent / "parse" / "EngHwPDFs"
+
+
+def test_reprocess_stale_tax_forms(db, settings):
+    """
+    Test that a tax form parsed by a stale parser version is re-parsed from its saved annotations,
+    and that a current tax form is left alone.
+    """
+    settings.MEDIA_ROOT = TAX_DIR.parent
+
+    tax_form = TaxForm.objects.create(tax_form=f"{TAX_DIR.name}/7.pdf", parser_version="stale")
+    TaxField.objects.create(tax_form=tax_form, tax_field=TaxField.TOTAL_TAX, value_in_numeric=0)
+
+    reprocessor = TaxFormReprocessor()
+    assert reprocessor.run() == 1, reprocessor.errors
+
+    tax_form.refresh_from_db()
+    assert tax_form.parser_version == TaxParser.get_version()
+    assert tax_form.tax_fields.count() == 1
+    assert tax_form.get_tax_field(TaxField.TOTAL_TAX).value_text == "26,825."
+
+    assert TaxFormReprocessor().run() == 0
+
+
+def test_reprocess_api_in_batches(db, settings):
+    """
+    Test that the reprocess endpoint re-parses at most a batch of stale tax forms per request, and
+    that its cursor resumes after them, past the tax forms that failed.
+    """
+    settings.MEDIA_ROOT = TAX_DIR.parent
+    settings.TAX_FORM_REPROCESS_MAX_BATCH = 2
+
+    missing = TaxForm.objects.create(tax_form=f"{TAX_DIR.name}/missing.pdf", parser_version="stale")
+    for _ in range(3):
+        tax_form = TaxForm.objects.create(tax_form=f"{TAX_DIR.name}/7.pdf", parser_version="stale")
+        TaxField.objects.create(tax_form=tax_form, tax_field=TaxField.TOTAL_TAX, value_in_numeric=0)
+
+    client = APIClient()
+    client.force_authenticate(User.objects.create_user("preparer"))
+    url = "/api/tax-forms/reprocess/"
+
+    response = client.post(f"{url}?limit=10")
+    assert response.status_code == 200
+    assert response.data["reprocessed"] == 1
+    assert list(response.data["errors"]) == [str(missing.id)]
+    assert response.data["next_cursor"]
+
+    response = client.post(url, QUERY_STRING=f"cursor={response.data['next_cursor']}")
+    assert response.data["reprocessed"] == 2
+    assert response.data["errors"] == {}
+    assert response.data["next_cursor"] is None
+
+    assert TaxForm.objects.exclude(parser_version=TaxParser.get_version()).get() == missing
+    assert client.post(url, QUERY_STRING="cursor=unknown").status_code == 400
+    assert client.post(url, QUERY_STRING="limit=0").status_code == 400
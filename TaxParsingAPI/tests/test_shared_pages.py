@@ -0,0 +1,51 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import os
+import pytest
+from PIL import Image
+from TaxParsingAPI.helpers.shared_pages import SharedPage, share_pages
+
+
+def read_shared_page(shared_page: SharedPage):
+    with shared_page.open() as image:
+        return image.size, image.getpixel((0, 0)), image.getpixel((image.width - 1, image.height - 1))
+
+
+def fail_on_shared_page(shared_page: SharedPage):
+    with shared_page.open():
+        raise RuntimeError("worker failed")
+
+
+def crash_on_shared_page(shared_page: SharedPage):
+    with shared_page.open():
+        os._exit(1)
+
+
+def test_shared_pages_are_read_by_workers_and_unlinked():
+    """
+    Test that a worker process reads a page from shared memory as grayscale, and that every
+    segment is unlinked once the pages are released, even when a worker fails or dies.
+    """
+    image = Image.new("RGB", (40, 30), (255, 255, 255))
+    image.putpixel((39, 29), (0, 0, 0))
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        with share_pages([image]) as shared_pages:
+            assert shared_pages[0].shape == (30, 40)
+            assert executor.submit(read_shared_page, shared_pages[0]).result() == ((40, 30), 255, 0)
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shared_pages[0].name)
+
+        with pytest.raises(RuntimeError):
+            with share_pages([image]) as shared_pages:
+                executor.submit(fail_on_shared_page, shared_pages[0]).result()
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shared_pages[0].name)
+
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(BrokenProcessPool):
+            with share_pages([image]) as shared_pages:
+                executor.submit(crash_on_shared_page, shared_pages[0]).result()
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shared_pages[0].name)
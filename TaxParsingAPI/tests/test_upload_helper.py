@@ -0,0 +1,38 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+import pytest
+from TaxParsingAPI.helpers import upload_helper
+from TaxParsingAPI.helpers.ocr_cache import get_document_hash
+from TaxParsingAPI.helpers.upload_helper import UploadTooLarge, store_upload
+
+
+def test_store_upload_streams_and_hashes(settings, tmp_path, monkeypatch):
+    """
+    Test that an upload is copied chunk by chunk under a name no stored tax form has, with the document hash
+    of its bytes, and that an upload over the limit leaves no file behind.
+    """
+    settings.MEDIA_ROOT = tmp_path
+    monkeypatch.setattr(upload_helper, "UPLOAD_CHUNK_SIZE", 4)
+    content = b"%PDF-1.4 streamed in chunks"
+
+    first = store_upload(SimpleUploadedFile(name="return.pdf", content=content))
+    second = store_upload(SimpleUploadedFile(name="nested/return.pdf", content=content))
+
+    assert first.name == "tax_forms/return.pdf"
+    assert second.name != first.name and second.name.startswith("tax_forms/return")
+    assert first.path.read_bytes() == second.path.read_bytes() == content
+    assert first.size == len(content)
+    assert first.document_hash == second.document_hash == get_document_hash(content)
+
+    upload = SimpleUploadedFile(name="dump.pdf", content=content)
+    with pytest.raises(UploadTooLarge):
+        store_upload(upload, max_bytes=10)
+    # the declared size can be wrong, the limit is enforced on the streamed bytes too
+    upload.size = None
+    with pytest.raises(UploadTooLarge):
+        store_upload(upload, max_bytes=10)
+    assert sorted(path.name for path in (tmp_path / "tax_forms").iterdir()) == sorted(
+        [first.path.name, second.path.name]
+    )
+
+    first.delete()
+    assert not first.path.exists()
@@ -0,0 +1,200 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import hashlib
+import io
+import threading
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.test import APIClient
+import pytest
+from TaxParsingAPI.models import TaxForm, UploadSession
+from TaxParsingAPI.parse.tax_parser import TaxParser
+from TaxParsingAPI.serializers import TaxFormSerializer
+from TaxParsingAPI.helpers.upload_session_helper import UploadSessionError, UploadSessionStore
+from TaxParsingAPI.helpers.utils.atomic_files import get_lock_path
+
+CONTENT = b"%PDF-1.4 a scanned return sent in ranges"
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+def write_range(store, session, first, last, body=None):
+    """
+    Write the bytes first to last of CONTENT, or the given body, as one range.
+    """
+    body = CONTENT[first:last + 1] if body is None else body
+    return store.write(session, f"bytes {first}-{last}/{len(CONTENT)}", io.BytesIO(body))
+
+
+def test_write_resumes_from_offset(db, tmp_path):
+    """
+    Test that ranges are only accepted from within the received bytes, that a resent range does no harm,
+    and that a body cut short keeps its received bytes.
+    """
+    store = UploadSessionStore(directory=tmp_path / "sessions", max_range_bytes=16)
+    with pytest.raises(UploadSessionError) as too_large:
+        store.create("return.pdf", size=10**12, sha256=SHA256)
+    assert too_large.value.status_code == 413
+    session = store.create("nested/return.pdf", size=len(CONTENT), sha256=SHA256.upper(), tenant="7")
+    assert (session.file_name, session.sha256, session.offset) == ("return.pdf", SHA256, 0)
+
+    assert write_range(store, session, 0, 9).offset == 10
+    with pytest.raises(UploadSessionError) as gap:
+        write_range(store, session, 12, 20)
+    assert gap.value.status_code == 409
+    with pytest.raises(UploadSessionError) as too_long:
+        write_range(store, session, 10, 30)
+    assert too_long.value.status_code == 413
+
+    # the response of a range was lost and the client sends it again, with the next bytes
+    assert write_range(store, session, 5, 20).offset == 21
+    with pytest.raises(UploadSessionError, match="holds 4 of the 10"):
+        write_range(store, session, 21, 30, body=CONTENT[21:25])
+    assert session.offset == 25
+    write_range(store, session, 25, len(CONTENT) - 1)
+
+    assert session.is_complete()
+    assert store.get_part_path(session).read_bytes() == CONTENT
+
+
+def test_finalize_verifies_hash(db, settings, tmp_path):
+    """
+    Test that a file is only stored once complete and matching its sha256, that a mismatch restarts the
+    session, that a session being processed cannot be finalized again, and that a released one can.
+    """
+    settings.MEDIA_ROOT = tmp_path / "media"
+    store = UploadSessionStore(directory=tmp_path / "sessions")
+    session = store.create("return.pdf", size=len(CONTENT), sha256=SHA256)
+
+    write_range(store, session, 0, 9)
+    with pytest.raises(UploadSessionError, match="missing") as incomplete:
+        store.finalize(session)
+    assert incomplete.value.status_code == 409
+
+    write_range(store, session, 10, len(CONTENT) - 1, body=b"x" * (len(CONTENT) - 10))
+    with pytest.raises(UploadSessionError) as mismatch:
+        store.finalize(session)
+    assert mismatch.value.status_code == 422
+    session.refresh_from_db()
+    assert session.offset == 0
+
+    write_range(store, session, 0, len(CONTENT) - 1)
+    stored_upload = store.finalize(session)
+    assert stored_upload.name == "tax_forms/return.pdf"
+    assert stored_upload.path.read_bytes() == CONTENT
+    assert stored_upload.document_hash == SHA256
+    assert not store.get_part_path(session).exists()
+    assert session.status == UploadSession.PROCESSING
+
+    with pytest.raises(UploadSessionError, match="being processed") as processing:
+        store.finalize(session)
+    assert processing.value.status_code == 409
+    with pytest.raises(UploadSessionError):
+        store.delete(session)
+    assert store.release(session).status == UploadSession.STORED
+    assert store.finalize(session) == stored_upload
+    with pytest.raises(UploadSessionError):
+        write_range(store, session, 0, 9)
+
+
+def test_purge_expired(db, settings, tmp_path):
+    """
+    Test that unfinished sessions past their expiry are deleted with their part file, and that no lock
+    file of a session is left behind.
+    """
+    settings.MEDIA_ROOT = tmp_path
+    store = UploadSessionStore()
+    assert store.directory == tmp_path / "tax_forms" / "upload_sessions"
+    expired = store.create("expired.pdf", size=len(CONTENT), sha256=SHA256)
+    write_range(store, expired, 0, 9)
+    UploadSession.objects.filter(id=expired.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+    # creating a session purges the expired ones
+    active = store.create("active.pdf", size=len(CONTENT), sha256=SHA256)
+
+    assert store.purge_expired() == 0
+    assert not UploadSession.objects.filter(id=expired.id).exists()
+    assert not store.get_part_path(expired).exists()
+    assert UploadSession.objects.filter(id=active.id).exists()
+    assert not get_lock_path(store.directory, str(expired.id)).exists()
+    assert not get_lock_path(store.directory, str(active.id)).exists()
+
+
+def test_upload_session_api(db, settings, tmp_path):
+    """
+    Test that a client creates a session, sends its ranges as raw bodies, asks for the offset to resume
+    from after a refused range, and only sees its own sessions.
+    """
+    settings.TAX_FORM_UPLOAD_SESSIONS = {"DIRECTORY": tmp_path / "sessions", "MAX_RANGE_BYTES": 16}
+    client = APIClient()
+    client.force_authenticate(User.objects.create_user("preparer"))
+
+    response = client.post(
+        "/api/tax-form-uploads/", {"file_name": "return.pdf", "size": len(CONTENT), "sha256": SHA256}, format="json"
+    )
+    assert response.status_code == 201
+    url = response["Location"]
+    assert response.data["offset"] == 0
+
+    response = client.put(
+        url, CONTENT[:16], content_type="application/octet-stream", HTTP_CONTENT_RANGE=f"bytes 0-15/{len(CONTENT)}"
+    )
+    assert (response.status_code, response.data["offset"]) == (200, 16)
+    response = client.put(
+        url, CONTENT[20:30], content_type="application/octet-stream", HTTP_CONTENT_RANGE=f"bytes 20-29/{len(CONTENT)}"
+    )
+    assert (response.status_code, response.data["offset"]) == (409, 16)
+    assert client.put(url, CONTENT[16:], content_type="application/octet-stream").status_code == 400
+    assert client.get(url).data["offset"] == 16
+
+    other_client = APIClient()
+    other_client.force_authenticate(User.objects.create_user("other"))
+    assert other_client.get(url).status_code == 404
+
+    assert client.delete(url).status_code == 204
+    assert not UploadSession.objects.exists()
+
+
+def test_concurrent_finalize_processes_the_file_once(transactional_db, settings, tmp_path, monkeypatch):
+    """
+    Test that a finalize retried while the first one is processing the file gets a 409 with the session,
+    and that only one tax form is created.
+    """
+    settings.MEDIA_ROOT = tmp_path / "media"
+    settings.TAX_FORM_UPLOAD_SESSIONS = {"DIRECTORY": tmp_path / "sessions"}
+    started, release = threading.Event(), threading.Event()
+    processed = []
+
+    def slow_preprocess_upload(self, upload, requested_tax_fields, stored_upload=None):
+        processed.append(stored_upload.name)
+        self.stored_upload = stored_upload
+        started.set()
+        release.wait(timeout=5)
+        return None
+
+    monkeypatch.setattr(TaxFormSerializer, "_preprocess_upload", slow_preprocess_upload)
+    monkeypatch.setattr(TaxParser, "extract_tax_fields", lambda preprocessed_tax_form, tax_fields: [])
+    user = User.objects.create_user("preparer")
+    store = UploadSessionStore.from_settings()
+    session = store.create("return.pdf", size=len(CONTENT), sha256=SHA256, tenant=str(user.id))
+    write_range(store, session, 0, len(CONTENT) - 1)
+    url = f"/api/tax-form-uploads/{session.id}/finalize/"
+
+    def finalize():
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(url)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        first = executor.submit(finalize)
+        assert started.wait(timeout=5)
+        retry = finalize()
+        release.set()
+        first = first.result()
+
+    assert retry.status_code == 409
+    assert retry.data["status"] == UploadSession.PROCESSING
+    assert first.status_code == 201
+    assert len(processed) == 1
+    assert TaxForm.objects.count() == 1
+    session.refresh_from_db()
+    assert session.status == UploadSession.FINALIZED and session.tax_form_id == TaxForm.objects.get().id
+    assert finalize().data["id"] == str(session.tax_form_id)
@@ -1,10 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TaxFormViewSet
+from .views import AsyncTaxFormDetailView, AsyncTaxFormListView, TaxFormViewSet, UploadSessionViewSet
 
 router = DefaultRouter()
 router.register(r'tax-forms', TaxFormViewSet)
+router.register(r'tax-form-uploads', UploadSessionViewSet)
 
 urlpatterns = [
+    # list, create and retrieve of the tax forms are served as coroutines, the other routes by TaxFormViewSet
+    path('tax-forms/', AsyncTaxFormListView.as_view()),
+    path('tax-forms/<uuid:pk>/', AsyncTaxFormDetailView.as_view()),
     path('', include(router.urls)),
 ]
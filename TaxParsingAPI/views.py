@@ -1,9 +1,474 @@
+import io
+import uuid
+from asgiref.sync import sync_to_async
+from rest_framework import mixins
 from rest_framework import viewsets
-from TaxParsingAPI.models import TaxForm
-from TaxParsingAPI.serializers import TaxFormSerializer
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections
+from django.http import Http404, StreamingHttpResponse
+from django.views import View
+from TaxParsingAPI.models import TaxForm, UploadSession
+from TaxParsingAPI.serializers import (
+    TaxFormSerializer,
+    UploadSessionSerializer,
+    admit_ocr_pages,
+    get_default_tax_fields,
+)
+from TaxParsingAPI.helpers.export_helper import TaxFormExporter
+from TaxParsingAPI.helpers.batch_helper import TaxFormBatch, TaxFormBatchError
+from TaxParsingAPI.helpers.reprocess_helper import TaxFormReprocessor
+from TaxParsingAPI.helpers.checkpoint_helper import resume_tax_form
+from TaxParsingAPI.helpers.upload_session_helper import UploadSessionError, UploadSessionStore
+from TaxParsingAPI.helpers.ocr_dispatcher import get_ocr_dispatcher
+from TaxParsingAPI.helpers.ocr_task_queue import get_ocr_task_queue
+from TaxParsingAPI.helpers.ocr_scheduler import BULK, get_tenant
+from TaxParsingAPI.helpers.executor import get_request_executor
+from TaxParsingAPI.helpers.cache_helper import (
+    aget_cached_representations,
+    aset_cached_representations,
+    etag_matches,
+    get_cached_representation,
+    set_cached_representation,
+)
 from rest_framework.permissions import IsAuthenticated
 
+
+def get_cached_response(request, cached):
+    """
+    Respond with a cached representation and its ETag, or with a 304 if the client already holds it.
+    """
+    headers = {"ETag": cached["etag"]}
+    if etag_matches(request.headers.get("If-None-Match"), cached["etag"]):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(cached["data"], headers=headers)
+
+
 class TaxFormViewSet(viewsets.ModelViewSet):
     queryset = TaxForm.objects.all()
     serializer_class = TaxFormSerializer
     permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        """
+        Get the persisted tax forms, the others are still being processed or failed and have no tax fields yet.
+        Only resume reaches the tax forms that were not persisted.
+        """
+        queryset = super().get_queryset()
+        if self.action == "resume":
+            return queryset
+        return queryset.filter(stage=TaxForm.PERSISTED)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Retrieve a tax form from the representation cache, honoring If-None-Match.
+
+        On a cache hit no database query is made for the tax form. If the client already
+        holds the current representation a 304 is returned without a body.
+        """
+        try:
+            # normalize the id so every spelling of it shares one cache entry
+            tax_form_id = uuid.UUID(kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            return super().retrieve(request, *args, **kwargs)
+        base_uri = request.build_absolute_uri("/")
+
+        cached = get_cached_representation(tax_form_id, base_uri)
+        if cached is None:
+            response = super().retrieve(request, *args, **kwargs)
+            cached = set_cached_representation(tax_form_id, base_uri, response.data)
+        return get_cached_response(request, cached)
+
+    @action(detail=False, methods=["get"], url_path=r"export/(?P<export_format>ndjson|csv)")
+    def export(self, request, export_format=None):
+        """
+        Stream every tax form and its tax fields as NDJSON or CSV.
+        """
+        exporter = TaxFormExporter(queryset=self.filter_queryset(self.get_queryset()))
+
+        if export_format == "csv":
+            response = StreamingHttpResponse(exporter.iter_csv(), content_type="text/csv")
+        else:
+            response = StreamingHttpResponse(exporter.iter_ndjson(), content_type="application/x-ndjson")
+        response["Content-Disposition"] = f'attachment; filename="tax_forms.{export_format}"'
+        return response
+
+    @action(detail=False, methods=["post"], url_path="batch")
+    def batch(self, request):
+        """
+        Upload many tax forms, as PDF files or zip archives of PDF files, in one request.
+
+        The tax forms are processed in parallel and the response holds one result per file,
+        either the created tax form or the error it failed with. The batch is refused with a 429
+        or a 503 and a Retry-After header while the OCR queues cannot take its pages.
+        """
+        uploads = request.FILES.getlist("tax_forms")
+        if not uploads:
+            raise ValidationError({"tax_forms": ["No files were submitted."]})
+
+        try:
+            batch = TaxFormBatch.from_uploads(
+                uploads=uploads,
+                tax_fields=get_default_tax_fields(),
+                tenant=get_tenant(request.user),
+                max_files=getattr(settings, "TAX_FORM_BATCH_MAX_FILES", None),
+                max_bytes=getattr(settings, "TAX_FORM_BATCH_MAX_BYTES", None),
+            )
+        except TaxFormBatchError as error:
+            raise ValidationError({"tax_forms": [str(error)]})
+        try:
+            admit_ocr_pages(
+                batch.preflight(),
+                BULK,
+                batch.tenant,
+                ocr_dispatcher=get_ocr_dispatcher(),
+                ocr_task_queue=get_ocr_task_queue(),
+            )
+        except BaseException:
+            batch.discard()
+            raise
+
+        results = batch.process()
+        for result in results:
+            if "id" in result:
+                result["url"] = reverse("taxform-detail", kwargs={"pk": result["id"]}, request=request)
+
+        failed = any("error" in result for result in results)
+        return Response(
+            {"results": results},
+            status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED,
+        )
+
+    @action(detail=False, methods=["post"], url_path="reprocess")
+    def reprocess(self, request):
+        """
+        Re-parse a batch of the tax forms extracted by a previous parser version from their saved annotations.
+        At most the limit query parameter, capped at TAX_FORM_REPROCESS_MAX_BATCH, are re-parsed per request,
+        and the next_cursor of the response, passed as the cursor query parameter, re-parses the next batch.
+        The reprocess_tax_forms command re-parses every stale tax form at once.
+        """
+        max_batch = settings.TAX_FORM_REPROCESS_MAX_BATCH
+        try:
+            limit = int(request.query_params.get("limit", max_batch))
+        except ValueError:
+            raise ValidationError({"limit": ["A positive integer is required."]})
+        if limit < 1:
+            raise ValidationError({"limit": ["A positive integer is required."]})
+
+        reprocessor = TaxFormReprocessor(
+            queryset=self.filter_queryset(self.get_queryset()),
+            limit=min(limit, max_batch),
+            cursor=request.query_params.get("cursor"),
+        )
+        try:
+            reprocessed = reprocessor.run()
+        except ValueError as error:
+            raise ValidationError({"cursor": [str(error)]})
+        return Response(
+            {
+                "parser_version": reprocessor.parser_version,
+                "reprocessed": reprocessed,
+                "errors": reprocessor.errors,
+                "next_cursor": reprocessor.next_cursor,
+            }
+        )
+
+    @action(detail=True, methods=["post"], url_path="resume")
+    def resume(self, request, pk=None):
+        """
+        Run the stages of a tax form left after its last completed one, such as a tax form of a batch
+        interrupted before it was persisted.
+        """
+        tax_form = self.get_object()
+        try:
+            tax_form = resume_tax_form(
+                tax_form,
+                ocr_dispatcher=get_ocr_dispatcher(),
+                ocr_task_queue=get_ocr_task_queue(),
+                tenant=get_tenant(request.user),
+            )
+        except Exception as error:
+            return Response(
+                {"stage": tax_form.stage, "error": str(error) or error.__class__.__name__},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+        return Response(self.get_serializer(tax_form).data)
+
+    @action(detail=False, methods=["get"], url_path="ocr-metrics")
+    def ocr_metrics(self, request):
+        """
+        Report the depth and the wait times of the OCR queues of every priority class, and the batch counters.
+        """
+        return Response(get_ocr_dispatcher().metrics())
+
+
+class UploadSessionViewSet(
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Resumable uploads of tax forms too large to send reliably in one request.
+
+    POST creates a session with the name, size and sha256 of the file, PUT sends a byte range of it with a
+    Content-Range header, GET reports the offset to resume from after a lost connection, and POST to finalize
+    verifies the file and processes it like a single upload.
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(tenant=get_tenant(self.request.user))
+
+    def create(self, request):
+        """
+        Create a session for a file, declared by its name, size in bytes and hex sha256 digest.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            session = UploadSessionStore.from_settings().create(
+                tenant=get_tenant(request.user), **serializer.validated_data
+            )
+        except UploadSessionError as error:
+            return Response({"detail": str(error)}, status=error.status_code)
+        data = self.get_serializer(session).data
+        return Response(data, status=status.HTTP_201_CREATED, headers={"Location": data["url"]})
+
+    def update(self, request, pk=None):
+        """
+        Write the byte range of the body, given by its Content-Range header, and report the new offset.
+
+        The body is streamed to the part file as it is read, it is not parsed.
+        """
+        session = self.get_object()
+        stream = request.stream or io.BytesIO(b"")
+        try:
+            session = UploadSessionStore.from_settings().write(session, request.headers.get("Content-Range"), stream)
+        except UploadSessionError as error:
+            session.refresh_from_db()
+            return Response({"detail": str(error), "offset": session.offset}, status=error.status_code)
+        return Response(self.get_serializer(session).data)
+
+    def destroy(self, request, pk=None):
+        """
+        Abandon a session and delete its received bytes.
+        """
+        try:
+            UploadSessionStore.from_settings().delete(self.get_object())
+        except UploadSessionError as error:
+            return Response({"detail": str(error)}, status=error.status_code)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=["post"], url_path="finalize")
+    def finalize(self, request, pk=None):
+        """
+        Verify the received file against its sha256 and create its tax form.
+
+        The tax form is not processed before every byte is received and verified, and only by one request:
+        a finalize retried while the file is being processed gets a 409 with the session, to poll until it
+        is finalized. A session already finalized returns its tax form, and one whose processing was
+        refused, such as with a 429 while the OCR queues are full, can be finalized again without resending
+        the file.
+        """
+        session = self.get_object()
+        if session.status == UploadSession.FINALIZED and session.tax_form is not None:
+            return Response(TaxFormSerializer(session.tax_form, context=self.get_serializer_context()).data)
+
+        store = UploadSessionStore.from_settings()
+        try:
+            stored_upload = store.finalize(session)
+        except UploadSessionError as error:
+            session.refresh_from_db()
+            return Response({**self.get_serializer(session).data, "detail": str(error)}, status=error.status_code)
+
+        try:
+            with File(open(stored_upload.path, "rb"), name=session.file_name) as tax_form_file:
+                serializer = TaxFormSerializer(
+                    data={
+                        "tax_form": tax_form_file,
+                        "stored_upload": stored_upload,
+                        "tax_fields": session.tax_fields or get_default_tax_fields(),
+                    },
+                    context=self.get_serializer_context(),
+                )
+                serializer.is_valid(raise_exception=True)
+                tax_form = serializer.save()
+        except BaseException:
+            store.release(session)
+            raise
+
+        store.complete(session, tax_form)
+        data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED, headers={"Location": data["url"]})
+
+
+class AsyncTaxFormView(View):
+    """
+    ASGI-native views of the tax forms, for reading and uploading them without blocking the event loop.
+
+    Under ASGI every synchronous view runs on one shared thread, so a single upload OCR-ed inline holds up
+    every other request. These views serve list, retrieve and create of TaxFormViewSet as coroutines: the
+    reads await the async ORM and cache, and the synchronous steps, authentication, serializing the tax
+    forms missing from the representation cache and an upload being stored, rasterized, OCR-ed and parsed,
+    run on the request executor rather than on the shared thread.
+    Authentication, permissions, content negotiation and error responses are those of TaxFormViewSet.
+    The methods the view does not serve itself are passed on to TaxFormViewSet unchanged.
+
+    Attributes:
+        actions (Dict[str, str]): The TaxFormViewSet action each method is served as.
+        sync_actions (Dict[str, str]): The TaxFormViewSet actions the methods passed on to it are served as.
+    """
+    actions = {}
+    sync_actions = {}
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # the session authentication of DRF enforces CSRF itself, as it does for TaxFormViewSet
+        view.csrf_exempt = True
+        return view
+
+    @classmethod
+    async def run_on_request_executor(cls, function, *args, **kwargs):
+        """
+        Call a synchronous function on the request executor, with database connections of its own.
+
+        Args:
+            function (Callable): The function.
+            *args: The arguments of the call.
+            **kwargs: The keyword arguments of the call.
+
+        Returns:
+            Any: The result of the call.
+        """
+        def call():
+            # the executor threads keep their own database connections across requests
+            close_old_connections()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                close_old_connections()
+
+        return await sync_to_async(call, thread_sensitive=False, executor=get_request_executor())()
+
+    async def run_action(self, request, handler, **kwargs):
+        """
+        Serve a request with a coroutine, checked and rendered by a TaxFormViewSet.
+
+        Args:
+            request (HttpRequest): The request.
+            handler (Callable): The coroutine function serving the request, given the viewset and its request.
+
+        Returns:
+            Response: The finalized response.
+        """
+        viewset = TaxFormViewSet(
+            action_map=self.actions,
+            args=(),
+            kwargs=kwargs,
+            format_kwarg=None,
+        )
+        api_request = viewset.initialize_request(request, **kwargs)
+        viewset.request = api_request
+        viewset.headers = viewset.default_response_headers
+        try:
+            # authentication loads the session and the user with the synchronous ORM
+            await self.run_on_request_executor(viewset.initial, api_request, **kwargs)
+            response = await handler(viewset, api_request, **kwargs)
+        except Exception as exc:
+            response = viewset.handle_exception(exc)
+        return viewset.finalize_response(api_request, response, **kwargs)
+
+    async def pass_to_viewset(self, request, **kwargs):
+        """
+        Serve a request with the synchronous TaxFormViewSet.
+        """
+        view = TaxFormViewSet.as_view(self.sync_actions)
+        return await sync_to_async(view)(request, **kwargs)
+
+    async def get_representations(self, viewset, api_request, tax_forms):
+        """
+        Get the representations of tax forms from the representation cache, serializing and caching the misses.
+
+        Args:
+            viewset (TaxFormViewSet): The viewset serving the request.
+            api_request (Request): The request.
+            tax_forms (QuerySet): The tax forms.
+
+        Returns:
+            List[Dict]: The cached entries of the tax forms in order, each with the "etag" and the "data".
+        """
+        base_uri = api_request.build_absolute_uri("/")
+        tax_form_ids = [tax_form_id async for tax_form_id in tax_forms.values_list("id", flat=True)]
+        cached = await aget_cached_representations(tax_form_ids, base_uri)
+
+        missing = [tax_form_id for tax_form_id in tax_form_ids if tax_form_id not in cached]
+        if missing:
+            missing_tax_forms = [tax_form async for tax_form in tax_forms.filter(id__in=missing)]
+
+            # the tax fields are read one by one while serializing, with the synchronous ORM
+            serialized = await self.run_on_request_executor(
+                lambda: viewset.get_serializer(missing_tax_forms, many=True).data
+            )
+            representations = {tax_form.id: data for tax_form, data in zip(missing_tax_forms, serialized)}
+            cached.update(await aset_cached_representations(representations, base_uri))
+        return [cached[tax_form_id] for tax_form_id in tax_form_ids if tax_form_id in cached]
+
+
+class AsyncTaxFormListView(AsyncTaxFormView):
+    """
+    GET lists the tax forms and POST uploads one, as TaxFormViewSet list and create do.
+    """
+    actions = {"get": "list", "post": "create"}
+
+    async def get(self, request):
+        return await self.run_action(request, self.list)
+
+    async def post(self, request):
+        return await self.run_action(request, self.create)
+
+    async def list(self, viewset, api_request):
+        tax_forms = viewset.filter_queryset(viewset.get_queryset())
+        cached = await self.get_representations(viewset, api_request, tax_forms)
+        return Response([entry["data"] for entry in cached])
+
+    async def create(self, viewset, api_request):
+        """
+        Store, preprocess and parse the upload on the request executor, so the event loop keeps serving reads.
+        """
+        return await self.run_on_request_executor(viewset.create, api_request)
+
+
+class AsyncTaxFormDetailView(AsyncTaxFormView):
+    """
+    GET retrieves a tax form from the representation cache, honoring If-None-Match, as TaxFormViewSet
+    retrieve does. PUT, PATCH and DELETE are passed on to TaxFormViewSet.
+    """
+    actions = {"get": "retrieve"}
+    sync_actions = {"put": "update", "patch": "partial_update", "delete": "destroy"}
+
+    async def get(self, request, pk):
+        return await self.run_action(request, self.retrieve, pk=pk)
+
+    async def put(self, request, pk):
+        return await self.pass_to_viewset(request, pk=pk)
+
+    async def patch(self, request, pk):
+        return await self.pass_to_viewset(request, pk=pk)
+
+    async def delete(self, request, pk):
+        return await self.pass_to_viewset(request, pk=pk)
+
+    async def retrieve(self, viewset, api_request, pk):
+        tax_forms = viewset.filter_queryset(viewset.get_queryset()).filter(pk=pk)
+        cached = await self.get_representations(viewset, api_request, tax_forms)
+        if not cached:
+            raise Http404
+        return get_cached_response(api_request, cached[0])